@@ -1,5 +1,5 @@
 
-__all__ = ['log', 'db', 'downloader']
+__all__ = ['log', 'metrics', 'tracing', 'profiling', 'progress', 'benchmark', 'db', 'downloader']
 
 
 
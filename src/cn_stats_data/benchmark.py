@@ -0,0 +1,370 @@
+import argparse
+import contextlib
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from cn_stats_util.models import Category
+from cn_stats_data import db
+from cn_stats_data.db.models import MetricCode, MetricHistoricalData, RegionCode
+
+__all__ = ["SIZES", "TREES", "REGIONS", "metric_tree", "region_tree", "metric_data", "run", "compare", "main"]
+
+# the row counts of the metric data cases, 1M takes minutes on Postgres so it's only run when asked for
+SIZES = (1_000, 100_000, 1_000_000)
+DEFAULT_SIZES = (1_000, 100_000)
+
+# the synthetic metric trees, by the name of the shape: (depth, children per node)
+TREES = {
+    "wide": (3, 20),
+    "deep": (12, 2),
+    "chain": (200, 1),
+}
+
+# the synthetic region tree: (provinces, cities per province, counties per city), about the size of the real one
+REGIONS = (34, 10, 9)
+
+# the timings below it are noise, they're never reported as regressions
+NOISE_SECONDS = 0.02
+
+_DATA_DB_CODE = Category.MACRO_MONTHLY
+_METRIC_DB_CODE = Category.MACRO_ANNUAL
+_REGION_DB_CODE = Category.PROVINCIAL_ANNUAL
+# the months of a synthetic series and the regions of a metric, so every metric has 1200 rows
+_MONTHS = [y * 100 + m for y in range(2010, 2020) for m in range(1, 13)]
+_REGION_CODES = [f"{p:02d}0000" for p in range(11, 21)]
+
+
+def metric_tree(shape: str, depth: int, branching: int) -> List[MetricCode]:
+    """
+    Build a synthetic metric tree, the code of a child is the code of its parent plus a 2-digit sequence
+    :param shape: The name of the shape, the root code is derived from it so the trees don't overlap
+    :param depth: The levels of the tree, including the root
+    :param branching: The children of every node which isn't a leaf
+    :return: Returns the codes in breadth-first order, the parents before their children
+    """
+    root = MetricCode(db_code=_METRIC_DB_CODE.db_code, code=f"Z{shape.upper()}", name=f"Benchmark {shape}",
+                      explanation=None, is_parent=depth > 1)
+    nodes, level = [root], [root]
+    for n in range(1, depth):
+        next_level = []
+        for parent in level:
+            for i in range(1, branching + 1):
+                next_level.append(MetricCode(
+                    db_code=_METRIC_DB_CODE.db_code, code=f"{parent.code}{i:02d}", name=f"Level {n} node {i}",
+                    explanation=None, is_parent=n < depth - 1, parent=parent))
+        nodes.extend(next_level)
+        level = next_level
+    return nodes
+
+
+def region_tree(provinces: int, cities: int, counties: int) -> List[RegionCode]:
+    """
+    Build a synthetic region tree of the 6-digit codes, province PP0000, city PPCC00 and county PPCCXX
+    :return: Returns the regions, the parents before their children
+    """
+    def region(code: str, children: Optional[List[RegionCode]] = None) -> RegionCode:
+        return RegionCode(db_code=_REGION_DB_CODE.db_code, code=code, name=f"Region {code}", explanation=None,
+                          is_parent=bool(children), children=children)
+
+    result = []
+    for p in range(11, 11 + provinces):
+        city_nodes, county_nodes = [], []
+        for c in range(1, cities + 1):
+            leaves = [region(f"{p:02d}{c:02d}{x:02d}") for x in range(1, counties + 1)]
+            city_nodes.append(region(f"{p:02d}{c:02d}00", leaves))
+            county_nodes.extend(leaves)
+        result.append(region(f"{p:02d}0000", city_nodes))
+        result.extend(city_nodes)
+        result.extend(county_nodes)
+    return result
+
+
+def metric_data(size: int, seed: int = 0, offset: float = 0.0) -> List[MetricHistoricalData]:
+    """
+    Build the synthetic monthly data, 120 months of 10 regions per metric
+    :param size: The count of the rows
+    :param seed: The seed of the values, the same seed gives the same rows
+    :param offset: Added to every value, a non-zero one changes all the rows of the same seed
+    """
+    rnd = random.Random(seed)
+    per_metric = len(_MONTHS) * len(_REGION_CODES)
+    return [
+        MetricHistoricalData(
+            metric_code=f"Z{i // per_metric:06d}", db_code=_DATA_DB_CODE.db_code,
+            region_code=_REGION_CODES[i % per_metric // len(_MONTHS)], period=_MONTHS[i % len(_MONTHS)],
+            data=round(rnd.uniform(0, 1e6), 2) + offset, has_data=True)
+        for i in range(size)
+    ]
+
+
+def _batches(lst: List[Any], size: int) -> Iterator[List[Any]]:
+    for i in range(0, len(lst), size):
+        yield lst[i:i + size]
+
+
+def _timed(func: Callable[[], Any]) -> Tuple[float, Any]:
+    """Run the function once with the garbage collector paused, as timeit does."""
+    gc.collect()
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        result = func()
+        return time.perf_counter() - start, result
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class _Recorder:
+    def __init__(self):
+        self.results: Dict[str, Dict[str, Any]] = {}
+
+    def add(self, case: str, param: Any, seconds: float, rows: int) -> None:
+        key = f"{case}[{param}]"
+        r = self.results.setdefault(key, {"case": case, "param": param, "rows": rows, "seconds": []})
+        r["seconds"].append(seconds)
+        logging.getLogger(__name__).info(f"{key}: {seconds:.3f}s, {rows} rows.")
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        for r in self.results.values():
+            r["median_seconds"] = statistics.median(r["seconds"])
+            r["min_seconds"] = min(r["seconds"])
+            r["rows_per_second"] = r["rows"] / r["median_seconds"] if r["median_seconds"] > 0 else None
+        return self.results
+
+
+@contextlib.contextmanager
+def _backend(backend: str, throwaway: bool) -> Iterator[Tuple[Any, Any, Any, str]]:
+    """
+    Point the DAOs at the database to benchmark
+    :return: Yields the metric code, region code and metric data DAOs, and the version of the database
+    """
+    if backend == "sqlite":
+        import sqlite3
+        from cn_stats_data.db.sqlite.metric_code_dao import SqliteMetricCodeDao
+        from cn_stats_data.db.sqlite.metric_data_dao import SqliteMetricDataDao
+        from cn_stats_data.db.sqlite.region_code_dao import SqliteRegionCodeDao
+
+        saved = db.db_config.sqlite_path
+        with tempfile.TemporaryDirectory() as d:
+            db.db_config.sqlite_path = os.path.join(d, "benchmark.db")
+            try:
+                yield SqliteMetricCodeDao, SqliteRegionCodeDao, SqliteMetricDataDao, f"SQLite {sqlite3.sqlite_version}"
+            finally:
+                db.db_config.sqlite_path = saved
+    elif backend == "postgres":
+        if not throwaway:
+            raise ValueError("The Postgres benchmark writes and deletes rows of the database of the [db] config, "
+                             "confirm it's a throwaway database by --throwaway.")
+        from cn_stats_data.db import metric_data_partition
+        from cn_stats_data.db.metric_code_dao import MetricCodeDao
+        from cn_stats_data.db.metric_data_dao import MetricDataDao
+        from cn_stats_data.db.region_code_dao import RegionCodeDao
+
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SHOW server_version;")
+                version = f"PostgreSQL {cursor.fetchone()[0]}"
+        metric_data_partition.ensure_partitions([_DATA_DB_CODE], sorted({i // 100 for i in _MONTHS}))
+        yield MetricCodeDao, RegionCodeDao, MetricDataDao, version
+    else:
+        raise ValueError(f"Unknown storage backend {backend}, it should be postgres or sqlite.")
+
+
+def _run_metric_data(dao, recorder: _Recorder, size: int, repeat: int, batch_size: int, seed: int) -> None:
+    rows = metric_data(size, seed)
+    changed = metric_data(size, seed, offset=1.0)
+    deleted = metric_data(size, seed)
+    for i in deleted:
+        i.is_deleted = True
+    metric_codes = [rows[0].metric_code]
+    for _ in range(repeat):
+        for case, lst in (("metric_data.insert", rows), ("metric_data.update", changed)):
+            seconds, _ = _timed(lambda: [dao.add_or_update(i) for i in _batches(lst, batch_size)])
+            recorder.add(case, size, seconds, size)
+        seconds, result = _timed(lambda: dao.list(db_codes=[_DATA_DB_CODE.db_code]))
+        recorder.add("metric_data.list", size, seconds, len(result))
+        seconds, result = _timed(lambda: dao.list(db_codes=[_DATA_DB_CODE.db_code], metric_codes=metric_codes))
+        recorder.add("metric_data.list_metric", size, seconds, len(result))
+        seconds, _ = _timed(lambda: [dao.delete(i) for i in _batches(deleted, batch_size)])
+        recorder.add("metric_data.delete", size, seconds, size)
+
+
+def _run_metric_codes(dao, recorder: _Recorder, trees: Dict[str, Tuple[int, int]], repeat: int) -> List[MetricCode]:
+    saved = []
+    for shape, (depth, branching) in trees.items():
+        nodes = metric_tree(shape, depth, branching)
+        seconds, _ = _timed(lambda: dao.add_or_update(nodes))
+        recorder.add("metric_code.add_or_update", shape, seconds, len(nodes))
+        for _ in range(repeat):
+            seconds, result = _timed(lambda: dao.list(_METRIC_DB_CODE, nodes[0].code))
+            recorder.add("metric_code.list", shape, seconds, len(result))
+        saved.extend(nodes)
+    for _ in range(repeat):
+        seconds, result = _timed(lambda: dao.list(_METRIC_DB_CODE))
+        recorder.add("metric_code.list", "all", seconds, len(result))
+    return saved
+
+
+def _run_region_codes(dao, recorder: _Recorder, regions: Tuple[int, int, int], repeat: int) -> List[RegionCode]:
+    nodes = region_tree(*regions)
+    seconds, _ = _timed(lambda: dao.add_or_update(nodes))
+    recorder.add("region_code.add_or_update", "all", seconds, len(nodes))
+    for _ in range(repeat):
+        seconds, result = _timed(lambda: dao.list(_REGION_DB_CODE))
+        recorder.add("region_code.list", "all", seconds, len(result))
+        seconds, result = _timed(lambda: dao.list(_REGION_DB_CODE, nodes[0].code))
+        recorder.add("region_code.list", "province", seconds, len(result))
+    return nodes
+
+
+def _delete_codes(dao, lst: List[MetricCode | RegionCode]) -> None:
+    for i in lst:
+        i.is_deleted = True
+    dao.delete(lst)
+
+
+def run(
+    backend: str = "sqlite",
+    sizes: Sequence[int] = DEFAULT_SIZES,
+    repeat: int = 3,
+    batch_size: int = 10_000,
+    trees: Optional[Dict[str, Tuple[int, int]]] = None,
+    regions: Tuple[int, int, int] = REGIONS,
+    seed: int = 0,
+    throwaway: bool = False,
+) -> Dict[str, Any]:
+    """
+    Run the benchmark of the DAOs on synthetic data.
+    The metric data are inserted, updated, listed and deleted `repeat` times per size, so every round starts empty.
+    :param backend: sqlite runs on a temporary file, postgres on the database of the [db] config
+    :param sizes: The row counts of the metric data cases
+    :param repeat: The rounds of every case
+    :param batch_size: The rows saved or deleted per DAO call, like a downloader saving a node at a time
+    :param trees: The metric trees by the name of the shape, TREES if not giving
+    :param regions: The provinces, the cities per province and the counties per city of the region tree
+    :param seed: The seed of the synthetic values
+    :param throwaway: Confirm the Postgres database can be written, the benchmark refuses to run on Postgres without it
+    :return: Returns the results, dump it as JSON
+    """
+    trees = TREES if trees is None else trees
+    recorder = _Recorder()
+    started = time.perf_counter()
+    with _backend(backend, throwaway) as (metric_code_dao, region_code_dao, metric_data_dao, version):
+        for size in sizes:
+            _run_metric_data(metric_data_dao, recorder, size, repeat, batch_size, seed)
+        metric_codes = _run_metric_codes(metric_code_dao, recorder, trees, repeat)
+        region_codes = _run_region_codes(region_code_dao, recorder, regions, repeat)
+        # the codes are soft-deleted, so a later run on the same database inserts them again
+        _delete_codes(metric_code_dao, metric_codes)
+        _delete_codes(region_code_dao, region_codes)
+
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "seconds": time.perf_counter() - started,
+        "environment": {
+            "backend": backend,
+            "database": version,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "config": {
+            "sizes": list(sizes),
+            "repeat": repeat,
+            "batch_size": batch_size,
+            "trees": {k: list(v) for k, v in trees.items()},
+            "regions": list(regions),
+            "seed": seed,
+        },
+        "results": recorder.summary(),
+    }
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float = 0.2) -> List[Dict[str, Any]]:
+    """
+    Find the cases slowed down since the baseline run.
+    The fastest round of a case is compared, it's the least disturbed by the other load of the machine.
+    :param baseline: The results of the earlier run
+    :param current: The results of this run
+    :param tolerance: The slowdown allowed, e.g. 0.2 for 20%
+    :return: Returns the regressions, the cases not in both runs and the timings below NOISE_SECONDS are skipped
+    """
+    regressions = []
+    for key, r in current["results"].items():
+        base = baseline["results"].get(key)
+        if base is None or r["min_seconds"] < NOISE_SECONDS:
+            continue
+        if r["min_seconds"] > base["min_seconds"] * (1 + tolerance):
+            regressions.append({
+                "key": key,
+                "baseline_seconds": base["min_seconds"],
+                "seconds": r["min_seconds"],
+                "ratio": r["min_seconds"] / base["min_seconds"] if base["min_seconds"] > 0 else None,
+            })
+    return regressions
+
+
+def _format(results: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> str:
+    lines = [f"{'median s':>10} {'min s':>10} {'rows/s':>12} {'vs base':>8}  case"]
+    for key, r in results["results"].items():
+        base = None if baseline is None else baseline["results"].get(key)
+        ratio = f"{r['min_seconds'] / base['min_seconds']:>7.2f}x" \
+            if base is not None and base["min_seconds"] > 0 else f"{'-':>8}"
+        rows = f"{r['rows_per_second']:>12.0f}" if r["rows_per_second"] is not None else f"{'-':>12}"
+        lines.append(f"{r['median_seconds']:>10.4f} {r['min_seconds']:>10.4f} {rows} {ratio}  {key}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the DAO bulk operations and the tree loading.")
+    parser.add_argument("--backend", choices=["sqlite", "postgres"], default="sqlite")
+    parser.add_argument("--throwaway", action="store_true",
+                        help="Confirm the Postgres database of the [db] config can be written")
+    parser.add_argument("--sizes", default=",".join(str(i) for i in DEFAULT_SIZES),
+                        help=f"The row counts of the metric data, e.g. {','.join(str(i) for i in SIZES)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="The JSON file to write the results to")
+    parser.add_argument("--baseline", help="The JSON file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="The slowdown of a case allowed before it fails the run, e.g. 0.2 for 20%%")
+    args = parser.parse_args(argv)
+
+    results = run(args.backend, [int(i) for i in args.sizes.split(",")], args.repeat, args.batch_size,
+                  seed=args.seed, throwaway=args.throwaway)
+    if args.output:
+        with open(args.output, mode="w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, mode="r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print(_format(results, baseline))
+    if baseline is None:
+        return 0
+
+    if baseline["environment"] != results["environment"]:
+        print(f"The baseline was run on {baseline['environment']}, the timings may not be comparable.")
+    regressions = compare(baseline, results, args.tolerance)
+    for i in regressions:
+        print(f"Regression of {i['key']}: {i['baseline_seconds']:.4f}s -> {i['seconds']:.4f}s.")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,19 @@
 import pathlib
+import time
 import tomllib
 from typing import Any
 
 import psycopg2
 
-from cn_stats_data.db.db_config import DbConfig
+from cn_stats_data.db.db_config import (
+    CacheConfig, CompactionConfig, DbConfig, QueryStatsConfig, SnapshotConfig, SpoolConfig)
+from cn_stats_data.db import query_stats
 
-__all__ = ['db_config', 'metric_code_dao', 'metric_data_dao', 'region_code_dao', 'process_data_dao', 'models']
+__all__ = ['db_config', 'cache_config', 'spool_config', 'snapshot_config', 'compaction_config', 'query_stats_config',
+           'metric_code_dao', 'metric_data_dao', 'region_code_dao',
+           'process_data_dao', 'models', 'migration', 'metric_data_partition', 'hierarchy_cache', 'hierarchy_index',
+           'row_hash', 'spool', 'dao', 'sqlite', 'aio', 'series_snapshot', 'rollup_dao', 'panel',
+           'change_log_dao', 'compaction', 'query_stats']
 
 
 def _get_db_config(cfg: dict[str, Any]) -> DbConfig:
@@ -15,23 +22,85 @@ def _get_db_config(cfg: dict[str, Any]) -> DbConfig:
         port=cfg['port'],
         db=cfg['db'],
         user=cfg['user'],
-        password=cfg['password'])
+        password=cfg['password'],
+        backend=cfg.get('backend', 'postgres'),
+        sqlite_path=cfg.get('sqlite_path', 'cn_stats.db'),
+        async_pool_min_size=cfg.get('async_pool_min_size', 1),
+        async_pool_max_size=cfg.get('async_pool_max_size', 20))
+
+
+def _get_cache_config(cfg: dict[str, Any]) -> CacheConfig:
+    default = CacheConfig()
+    return CacheConfig(
+        hierarchy_max_entries=cfg.get('hierarchy_max_entries', default.hierarchy_max_entries),
+        hierarchy_max_nodes=cfg.get('hierarchy_max_nodes', default.hierarchy_max_nodes),
+        series_max_entries=cfg.get('series_max_entries', default.series_max_entries),
+        series_max_points=cfg.get('series_max_points', default.series_max_points))
+
+
+def _get_spool_config(cfg: dict[str, Any]) -> SpoolConfig:
+    default = SpoolConfig()
+    return SpoolConfig(
+        enabled=cfg.get('enabled', default.enabled),
+        directory=cfg.get('directory', default.directory),
+        segment_max_records=cfg.get('segment_max_records', default.segment_max_records),
+        batch_max_records=cfg.get('batch_max_records', default.batch_max_records),
+        retry_interval=cfg.get('retry_interval', default.retry_interval),
+        segment_max_seconds=cfg.get('segment_max_seconds', default.segment_max_seconds),
+        close_timeout=cfg.get('close_timeout', default.close_timeout))
+
+
+def _get_snapshot_config(cfg: dict[str, Any]) -> SnapshotConfig:
+    default = SnapshotConfig()
+    return SnapshotConfig(
+        directory=cfg.get('directory', default.directory))
+
+
+def _get_compaction_config(cfg: dict[str, Any]) -> CompactionConfig:
+    default = CompactionConfig()
+    return CompactionConfig(
+        retention_days=cfg.get('retention_days', default.retention_days),
+        batch_size=cfg.get('batch_size', default.batch_size),
+        archive=cfg.get('archive', default.archive))
+
+
+def _get_query_stats_config(cfg: dict[str, Any]) -> QueryStatsConfig:
+    default = QueryStatsConfig()
+    return QueryStatsConfig(
+        enabled=cfg.get('enabled', default.enabled),
+        slow_query_ms=cfg.get('slow_query_ms', default.slow_query_ms),
+        explain_slow=cfg.get('explain_slow', default.explain_slow),
+        max_param_chars=cfg.get('max_param_chars', default.max_param_chars))
 
 
 with (pathlib.Path(__file__).parent / "config.toml").open(mode="rb") as fp:
     _config = tomllib.load(fp)
     db_config = _get_db_config(_config['db'])
+    cache_config = _get_cache_config(_config.get('cache', {}))
+    spool_config = _get_spool_config(_config.get('spool', {}))
+    snapshot_config = _get_snapshot_config(_config.get('snapshot', {}))
+    compaction_config = _get_compaction_config(_config.get('compaction', {}))
+    query_stats_config = _get_query_stats_config(_config.get('query_stats', {}))
 
 
 def get_conn():
-    return psycopg2.connect(
+    start = time.perf_counter()
+    conn = psycopg2.connect(
         database=db_config.db,
         user=db_config.user,
         password=db_config.password,
         host=db_config.server,
-        port=db_config.port)
+        port=db_config.port,
+        cursor_factory=query_stats.StatsCursor if query_stats_config.enabled else None)
+    query_stats.record_connect(time.perf_counter() - start)
+    return conn
 
 
 if __name__ == '__main__':
     print(_config)
     print(db_config)
+    print(cache_config)
+    print(spool_config)
+    print(snapshot_config)
+    print(compaction_config)
+    print(query_stats_config)
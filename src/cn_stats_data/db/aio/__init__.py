@@ -0,0 +1,114 @@
+import asyncio
+import contextlib
+import time
+from typing import Any, AsyncIterator, Optional
+
+import psycopg
+from psycopg import AsyncClientCursor, AsyncConnection
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+
+from cn_stats_data import db
+from cn_stats_data.db import query_stats
+
+__all__ = ['get_pool', 'get_conn', 'close_pool', 'metric_code_dao', 'region_code_dao', 'metric_data_dao',
+           'process_data_dao']
+
+_pool: Optional[AsyncConnectionPool] = None
+_pool_lock = asyncio.Lock()
+
+
+async def _explain(conn: AsyncConnection, sql: str, params: Any = None) -> str:
+    """The async version of `query_stats.explain`."""
+    reason = query_stats.explainable(sql)
+    if reason is not None:
+        return reason
+
+    in_transaction = not conn.autocommit
+    async with AsyncClientCursor(conn) as cursor:  # not recorded
+        if in_transaction:
+            await cursor.execute("SAVEPOINT cn_stats_explain")
+        try:
+            await cursor.execute("EXPLAIN " + sql.rstrip("; \t\r\n"), params)
+            plan = "\n".join(i[0] for i in await cursor.fetchall())
+        except psycopg.Error as e:
+            if in_transaction:
+                await cursor.execute("ROLLBACK TO SAVEPOINT cn_stats_explain")
+            return f"Failed to explain: {e}".strip()
+        if in_transaction:
+            await cursor.execute("RELEASE SAVEPOINT cn_stats_explain")
+        return plan
+
+
+class AsyncStatsCursor(AsyncClientCursor):
+    """The async version of `query_stats.StatsCursor`, it's the cursor factory of the pooled connections."""
+
+    async def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = await super().execute(query, params, **kwargs)
+            failed = False
+            return result
+        finally:
+            seconds = time.perf_counter() - start
+            plan = None
+            if not failed and db.query_stats_config.explain_slow and query_stats.is_slow(seconds):
+                plan = await _explain(self.connection, query, params)
+            query_stats.record(query, params, seconds, -1 if failed else self.rowcount, plan)
+
+    async def executemany(self, query, params_seq, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().executemany(query, params_seq, **kwargs)
+        finally:
+            query_stats.record(query, "(executemany)", time.perf_counter() - start, self.rowcount)
+
+
+async def get_pool() -> AsyncConnectionPool:
+    """
+    Get the async connection pool, it's opened the first time it's used.
+    The connections use client-side parameter binding same as psycopg2,
+    so the SQL text of the sync DAOs is shared as it is, including the statements with multiple commands.
+    """
+    global _pool
+    async with _pool_lock:
+        if _pool is None:
+            pool = AsyncConnectionPool(
+                conninfo=make_conninfo(
+                    dbname=db.db_config.db,
+                    user=db.db_config.user,
+                    password=db.db_config.password,
+                    host=db.db_config.server,
+                    port=db.db_config.port,
+                ),
+                min_size=db.db_config.async_pool_min_size,
+                max_size=db.db_config.async_pool_max_size,
+                kwargs={"cursor_factory": AsyncStatsCursor if db.query_stats_config.enabled else AsyncClientCursor},
+                open=False,
+            )
+            await pool.open()
+            _pool = pool
+        return _pool
+
+
+@contextlib.asynccontextmanager
+async def get_conn() -> AsyncIterator[AsyncConnection]:
+    """
+    Borrow a connection from the pool, the changes are committed when leaving the context without error,
+    same as `with db.get_conn() as conn` of psycopg2.
+    """
+    pool = await get_pool()
+    start = time.perf_counter()
+    async with pool.connection() as conn:
+        query_stats.record_connect(time.perf_counter() - start)
+        yield conn
+
+
+async def close_pool() -> None:
+    """Close the connection pool, e.g. before the event loop is closed."""
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            await _pool.close()
+            _pool = None
@@ -0,0 +1,229 @@
+from itertools import groupby
+from typing import List, Optional
+
+from cn_stats_util.models import Category
+
+from cn_stats_data import metrics
+from cn_stats_data.db import aio
+from cn_stats_data.db.hierarchy_cache import hierarchy_cache
+from cn_stats_data.db.hierarchy_index import HierarchyIndex
+from cn_stats_data.db.metric_code_dao import (
+    _ADD_OR_UPDATE_SQL,
+    _ATTACH_SQL,
+    _CLOSURE_LINKS_SQL,
+    _DELETE_SQL,
+    _DETACH_SQL,
+    _GET_SQL,
+    _LIST_ANCESTORS_SQL,
+    _LIST_DESCENDANTS_SQL,
+    _LIST_LEAVES_SQL,
+    _LIST_SQL,
+    _LOG_CHANGES_SQL,
+    _WATERMARK_SQL,
+    _build_index,
+    _closure_relinks,
+    _metric_code_from_row,
+    _metric_code_params,
+    _set_children,
+)
+from cn_stats_data.db.models import MetricCode
+
+__all__ = ["AsyncMetricCodeDao"]
+
+
+@metrics.instrument_dao
+class AsyncMetricCodeDao:
+    """
+    The async counterpart of `MetricCodeDao`, sharing its SQL and row mapping.
+    """
+
+    @classmethod
+    async def add_or_update(cls, lst: List[MetricCode]) -> int:
+        """
+        Insert or update the data to database.
+        :param lst: The list of metric codes
+        :return: The record count are saved
+        """
+
+        if not lst:
+            return 0
+        data = [_metric_code_params(i) for i in lst if not hasattr(i, "is_deleted") or not i.is_deleted]
+        if len(data) == 0:
+            return 0
+
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.executemany(_ADD_OR_UPDATE_SQL, data)
+                count = cursor.rowcount
+                await cls._relink_closure(cursor, [(i[1], i[0], i[6]) for i in data])
+                await cls._log_changes(cursor, [(i[1], i[0]) for i in data])
+                return count
+
+    @classmethod
+    async def delete(cls, lst: List[MetricCode]) -> int:
+        """
+        Delete the data from database
+        :param lst: the list of metric codes
+        :return: The record count are deleted
+        """
+
+        if not lst:
+            return 0
+        data = [(i.db_code, i.code) for i in lst if not hasattr(i, "is_deleted") or i.is_deleted]
+        if len(data) == 0:
+            return 0
+
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.executemany(_DELETE_SQL, data)
+                count = cursor.rowcount
+                await cursor.executemany(_DETACH_SQL, [{"db_code": i[0], "metric_code": i[1]} for i in data])
+                await cls._log_changes(cursor, data)
+                return count
+
+    @classmethod
+    async def _relink_closure(cls, cursor, lst: List[tuple[str, str, Optional[str]]]) -> None:
+        """
+        Same as `MetricCodeDao._relink_closure`
+        :param cursor: The cursor of the transaction saving the metric codes
+        :param lst: The list of (db_code, metric_code, parent_metric_code) saved
+        """
+
+        data = []
+        for key, group in groupby(sorted(lst, key=lambda x: x[0]), key=lambda x: x[0]):
+            group = list(group)
+            await cursor.execute(_CLOSURE_LINKS_SQL, (key, [i[1] for i in group]))
+            data.extend(_closure_relinks(group, await cursor.fetchall()))
+
+        for i in data:
+            await cursor.execute(_DETACH_SQL, i)
+            await cursor.execute(_ATTACH_SQL, i)
+
+    @classmethod
+    async def _log_changes(cls, cursor, lst: List[tuple[str, str]]) -> None:
+        """
+        Same as `MetricCodeDao._log_changes`
+        :param cursor: The cursor of the transaction saving or deleting the metric codes
+        :param lst: The list of (db_code, metric_code) saved or deleted
+        """
+
+        for key, group in groupby(sorted(lst, key=lambda x: x[0]), key=lambda x: x[0]):
+            await cursor.execute(_LOG_CHANGES_SQL, (key, [i[1] for i in group]))
+
+    @classmethod
+    async def get(cls, metric_code: str, db_code: Category) -> MetricCode | None:
+        """
+        Get metric code from DB
+        :param metric_code: code of the metric
+        :param db_code: db code of the metric
+        :return: Returns the metric code object if found, otherwise returns None
+        """
+
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(_GET_SQL, (db_code.db_code, metric_code, db_code.db_code, metric_code))
+                row = await cursor.fetchone()
+                return None if row is None else _metric_code_from_row(row, is_parent=row[12])
+
+    @classmethod
+    async def list(
+        cls, db_code: Category | None = None, metric_code: str | None = None
+    ) -> List[MetricCode]:
+        """
+        Get metrics via db code and metric code and its descendants
+        :param db_code: Specific the db code or None for all db codes
+        :param metric_code:  Specific the metric code or None for metrics
+        :return: Returns the metrics and its descendants
+        """
+
+        dbcode = None if db_code is None else db_code.db_code
+        if metric_code is None:
+            sql, criteria = _LIST_SQL, (dbcode is None, dbcode)
+        else:
+            sql, criteria = _LIST_DESCENDANTS_SQL, (dbcode is None, dbcode, metric_code)
+
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(sql, criteria)
+                data = [_metric_code_from_row(i) for i in await cursor.fetchall()]
+                _set_children(_build_index(data))
+                return data
+
+    @classmethod
+    async def list_leaves(
+        cls, db_code: Category, metric_codes: List[str] | None = None
+    ) -> List[MetricCode]:
+        """
+        Get the metrics which don't have children
+        :param db_code: Specific the db code
+        :param metric_codes: Specific the metric codes whose descendant leaves are returned,
+            or None for all the leaves of the db code
+        :return: Returns the leaf metrics
+        """
+
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    _LIST_LEAVES_SQL,
+                    (db_code.db_code, metric_codes is None, [] if metric_codes is None else metric_codes),
+                )
+                return [_metric_code_from_row(i) for i in await cursor.fetchall()]
+
+    @classmethod
+    async def list_ancestors(cls, metric_code: str, db_code: Category) -> List[MetricCode]:
+        """
+        Get the ancestors of the metric code
+        :param metric_code: code of the metric
+        :param db_code: db code of the metric
+        :return: Returns the ancestors, from the root to the parent of the metric code
+        """
+
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(_LIST_ANCESTORS_SQL, (db_code.db_code, metric_code))
+                return [_metric_code_from_row(i, is_parent=True) for i in await cursor.fetchall()]
+
+    @classmethod
+    async def get_watermark(cls, db_code: Category) -> tuple:
+        """
+        Get the watermark of the metric codes of the db code, see `MetricCodeDao.get_watermark`
+        :param db_code: db code of the metrics
+        :return: Returns the count of the codes and the max last updated time
+        """
+
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(_WATERMARK_SQL, {"db_code": db_code.db_code})
+                return tuple(await cursor.fetchone())
+
+    @classmethod
+    async def get_hierarchy(cls, db_code: Category) -> HierarchyIndex[MetricCode]:
+        """
+        Get the hierarchy of the metrics of the db code from the hierarchy cache shared with `MetricCodeDao`.
+        The nodes are shared with other callers and must not be modified.
+        :param db_code: Specific the db code
+        :return: Returns the hierarchy index of the metrics, keyed by (db_code, metric_code)
+        """
+
+        async def load() -> HierarchyIndex[MetricCode]:
+            return _build_index(await cls.list(db_code))
+
+        return await hierarchy_cache.get_async(
+            ("metric_codes", db_code.db_code),
+            watermark=lambda: cls.get_watermark(db_code),
+            loader=load,
+        )
+
+    @classmethod
+    async def list_cached(cls, db_code: Category, metric_code: str | None = None) -> List[MetricCode]:
+        """
+        Same as `list`, but the metrics are served from the hierarchy cache, see `get_hierarchy`.
+        :param db_code: Specific the db code
+        :param metric_code: Specific the metric code or None for metrics
+        :return: Returns the metrics and its descendants
+        """
+        index = await cls.get_hierarchy(db_code)
+        if metric_code is None:
+            return [i for i in index]
+        key = (db_code.db_code, metric_code)
+        return index.descendants(key) if key in index else []
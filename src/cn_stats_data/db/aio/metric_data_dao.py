@@ -0,0 +1,233 @@
+from typing import List
+
+from cn_stats_util.models import HistoricalData
+
+from cn_stats_data import metrics
+from cn_stats_data.db import aio
+from cn_stats_data.db.hierarchy_cache import series_cache
+from cn_stats_data.db.metric_data_dao import (
+    _ADD_OR_UPDATE_SQL,
+    _DELETE_SQL,
+    _LIST_SQL,
+    _LIST_VALUES_SQL,
+    _LOG_CHANGES_SQL,
+    _MARK_ROLLUP_DIRTY_SQL,
+    _SERIES_SQL,
+    _SERIES_WATERMARK_SQL,
+    _SYNC_CREATE_SQL,
+    _SYNC_LOG_CHANGES_SQL,
+    _SYNC_SQL,
+    _keys_params,
+    _list_criteria,
+    _list_values_criteria,
+    _metric_data_from_row,
+    _metric_data_params,
+    _series_criteria,
+    _series_key,
+    _series_watermark_params,
+    _sync_params,
+    _values_from_rows,
+)
+from cn_stats_data.db.models import MetricHistoricalData
+
+__all__ = ["AsyncMetricDataDao"]
+
+# the temporary table is loaded by COPY instead of the multi-row INSERT of the sync version
+_SYNC_COPY_SQL = """
+COPY tmp_metric_data (metric_code, db_code, date_num, region_code, metric_value, extra_attributes, row_hash) FROM STDIN
+"""
+
+
+@metrics.instrument_dao
+class AsyncMetricDataDao:
+    """
+    The async counterpart of `MetricDataDao`, sharing its SQL and row mapping.
+    """
+
+    @classmethod
+    async def add_or_update(cls, lst: List[MetricHistoricalData]) -> int:
+        """
+        Insert or update the data to database.
+        :param lst: The list of metric data
+        :return: The record count are saved
+        """
+
+        if not lst:
+            return 0
+        data = [_metric_data_params(i) for i in lst if not hasattr(i, "is_deleted") or not i.is_deleted]
+        if len(data) == 0:
+            return 0
+
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.executemany(_ADD_OR_UPDATE_SQL, data)
+                count = cursor.rowcount
+                params = _keys_params(data)
+                await cursor.execute(_MARK_ROLLUP_DIRTY_SQL, params)
+                await cursor.execute(_LOG_CHANGES_SQL, params)
+                return count
+
+    @classmethod
+    async def delete(cls, lst: List[MetricHistoricalData]) -> int:
+        """
+        Delete the data from database
+        :param lst: the list of metric data
+        :return: The record count are deleted
+        """
+
+        if lst is None or len(lst) == 0:
+            return 0
+        data = [
+            (
+                i.metric_code,
+                i.db_code,
+                i.period,
+                "" if i.region_code is None else i.region_code,
+            )
+            for i in lst
+            if not hasattr(i, "is_deleted") or i.is_deleted
+        ]
+        if len(data) == 0:
+            return 0
+
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.executemany(_DELETE_SQL, data)
+                count = cursor.rowcount
+                params = _keys_params(data)
+                await cursor.execute(_MARK_ROLLUP_DIRTY_SQL, params)
+                await cursor.execute(_LOG_CHANGES_SQL, params)
+                return count
+
+    @classmethod
+    async def list(
+        cls,
+        db_codes: List[str] | None = None,
+        metric_codes: List[str] | None = None,
+        region_codes: List[str | None] | None = None,
+        date_nums: List[int] | None = None,
+    ) -> List[MetricHistoricalData]:
+        """
+        Get metric data by the giving criteria
+        :param db_codes: Specific the db codes or None for all db codes
+        :param metric_codes:  Specific the metric codes or None for metrics
+        :param region_codes: Specific the region codes or None for metrics
+        :param date_nums: Specific the date nums or None for metrics
+        :return: Returns the metric data for the specified criteria
+        """
+
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(_LIST_SQL, _list_criteria(db_codes, metric_codes, region_codes, date_nums))
+                return [_metric_data_from_row(i) for i in await cursor.fetchall()]
+
+    @classmethod
+    async def sync(
+        cls,
+        db_code: str,
+        metric_codes: List[str],
+        date_nums: List[int],
+        lst: List[HistoricalData],
+    ) -> dict[str, int]:
+        """
+        Same as `MetricDataDao.sync`, the temporary table is loaded by COPY.
+        :param db_code: The db code of the data
+        :param metric_codes: The metric codes the data is downloaded for
+        :param date_nums: The periods the data is downloaded for
+        :param lst: The downloaded data
+        :return: Returns the record count of each kind of change, keyed by inserted, updated and deleted
+        """
+
+        data = _sync_params(lst)
+
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(_SYNC_CREATE_SQL)
+                async with cursor.copy(_SYNC_COPY_SQL) as copy:
+                    for i in data:
+                        await copy.write_row(i)
+                params = {"db_code": db_code, "metric_codes": metric_codes, "date_nums": date_nums}
+                await cursor.execute(_SYNC_SQL, params)
+                row = await cursor.fetchone()
+                await cursor.execute(_SYNC_LOG_CHANGES_SQL, params)
+                return {"inserted": row[0], "updated": row[1], "deleted": row[2]}
+
+    @classmethod
+    async def list_values(
+        cls,
+        db_code: str,
+        metric_codes: List[str],
+        region_codes: List[str | None] | None = None,
+        date_nums: List[int] | None = None,
+    ) -> dict[tuple[str, int, str | None], tuple[float | None, str | None]]:
+        """
+        Get the values of the metric data by the giving criteria, see `MetricDataDao.list_values`
+        :param db_code: Specific the db code
+        :param metric_codes: Specific the metric codes
+        :param region_codes: Specific the region codes or None for all regions
+        :param date_nums: Specific the date nums or None for all periods
+        :return: Returns the (metric_value, row_hash) keyed by (metric_code, date_num, region_code)
+        """
+
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(_LIST_VALUES_SQL, _list_values_criteria(db_code, metric_codes, region_codes, date_nums))
+                return _values_from_rows(await cursor.fetchall())
+
+    @classmethod
+    async def series(
+        cls,
+        db_code: str,
+        metric_code: str,
+        region_code: str | None = None,
+        start: int | None = None,
+        end: int | None = None,
+    ) -> List[tuple[int, float | None]]:
+        """
+        Get the series of the metric of the region in the period range, see `MetricDataDao.series`
+        :param db_code: Specific the db code
+        :param metric_code: Specific the metric code
+        :param region_code: Specific the region code or None for the data without region
+        :param start: The first date num of the range (inclusive) or None for no lower bound
+        :param end: The last date num of the range (inclusive) or None for no upper bound
+        :return: Returns the (date_num, metric_value) points ordered by date_num
+        """
+
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(_SERIES_SQL, _series_criteria(db_code, metric_code, region_code, start, end))
+                return [(i[0], i[1]) for i in await cursor.fetchall()]
+
+    @classmethod
+    async def get_series_watermark(cls, db_code: str, metric_code: str, region_code: str | None = None) -> tuple:
+        """
+        Get the watermark of the series, see `MetricDataDao.get_series_watermark`
+        :param db_code: Specific the db code
+        :param metric_code: Specific the metric code
+        :param region_code: Specific the region code or None for the data without region
+        :return: Returns the count of the points, the max last updated time and the last change log sequence number
+        """
+
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(_SERIES_WATERMARK_SQL, _series_watermark_params(db_code, metric_code, region_code))
+                return tuple(await cursor.fetchone())
+
+    @classmethod
+    async def series_cached(
+        cls,
+        db_code: str,
+        metric_code: str,
+        region_code: str | None = None,
+        start: int | None = None,
+        end: int | None = None,
+    ) -> List[tuple[int, float | None]]:
+        """
+        Same as `series`, but the result is served from the series cache shared with `MetricDataDao`.
+        The list is shared with other callers and must not be modified.
+        """
+        return await series_cache.get_async(
+            ("series", *_series_key(db_code, metric_code, region_code), start, end),
+            watermark=lambda: cls.get_series_watermark(db_code, metric_code, region_code),
+            loader=lambda: cls.series(db_code, metric_code, region_code, start, end),
+        )
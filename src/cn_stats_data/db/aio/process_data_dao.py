@@ -0,0 +1,63 @@
+import json
+from typing import Optional
+
+from cn_stats_data import metrics
+from cn_stats_data.db import aio
+from cn_stats_data.db.models import MetricCodeDownloadCheckpoint, ProcessData, RegionCodeDownloadCheckpoint
+from cn_stats_data.db.process_data_dao import ProcessDataDao, _ADD_OR_UPDATE_SQL, _DELETE_SQL, _GET_SQL
+
+__all__ = ["AsyncProcessDataDao"]
+
+
+@metrics.instrument_dao
+class AsyncProcessDataDao:
+    """
+    The async counterpart of `ProcessDataDao`, sharing its SQL.
+    """
+
+    METRIC_CODE_DOWNLOAD_ID: str = ProcessDataDao.METRIC_CODE_DOWNLOAD_ID
+    REGION_CODE_DOWNLOAD_ID: str = ProcessDataDao.REGION_CODE_DOWNLOAD_ID
+
+    @classmethod
+    async def add_or_update(cls, data: ProcessData) -> int:
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(_ADD_OR_UPDATE_SQL, (data.process_id, data.data))
+                return cursor.rowcount
+
+    @classmethod
+    async def get(cls, process_id: str) -> Optional[ProcessData]:
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(_GET_SQL, (process_id,))
+                row = await cursor.fetchone()
+                if row is None:
+                    return None
+                return ProcessData(process_id=row[0], data=json.dumps(row[1]))
+
+    @classmethod
+    async def delete(cls, process_id: str) -> int:
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(_DELETE_SQL, (process_id,))
+                return cursor.rowcount
+
+    @classmethod
+    async def add_or_update_metric_code_download_checkpoint(cls, data: MetricCodeDownloadCheckpoint) -> int:
+        metrics.checkpoint_writes.inc(process=cls.METRIC_CODE_DOWNLOAD_ID)
+        return await cls.add_or_update(ProcessData(cls.METRIC_CODE_DOWNLOAD_ID, data.to_json()))
+
+    @classmethod
+    async def get_metric_code_download_checkpoint(cls) -> Optional[MetricCodeDownloadCheckpoint]:
+        data = await cls.get(cls.METRIC_CODE_DOWNLOAD_ID)
+        return MetricCodeDownloadCheckpoint.from_json(data.data) if data and data.data else None
+
+    @classmethod
+    async def add_or_update_region_code_download_checkpoint(cls, data: RegionCodeDownloadCheckpoint) -> int:
+        metrics.checkpoint_writes.inc(process=cls.REGION_CODE_DOWNLOAD_ID)
+        return await cls.add_or_update(ProcessData(cls.REGION_CODE_DOWNLOAD_ID, data.to_json()))
+
+    @classmethod
+    async def get_region_code_download_checkpoint(cls) -> Optional[RegionCodeDownloadCheckpoint]:
+        data = await cls.get(cls.REGION_CODE_DOWNLOAD_ID)
+        return RegionCodeDownloadCheckpoint.from_json(data.data) if data and data.data else None
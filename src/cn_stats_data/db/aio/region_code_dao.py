@@ -0,0 +1,155 @@
+from itertools import groupby
+from typing import List
+
+from cn_stats_util.models import Category
+
+from cn_stats_data import metrics
+from cn_stats_data.db import aio
+from cn_stats_data.db.hierarchy_cache import hierarchy_cache
+from cn_stats_data.db.hierarchy_index import HierarchyIndex
+from cn_stats_data.db.models import RegionCode
+from cn_stats_data.db.region_code_dao import (
+    _ADD_OR_UPDATE_SQL,
+    _DELETE_SQL,
+    _GET_SQL,
+    _LIST_SQL,
+    _LOG_CHANGES_SQL,
+    _SYNC_PARENT_SQL,
+    _WATERMARK_SQL,
+    _build_index,
+    _region_code_from_row,
+    _region_code_params,
+    _set_children,
+)
+
+__all__ = ["AsyncRegionCodeDao"]
+
+
+@metrics.instrument_dao
+class AsyncRegionCodeDao:
+    """
+    The async counterpart of `RegionCodeDao`, sharing its SQL and row mapping.
+    """
+
+    @classmethod
+    async def add_or_update(cls, lst: List[RegionCode]) -> int:
+        """
+        Insert or update the data to database.
+        :param lst: The list of region codes
+        :return: The record count are saved
+        """
+
+        if not lst:
+            return 0
+        data = [_region_code_params(i) for i in lst if not hasattr(i, "is_deleted") or not i.is_deleted]
+        if len(data) == 0:
+            return 0
+
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.executemany(_ADD_OR_UPDATE_SQL, data)
+                count = cursor.rowcount
+                for key, group in groupby(sorted(data, key=lambda x: x[1]), key=lambda x: x[1]):
+                    await cursor.execute(_SYNC_PARENT_SQL + _LOG_CHANGES_SQL, {"db_code": key, "region_codes": [i[0] for i in group]})
+                return count
+
+    @classmethod
+    async def delete(cls, lst: List[RegionCode]) -> int:
+        """
+        Delete the data from database
+        :param lst: the list of region codes
+        :return: The record count are deleted
+        """
+
+        if lst is None or len(lst) == 0:
+            return 0
+        data = [(i.db_code, i.code) for i in lst if not hasattr(i, "is_deleted") or i.is_deleted]
+        if len(data) == 0:
+            return 0
+
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.executemany(_DELETE_SQL, data)
+                count = cursor.rowcount
+                for key, group in groupby(sorted(data, key=lambda x: x[0]), key=lambda x: x[0]):
+                    await cursor.execute(_LOG_CHANGES_SQL, {"db_code": key, "region_codes": [i[1] for i in group]})
+                return count
+
+    @classmethod
+    async def get(cls, reg_code: str, db_code: Category) -> RegionCode | None:
+        """
+        Get region code from DB
+        :param reg_code: code of the region
+        :param db_code: db code of the region
+        :return: Returns the region code object if found, otherwise returns None
+        """
+
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(_GET_SQL, (db_code.db_code, reg_code))
+                row = await cursor.fetchone()
+                return None if row is None else _region_code_from_row(row, is_parent=row[4] is not None)
+
+    @classmethod
+    async def list(
+        cls, db_code: Category | None = None, reg_code: str | None = None
+    ) -> List[RegionCode]:
+        """
+        Get regions via db code and region code and its descendants
+        :param db_code: Specific the db code or None for all db codes
+        :param reg_code:  Specific the region code or None for regions
+        :return: Returns the regions and its descendants
+        """
+
+        dbcode = None if db_code is None else db_code.db_code
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(_LIST_SQL, (dbcode is None, dbcode, reg_code is None, reg_code))
+                data = [_region_code_from_row(i) for i in await cursor.fetchall()]
+                _set_children(_build_index(data))
+                return data
+
+    @classmethod
+    async def get_watermark(cls, db_code: Category) -> tuple:
+        """
+        Get the watermark of the region codes of the db code, see `RegionCodeDao.get_watermark`
+        :param db_code: db code of the regions
+        :return: Returns the count of the codes and the max last updated time
+        """
+
+        async with aio.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(_WATERMARK_SQL, {"db_code": db_code.db_code})
+                return tuple(await cursor.fetchone())
+
+    @classmethod
+    async def get_hierarchy(cls, db_code: Category) -> HierarchyIndex[RegionCode]:
+        """
+        Get the hierarchy of the regions of the db code from the hierarchy cache shared with `RegionCodeDao`.
+        The nodes are shared with other callers and must not be modified.
+        :param db_code: Specific the db code
+        :return: Returns the hierarchy index of the regions, keyed by (db_code, region_code)
+        """
+
+        async def load() -> HierarchyIndex[RegionCode]:
+            return _build_index(await cls.list(db_code))
+
+        return await hierarchy_cache.get_async(
+            ("region_codes", db_code.db_code),
+            watermark=lambda: cls.get_watermark(db_code),
+            loader=load,
+        )
+
+    @classmethod
+    async def list_cached(cls, db_code: Category, reg_code: str | None = None) -> List[RegionCode]:
+        """
+        Same as `list`, but the regions are served from the hierarchy cache, see `get_hierarchy`.
+        :param db_code: Specific the db code
+        :param reg_code: Specific the region code or None for regions
+        :return: Returns the regions and its descendants
+        """
+        index = await cls.get_hierarchy(db_code)
+        if reg_code is None:
+            return [i for i in index]
+        key = (db_code.db_code, reg_code)
+        return index.descendants(key) if key in index else []
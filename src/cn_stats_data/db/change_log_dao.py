@@ -0,0 +1,113 @@
+from typing import Iterator, List
+
+from cn_stats_data import db, metrics
+from cn_stats_data.db.models import ChangeEntity, ChangeOperation, ChangeRecord
+
+__all__ = ["ChangeLogDao"]
+
+# taken right before appending to the change log, and held until the transaction is committed,
+# so the transactions append to the log one by one in the order of their commits
+_LOCK_CHANGE_LOG_SQL = """
+SELECT pg_advisory_xact_lock(hashtext('cn_stats_change_log'));
+"""
+
+# the operation of a record changed at now() of the transaction, a restored record is an update
+_CHANGE_OPERATION_TEMPLATE = """CASE
+        WHEN {t}.is_deleted THEN 'delete'
+        WHEN {t}.created_time = {t}.last_updated_time THEN 'insert'
+        ELSE 'update' END"""
+
+_LIST_CHANGED_SINCE_SQL = """
+SELECT
+    seq,
+    entity,
+    operation,
+    db_code,
+    code,
+    region_code,
+    date_num,
+    metric_value,
+    row_hash,
+    changed_time
+FROM cn_stats_change_log
+WHERE seq > %s AND (%s OR entity = ANY(%s))
+ORDER BY seq
+"""
+
+_LAST_SEQ_SQL = """
+SELECT COALESCE(max(seq), 0) FROM cn_stats_change_log;
+"""
+
+_PURGE_SQL = """
+DELETE FROM cn_stats_change_log WHERE seq <= %s;
+"""
+
+
+def _change_from_row(i: tuple) -> ChangeRecord:
+    return ChangeRecord(
+        seq=i[0],
+        entity=ChangeEntity(i[1]),
+        operation=ChangeOperation(i[2]),
+        db_code=i[3],
+        code=i[4],
+        region_code=i[5] if i[5] != "" else None,
+        date_num=i[6],
+        metric_value=i[7],
+        row_hash=i[8],
+        changed_time=i[9],
+    )
+
+
+@metrics.instrument_dao
+class ChangeLogDao:
+    """
+    The class for reading the change log, which is appended by `MetricCodeDao`, `RegionCodeDao` and `MetricDataDao`.
+    """
+
+    @classmethod
+    def list_changed_since(
+        cls,
+        seq: int = 0,
+        entities: List[ChangeEntity] | None = None,
+        itersize: int = 10000,
+    ) -> Iterator[ChangeRecord]:
+        """
+        Stream the changes after the sequence number, without loading them into memory at once.
+        :param seq: The last sequence number the consumer has seen, 0 for all the changes kept in the log
+        :param entities: Specific the entity types or None for all the types
+        :param itersize: The count of the rows fetched from database at a time
+        :return: Returns the changes in the order of their sequence numbers
+        """
+
+        criteria = (seq, entities is None, [] if entities is None else [i.value for i in entities])
+        with db.get_conn() as conn:
+            with conn.cursor(name="cn_stats_change_log") as cursor:
+                cursor.itersize = itersize
+                cursor.execute(_LIST_CHANGED_SINCE_SQL, criteria)
+                for i in cursor:
+                    yield _change_from_row(i)
+
+    @classmethod
+    def get_last_seq(cls) -> int:
+        """
+        Get the sequence number of the last change, a new consumer starts from it to skip the history
+        :return: Returns the sequence number or 0 if the log is empty
+        """
+
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(_LAST_SEQ_SQL)
+                return cursor.fetchone()[0]
+
+    @classmethod
+    def purge(cls, seq: int) -> int:
+        """
+        Delete the changes which have been read by all the consumers
+        :param seq: The sequence number of the last change to delete
+        :return: The record count are deleted
+        """
+
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(_PURGE_SQL, (seq,))
+                return cursor.rowcount
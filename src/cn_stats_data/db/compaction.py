@@ -0,0 +1,129 @@
+import logging
+from typing import Optional
+
+from cn_stats_data import db
+
+__all__ = ["compact_table", "compact"]
+
+# the primary key of the tables with soft-deleted rows
+_KEYS = {
+    "cn_stats_metric_data": "metric_code, db_code, date_num, region_code",
+    "cn_stats_metric_codes": "db_code, metric_code",
+    "cn_stats_region_codes": "db_code, region_code",
+}
+
+# the columns copied to the archive tables, named as the column order of a table migrated by ALTER TABLE and of its
+# archive created by LIKE can differ
+_COLUMNS = {
+    "cn_stats_metric_data": "metric_code, db_code, date_num, region_code, metric_value, extra_attributes, row_hash, "
+                            "is_deleted, created_time, last_updated_time",
+    "cn_stats_metric_codes": "metric_code, db_code, name, explanation, memo, unit, parent_metric_code, "
+                             "extra_attributes, row_hash, is_deleted, created_time, last_updated_time",
+    "cn_stats_region_codes": "region_code, db_code, name, explanation, children_region_codes, parent_region_code, "
+                             "extra_attributes, row_hash, is_deleted, created_time, last_updated_time",
+}
+
+# move a batch of the expired soft-deleted rows out of the table in one statement.
+# the rows locked by other transactions are skipped, they are purged by the next run
+_COMPACT_SQL_TEMPLATE = """
+WITH expired AS (
+    SELECT {keys}
+    FROM {table}
+    WHERE is_deleted = TRUE AND last_updated_time < now() - make_interval(days => %(retention_days)s)
+    LIMIT %(batch_size)s
+    FOR UPDATE SKIP LOCKED
+), moved AS (
+    DELETE FROM {table} t
+    USING expired e
+    WHERE ({t_keys}) = ({e_keys})
+    RETURNING t.*
+), archived AS (
+    INSERT INTO {table}_archive ({columns}, archived_time)
+    SELECT {columns}, now() FROM moved
+    WHERE %(archive)s
+){extra}
+SELECT count(*) FROM moved;
+"""
+
+# the closure links of a purged metric code can't be used any more, neither as the ancestor nor the descendant
+_PURGE_CLOSURE_CTE = """, unlinked AS (
+    DELETE FROM cn_stats_metric_code_closure c
+    USING moved m
+    WHERE c.db_code = m.db_code AND (c.ancestor_code = m.metric_code OR c.descendant_code = m.metric_code)
+)"""
+
+_COMPACT_SQL = {
+    table: _COMPACT_SQL_TEMPLATE.format(
+        table=table,
+        keys=keys,
+        columns=_COLUMNS[table],
+        t_keys=", ".join(f"t.{i.strip()}" for i in keys.split(",")),
+        e_keys=", ".join(f"e.{i.strip()}" for i in keys.split(",")),
+        extra=_PURGE_CLOSURE_CTE if table == "cn_stats_metric_codes" else "",
+    )
+    for table, keys in _KEYS.items()
+}
+
+
+def compact_table(
+    table: str,
+    retention_days: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    archive: Optional[bool] = None,
+) -> int:
+    """
+    Purge the soft-deleted rows of the table which haven't been changed in the retention window.
+    The rows are purged in batches, one transaction per batch, so neither the locks nor the WAL of one run grow with the
+    count of the deleted rows.
+    :param table: The table, one of cn_stats_metric_codes, cn_stats_region_codes and cn_stats_metric_data
+    :param retention_days: The days the soft-deleted rows are kept, or None for the config
+    :param batch_size: The row count purged in a transaction, or None for the config
+    :param archive: Whether the purged rows are kept in the archive table, or None for the config
+    :return: Returns the count of the rows purged
+    """
+    if table not in _COMPACT_SQL:
+        raise ValueError(f"Unknown table {table}, it should be one of {', '.join(_COMPACT_SQL)}.")
+
+    config = db.compaction_config
+    params = {
+        "retention_days": config.retention_days if retention_days is None else retention_days,
+        "batch_size": config.batch_size if batch_size is None else batch_size,
+        "archive": config.archive if archive is None else archive,
+    }
+    # a batch of no rows is always "full", so the purge would never end
+    if params["batch_size"] <= 0:
+        raise ValueError(f"The batch size should be positive, but it's {params['batch_size']}.")
+    logger = logging.getLogger(__name__)
+
+    total = 0
+    while True:
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(_COMPACT_SQL[table], params)
+                count = cursor.fetchone()[0]
+        total += count
+        if count < params["batch_size"]:
+            break
+
+    logger.info(f"Purged {total} soft-deleted rows of {table}.")
+    return total
+
+
+def compact(
+    retention_days: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    archive: Optional[bool] = None,
+) -> dict[str, int]:
+    """
+    Purge the expired soft-deleted rows of the metric data, the metric codes and the region codes.
+    :param retention_days: The days the soft-deleted rows are kept, or None for the config
+    :param batch_size: The row count purged in a transaction, or None for the config
+    :param archive: Whether the purged rows are kept in the archive tables, or None for the config
+    :return: Returns the count of the rows purged, keyed by the table
+    """
+    return {i: compact_table(i, retention_days, batch_size, archive) for i in _KEYS}
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    compact()
@@ -0,0 +1,21 @@
+from cn_stats_data import db
+
+__all__ = ["MetricCodeDao", "RegionCodeDao", "MetricDataDao", "ProcessDataDao", "RollupDao", "ChangeLogDao"]
+
+# the DAOs of the storage backend configured by `backend` of the [db] config
+if db.db_config.backend == "sqlite":
+    from cn_stats_data.db.sqlite.metric_code_dao import SqliteMetricCodeDao as MetricCodeDao
+    from cn_stats_data.db.sqlite.region_code_dao import SqliteRegionCodeDao as RegionCodeDao
+    from cn_stats_data.db.sqlite.metric_data_dao import SqliteMetricDataDao as MetricDataDao
+    from cn_stats_data.db.sqlite.process_data_dao import SqliteProcessDataDao as ProcessDataDao
+    RollupDao = None  # the roll-ups are only maintained in Postgres
+    ChangeLogDao = None  # so is the change log
+elif db.db_config.backend == "postgres":
+    from cn_stats_data.db.metric_code_dao import MetricCodeDao
+    from cn_stats_data.db.region_code_dao import RegionCodeDao
+    from cn_stats_data.db.metric_data_dao import MetricDataDao
+    from cn_stats_data.db.process_data_dao import ProcessDataDao
+    from cn_stats_data.db.rollup_dao import RollupDao
+    from cn_stats_data.db.change_log_dao import ChangeLogDao
+else:
+    raise ValueError(f"Unknown storage backend {db.db_config.backend}, it should be postgres or sqlite.")
@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 
-__all__ = ['DbConfig']
+__all__ = ['DbConfig', 'CacheConfig', 'SpoolConfig', 'SnapshotConfig', 'CompactionConfig', 'QueryStatsConfig']
 
 
 @dataclass
@@ -10,3 +10,46 @@ class DbConfig:
     db: str
     user: str
     password: str 
+    backend: str = 'postgres'
+    sqlite_path: str = 'cn_stats.db'
+    async_pool_min_size: int = 1
+    async_pool_max_size: int = 20
+
+
+@dataclass
+class CacheConfig:
+    hierarchy_max_entries: int = 64
+    hierarchy_max_nodes: int = 1000000
+    series_max_entries: int = 4096
+    series_max_points: int = 1000000
+
+
+@dataclass
+class SpoolConfig:
+    enabled: bool = False
+    directory: str = 'spool'
+    segment_max_records: int = 100000
+    batch_max_records: int = 50000
+    retry_interval: float = 5.0
+    segment_max_seconds: float = 60.0
+    close_timeout: float = 600.0
+
+
+@dataclass
+class SnapshotConfig:
+    directory: str = 'snapshot'
+
+
+@dataclass
+class CompactionConfig:
+    retention_days: int = 90
+    batch_size: int = 10000
+    archive: bool = True
+
+
+@dataclass
+class QueryStatsConfig:
+    enabled: bool = True
+    slow_query_ms: float = 1000.0
+    explain_slow: bool = False
+    max_param_chars: int = 2000
@@ -0,0 +1,141 @@
+from collections import OrderedDict
+import threading
+import weakref
+from typing import Any, Awaitable, Callable, Hashable, Optional, Sized, TypeVar
+
+from cn_stats_data import db
+
+__all__ = ["HierarchyCache", "hierarchy_cache", "series_cache"]
+
+V = TypeVar("V", bound=Sized)
+
+
+class _Entry:
+    def __init__(self, watermark: Any, value: Sized):
+        self.watermark = watermark
+        self.value = value
+
+
+class HierarchyCache:
+    """
+    In-process LRU cache for the code hierarchies loaded per category, or other sized values like series.
+    Every lookup compares a cheap watermark of the category (e.g. the row count and max(last_updated_time))
+    with the one recorded when the entry was loaded, and only reloads the hierarchy when it's changed.
+    The cached objects are shared between callers, and must be treated as read-only.
+    """
+
+    def __init__(self, max_entries: int, max_nodes: int):
+        """
+        :param max_entries: The max count of hierarchies kept in the cache
+        :param max_nodes: The max count of nodes kept in the cache, summed over all hierarchies
+        """
+        self.max_entries = max_entries
+        self.max_nodes = max_nodes
+        self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+        self._nodes = 0
+        self._lock = threading.Lock()
+        # the lock of loading a key, so concurrent misses of the same key load it once, the others aren't blocked.
+        # a lock is dropped once no thread holds a reference to it
+        self._loading: weakref.WeakValueDictionary[Hashable, threading.Lock] = weakref.WeakValueDictionary()
+
+    def get(self, key: Hashable, watermark: Callable[[], Any], loader: Callable[[], V]) -> V:
+        """
+        Get the hierarchy from the cache, or load it if it's not cached or out of date
+        :param key: The key of the hierarchy
+        :param watermark: The function to get the current watermark of the hierarchy
+        :param loader: The function to load the hierarchy
+        :return: Returns the hierarchy, its size is the count of its nodes
+        """
+        # the lock is only held to access the entries, not while reading database,
+        # so the lookups of the other keys, and the hits, don't wait for a slow query
+        current = watermark()
+        entry = self._lookup(key, current)
+        if entry is not None:
+            return entry.value
+
+        with self._lock:
+            loading = self._loading.get(key)
+            if loading is None:
+                loading = self._loading[key] = threading.Lock()
+        with loading:
+            entry = self._lookup(key, current)  # loaded by a concurrent miss while waiting
+            if entry is not None:
+                return entry.value
+            value = loader()
+            with self._lock:
+                self._remove(key)
+                self._put(key, _Entry(current, value))
+            return value
+
+    async def get_async(
+        self, key: Hashable, watermark: Callable[[], Awaitable[Any]], loader: Callable[[], Awaitable[V]]
+    ) -> V:
+        """
+        Same as `get`, but the watermark and the loader are coroutine functions.
+        Concurrent misses of the same key may load it more than once.
+        """
+        current = await watermark()
+        entry = self._lookup(key, current)
+        if entry is not None:
+            return entry.value
+
+        value = await loader()
+        with self._lock:
+            self._remove(key)
+            self._put(key, _Entry(current, value))
+        return value
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """
+        Remove the hierarchy from the cache
+        :param key: The key of the hierarchy or None to clear the cache
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._nodes = 0
+            else:
+                self._remove(key)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def nodes(self) -> int:
+        return self._nodes
+
+    def _lookup(self, key: Hashable, watermark: Any) -> Optional[_Entry]:
+        """Get the entry of the key if it's loaded at the watermark, and mark it as the most recently used."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.watermark != watermark:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._nodes -= len(entry.value)
+
+    def _put(self, key: Hashable, entry: _Entry) -> None:
+        size = len(entry.value)
+        if size > self.max_nodes:
+            return  # too large to be cached
+        while self._entries and (len(self._entries) >= self.max_entries or self._nodes + size > self.max_nodes):
+            _, evicted = self._entries.popitem(last=False)
+            self._nodes -= len(evicted.value)
+        self._entries[key] = entry
+        self._nodes += size
+
+
+hierarchy_cache = HierarchyCache(
+    max_entries=db.cache_config.hierarchy_max_entries,
+    max_nodes=db.cache_config.hierarchy_max_nodes,
+)
+
+# the results of the series queries of MetricDataDao, a node is a point of the series
+series_cache = HierarchyCache(
+    max_entries=db.cache_config.series_max_entries,
+    max_nodes=db.cache_config.series_max_points,
+)
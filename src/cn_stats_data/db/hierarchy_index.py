@@ -0,0 +1,158 @@
+from typing import Callable, Generic, Hashable, Iterable, Iterator, List, Optional, TypeVar
+
+__all__ = ["HierarchyIndex"]
+
+T = TypeVar("T")
+
+
+class HierarchyIndex(Generic[T]):
+    """
+    Read-only index of a tree (or forest) of nodes, built iteratively in one pass over the nodes.
+    It precomputes the parent and children of every node, the depth, the leaves,
+    and the Euler-tour interval of every subtree, so checking if a node is a descendant of another
+    is a constant time operation, and the descendants or the leaves of a subtree are a slice.
+    Nodes whose parent isn't in the index are the roots.
+    """
+
+    def __init__(
+        self,
+        nodes: Iterable[T],
+        key: Callable[[T], Hashable],
+        parent_key: Callable[[T], Optional[Hashable]],
+    ):
+        """
+        :param nodes: The nodes of the tree, the children are kept in the order of this iterable
+        :param key: The function to get the key of a node
+        :param parent_key: The function to get the key of the parent of a node, or None for a root
+        """
+        self._nodes: List[T] = list(nodes)
+        self._positions: dict[Hashable, int] = {}
+        for i, n in enumerate(self._nodes):
+            self._positions.setdefault(key(n), i)
+
+        size = len(self._nodes)
+        self._parents: List[int] = [-1] * size
+        self._children: List[List[int]] = [[] for _ in range(size)]
+        for i, n in enumerate(self._nodes):
+            p = self._positions.get(parent_key(n))
+            if p is not None and p != i:
+                self._parents[i] = p
+                self._children[p].append(i)
+
+        self._depths: List[int] = [0] * size
+        self._tin: List[int] = [-1] * size
+        self._tout: List[int] = [0] * size
+        self._order: List[int] = []
+        self._roots: List[int] = [i for i in range(size) if self._parents[i] < 0]
+        for r in self._roots:
+            self._visit(r)
+        # nodes on a cycle are not reachable from the roots, break the cycle at the first one
+        for i in range(size):
+            if self._tin[i] < 0:
+                self._parents[i] = -1
+                self._roots.append(i)
+                self._visit(i)
+
+        # prefix count of leaves in Euler order, so the leaves of a subtree are a slice
+        self._leaf_order: List[int] = []
+        self._leaf_prefix: List[int] = [0] * (size + 1)
+        for t, i in enumerate(self._order):
+            if not self._children[i]:
+                self._leaf_order.append(i)
+            self._leaf_prefix[t + 1] = len(self._leaf_order)
+
+    def _visit(self, root: int) -> None:
+        self._depths[root] = 0
+        stack = [(root, False)]
+        while stack:
+            i, exiting = stack.pop()
+            if exiting:
+                self._tout[i] = len(self._order)
+                continue
+            self._tin[i] = len(self._order)
+            self._order.append(i)
+            stack.append((i, True))
+            for c in reversed(self._children[i]):
+                if self._tin[c] < 0:
+                    self._depths[c] = self._depths[i] + 1
+                    stack.append((c, False))
+
+    def _position(self, key: Hashable) -> int:
+        return self._positions[key]
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __iter__(self) -> Iterator[T]:
+        return iter(self._nodes)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._positions
+
+    def node(self, key: Hashable) -> T:
+        """Get the node by its key, raises KeyError if not found."""
+        return self._nodes[self._position(key)]
+
+    def get(self, key: Hashable, default: Optional[T] = None) -> Optional[T]:
+        """Get the node by its key, or the default value if not found."""
+        i = self._positions.get(key)
+        return default if i is None else self._nodes[i]
+
+    @property
+    def roots(self) -> List[T]:
+        return [self._nodes[i] for i in self._roots]
+
+    @property
+    def leaves(self) -> List[T]:
+        return [self._nodes[i] for i in self._leaf_order]
+
+    def parent(self, key: Hashable) -> Optional[T]:
+        p = self._parents[self._position(key)]
+        return None if p < 0 else self._nodes[p]
+
+    def children(self, key: Hashable) -> List[T]:
+        return [self._nodes[i] for i in self._children[self._position(key)]]
+
+    def depth(self, key: Hashable) -> int:
+        """Get the depth of the node, the roots are at depth 0."""
+        return self._depths[self._position(key)]
+
+    def is_leaf(self, key: Hashable) -> bool:
+        return not self._children[self._position(key)]
+
+    def is_descendant(self, key: Hashable, ancestor_key: Hashable, include_self: bool = False) -> bool:
+        """
+        Check if a node is in the subtree of another node
+        :param key: The key of the node
+        :param ancestor_key: The key of the ancestor
+        :param include_self: Whether a node is thought as a descendant of itself
+        :return: Returns True if the node is a descendant of the ancestor
+        """
+        i = self._position(key)
+        a = self._position(ancestor_key)
+        if i == a:
+            return include_self
+        return self._tin[a] <= self._tin[i] < self._tout[a]
+
+    def descendants(self, key: Hashable, include_self: bool = True) -> List[T]:
+        """Get the nodes of the subtree in pre-order."""
+        i = self._position(key)
+        start = self._tin[i] if include_self else self._tin[i] + 1
+        return [self._nodes[j] for j in self._order[start:self._tout[i]]]
+
+    def leaves_under(self, key: Hashable) -> List[T]:
+        """Get the leaves of the subtree, a leaf is a leaf of itself."""
+        i = self._position(key)
+        start = self._leaf_prefix[self._tin[i]]
+        end = self._leaf_prefix[self._tout[i]]
+        return [self._nodes[j] for j in self._leaf_order[start:end]]
+
+    def ancestors(self, key: Hashable) -> List[T]:
+        """Get the ancestors of the node, from the root to its parent."""
+        result = []
+        p = self._parents[self._position(key)]
+        while p >= 0:
+            result.append(self._nodes[p])
+            p = self._parents[p]
+        result.reverse()
+        return result
@@ -4,45 +4,16 @@ from typing import List, Optional
 
 from cn_stats_util.models import Category
 
-from cn_stats_data import db
+from cn_stats_data import db, metrics
+from cn_stats_data.db.change_log_dao import _CHANGE_OPERATION_TEMPLATE, _LOCK_CHANGE_LOG_SQL
+from cn_stats_data.db.hierarchy_cache import hierarchy_cache
+from cn_stats_data.db.hierarchy_index import HierarchyIndex
 from cn_stats_data.db.models import MetricCode
+from cn_stats_data.db.row_hash import metric_code_hash
 
 __all__ = ["MetricCodeDao"]
 
-
-class MetricCodeDao:
-    """
-    The class for interacting with database.
-    """
-
-    @classmethod
-    def add_or_update(cls, lst: List[MetricCode]) -> int:
-        """
-        Insert or update the data to database.
-        :param lst: The list of metric codes
-        :return: The record count are saved
-        """
-
-        if not lst:
-            return 0
-        data = [
-            (
-                i.code,
-                i.db_code,
-                i.name,
-                i.explanation,
-                i.memo,
-                i.unit,
-                i.parent.code if i.parent else None,
-                json.dumps(i.extra_attributes),
-            )
-            for i in lst
-            if not hasattr(i, "is_deleted") or not i.is_deleted
-        ]
-        if len(data) == 0:
-            return 0
-
-        sql = """        
+_ADD_OR_UPDATE_SQL = """
 INSERT INTO cn_stats_metric_codes AS t (
     metric_code, 
     db_code, 
@@ -52,10 +23,11 @@ INSERT INTO cn_stats_metric_codes AS t (
     unit,
     parent_metric_code, 
     extra_attributes,
+    row_hash,
     is_deleted,
     created_time, 
     last_updated_time) 
-VALUES(%s, %s, %s, %s, %s, %s, %s, %s::JSONB, False, now(), now()) 
+VALUES(%s, %s, %s, %s, %s, %s, %s, %s::JSONB, %s, False, now(), now()) 
 ON CONFLICT(db_code, metric_code) 
 DO UPDATE SET 
     name = EXCLUDED.name, 
@@ -64,30 +36,299 @@ DO UPDATE SET
     unit = EXCLUDED.unit,
     parent_metric_code = EXCLUDED.parent_metric_code, 
     extra_attributes = EXCLUDED.extra_attributes,
+    row_hash = EXCLUDED.row_hash,
     is_deleted = False,
     last_updated_time = EXCLUDED.last_updated_time 
-WHERE t.name <> EXCLUDED.name 
-    OR ((t.explanation IS NULL AND EXCLUDED.explanation IS NOT NULL) 
-        OR (t.explanation IS NOT NULL AND EXCLUDED.explanation IS NULL) 
-        OR (t.explanation <> EXCLUDED.explanation))
-    OR ((t.memo IS NULL AND EXCLUDED.memo IS NOT NULL) 
-        OR (t.memo IS NOT NULL AND EXCLUDED.memo IS NULL) 
-        OR (t.memo <> EXCLUDED.memo))
-    OR ((t.unit IS NULL AND EXCLUDED.unit IS NOT NULL) 
-        OR (t.unit IS NOT NULL AND EXCLUDED.unit IS NULL) 
-        OR (t.unit <> EXCLUDED.unit))
-    OR ((t.parent_metric_code IS NULL AND EXCLUDED.parent_metric_code IS NOT NULL) 
-        OR (t.parent_metric_code IS NOT NULL AND EXCLUDED.parent_metric_code IS NULL) 
-        OR (t.parent_metric_code <> EXCLUDED.parent_metric_code))
-    OR ((t.extra_attributes IS NULL AND EXCLUDED.extra_attributes IS NOT NULL) 
-        OR (t.extra_attributes IS NOT NULL AND EXCLUDED.extra_attributes IS NULL) 
-        OR (t.extra_attributes <> EXCLUDED.extra_attributes))
+WHERE t.row_hash IS DISTINCT FROM EXCLUDED.row_hash
     OR t.is_deleted = True;
+"""
+
+_DELETE_SQL = """
+UPDATE cn_stats_metric_codes SET
+    is_deleted = True,
+    last_updated_time = now()
+WHERE db_code = %s
+    AND metric_code = %s 
+    AND is_deleted = False;
+"""
+
+_CLOSURE_LINKS_SQL = """
+SELECT descendant_code, ancestor_code, depth
+FROM cn_stats_metric_code_closure
+WHERE db_code = %s AND descendant_code = ANY(%s) AND depth <= 1;
+"""
+
+# append the saved or deleted codes to the change log, the changed ones are updated at now() of the transaction
+_LOG_CHANGES_SQL = _LOCK_CHANGE_LOG_SQL + f"""
+INSERT INTO cn_stats_change_log (entity, operation, db_code, code, row_hash)
+SELECT 'metric_code', {_CHANGE_OPERATION_TEMPLATE.format(t="c")}, c.db_code, c.metric_code, c.row_hash
+FROM cn_stats_metric_codes c
+WHERE c.db_code = %s
+    AND c.metric_code = ANY(%s)
+    AND c.last_updated_time = now()
+ORDER BY c.metric_code;
+"""
+
+_GET_SQL = """
+SELECT 
+    metric_code, 
+    db_code, 
+    name, 
+    explanation, 
+    memo, 
+    unit,
+    parent_metric_code, 
+    extra_attributes,
+    is_deleted,
+    created_time, 
+    last_updated_time,
+    row_hash,
+    CASE WHEN EXISTS (SELECT 1 FROM cn_stats_metric_codes WHERE is_deleted = FALSE AND db_code = %s AND parent_metric_code = %s) 
+         THEN TRUE 
+         ELSE FALSE END AS is_parent
+FROM cn_stats_metric_codes 
+WHERE is_deleted = FALSE AND db_code = %s AND metric_code = %s;
+"""
+
+# all the codes of the db code
+_LIST_SQL = """
+SELECT 
+    metric_code, 
+    db_code, 
+    name, 
+    explanation, 
+    memo, 
+    unit,
+    parent_metric_code, 
+    extra_attributes,
+    is_deleted,
+    created_time, 
+    last_updated_time,
+    row_hash 
+FROM cn_stats_metric_codes 
+WHERE is_deleted = FALSE AND (%s OR db_code = %s);
+"""
+
+# the code and its descendants, looked up from the closure table
+_LIST_DESCENDANTS_SQL = """
+SELECT 
+    m.metric_code, 
+    m.db_code, 
+    m.name, 
+    m.explanation, 
+    m.memo, 
+    m.unit,
+    m.parent_metric_code, 
+    m.extra_attributes,
+    m.is_deleted,
+    m.created_time, 
+    m.last_updated_time,
+    m.row_hash 
+FROM cn_stats_metric_code_closure cl
+    INNER JOIN cn_stats_metric_codes r ON r.db_code = cl.db_code AND r.metric_code = cl.ancestor_code AND r.is_deleted = FALSE
+    INNER JOIN cn_stats_metric_codes m ON m.db_code = cl.db_code AND m.metric_code = cl.descendant_code AND m.is_deleted = FALSE
+WHERE (%s OR cl.db_code = %s) AND cl.ancestor_code = %s;
+"""
+
+# the live leaves, a leaf under a deleted ancestor is excluded as it's detached from the hierarchy.
+# the deleted code keeps the links to its subtree, so the deleted ancestor is found in the closure table
+_LIST_LEAVES_SQL = """
+SELECT 
+    m.metric_code, 
+    m.db_code, 
+    m.name, 
+    m.explanation, 
+    m.memo, 
+    m.unit,
+    m.parent_metric_code, 
+    m.extra_attributes,
+    m.is_deleted,
+    m.created_time, 
+    m.last_updated_time,
+    m.row_hash 
+FROM cn_stats_metric_codes m
+WHERE m.is_deleted = FALSE AND m.db_code = %s
+    AND NOT EXISTS (
+        SELECT 1 FROM cn_stats_metric_code_closure c 
+        WHERE c.db_code = m.db_code AND c.ancestor_code = m.metric_code AND c.depth = 1)
+    AND NOT EXISTS (
+        SELECT 1 FROM cn_stats_metric_code_closure d 
+            INNER JOIN cn_stats_metric_codes x ON x.db_code = d.db_code AND x.metric_code = d.ancestor_code AND x.is_deleted = TRUE
+        WHERE d.db_code = m.db_code AND d.descendant_code = m.metric_code AND d.depth > 0)
+    AND (%s OR EXISTS (
+        SELECT 1 FROM cn_stats_metric_code_closure a 
+            INNER JOIN cn_stats_metric_codes r ON r.db_code = a.db_code AND r.metric_code = a.ancestor_code AND r.is_deleted = FALSE
+        WHERE a.db_code = m.db_code AND a.descendant_code = m.metric_code AND a.ancestor_code = ANY(%s)));
+"""
+
+_LIST_ANCESTORS_SQL = """
+SELECT 
+    m.metric_code, 
+    m.db_code, 
+    m.name, 
+    m.explanation, 
+    m.memo, 
+    m.unit,
+    m.parent_metric_code, 
+    m.extra_attributes,
+    m.is_deleted,
+    m.created_time, 
+    m.last_updated_time,
+    m.row_hash 
+FROM cn_stats_metric_code_closure cl
+    INNER JOIN cn_stats_metric_codes m ON m.db_code = cl.db_code AND m.metric_code = cl.ancestor_code AND m.is_deleted = FALSE
+WHERE cl.db_code = %s AND cl.descendant_code = %s AND cl.depth > 0
+ORDER BY cl.depth DESC;
+"""
+
+# last_updated_time is the start of the writing transaction, a transaction started earlier but committed later
+# can't move it, so the last sequence number of the change log, assigned in commit order, is compared as well
+_WATERMARK_SQL = """
+SELECT 
+    count(*), 
+    max(last_updated_time),
+    (SELECT max(seq) FROM cn_stats_change_log WHERE entity = 'metric_code' AND db_code = %(db_code)s)
+FROM cn_stats_metric_codes 
+WHERE db_code = %(db_code)s;
+"""
+
+# remove the links from the ancestors above the metric code to its subtree
+_DETACH_SQL = """
+DELETE FROM cn_stats_metric_code_closure a
+USING cn_stats_metric_code_closure s
+WHERE s.db_code = %(db_code)s
+    AND s.ancestor_code = %(metric_code)s
+    AND a.db_code = s.db_code
+    AND a.descendant_code = s.descendant_code
+    AND a.depth > s.depth;
+"""
+
+# link the subtree of the metric code to its parent and the ancestors of its parent
+_ATTACH_SQL = """
+INSERT INTO cn_stats_metric_code_closure (db_code, ancestor_code, descendant_code, depth)
+VALUES (%(db_code)s, %(metric_code)s, %(metric_code)s, 0)
+ON CONFLICT (db_code, ancestor_code, descendant_code) DO NOTHING;
+
+INSERT INTO cn_stats_metric_code_closure (db_code, ancestor_code, descendant_code, depth)
+SELECT s.db_code, p.ancestor_code, s.descendant_code, p.depth + s.depth + 1
+FROM cn_stats_metric_code_closure s
+    INNER JOIN (
+        SELECT %(parent_metric_code)s AS ancestor_code, 0 AS depth
+        UNION ALL
+        SELECT ancestor_code, depth
+        FROM cn_stats_metric_code_closure
+        WHERE db_code = %(db_code)s AND descendant_code = %(parent_metric_code)s AND depth > 0
+    ) p ON p.ancestor_code IS NOT NULL
+WHERE s.db_code = %(db_code)s AND s.ancestor_code = %(metric_code)s
+ON CONFLICT (db_code, ancestor_code, descendant_code) DO UPDATE SET depth = EXCLUDED.depth;
+"""
+
+
+def _build_index(data: List[MetricCode]) -> HierarchyIndex[MetricCode]:
+    return HierarchyIndex(
+        data,
+        key=lambda i: (i.db_code, i.code),
+        parent_key=lambda i: (i.db_code, i.parent.code) if i.parent else None,
+    )
+
+
+def _set_children(index: HierarchyIndex[MetricCode]) -> None:
+    for i in index:
+        if i.code:
+            i.children = index.children((i.db_code, i.code))
+
+
+def _metric_code_from_row(i: tuple, is_parent: bool = False) -> MetricCode:
+    return MetricCode(
+        code=i[0],
+        db_code=i[1],
+        name=i[2],
+        explanation=i[3],
+        is_parent=is_parent,
+        memo=i[4],
+        unit=i[5],
+        parent=(
+            MetricCode(
+                code=i[6],
+                db_code=i[1],
+                name=None,
+                explanation=None,
+                is_parent=False,
+            )
+            if i[6]
+            else None
+        ),
+        children=None,
+        is_deleted=i[8],
+        created_time=i[9],
+        last_updated_time=i[10],
+        row_hash=i[11],
+        **i[7],
+    )
+
+
+def _metric_code_params(i: MetricCode) -> tuple:
+    return (
+        i.code,
+        i.db_code,
+        i.name,
+        i.explanation,
+        i.memo,
+        i.unit,
+        i.parent.code if i.parent else None,
+        json.dumps(i.extra_attributes),
+        metric_code_hash(i),
+    )
+
+
+def _closure_relinks(lst: List[tuple[str, str, Optional[str]]], links: List[tuple]) -> List[dict]:
+    """
+    Get the saved metric codes need to be relinked in the closure table
+    :param lst: The list of (db_code, metric_code, parent_metric_code) saved of one db code
+    :param links: The rows of `_CLOSURE_LINKS_SQL` of the metric codes
+    :return: Returns the parameters of `_DETACH_SQL` and `_ATTACH_SQL` of the codes which are new or whose parent is changed
+    """
+    linked = set()
+    parents = {}
+    for i in links:
+        if i[2] == 0:
+            linked.add(i[0])
+        else:
+            parents[i[0]] = i[1]
+    return [
+        {"db_code": i[0], "metric_code": i[1], "parent_metric_code": i[2]}
+        for i in lst
+        if i[1] not in linked or parents.get(i[1]) != i[2]
+    ]
+
+
+@metrics.instrument_dao
+class MetricCodeDao:
+    """
+    The class for interacting with database.
+    """
+
+    @classmethod
+    def add_or_update(cls, lst: List[MetricCode]) -> int:
+        """
+        Insert or update the data to database.
+        :param lst: The list of metric codes
+        :return: The record count are saved
         """
+
+        if not lst:
+            return 0
+        data = [_metric_code_params(i) for i in lst if not hasattr(i, "is_deleted") or not i.is_deleted]
+        if len(data) == 0:
+            return 0
+
         with db.get_conn() as conn:
             with conn.cursor() as cursor:
-                cursor.executemany(sql, data)
-                return cursor.rowcount
+                cursor.executemany(_ADD_OR_UPDATE_SQL, data)
+                count = cursor.rowcount
+                cls._relink_closure(cursor, [(i[1], i[0], i[6]) for i in data])
+                cls._log_changes(cursor, [(i[1], i[0]) for i in data])
+                return count
 
     @classmethod
     def delete(cls, lst: List[MetricCode]) -> int:
@@ -103,19 +344,44 @@ WHERE t.name <> EXCLUDED.name
         if len(data) == 0:
             return 0
 
-        sql = """
-UPDATE cn_stats_metric_codes SET
-    is_deleted = True,
-    last_updated_time = now()
-WHERE db_code = %s
-    AND metric_code = %s 
-    AND is_deleted = False;
-        """
-
         with db.get_conn() as conn:
             with conn.cursor() as cursor:
-                cursor.executemany(sql, data)
-                return cursor.rowcount
+                cursor.executemany(_DELETE_SQL, data)
+                count = cursor.rowcount
+                # the descendants of the deleted codes are no longer reachable from their ancestors
+                cursor.executemany(_DETACH_SQL, [{"db_code": i[0], "metric_code": i[1]} for i in data])
+                cls._log_changes(cursor, data)
+                return count
+
+    @classmethod
+    def _relink_closure(cls, cursor, lst: List[tuple[str, str, Optional[str]]]) -> None:
+        """
+        Update the closure table for the saved metric codes whose parent is changed, or which are new.
+        :param cursor: The cursor of the transaction saving the metric codes
+        :param lst: The list of (db_code, metric_code, parent_metric_code) saved
+        """
+
+        data = []
+        for key, group in groupby(sorted(lst, key=lambda x: x[0]), key=lambda x: x[0]):
+            group = list(group)
+            cursor.execute(_CLOSURE_LINKS_SQL, (key, [i[1] for i in group]))
+            data.extend(_closure_relinks(group, cursor.fetchall()))
+
+        # relink one by one, so a batch containing both a code and its new parent ends up consistent
+        for i in data:
+            cursor.execute(_DETACH_SQL, i)
+            cursor.execute(_ATTACH_SQL, i)
+
+    @classmethod
+    def _log_changes(cls, cursor, lst: List[tuple[str, str]]) -> None:
+        """
+        Append the changed metric codes to the change log, it must be the last statement of the transaction.
+        :param cursor: The cursor of the transaction saving or deleting the metric codes
+        :param lst: The list of (db_code, metric_code) saved or deleted
+        """
+
+        for key, group in groupby(sorted(lst, key=lambda x: x[0]), key=lambda x: x[0]):
+            cursor.execute(_LOG_CHANGES_SQL, (key, [i[1] for i in group]))
 
     @classmethod
     def get(cls, metric_code: str, db_code: Category) -> MetricCode | None:
@@ -126,54 +392,11 @@ WHERE db_code = %s
         :return: Returns the metric code object if found, otherwise returns None
         """
 
-        sql = """
-SELECT 
-    metric_code, 
-    db_code, 
-    name, 
-    explanation, 
-    memo, 
-    unit,
-    parent_metric_code, 
-    extra_attributes,
-    is_deleted,
-    created_time, 
-    last_updated_time,
-    CASE WHEN EXISTS (SELECT 1 FROM cn_stats_metric_codes WHERE is_deleted = FALSE AND db_code = %s AND parent_metric_code = %s) 
-         THEN TRUE 
-         ELSE FALSE END AS is_parent
-FROM cn_stats_metric_codes 
-WHERE is_deleted = FALSE AND db_code = %s AND metric_code = %s;
-        """
-
         with db.get_conn() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(sql, (db_code.db_code, metric_code, db_code.db_code, metric_code))
-                data = [
-                    MetricCode(
-                        code=i[0],
-                        db_code=i[1],
-                        name=i[2],
-                        explanation=i[3],
-                        is_parent=i[11],
-                        memo=i[4],
-                        unit=i[5],
-                        parent=(
-                            MetricCode.of(id=i[6], db_code=i[1])
-                            if i[6]
-                            else None
-                        ),
-                        **i[7],
-                        is_deleted=i[8],
-                        created_time=i[9],
-                        last_updated_time=i[10],
-                    )
-                    for i in cursor.fetchall()
-                ]
-                if len(data) == 0:
-                    return None
-                else:
-                    return data[0]
+                cursor.execute(_GET_SQL, (db_code.db_code, metric_code, db_code.db_code, metric_code))
+                row = cursor.fetchone()
+                return None if row is None else _metric_code_from_row(row, is_parent=row[12])
 
     @classmethod
     def list(
@@ -186,109 +409,91 @@ WHERE is_deleted = FALSE AND db_code = %s AND metric_code = %s;
         :return: Returns the metrics and its descendants
         """
 
-        def manipulate_children(
-            parent_dict: dict[(str, str), List[MetricCode]], parent: Optional[MetricCode] = None
-        ) -> None:
-
-            if parent is None:
-                db_codes = [db_code] if db_code else list(Category)
-                for c in db_codes:
-                    children = parent_dict.get((c.db_code, ""), [])
-                    for i in children:
-                        manipulate_children(parent_dict, i)
-            else:
-                children = parent_dict.get((parent.db_code, parent.code), [])
-                parent.children = children if parent.code else None
-                for i in children:
-                    manipulate_children(parent_dict, i)
-
-        sql = """
-WITH RECURSIVE cte_metrics (
-    metric_code, 
-    db_code, 
-    name, 
-    explanation, 
-    memo, 
-    unit,
-    parent_metric_code, 
-    extra_attributes,
-    is_deleted,
-    created_time, 
-    last_updated_time)
-AS(
-    SELECT 
-        metric_code, 
-        db_code, 
-        name, 
-        explanation, 
-        memo, 
-        unit,
-        parent_metric_code, 
-        extra_attributes,
-        is_deleted,
-        created_time, 
-        last_updated_time 
-    FROM cn_stats_metric_codes 
-    WHERE is_deleted = FALSE AND (%s OR db_code = %s) AND (%s OR metric_code = %s) 
-    UNION
-    SELECT 
-        c.metric_code, 
-        c.db_code, 
-        c.name, 
-        c.explanation, 
-        c.memo, 
-        c.unit,
-        c.parent_metric_code, 
-        c.extra_attributes,
-        c.is_deleted,
-        c.created_time, 
-        c.last_updated_time 
-    FROM cn_stats_metric_codes c
-        INNER JOIN cte_metrics r ON c.db_code = r.db_code AND c.parent_metric_code = r.metric_code AND c.is_deleted = FALSE
-) 
-SELECT * FROM cte_metrics;        
+        dbcode = None if db_code is None else db_code.db_code
+        if metric_code is None:
+            sql, criteria = _LIST_SQL, (dbcode is None, dbcode)
+        else:
+            sql, criteria = _LIST_DESCENDANTS_SQL, (dbcode is None, dbcode, metric_code)
+
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, criteria)
+                data = [_metric_code_from_row(i) for i in cursor.fetchall()]
+                _set_children(_build_index(data))
+                return data
+
+    @classmethod
+    def list_leaves(
+        cls, db_code: Category, metric_codes: List[str] | None = None
+    ) -> List[MetricCode]:
+        """
+        Get the metrics which don't have children
+        :param db_code: Specific the db code
+        :param metric_codes: Specific the metric codes whose descendant leaves are returned,
+            or None for all the leaves of the db code. A code without children is a leaf of itself.
+        :return: Returns the leaf metrics
         """
+
         with db.get_conn() as conn:
             with conn.cursor() as cursor:
-                dbcode = None if db_code is None else db_code.db_code
                 cursor.execute(
-                    sql, (dbcode is None, dbcode, metric_code is None, metric_code)
+                    _LIST_LEAVES_SQL,
+                    (db_code.db_code, metric_codes is None, [] if metric_codes is None else metric_codes),
                 )
-                data = [
-                    MetricCode(
-                        code=i[0],
-                        db_code=i[1],
-                        name=i[2],
-                        explanation=i[3],
-                        is_parent=False,
-                        memo=i[4],
-                        unit=i[5],
-                        parent=(
-                            MetricCode(
-                                code=i[6],
-                                db_code=i[1],
-                                name=None,
-                                explanation=None,
-                                is_parent=False,
-                            )
-                            if i[6]
-                            else None
-                        ),
-                        children=None,
-                        is_deleted=i[8],
-                        created_time=i[9],
-                        last_updated_time=i[10],
-                        **i[7],
-                    )
-                    for i in cursor.fetchall()
-                ]
-
-                parent_dict = {}
-                for i in data:
-                    if i.parent:
-                        parent_dict.setdefault((i.db_code, i.parent.code or ""), []).append(i)
-                    else:
-                        parent_dict.setdefault((i.db_code, ""), []).append(i)
-                manipulate_children(parent_dict)
+                return [_metric_code_from_row(i) for i in cursor.fetchall()]
 
-                return data
+    @classmethod
+    def list_ancestors(cls, metric_code: str, db_code: Category) -> List[MetricCode]:
+        """
+        Get the ancestors of the metric code
+        :param metric_code: code of the metric
+        :param db_code: db code of the metric
+        :return: Returns the ancestors, from the root to the parent of the metric code
+        """
+
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(_LIST_ANCESTORS_SQL, (db_code.db_code, metric_code))
+                return [_metric_code_from_row(i, is_parent=True) for i in cursor.fetchall()]
+
+    @classmethod
+    def get_watermark(cls, db_code: Category) -> tuple:
+        """
+        Get the watermark of the metric codes of the db code, it changes when any code is saved or deleted
+        :param db_code: db code of the metrics
+        :return: Returns the count of the codes, the max last updated time and the last change log sequence number
+        """
+
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(_WATERMARK_SQL, {"db_code": db_code.db_code})
+                return tuple(cursor.fetchone())
+
+    @classmethod
+    def get_hierarchy(cls, db_code: Category) -> HierarchyIndex[MetricCode]:
+        """
+        Get the hierarchy of the metrics of the db code from the hierarchy cache.
+        It's only reloaded from database when the codes in database are changed.
+        The nodes are shared with other callers and must not be modified.
+        :param db_code: Specific the db code
+        :return: Returns the hierarchy index of the metrics, keyed by (db_code, metric_code)
+        """
+        return hierarchy_cache.get(
+            ("metric_codes", db_code.db_code),
+            watermark=lambda: cls.get_watermark(db_code),
+            loader=lambda: _build_index(cls.list(db_code)),
+        )
+
+    @classmethod
+    def list_cached(cls, db_code: Category, metric_code: str | None = None) -> List[MetricCode]:
+        """
+        Same as `list`, but the metrics are served from the hierarchy cache, see `get_hierarchy`.
+        :param db_code: Specific the db code
+        :param metric_code: Specific the metric code or None for metrics
+        :return: Returns the metrics and its descendants
+        """
+        index = cls.get_hierarchy(db_code)
+        if metric_code is None:
+            return list(index)
+        key = (db_code.db_code, metric_code)
+        return index.descendants(key) if key in index else []
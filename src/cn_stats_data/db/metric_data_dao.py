@@ -1,15 +1,383 @@
 import json
-from typing import List
+from typing import Iterator, List
 
+from psycopg2.extras import execute_values
 
-from cn_stats_data import db
+from cn_stats_data import db, metrics
+from cn_stats_data.db.change_log_dao import _CHANGE_OPERATION_TEMPLATE, _LOCK_CHANGE_LOG_SQL
+from cn_stats_data.db.hierarchy_cache import series_cache
 from cn_stats_data.db.models import MetricCode, RegionCode, MetricHistoricalData
-from cn_stats_util.models import Category
+from cn_stats_data.db.row_hash import metric_data_hash
+from cn_stats_util.models import Category, HistoricalData
 
 
 __all__ = ["MetricDataDao"]
 
+_ADD_OR_UPDATE_SQL = """
+INSERT INTO cn_stats_metric_data AS t (
+    metric_code, 
+    db_code, 
+    date_num, 
+    region_code,
+    metric_value, 
+    extra_attributes,
+    row_hash,
+    is_deleted,
+    created_time, 
+    last_updated_time) 
+VALUES(%s, %s, %s, %s, %s, %s::JSONB, %s, False, now(), now()) 
+ON CONFLICT(metric_code, db_code, date_num, region_code) 
+DO UPDATE SET 
+    metric_value = EXCLUDED.metric_value, 
+    extra_attributes = EXCLUDED.extra_attributes,
+    row_hash = EXCLUDED.row_hash,
+    is_deleted = False,
+    last_updated_time = EXCLUDED.last_updated_time 
+WHERE t.row_hash IS DISTINCT FROM EXCLUDED.row_hash
+    OR t.is_deleted = True;
+"""
+
+_DELETE_SQL = """
+UPDATE cn_stats_metric_data SET
+    is_deleted = True,
+    last_updated_time = now() 
+WHERE metric_code = %s 
+    AND db_code = %s 
+    AND date_num = %s
+    AND region_code = %s
+    AND is_deleted = False;
+"""
+
+_LIST_SQL = """
+SELECT 
+    metric_code, 
+    db_code, 
+    date_num, 
+    region_code, 
+    metric_value, 
+    extra_attributes, 
+    is_deleted, 
+    created_time, 
+    last_updated_time,
+    row_hash
+FROM cn_stats_metric_data
+WHERE is_deleted = FALSE
+    AND (%s OR metric_code = ANY(%s))
+    AND (%s OR db_code = ANY(%s))
+    AND (%s OR date_num = ANY(%s))
+    AND (%s OR region_code = ANY(%s));
+"""
+
+_SYNC_CREATE_SQL = """
+CREATE TEMP TABLE tmp_metric_data ON COMMIT DROP AS 
+SELECT metric_code, db_code, date_num, region_code, metric_value, extra_attributes, row_hash 
+FROM cn_stats_metric_data 
+WITH NO DATA;
+"""
+
+_SYNC_INSERT_SQL = """
+INSERT INTO tmp_metric_data (
+    metric_code, 
+    db_code, 
+    date_num, 
+    region_code,
+    metric_value, 
+    extra_attributes,
+    row_hash) 
+VALUES %s;
+"""
+
+# inserted rows are the ones without xmax, an updated row version has the xmax of the upsert's transaction.
+# the changed buckets of the metrics having a roll-up rule are recorded for RollupDao.refresh,
+# the changed rows are appended to the change log by `_SYNC_LOG_CHANGES_SQL` afterwards
+_SYNC_SQL = """
+WITH upserted AS (
+    INSERT INTO cn_stats_metric_data AS t (
+        metric_code, 
+        db_code, 
+        date_num, 
+        region_code,
+        metric_value, 
+        extra_attributes,
+        row_hash,
+        is_deleted,
+        created_time, 
+        last_updated_time) 
+    SELECT metric_code, db_code, date_num, region_code, metric_value, extra_attributes, row_hash, False, now(), now()
+    FROM tmp_metric_data
+    ON CONFLICT(metric_code, db_code, date_num, region_code) 
+    DO UPDATE SET 
+        metric_value = EXCLUDED.metric_value, 
+        extra_attributes = EXCLUDED.extra_attributes,
+        row_hash = EXCLUDED.row_hash,
+        is_deleted = False,
+        last_updated_time = EXCLUDED.last_updated_time 
+    WHERE t.row_hash IS DISTINCT FROM EXCLUDED.row_hash
+        OR t.is_deleted = True
+    RETURNING t.metric_code, t.region_code, t.date_num, (t.xmax = 0) AS inserted
+), deleted AS (
+    UPDATE cn_stats_metric_data t SET
+        is_deleted = True,
+        last_updated_time = now()
+    WHERE t.db_code = %(db_code)s
+        AND t.metric_code = ANY(%(metric_codes)s)
+        AND t.date_num = ANY(%(date_nums)s)
+        AND t.is_deleted = False
+        AND NOT EXISTS (
+            SELECT 1 FROM tmp_metric_data d 
+            WHERE d.metric_code = t.metric_code 
+                AND d.db_code = t.db_code
+                AND d.date_num = t.date_num 
+                AND d.region_code = t.region_code)
+    RETURNING t.metric_code, t.region_code, t.date_num
+), dirty AS (
+    INSERT INTO cn_stats_metric_rollup_dirty (db_code, metric_code, region_code, year)
+    SELECT DISTINCT %(db_code)s, c.metric_code, c.region_code, c.date_num / 100
+    FROM (
+        SELECT metric_code, region_code, date_num FROM upserted
+        UNION ALL
+        SELECT metric_code, region_code, date_num FROM deleted
+    ) c
+        INNER JOIN cn_stats_metric_rollup_rules r ON r.db_code = %(db_code)s AND r.metric_code = c.metric_code
+    ON CONFLICT DO NOTHING
+)
+SELECT 
+    (SELECT count(*) FROM upserted WHERE inserted),
+    (SELECT count(*) FROM upserted WHERE NOT inserted),
+    (SELECT count(*) FROM deleted);
+"""
 
+# the values of the metrics and regions of the panel with the positions of them on the axes of the panel.
+# it's run by a named (server side) cursor, so there's no semicolon at the end
+_PANEL_SQL = """
+SELECT 
+    m.ord - 1, 
+    r.ord - 1, 
+    d.date_num, 
+    d.metric_value
+FROM cn_stats_metric_data d
+    INNER JOIN unnest(%s) WITH ORDINALITY AS m (code, ord) ON m.code = d.metric_code
+    INNER JOIN unnest(%s) WITH ORDINALITY AS r (code, ord) ON r.code = d.region_code
+WHERE d.is_deleted = FALSE
+    AND d.db_code = %s
+    AND d.date_num >= %s
+    AND d.date_num <= %s
+"""
+
+# record the changed buckets of the saved or deleted rows, the changed ones are updated at now() of the transaction
+_MARK_ROLLUP_DIRTY_SQL = """
+INSERT INTO cn_stats_metric_rollup_dirty (db_code, metric_code, region_code, year)
+SELECT DISTINCT d.db_code, d.metric_code, d.region_code, d.date_num / 100
+FROM unnest(%s, %s, %s, %s) AS k (metric_code, db_code, date_num, region_code)
+    INNER JOIN cn_stats_metric_rollup_rules r ON r.db_code = k.db_code AND r.metric_code = k.metric_code
+    INNER JOIN cn_stats_metric_data d 
+        ON d.metric_code = k.metric_code AND d.db_code = k.db_code AND d.date_num = k.date_num AND d.region_code = k.region_code
+WHERE d.last_updated_time = now()
+ON CONFLICT DO NOTHING;
+"""
+
+# append the saved or deleted rows to the change log, the changed ones are updated at now() of the transaction
+_LOG_CHANGES_SQL = _LOCK_CHANGE_LOG_SQL + f"""
+INSERT INTO cn_stats_change_log (entity, operation, db_code, code, region_code, date_num, metric_value, row_hash)
+SELECT 'metric_data', {_CHANGE_OPERATION_TEMPLATE.format(t="d")}, d.db_code, d.metric_code, d.region_code, d.date_num, d.metric_value, d.row_hash
+FROM (SELECT DISTINCT * FROM unnest(%s, %s, %s, %s) AS k (metric_code, db_code, date_num, region_code)) k
+    INNER JOIN cn_stats_metric_data d 
+        ON d.metric_code = k.metric_code AND d.db_code = k.db_code AND d.date_num = k.date_num AND d.region_code = k.region_code
+WHERE d.last_updated_time = now()
+ORDER BY d.db_code, d.metric_code, d.region_code, d.date_num;
+"""
+
+# append the rows changed by `_SYNC_SQL` to the change log, in its own statement after the data is written,
+# so the lock serializing the writers of the log is only held from here to the commit
+_SYNC_LOG_CHANGES_SQL = _LOCK_CHANGE_LOG_SQL + f"""
+INSERT INTO cn_stats_change_log (entity, operation, db_code, code, region_code, date_num, metric_value, row_hash)
+SELECT 'metric_data', {_CHANGE_OPERATION_TEMPLATE.format(t="d")}, d.db_code, d.metric_code, d.region_code, d.date_num, d.metric_value, d.row_hash
+FROM cn_stats_metric_data d
+WHERE d.db_code = %(db_code)s
+    AND d.metric_code = ANY(%(metric_codes)s)
+    AND d.date_num = ANY(%(date_nums)s)
+    AND d.last_updated_time = now()
+ORDER BY d.metric_code, d.region_code, d.date_num;
+"""
+
+_LIST_VALUES_SQL = """
+SELECT 
+    metric_code, 
+    date_num, 
+    region_code, 
+    metric_value,
+    row_hash
+FROM cn_stats_metric_data
+WHERE is_deleted = FALSE
+    AND db_code = %s
+    AND metric_code = ANY(%s)
+    AND (%s OR region_code = ANY(%s))
+    AND (%s OR date_num = ANY(%s));
+"""
+
+# the points of one series in the period range, read from the covering index in date_num order
+_SERIES_SQL = """
+SELECT 
+    date_num, 
+    metric_value
+FROM cn_stats_metric_data
+WHERE is_deleted = FALSE
+    AND db_code = %s
+    AND metric_code = %s
+    AND region_code = %s
+    AND (%s OR date_num >= %s)
+    AND (%s OR date_num <= %s)
+ORDER BY date_num;
+"""
+
+# deleted rows are counted as well, soft-deleting a point updates its last updated time
+# the last change log sequence number is compared as well, the same as the watermark of the codes,
+# since the last updated time can't tell an update committed after the series was cached
+_SERIES_WATERMARK_SQL = """
+SELECT 
+    count(*), 
+    max(last_updated_time),
+    (
+        SELECT max(seq) 
+        FROM cn_stats_change_log 
+        WHERE entity = 'metric_data' AND db_code = %(db_code)s AND code = %(metric_code)s AND region_code = %(region_code)s
+    )
+FROM cn_stats_metric_data 
+WHERE db_code = %(db_code)s AND metric_code = %(metric_code)s AND region_code = %(region_code)s;
+"""
+
+# all the points of the db code ordered by series, read from the covering index.
+# it's run by a named (server side) cursor, so there's no semicolon at the end
+_ITER_POINTS_SQL = """
+SELECT 
+    metric_code, 
+    region_code, 
+    date_num, 
+    metric_value
+FROM cn_stats_metric_data
+WHERE is_deleted = FALSE AND db_code = %s
+ORDER BY metric_code, region_code, date_num
+"""
+
+
+def _metric_data_from_row(i: tuple) -> MetricHistoricalData:
+    return MetricHistoricalData(
+        metric_code=i[0],
+        db_code=i[1],
+        period=i[2],
+        region_code=i[3] if i[3] != "" else None,
+        data=i[4],
+        has_data=i[4] is not None,
+        is_deleted=i[6],
+        created_time=i[7],
+        last_updated_time=i[8],
+        row_hash=i[9],
+        **i[5],
+    )
+
+
+def _metric_data_params(i: HistoricalData) -> tuple:
+    return (
+        i.metric_code,
+        i.db_code,
+        i.period,
+        "" if i.region_code is None else i.region_code,
+        i.data,
+        json.dumps(i.extra_attributes),
+        metric_data_hash(i),
+    )
+
+
+def _sync_params(lst: List[HistoricalData]) -> List[tuple]:
+    # the last one wins if the same key is downloaded more than once
+    return list({
+        (i.metric_code, i.period, "" if i.region_code is None else i.region_code): _metric_data_params(i)
+        for i in lst
+        if not hasattr(i, "is_deleted") or not i.is_deleted
+    }.values())
+
+
+def _keys_params(data: List[tuple]) -> tuple:
+    """
+    Get the parameters of `_MARK_ROLLUP_DIRTY_SQL` and `_LOG_CHANGES_SQL`
+    :param data: The parameters of the saved or deleted rows, starting with metric_code, db_code, date_num and region_code
+    """
+    return tuple([i[n] for i in data] for n in range(4))
+
+
+def _panel_criteria(
+    db_code: str,
+    metric_codes: List[str],
+    region_codes: List[str | None],
+    start: int,
+    end: int,
+) -> tuple:
+    return metric_codes, ["" if i is None else i for i in region_codes], db_code, start, end
+
+
+def _list_criteria(
+    db_codes: List[str] | None,
+    metric_codes: List[str] | None,
+    region_codes: List[str | None] | None,
+    date_nums: List[int] | None,
+) -> tuple:
+    return (
+        metric_codes is None,
+        [] if metric_codes is None else metric_codes,
+        db_codes is None,
+        [] if db_codes is None else db_codes,
+        date_nums is None,
+        [] if date_nums is None else date_nums,
+        region_codes is None,
+        [] if region_codes is None else ["" if i is None else i for i in region_codes],
+    )
+
+
+def _list_values_criteria(
+    db_code: str,
+    metric_codes: List[str],
+    region_codes: List[str | None] | None,
+    date_nums: List[int] | None,
+) -> tuple:
+    return (
+        db_code,
+        metric_codes,
+        region_codes is None,
+        [] if region_codes is None else ["" if i is None else i for i in region_codes],
+        date_nums is None,
+        [] if date_nums is None else date_nums,
+    )
+
+
+def _series_key(db_code: str, metric_code: str, region_code: str | None) -> tuple:
+    return db_code, metric_code, "" if region_code is None else region_code
+
+
+def _series_watermark_params(db_code: str, metric_code: str, region_code: str | None) -> dict:
+    return dict(zip(("db_code", "metric_code", "region_code"), _series_key(db_code, metric_code, region_code)))
+
+
+def _series_criteria(
+    db_code: str,
+    metric_code: str,
+    region_code: str | None,
+    start: int | None,
+    end: int | None,
+) -> tuple:
+    return (
+        *_series_key(db_code, metric_code, region_code),
+        start is None,
+        start,
+        end is None,
+        end,
+    )
+
+
+def _values_from_rows(rows: List[tuple]) -> dict[tuple[str, int, str | None], tuple[float | None, str | None]]:
+    return {(i[0], i[1], i[2] if i[2] != "" else None): (i[3], i[4]) for i in rows}
+
+
+@metrics.instrument_dao
 class MetricDataDao:
     """
     The class for interacting with database.
@@ -25,49 +393,18 @@ class MetricDataDao:
 
         if not lst:
             return 0
-        data = [
-            (
-                i.metric_code,
-                i.db_code,
-                i.period,
-                "" if i.region_code is None else i.region_code,
-                i.data,
-                json.dumps(i.extra_attributes),
-            )
-            for i in lst
-            if not hasattr(i, "is_deleted") or not i.is_deleted
-        ]
+        data = [_metric_data_params(i) for i in lst if not hasattr(i, "is_deleted") or not i.is_deleted]
         if len(data) == 0:
             return 0
 
-        sql = """        
-INSERT INTO cn_stats_metric_data AS t (
-    metric_code, 
-    db_code, 
-    date_num, 
-    region_code,
-    metric_value, 
-    extra_attributes,
-    is_deleted,
-    created_time, 
-    last_updated_time) 
-VALUES(%s, %s, %s, %s, %s, %s::JSONB, False, now(), now()) 
-ON CONFLICT(metric_code, db_code, date_num, region_code) 
-DO UPDATE SET 
-    metric_value = EXCLUDED.metric_value, 
-    extra_attributes = EXCLUDED.extra_attributes,
-    is_deleted = False,
-    last_updated_time = EXCLUDED.last_updated_time 
-WHERE t.metric_value <> EXCLUDED.metric_value
-    OR ((t.extra_attributes IS NULL AND EXCLUDED.extra_attributes IS NOT NULL) 
-        OR (t.extra_attributes IS NOT NULL AND EXCLUDED.extra_attributes IS NULL) 
-        OR (t.extra_attributes <> EXCLUDED.extra_attributes))
-    OR t.is_deleted = True;
-        """
         with db.get_conn() as conn:
             with conn.cursor() as cursor:
-                cursor.executemany(sql, data)
-                return cursor.rowcount
+                cursor.executemany(_ADD_OR_UPDATE_SQL, data)
+                count = cursor.rowcount
+                params = _keys_params(data)
+                cursor.execute(_MARK_ROLLUP_DIRTY_SQL, params)
+                cursor.execute(_LOG_CHANGES_SQL, params)
+                return count
 
     @classmethod
     def delete(cls, lst: List[MetricHistoricalData]) -> int:
@@ -84,7 +421,7 @@ WHERE t.metric_value <> EXCLUDED.metric_value
                 i.metric_code,
                 i.db_code,
                 i.period,
-                "" if i.region_code is None else i.region_code.code,
+                "" if i.region_code is None else i.region_code,
             )
             for i in lst
             if not hasattr(i, "is_deleted") or i.is_deleted
@@ -92,21 +429,14 @@ WHERE t.metric_value <> EXCLUDED.metric_value
         if len(data) == 0:
             return 0
 
-        sql = """
-UPDATE cn_stats_metric_data SET
-    is_deleted = True,
-    last_updated_time = now() 
-WHERE metric_code = %s 
-    AND db_code = %s 
-    AND date_num = %s
-    AND region_code = %s
-    AND is_deleted = False;
-        """
-
         with db.get_conn() as conn:
             with conn.cursor() as cursor:
-                cursor.executemany(sql, data)
-                return cursor.rowcount
+                cursor.executemany(_DELETE_SQL, data)
+                count = cursor.rowcount
+                params = _keys_params(data)
+                cursor.execute(_MARK_ROLLUP_DIRTY_SQL, params)
+                cursor.execute(_LOG_CHANGES_SQL, params)
+                return count
 
     @classmethod
     def list(
@@ -125,54 +455,168 @@ WHERE metric_code = %s
         :return: Returns the metric data for the specified criteria
         """
 
-        sql = """
-SELECT 
-    metric_code, 
-    db_code, 
-    date_num, 
-    region_code, 
-    metric_value, 
-    extra_attributes, 
-    is_deleted, 
-    created_time, 
-    last_updated_time
-FROM cn_stats_metric_data
-WHERE is_deleted = FALSE
-    AND (%s OR metric_code = ANY(%s))
-    AND (%s OR db_code = ANY(%s))
-    AND (%s OR date_num = ANY(%s))
-    AND (%s OR region_code = ANY(%s));
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(_LIST_SQL, _list_criteria(db_codes, metric_codes, region_codes, date_nums))
+                return [_metric_data_from_row(i) for i in cursor.fetchall()]
+
+    @classmethod
+    def sync(
+        cls,
+        db_code: str,
+        metric_codes: List[str],
+        date_nums: List[int],
+        lst: List[HistoricalData],
+    ) -> dict[str, int]:
+        """
+        Synchronize the downloaded data of the metric codes and periods to database.
+        The data is loaded into a temporary table, and database computes the rows to insert,
+        the rows whose value is changed, and the rows not downloaded any more (soft-deleted)
+        in one statement, so the existing data doesn't need to be read back.
+        :param db_code: The db code of the data
+        :param metric_codes: The metric codes the data is downloaded for
+        :param date_nums: The periods the data is downloaded for
+        :param lst: The downloaded data
+        :return: Returns the record count of each kind of change, keyed by inserted, updated and deleted
+        """
+
+        data = _sync_params(lst)
+
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(_SYNC_CREATE_SQL)
+                execute_values(cursor, _SYNC_INSERT_SQL, data, template="(%s, %s, %s, %s, %s, %s::JSONB, %s)", page_size=1000)
+                params = {"db_code": db_code, "metric_codes": metric_codes, "date_nums": date_nums}
+                cursor.execute(_SYNC_SQL, params)
+                row = cursor.fetchone()
+                cursor.execute(_SYNC_LOG_CHANGES_SQL, params)
+                return {"inserted": row[0], "updated": row[1], "deleted": row[2]}
+
+    @classmethod
+    def list_values(
+        cls,
+        db_code: str,
+        metric_codes: List[str],
+        region_codes: List[str | None] | None = None,
+        date_nums: List[int] | None = None,
+    ) -> dict[tuple[str, int, str | None], tuple[float | None, str | None]]:
+        """
+        Get the values of the metric data by the giving criteria, for diffing with the downloaded data.
+        Only the natural key, the value and the row hash are read, which is served by the covering index.
+        :param db_code: Specific the db code
+        :param metric_codes: Specific the metric codes
+        :param region_codes: Specific the region codes or None for all regions
+        :param date_nums: Specific the date nums or None for all periods
+        :return: Returns the (metric_value, row_hash) keyed by (metric_code, date_num, region_code)
         """
+
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(_LIST_VALUES_SQL, _list_values_criteria(db_code, metric_codes, region_codes, date_nums))
+                return _values_from_rows(cursor.fetchall())
+
+    @classmethod
+    def series(
+        cls,
+        db_code: str,
+        metric_code: str,
+        region_code: str | None = None,
+        start: int | None = None,
+        end: int | None = None,
+    ) -> List[tuple[int, float | None]]:
+        """
+        Get the series of the metric of the region in the period range, served by the covering index.
+        :param db_code: Specific the db code
+        :param metric_code: Specific the metric code
+        :param region_code: Specific the region code or None for the data without region
+        :param start: The first date num of the range (inclusive) or None for no lower bound
+        :param end: The last date num of the range (inclusive) or None for no upper bound
+        :return: Returns the (date_num, metric_value) points ordered by date_num
+        """
+
         with db.get_conn() as conn:
             with conn.cursor() as cursor:
-                criteria = (
-                    metric_codes is None,
-                    [] if metric_codes is None else metric_codes,
-                    db_codes is None,
-                    [] if db_codes is None else db_codes,
-                    date_nums is None,
-                    [] if date_nums is None else date_nums,
-                    region_codes is None,
-                    (
-                        []
-                        if region_codes is None
-                        else ["" if i is None else i for i in region_codes]
-                    ),
-                )
-                cursor.execute(sql, criteria)
-                data = [
-                    MetricHistoricalData(
-                        metric_code=i[0],
-                        db_code=i[1],
-                        period=i[2],
-                        region_code=i[3] if i[3] != "" else None,
-                        data=i[4],
-                        has_data=i[4] is not None,
-                        is_deleted=i[6],
-                        created_time=i[7],
-                        last_updated_time=i[8],
-                        **i[5],
-                    )
-                    for i in cursor.fetchall()
-                ]
-                return data
+                cursor.execute(_SERIES_SQL, _series_criteria(db_code, metric_code, region_code, start, end))
+                return [(i[0], i[1]) for i in cursor.fetchall()]
+
+    @classmethod
+    def iter_points(cls, db_code: str, itersize: int = 10000) -> Iterator[tuple[str, str | None, int, float | None]]:
+        """
+        Stream all the points of the db code, without loading them into memory at once.
+        :param db_code: Specific the db code
+        :param itersize: The count of the rows fetched from database at a time
+        :return: Returns the (metric_code, region_code, date_num, metric_value) points,
+            ordered by metric_code, region_code and date_num
+        """
+
+        with db.get_conn() as conn:
+            with conn.cursor(name="cn_stats_metric_data_points") as cursor:
+                cursor.itersize = itersize
+                cursor.execute(_ITER_POINTS_SQL, (db_code,))
+                for i in cursor:
+                    yield i[0], i[1] if i[1] != "" else None, i[2], i[3]
+
+    @classmethod
+    def iter_panel_values(
+        cls,
+        db_code: str,
+        metric_codes: List[str],
+        region_codes: List[str | None],
+        start: int,
+        end: int,
+        itersize: int = 10000,
+    ) -> Iterator[List[tuple[int, int, int, float | None]]]:
+        """
+        Stream the values of a panel in chunks, for filling the panel array chunk by chunk.
+        :param db_code: Specific the db code
+        :param metric_codes: The metric axis of the panel
+        :param region_codes: The region axis of the panel, None for the data without region
+        :param start: The first date num of the panel (inclusive)
+        :param end: The last date num of the panel (inclusive)
+        :param itersize: The count of the rows of a chunk
+        :return: Returns the chunks of (metric index, region index, date_num, metric_value),
+            the indexes are the positions of the codes in metric_codes and region_codes
+        """
+
+        if not metric_codes or not region_codes:
+            return
+        with db.get_conn() as conn:
+            with conn.cursor(name="cn_stats_metric_data_panel") as cursor:
+                cursor.execute(_PANEL_SQL, _panel_criteria(db_code, metric_codes, region_codes, start, end))
+                while rows := cursor.fetchmany(itersize):
+                    yield rows
+
+    @classmethod
+    def get_series_watermark(cls, db_code: str, metric_code: str, region_code: str | None = None) -> tuple:
+        """
+        Get the watermark of the series, it changes when any point of the series is saved or deleted
+        :param db_code: Specific the db code
+        :param metric_code: Specific the metric code
+        :param region_code: Specific the region code or None for the data without region
+        :return: Returns the count of the points, the max last updated time and the last change log sequence number
+        """
+
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(_SERIES_WATERMARK_SQL, _series_watermark_params(db_code, metric_code, region_code))
+                return tuple(cursor.fetchone())
+
+    @classmethod
+    def series_cached(
+        cls,
+        db_code: str,
+        metric_code: str,
+        region_code: str | None = None,
+        start: int | None = None,
+        end: int | None = None,
+    ) -> List[tuple[int, float | None]]:
+        """
+        Same as `series`, but the result is served from the series cache keyed by the query.
+        It's only reloaded from database when the watermark of the series is changed, see `get_series_watermark`.
+        The list is shared with other callers and must not be modified.
+        """
+        return series_cache.get(
+            ("series", *_series_key(db_code, metric_code, region_code), start, end),
+            watermark=lambda: cls.get_series_watermark(db_code, metric_code, region_code),
+            loader=lambda: cls.series(db_code, metric_code, region_code, start, end),
+        )
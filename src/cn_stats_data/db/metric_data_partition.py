@@ -0,0 +1,144 @@
+import logging
+import time
+from typing import List, Optional, Tuple
+
+from psycopg2 import sql
+from cn_stats_util.models import Category
+
+from cn_stats_data import db
+
+__all__ = ["get_year_bounds", "ensure_partitions", "create_future_partitions"]
+
+TABLE_NAME = "cn_stats_metric_data"
+
+
+def _db_partition_name(db_code: str) -> str:
+    return f"{TABLE_NAME}_{db_code}"
+
+
+def _year_partition_name(db_code: str, year: int) -> str:
+    return f"{TABLE_NAME}_{db_code}_{year}"
+
+
+def get_year_bounds(db_code: Category, year: int) -> Tuple[int, int]:
+    """
+    Get the date_num range of a year for the category
+    :param db_code: The category
+    :param year: The year
+    :return: Returns the lower bound (inclusive) and the upper bound (exclusive) of the year
+    """
+    return (
+        min(db_code.get_periods_from_years([year])),
+        min(db_code.get_periods_from_years([year + 1])),
+    )
+
+
+def _table_exists(cursor, name: str) -> bool:
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (name,))
+    return cursor.fetchone()[0]
+
+
+def _ensure_db_partition(cursor, db_code: Category) -> bool:
+    """
+    Create the LIST partition of the db code, and move its rows out of the default partition.
+    :return: Returns True if the partition is created
+    """
+    name = _db_partition_name(db_code.db_code)
+    if _table_exists(cursor, name):
+        return False
+
+    cursor.execute(
+        sql.SQL("CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE (date_num);").format(
+            sql.Identifier(name), sql.Identifier(TABLE_NAME)
+        )
+    )
+    cursor.execute(
+        sql.SQL("CREATE TABLE {} PARTITION OF {} DEFAULT;").format(
+            sql.Identifier(f"{name}_default"), sql.Identifier(name)
+        )
+    )
+    cursor.execute(
+        sql.SQL("WITH moved AS (DELETE FROM {} WHERE db_code = %s RETURNING *) INSERT INTO {} SELECT * FROM moved;").format(
+            sql.Identifier(f"{TABLE_NAME}_default"), sql.Identifier(name)
+        ),
+        (db_code.db_code,),
+    )
+    cursor.execute(
+        sql.SQL("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES IN (%s);").format(
+            sql.Identifier(TABLE_NAME), sql.Identifier(name)
+        ),
+        (db_code.db_code,),
+    )
+    return True
+
+
+def _ensure_year_partition(cursor, db_code: Category, year: int) -> bool:
+    """
+    Create the RANGE partition of the year, and move its rows out of the default partition of the db code.
+    :return: Returns True if the partition is created
+    """
+    name = _year_partition_name(db_code.db_code, year)
+    if _table_exists(cursor, name):
+        return False
+
+    parent = _db_partition_name(db_code.db_code)
+    lower, upper = get_year_bounds(db_code, year)
+    cursor.execute(
+        sql.SQL("CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);").format(
+            sql.Identifier(name), sql.Identifier(TABLE_NAME)
+        )
+    )
+    cursor.execute(
+        sql.SQL(
+            "WITH moved AS (DELETE FROM {} WHERE date_num >= %s AND date_num < %s RETURNING *) "
+            "INSERT INTO {} SELECT * FROM moved;"
+        ).format(sql.Identifier(f"{parent}_default"), sql.Identifier(name)),
+        (lower, upper),
+    )
+    cursor.execute(
+        sql.SQL("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s);").format(
+            sql.Identifier(parent), sql.Identifier(name)
+        ),
+        (lower, upper),
+    )
+    return True
+
+
+def ensure_partitions(db_codes: Optional[List[Category]], years: List[int]) -> List[str]:
+    """
+    Make sure the partitions of the giving db codes and years exist.
+    Rows already stored in a default partition are moved into the new partition,
+    so it also splits the data loaded by the partitioning migration.
+    :param db_codes: Specific the db codes or None for all db codes
+    :param years: The years need to be partitioned
+    :return: Returns the names of the partitions created
+    """
+    logger = logging.getLogger(__name__)
+
+    created = []
+    for c in db_codes if db_codes else list(Category):
+        # one transaction per db code, so the moved rows are attached atomically
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                if _ensure_db_partition(cursor, c):
+                    created.append(_db_partition_name(c.db_code))
+                for year in sorted(set(years)):
+                    if _ensure_year_partition(cursor, c, year):
+                        created.append(_year_partition_name(c.db_code, year))
+
+    logger.info(f"Created {len(created)} partitions of {TABLE_NAME}.")
+    return created
+
+
+def create_future_partitions(years_ahead: int = 1) -> List[str]:
+    """
+    Create the partitions of the current year and the coming years for all db codes ahead of time.
+    :param years_ahead: How many years after the current year need to be created
+    :return: Returns the names of the partitions created
+    """
+    year = time.localtime().tm_year
+    return ensure_partitions(None, [year + i for i in range(0, years_ahead + 1)])
+
+
+if __name__ == '__main__':
+    create_future_partitions()
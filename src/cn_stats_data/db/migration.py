@@ -0,0 +1,78 @@
+import importlib.util
+import logging
+import pathlib
+from typing import List
+
+from cn_stats_data import db
+
+__all__ = ["list_migrations", "list_applied_migrations", "apply_migrations"]
+
+MIGRATIONS_DIR = pathlib.Path(__file__).parent / "migrations"
+
+
+def list_migrations() -> List[pathlib.Path]:
+    """
+    Get the migration scripts shipped with the package, the SQL scripts and the Python ones defining `migrate(conn)`
+    for the data changes which can't be done in SQL
+    :return: Returns the paths of the scripts, ordered by version
+    """
+    return sorted([*MIGRATIONS_DIR.glob("*.sql"), *MIGRATIONS_DIR.glob("*.py")], key=lambda p: p.name)
+
+
+def _load_python_migration(path: pathlib.Path):
+    spec = importlib.util.spec_from_file_location(f"cn_stats_data.db.migrations.m{path.stem}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def list_applied_migrations() -> List[str]:
+    """
+    Get the versions of the migrations which have been applied to the database
+    :return: Returns the applied versions, ordered by version
+    """
+
+    sql = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version VARCHAR PRIMARY KEY,
+    applied_time TIMESTAMP NOT NULL DEFAULT now()
+);
+SELECT version FROM schema_migrations ORDER BY version;
+    """
+    with db.get_conn() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(sql)
+            return [i[0] for i in cursor.fetchall()]
+
+
+def apply_migrations() -> List[str]:
+    """
+    Apply the migration scripts which haven't been applied yet.
+    Each script runs in its own transaction together with its version record,
+    so a failed script leaves the database at the previous version.
+    :return: Returns the versions applied by this call
+    """
+    logger = logging.getLogger(__name__)
+
+    applied = set(list_applied_migrations())
+    versions = []
+    for path in list_migrations():
+        version = path.stem
+        if version in applied:
+            continue
+        logger.info(f"Applying migration {version}.")
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                if path.suffix == ".py":
+                    _load_python_migration(path).migrate(conn)
+                else:
+                    cursor.execute(path.read_text(encoding="utf-8"))
+                cursor.execute("INSERT INTO schema_migrations (version) VALUES (%s);", (version,))
+        versions.append(version)
+
+    logger.info(f"Applied {len(versions)} migrations.")
+    return versions
+
+
+if __name__ == '__main__':
+    apply_migrations()
@@ -0,0 +1,19 @@
+-- Keep an explicit parent pointer on every region so the hierarchy can be
+-- walked through a B-tree index instead of `= ANY(children_region_codes)`.
+
+ALTER TABLE cn_stats_region_codes
+    ADD COLUMN IF NOT EXISTS parent_region_code VARCHAR;
+
+UPDATE cn_stats_region_codes c SET
+    parent_region_code = p.region_code
+FROM cn_stats_region_codes p
+WHERE p.db_code = c.db_code
+    AND c.region_code = ANY(p.children_region_codes)
+    AND c.parent_region_code IS DISTINCT FROM p.region_code;
+
+CREATE INDEX IF NOT EXISTS ix_cn_stats_region_codes_parent
+    ON cn_stats_region_codes (db_code, parent_region_code);
+
+-- Only used on the write path to find the parent of a newly inserted region.
+CREATE INDEX IF NOT EXISTS ix_cn_stats_region_codes_children
+    ON cn_stats_region_codes USING GIN (children_region_codes);
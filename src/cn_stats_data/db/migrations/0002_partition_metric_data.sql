@@ -0,0 +1,43 @@
+-- Partition cn_stats_metric_data by db_code (LIST), and each db_code by date_num (RANGE).
+-- The yearly range partitions are created by cn_stats_data.db.metric_data_partition,
+-- which also moves the rows out of the default partitions created here.
+-- The original table is kept as cn_stats_metric_data_unpartitioned, and can be
+-- dropped once the partitioned table has been verified.
+
+ALTER TABLE cn_stats_metric_data RENAME TO cn_stats_metric_data_unpartitioned;
+
+-- The indexes of the original table are copied as well, they are created on every partition
+-- attached later. The key of the original table includes db_code and date_num, so it's valid
+-- on the partitioned table, and it's only added when the original table has no unique key.
+
+CREATE TABLE cn_stats_metric_data (
+    LIKE cn_stats_metric_data_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING INDEXES
+) PARTITION BY LIST (db_code);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_index WHERE indrelid = 'cn_stats_metric_data'::regclass AND indisunique) THEN
+        ALTER TABLE cn_stats_metric_data
+            ADD CONSTRAINT uq_cn_stats_metric_data_key UNIQUE (metric_code, db_code, date_num, region_code);
+    END IF;
+END
+$$;
+
+CREATE TABLE cn_stats_metric_data_default PARTITION OF cn_stats_metric_data DEFAULT;
+
+DO $$
+DECLARE
+    v_db_code TEXT;
+BEGIN
+    FOR v_db_code IN SELECT DISTINCT db_code FROM cn_stats_metric_data_unpartitioned LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF cn_stats_metric_data FOR VALUES IN (%L) PARTITION BY RANGE (date_num)',
+            'cn_stats_metric_data_' || v_db_code, v_db_code);
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF %I DEFAULT',
+            'cn_stats_metric_data_' || v_db_code || '_default', 'cn_stats_metric_data_' || v_db_code);
+    END LOOP;
+END
+$$;
+
+INSERT INTO cn_stats_metric_data SELECT * FROM cn_stats_metric_data_unpartitioned;
@@ -0,0 +1,27 @@
+-- Closure table of the metric code hierarchy, one row per (ancestor, descendant) pair
+-- including the node itself at depth 0. A link only exists when every node below the
+-- ancestor on the path is not deleted, which is what the recursive queries used to walk.
+-- The table is maintained by MetricCodeDao.add_or_update and MetricCodeDao.delete.
+
+CREATE TABLE IF NOT EXISTS cn_stats_metric_code_closure (
+    db_code VARCHAR NOT NULL,
+    ancestor_code VARCHAR NOT NULL,
+    descendant_code VARCHAR NOT NULL,
+    depth INT NOT NULL,
+    PRIMARY KEY (db_code, ancestor_code, descendant_code)
+);
+
+CREATE INDEX IF NOT EXISTS ix_cn_stats_metric_code_closure_descendant
+    ON cn_stats_metric_code_closure (db_code, descendant_code, depth);
+
+WITH RECURSIVE paths (db_code, ancestor_code, descendant_code, depth) AS (
+    SELECT db_code, metric_code, metric_code, 0
+    FROM cn_stats_metric_codes
+    UNION ALL
+    SELECT p.db_code, p.ancestor_code, c.metric_code, p.depth + 1
+    FROM paths p
+        INNER JOIN cn_stats_metric_codes c ON c.db_code = p.db_code AND c.parent_metric_code = p.descendant_code AND c.is_deleted = FALSE
+)
+INSERT INTO cn_stats_metric_code_closure (db_code, ancestor_code, descendant_code, depth)
+SELECT db_code, ancestor_code, descendant_code, depth FROM paths
+ON CONFLICT (db_code, ancestor_code, descendant_code) DO NOTHING;
@@ -0,0 +1,8 @@
+-- Serve the per db_code watermark (count(*), max(last_updated_time)) of the
+-- hierarchy cache with index-only scans.
+
+CREATE INDEX IF NOT EXISTS ix_cn_stats_metric_codes_last_updated
+    ON cn_stats_metric_codes (db_code, last_updated_time);
+
+CREATE INDEX IF NOT EXISTS ix_cn_stats_region_codes_last_updated
+    ON cn_stats_region_codes (db_code, last_updated_time);
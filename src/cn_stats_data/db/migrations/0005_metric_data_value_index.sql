@@ -0,0 +1,7 @@
+-- Covering index of the live metric data, so reading the keys and values of a
+-- category's metrics (MetricDataDao.list_values) is answered by an index-only scan.
+
+CREATE INDEX IF NOT EXISTS ix_cn_stats_metric_data_value
+    ON cn_stats_metric_data (db_code, metric_code, region_code, date_num)
+    INCLUDE (metric_value)
+    WHERE is_deleted = FALSE;
@@ -0,0 +1,9 @@
+-- Hash of the compared columns of every row, computed by the DAOs (cn_stats_data.db.row_hash).
+-- Upserts and diffs compare this single value instead of every column.
+-- The existing rows are hashed by the next migration, 0011_row_hash_backfill.py.
+
+ALTER TABLE cn_stats_metric_codes ADD COLUMN IF NOT EXISTS row_hash CHAR(32);
+
+ALTER TABLE cn_stats_region_codes ADD COLUMN IF NOT EXISTS row_hash CHAR(32);
+
+ALTER TABLE cn_stats_metric_data ADD COLUMN IF NOT EXISTS row_hash CHAR(32);
@@ -0,0 +1,6 @@
+-- Serve the per series watermark (count(*), max(last_updated_time)) of the
+-- series cache with index-only scans. The series themselves are read from the
+-- covering index ix_cn_stats_metric_data_value of 0005, in date_num order.
+
+CREATE INDEX IF NOT EXISTS ix_cn_stats_metric_data_last_updated
+    ON cn_stats_metric_data (db_code, metric_code, region_code, last_updated_time);
@@ -0,0 +1,43 @@
+-- Roll-ups of the monthly metric data into quarters and years.
+-- cn_stats_metric_rollup_rules defines how the months of a metric are aggregated (sum, avg or last).
+-- MetricDataDao records the (series, year) buckets having changed rows of the metrics with a rule
+-- in cn_stats_metric_rollup_dirty, and RollupDao.refresh recomputes only those buckets.
+-- The quarterly date_num is year * 10 + quarter (e.g. 20241), the annual date_num is the year.
+
+CREATE TABLE IF NOT EXISTS cn_stats_metric_rollup_rules (
+    db_code VARCHAR NOT NULL,
+    metric_code VARCHAR NOT NULL,
+    aggregation VARCHAR NOT NULL CHECK (aggregation IN ('sum', 'avg', 'last')),
+    last_updated_time TIMESTAMP NOT NULL,
+    PRIMARY KEY (db_code, metric_code)
+);
+
+CREATE TABLE IF NOT EXISTS cn_stats_metric_rollup_dirty (
+    db_code VARCHAR NOT NULL,
+    metric_code VARCHAR NOT NULL,
+    region_code VARCHAR NOT NULL,
+    year INT NOT NULL,
+    PRIMARY KEY (db_code, metric_code, region_code, year)
+);
+
+CREATE TABLE IF NOT EXISTS cn_stats_metric_rollup_quarterly (
+    db_code VARCHAR NOT NULL,
+    metric_code VARCHAR NOT NULL,
+    region_code VARCHAR NOT NULL,
+    date_num INT NOT NULL,
+    metric_value DOUBLE PRECISION,
+    month_count INT NOT NULL,
+    last_updated_time TIMESTAMP NOT NULL,
+    PRIMARY KEY (db_code, metric_code, region_code, date_num)
+);
+
+CREATE TABLE IF NOT EXISTS cn_stats_metric_rollup_annual (
+    db_code VARCHAR NOT NULL,
+    metric_code VARCHAR NOT NULL,
+    region_code VARCHAR NOT NULL,
+    date_num INT NOT NULL,
+    metric_value DOUBLE PRECISION,
+    month_count INT NOT NULL,
+    last_updated_time TIMESTAMP NOT NULL,
+    PRIMARY KEY (db_code, metric_code, region_code, date_num)
+);
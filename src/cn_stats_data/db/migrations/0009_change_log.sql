@@ -0,0 +1,17 @@
+-- Change log of the metric codes, the region codes and the metric data, for the systems mirroring the data.
+-- A row is appended for every insert, value change and soft-delete by the DAOs, as the last statement of
+-- their transactions under a transaction-level advisory lock, so seq is assigned in commit order and a consumer
+-- reading the rows after the last seq it has seen never misses a change committed later.
+
+CREATE TABLE IF NOT EXISTS cn_stats_change_log (
+    seq BIGSERIAL PRIMARY KEY,
+    entity VARCHAR NOT NULL CHECK (entity IN ('metric_code', 'region_code', 'metric_data')),
+    operation VARCHAR NOT NULL CHECK (operation IN ('insert', 'update', 'delete')),
+    db_code VARCHAR NOT NULL,
+    code VARCHAR NOT NULL,
+    region_code VARCHAR,
+    date_num INT,
+    metric_value DOUBLE PRECISION,
+    row_hash VARCHAR,
+    changed_time TIMESTAMP NOT NULL DEFAULT now()
+);
@@ -0,0 +1,44 @@
+-- Soft-deleted rows are purged by cn_stats_data.db.compaction once they are older than the retention window,
+-- optionally into the archive tables below, which keep the columns of the live tables plus the archived time.
+-- The same key can be archived more than once, after it's restored and deleted again.
+
+CREATE TABLE IF NOT EXISTS cn_stats_metric_codes_archive (LIKE cn_stats_metric_codes INCLUDING DEFAULTS);
+ALTER TABLE cn_stats_metric_codes_archive ADD COLUMN IF NOT EXISTS archived_time TIMESTAMP NOT NULL DEFAULT now();
+CREATE INDEX IF NOT EXISTS ix_cn_stats_metric_codes_archive_key
+    ON cn_stats_metric_codes_archive (db_code, metric_code);
+
+CREATE TABLE IF NOT EXISTS cn_stats_region_codes_archive (LIKE cn_stats_region_codes INCLUDING DEFAULTS);
+ALTER TABLE cn_stats_region_codes_archive ADD COLUMN IF NOT EXISTS archived_time TIMESTAMP NOT NULL DEFAULT now();
+CREATE INDEX IF NOT EXISTS ix_cn_stats_region_codes_archive_key
+    ON cn_stats_region_codes_archive (db_code, region_code);
+
+CREATE TABLE IF NOT EXISTS cn_stats_metric_data_archive (LIKE cn_stats_metric_data INCLUDING DEFAULTS);
+ALTER TABLE cn_stats_metric_data_archive ADD COLUMN IF NOT EXISTS archived_time TIMESTAMP NOT NULL DEFAULT now();
+CREATE INDEX IF NOT EXISTS ix_cn_stats_metric_data_archive_key
+    ON cn_stats_metric_data_archive (db_code, metric_code, region_code, date_num);
+
+-- The expired soft-deleted rows are found without scanning the live ones.
+
+CREATE INDEX IF NOT EXISTS ix_cn_stats_metric_codes_deleted
+    ON cn_stats_metric_codes (last_updated_time)
+    WHERE is_deleted = TRUE;
+
+CREATE INDEX IF NOT EXISTS ix_cn_stats_region_codes_deleted
+    ON cn_stats_region_codes (last_updated_time)
+    WHERE is_deleted = TRUE;
+
+CREATE INDEX IF NOT EXISTS ix_cn_stats_metric_data_deleted
+    ON cn_stats_metric_data (last_updated_time)
+    WHERE is_deleted = TRUE;
+
+-- Live-row indexes matching the predicates of MetricCodeDao, the live metric data is served by
+-- ix_cn_stats_metric_data_value of 0005, and the region codes are read by the primary key or the parent
+-- including the deleted ones.
+
+CREATE INDEX IF NOT EXISTS ix_cn_stats_metric_codes_live
+    ON cn_stats_metric_codes (db_code, metric_code)
+    WHERE is_deleted = FALSE;
+
+CREATE INDEX IF NOT EXISTS ix_cn_stats_metric_codes_live_parent
+    ON cn_stats_metric_codes (db_code, parent_metric_code)
+    WHERE is_deleted = FALSE;
@@ -0,0 +1,87 @@
+"""
+Backfill the row_hash column added by 0006_row_hash for the rows saved before it,
+otherwise the first sync after the upgrade sees every row as changed and rewrites it,
+bumping last_updated_time, appending to the change log and marking the rollups dirty.
+The hashes are computed by cn_stats_data.db.row_hash from the stored columns, the same as the DAOs compute them
+from the downloaded objects, and all the rows are rehashed, so the ones saved by an older version are fixed as well.
+"""
+
+from psycopg2.extras import execute_values
+
+from cn_stats_data.db.row_hash import metric_code_row_hash, metric_data_row_hash, region_code_row_hash
+
+BATCH_SIZE = 10000
+
+_METRIC_CODES = (
+    """
+SELECT db_code, metric_code, name, explanation, memo, unit, parent_metric_code, extra_attributes, row_hash
+FROM cn_stats_metric_codes;
+""",
+    """
+UPDATE cn_stats_metric_codes t SET row_hash = v.row_hash
+FROM (VALUES %s) AS v (db_code, metric_code, row_hash)
+WHERE t.db_code = v.db_code AND t.metric_code = v.metric_code;
+""",
+    lambda i: metric_code_row_hash(*i[2:8]),
+    2,
+)
+
+_REGION_CODES = (
+    """
+SELECT db_code, region_code, name, explanation, children_region_codes, extra_attributes, row_hash
+FROM cn_stats_region_codes;
+""",
+    """
+UPDATE cn_stats_region_codes t SET row_hash = v.row_hash
+FROM (VALUES %s) AS v (db_code, region_code, row_hash)
+WHERE t.db_code = v.db_code AND t.region_code = v.region_code;
+""",
+    lambda i: region_code_row_hash(*i[2:6]),
+    2,
+)
+
+_METRIC_DATA = (
+    """
+SELECT db_code, metric_code, date_num, region_code, metric_value, extra_attributes, row_hash
+FROM cn_stats_metric_data;
+""",
+    """
+UPDATE cn_stats_metric_data t SET row_hash = v.row_hash
+FROM (VALUES %s) AS v (db_code, metric_code, date_num, region_code, row_hash)
+WHERE t.db_code = v.db_code AND t.metric_code = v.metric_code
+    AND t.date_num = v.date_num AND t.region_code = v.region_code;
+""",
+    lambda i: metric_data_row_hash(*i[4:6]),
+    4,
+)
+
+
+def _backfill(conn, select_sql: str, update_sql: str, compute, key_size: int) -> int:
+    """
+    Rehash the rows of a table, only the rows of a different hash are updated
+    :return: Returns the count of the rows updated
+    """
+    count = 0
+    # a server-side cursor, so the table isn't loaded into memory at once
+    with conn.cursor(name="row_hash_backfill") as reader, conn.cursor() as writer:
+        reader.itersize = BATCH_SIZE
+        reader.execute(select_sql)
+        while True:
+            rows = reader.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            changed = []
+            for i in rows:
+                row_hash = compute(i)
+                if row_hash != i[-1]:
+                    changed.append((*i[:key_size], row_hash))
+            if changed:
+                execute_values(writer, update_sql, changed, page_size=1000)
+                count += len(changed)
+    return count
+
+
+def migrate(conn) -> None:
+    """Run by cn_stats_data.db.migration in the transaction recording the version."""
+    for select_sql, update_sql, compute, key_size in (_METRIC_CODES, _REGION_CODES, _METRIC_DATA):
+        _backfill(conn, select_sql, update_sql, compute, key_size)
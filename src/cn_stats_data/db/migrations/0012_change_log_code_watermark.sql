@@ -0,0 +1,5 @@
+-- The last change log sequence number of the codes of a db code, compared by the watermark of the hierarchy cache
+-- (MetricCodeDao.get_watermark and RegionCodeDao.get_watermark), is read from the end of this index.
+
+CREATE INDEX IF NOT EXISTS ix_cn_stats_change_log_db_code
+    ON cn_stats_change_log (entity, db_code, seq);
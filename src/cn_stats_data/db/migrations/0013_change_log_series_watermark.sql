@@ -0,0 +1,5 @@
+-- The last change log sequence number of a series, compared by the watermark of the series cache
+-- (MetricDataDao.get_series_watermark), is read from the end of this index.
+
+CREATE INDEX IF NOT EXISTS ix_cn_stats_change_log_series
+    ON cn_stats_change_log (entity, db_code, code, region_code, seq);
@@ -5,7 +5,8 @@ from typing import List, Optional
 
 from cn_stats_util.models import Metric, Region, HistoricalData
 
-__all__ = ["MetricCode", "RegionCode", "MetricHistoricalData", "ProcessData", "RegionCodeDownloadCheckpoint", "MetricCodeDownloadCheckpoint"]
+__all__ = ["MetricCode", "RegionCode", "MetricHistoricalData", "ProcessData", "RegionCodeDownloadCheckpoint", "MetricCodeDownloadCheckpoint",
+           "Aggregation", "RollupLevel", "RollupRule", "ChangeEntity", "ChangeOperation", "ChangeRecord"]
 
 
 class MetricCode(Metric):
@@ -23,6 +24,7 @@ class MetricCode(Metric):
         is_deleted: Optional[bool] = False,
         created_time: Optional[datetime] = None,
         last_updated_time: Optional[datetime] = None,
+        row_hash: Optional[str] = None,
         **kwargs,
     ):
         super().__init__(
@@ -40,6 +42,7 @@ class MetricCode(Metric):
         self.is_deleted = is_deleted
         self.created_time = created_time
         self.last_updated_time = last_updated_time
+        self.row_hash = row_hash
         if is_parent and children is None:
             self._is_parent = is_parent
 
@@ -74,6 +77,7 @@ class RegionCode(Region):
         is_deleted: Optional[bool] = False,
         created_time: Optional[datetime] = None,
         last_updated_time: Optional[datetime] = None,
+        row_hash: Optional[str] = None,
         **kwargs,
     ):
         super().__init__(
@@ -89,6 +93,7 @@ class RegionCode(Region):
         self.is_deleted = is_deleted
         self.created_time = created_time
         self.last_updated_time = last_updated_time
+        self.row_hash = row_hash
         if is_parent and children is None:
             self._is_parent = is_parent
 
@@ -121,6 +126,7 @@ class MetricHistoricalData(HistoricalData):
         is_deleted: Optional[bool] = False,
         created_time: Optional[datetime] = None,
         last_updated_time: Optional[datetime] = None,
+        row_hash: Optional[str] = None,
         **kwargs,
     ):
         super().__init__(
@@ -135,6 +141,7 @@ class MetricHistoricalData(HistoricalData):
         self.is_deleted = is_deleted
         self.created_time = created_time
         self.last_updated_time = last_updated_time
+        self.row_hash = row_hash
 
     def __eq__(self, other):
         if not isinstance(other, MetricHistoricalData):
@@ -154,6 +161,86 @@ class ProcessData:
         self.process_id = process_id
         self.data = data
 
+class Aggregation(Enum):
+    """How the months of a metric are aggregated into a quarter or a year."""
+    SUM = 'sum'
+    AVG = 'avg'
+    LAST = 'last'  # the value of the last month having data
+
+
+class RollupLevel(Enum):
+    QUARTERLY = 'quarterly'
+    ANNUAL = 'annual'
+
+
+class RollupRule:
+    def __init__(self, db_code: str, metric_code: str, aggregation: Aggregation):
+        self.db_code = db_code
+        self.metric_code = metric_code
+        self.aggregation = aggregation
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, RollupRule):
+            return False
+        return (
+            self.db_code == other.db_code
+            and self.metric_code == other.metric_code
+            and self.aggregation == other.aggregation
+        )
+
+    def __repr__(self) -> str:
+        return f"RollupRule(db_code={self.db_code}, metric_code={self.metric_code}, aggregation={self.aggregation.value})"
+
+
+class ChangeEntity(Enum):
+    METRIC_CODE = 'metric_code'
+    REGION_CODE = 'region_code'
+    METRIC_DATA = 'metric_data'
+
+
+class ChangeOperation(Enum):
+    INSERT = 'insert'
+    UPDATE = 'update'  # including restoring a soft-deleted record
+    DELETE = 'delete'
+
+
+class ChangeRecord:
+    """
+    A change of the change log. code is the metric code of the metric codes and the metric data,
+    or the region code of the region codes. region_code, date_num and metric_value are of the metric data only.
+    """
+
+    def __init__(
+        self,
+        seq: int,
+        entity: ChangeEntity,
+        operation: ChangeOperation,
+        db_code: str,
+        code: str,
+        region_code: Optional[str] = None,
+        date_num: Optional[int] = None,
+        metric_value: Optional[float] = None,
+        row_hash: Optional[str] = None,
+        changed_time: Optional[datetime] = None,
+    ):
+        self.seq = seq
+        self.entity = entity
+        self.operation = operation
+        self.db_code = db_code
+        self.code = code
+        self.region_code = region_code
+        self.date_num = date_num
+        self.metric_value = metric_value
+        self.row_hash = row_hash
+        self.changed_time = changed_time
+
+    def __repr__(self) -> str:
+        return (
+            f"ChangeRecord(seq={self.seq}, entity={self.entity.value}, operation={self.operation.value}, "
+            f"db_code={self.db_code}, code={self.code}, region_code={self.region_code}, date_num={self.date_num})"
+        )
+
+
 class ProcessStatus(Enum):
     PENDING = ('Pending')
     RUNNING = ('Running')
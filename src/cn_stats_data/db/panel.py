@@ -0,0 +1,93 @@
+from typing import List, Optional
+
+import numpy as np
+from cn_stats_util.models import Category
+
+from cn_stats_data.db.dao import MetricCodeDao, MetricDataDao, RegionCodeDao
+
+__all__ = ["Panel", "load_panel"]
+
+
+class Panel:
+    """
+    Dense (metric × region × period) panel of the metric data of a category.
+    `values[m, r, p]` is the value of `metric_codes[m]` of `region_codes[r]` at `periods[p]`,
+    it's NaN where `mask` is True, i.e. there's no data in database.
+    """
+
+    def __init__(self, db_code: str, metric_codes: List[str], region_codes: List[str | None], periods: List[int]):
+        """
+        :param db_code: The db code of the data
+        :param metric_codes: The metric axis
+        :param region_codes: The region axis, [None] for the categories without regions
+        :param periods: The period axis, in ascending order
+        """
+        self.db_code = db_code
+        self.metric_codes = metric_codes
+        self.region_codes = region_codes
+        self.periods = np.asarray(periods, dtype=np.int64)
+        shape = (len(metric_codes), len(region_codes), len(periods))
+        self.values = np.full(shape, np.nan, dtype=np.float64)
+        self.mask = np.ones(shape, dtype=bool)
+
+    def fill(self, rows: List[tuple[int, int, int, float | None]]) -> int:
+        """
+        Fill a chunk of the values into the panel
+        :param rows: The (metric index, region index, date_num, metric_value) of `MetricDataDao.iter_panel_values`
+        :return: Returns the count of the values filled, the ones out of the period axis are ignored
+        """
+        if not rows:
+            return 0
+        metrics, regions, date_nums, values = zip(*rows)
+        date_nums = np.asarray(date_nums, dtype=np.int64)
+        positions = np.searchsorted(self.periods, date_nums)
+        found = positions < len(self.periods)
+        found[found] = self.periods[positions[found]] == date_nums[found]
+
+        index = (np.asarray(metrics, dtype=np.intp)[found], np.asarray(regions, dtype=np.intp)[found], positions[found])
+        data = np.asarray(values, dtype=np.float64)[found]  # None is converted to NaN
+        self.values[index] = data
+        self.mask[index] = np.isnan(data)
+        return int(found.sum())
+
+    def masked(self) -> np.ma.MaskedArray:
+        """Get the values as a masked array, it shares the memory of the panel."""
+        return np.ma.MaskedArray(self.values, mask=self.mask, copy=False)
+
+    @property
+    def shape(self) -> tuple[int, int, int]:
+        return self.values.shape
+
+
+def load_panel(
+    db_code: Category,
+    years: List[int],
+    metric_codes: Optional[List[str]] = None,
+    region_code: Optional[str] = None,
+    itersize: int = 10000,
+) -> Panel:
+    """
+    Load the metric data of the category into a dense panel by one query.
+    :param db_code: The category
+    :param years: The years of the period axis
+    :param metric_codes: The metric axis, or None for all the leaf metrics of the category
+    :param region_code: The region and its descendants for the region axis, or None for all the regions of the category.
+        The region axis is [None] for the categories without regions.
+    :param itersize: The count of the rows filled at a time
+    :return: Returns the panel
+    """
+    if metric_codes is None:
+        metric_codes = [i.code for i in MetricCodeDao.list_leaves(db_code)]
+    if db_code.is_regional():
+        region_codes = [i.code for i in RegionCodeDao.list_cached(db_code, region_code)]
+    else:
+        region_codes = [None]
+    periods = sorted(set(db_code.get_periods_from_years(years)))
+
+    panel = Panel(db_code.db_code, metric_codes, region_codes, periods)
+    if not periods:
+        return panel
+    for rows in MetricDataDao.iter_panel_values(
+            db_code.db_code, metric_codes, region_codes, periods[0], periods[-1], itersize):
+        panel.fill(rows)
+    return panel
@@ -1,20 +1,12 @@
 from itertools import groupby
 from typing import List, Optional
 import json
-from cn_stats_data import db
+from cn_stats_data import db, metrics
 from cn_stats_data.db.models import MetricCodeDownloadCheckpoint, ProcessData, RegionCodeDownloadCheckpoint
 
 __all__ = ["ProcessDataDao"]
 
-class ProcessDataDao:
-
-    METRIC_CODE_DOWNLOAD_ID: str = "metric_code_download"
-    REGION_CODE_DOWNLOAD_ID: str = "region_code_download"
-
-    @classmethod
-    def add_or_update(cls, data: ProcessData) -> int:
-
-        sql = """
+_ADD_OR_UPDATE_SQL = """
 INSERT INTO process_data AS t (
     process_id,
     data,
@@ -26,20 +18,35 @@ DO UPDATE SET
     data = EXCLUDED.data,
     last_updated_time = now()
 WHERE t.process_id = EXCLUDED.process_id;
-        """
+"""
+
+_GET_SQL = """
+SELECT process_id, data FROM process_data WHERE process_id = %s;
+"""
+
+_DELETE_SQL = """
+DELETE FROM process_data WHERE process_id = %s;
+"""
+
+
+@metrics.instrument_dao
+class ProcessDataDao:
+
+    METRIC_CODE_DOWNLOAD_ID: str = "metric_code_download"
+    REGION_CODE_DOWNLOAD_ID: str = "region_code_download"
+
+    @classmethod
+    def add_or_update(cls, data: ProcessData) -> int:
         with db.get_conn() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(sql, (data.process_id, data.data))
+                cursor.execute(_ADD_OR_UPDATE_SQL, (data.process_id, data.data))
                 return cursor.rowcount
             
     @classmethod
     def get(cls, process_id: str) -> Optional[ProcessData]:
-        sql = """
-SELECT process_id, data FROM process_data WHERE process_id = %s;
-        """
         with db.get_conn() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(sql, (process_id,))
+                cursor.execute(_GET_SQL, (process_id,))
                 row = cursor.fetchone()
                 if row is None:
                     return None
@@ -47,16 +54,14 @@ SELECT process_id, data FROM process_data WHERE process_id = %s;
             
     @classmethod
     def delete(cls, process_id: str) -> int:
-        sql = """
-DELETE FROM process_data WHERE process_id = %s;
-        """
         with db.get_conn() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(sql, (process_id,))
+                cursor.execute(_DELETE_SQL, (process_id,))
                 return cursor.rowcount
             
     @classmethod
     def add_or_update_metric_code_download_checkpoint(cls, data: MetricCodeDownloadCheckpoint) -> int:
+        metrics.checkpoint_writes.inc(process=cls.METRIC_CODE_DOWNLOAD_ID)
         cls.add_or_update(ProcessData(cls.METRIC_CODE_DOWNLOAD_ID, data.to_json()))
 
     @classmethod
@@ -66,6 +71,7 @@ DELETE FROM process_data WHERE process_id = %s;
     
     @classmethod
     def add_or_update_region_code_download_checkpoint(cls, data: RegionCodeDownloadCheckpoint) -> int:
+        metrics.checkpoint_writes.inc(process=cls.REGION_CODE_DOWNLOAD_ID)
         cls.add_or_update(ProcessData(cls.REGION_CODE_DOWNLOAD_ID, data.to_json()))
 
     @classmethod
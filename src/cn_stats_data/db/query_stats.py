@@ -0,0 +1,255 @@
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+import psycopg2.extensions
+
+from cn_stats_data import db, metrics
+
+__all__ = ["StatementStats", "StatsCursor", "statement_name", "is_slow", "record", "record_connect", "explainable",
+           "explain", "snapshot", "report", "reset"]
+
+# the name of the connection-acquire time in the statistics
+CONNECT = "(connect)"
+
+# the latencies kept per statement for the percentiles
+_RESERVOIR = 1024
+
+_EXPLAIN_SAVEPOINT = "cn_stats_explain"
+
+_lock = threading.Lock()
+_stats: Dict[str, "StatementStats"] = {}
+# the SQL constants of the DAO modules by their text, the modules are indexed when they're loaded
+_names: Dict[str, str] = {}
+_indexed: set[str] = set()
+_modules_seen = 0
+
+_slow_logger = logging.getLogger("cn_stats_data.db.slow_query")
+
+
+class StatementStats:
+    """The call count, the latency and the rows of a SQL statement."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self._latencies: Deque[float] = deque(maxlen=_RESERVOIR)
+
+    def add(self, seconds: float, rows: int = -1) -> None:
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        if rows > 0:
+            self.rows += rows
+        self._latencies.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        """
+        Get the latency percentile of the recent calls
+        :param q: The percentile between 0 and 1, e.g. 0.95
+        :return: Returns the seconds, or 0 if there's no call
+        """
+        latencies = sorted(self._latencies)
+        if not latencies:
+            return 0.0
+        return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "calls": self.calls,
+            "seconds": self.seconds,
+            "mean_seconds": self.seconds / self.calls if self.calls else 0.0,
+            "p50_seconds": self.percentile(0.5),
+            "p95_seconds": self.percentile(0.95),
+            "p99_seconds": self.percentile(0.99),
+            "max_seconds": self.max_seconds,
+            "rows": self.rows,
+        }
+
+
+def _index_statements() -> None:
+    """Index the `*_SQL` constants of the loaded db modules, the ones of the Postgres DAOs win over the aio copies."""
+    global _modules_seen
+
+    modules = [(k, v) for k, v in list(sys.modules.items()) if k.startswith("cn_stats_data.db.") and k not in _indexed]
+    for module_name, module in sorted(modules, key=lambda i: (".aio." in i[0] or ".sqlite." in i[0], i[0])):
+        _indexed.add(module_name)
+        prefix = module_name[len("cn_stats_data.db."):]
+        for k, v in list(vars(module).items()):
+            if not k.endswith("_SQL"):
+                continue
+            if isinstance(v, str):
+                _names.setdefault(v, f"{prefix}.{k}")
+            elif isinstance(v, dict):  # e.g. the statements per table
+                for key, sql in v.items():
+                    if isinstance(sql, str):
+                        _names.setdefault(sql, f"{prefix}.{k}[{key}]")
+    _modules_seen = len(sys.modules)
+
+
+def statement_name(sql: Any) -> str:
+    """
+    Name a SQL statement by the constant it's defined by, e.g. metric_code_dao._LIST_SQL.
+    The statements built at runtime, e.g. the pages of `execute_values`, are named by the DAO method running them.
+    """
+    if isinstance(sql, str):
+        if len(sys.modules) != _modules_seen:
+            with _lock:
+                _index_statements()
+        name = _names.get(sql)
+        if name is not None:
+            return name
+    return metrics.current_dao_call.get() or "other"
+
+
+def is_slow(seconds: float) -> bool:
+    return seconds * 1000 >= db.query_stats_config.slow_query_ms
+
+
+def _format_params(params: Any) -> str:
+    text = repr(params)
+    limit = db.query_stats_config.max_param_chars
+    return text if len(text) <= limit else f"{text[:limit]}... ({len(text)} chars)"
+
+
+def record(sql: Any, params: Any, seconds: float, rows: int = -1, plan: Optional[str] = None) -> None:
+    """
+    Record an execution of a SQL statement, it's logged to the cn_stats_data.db.slow_query logger if it's slow.
+    :param sql: The SQL text
+    :param params: The parameters, they're only logged for a slow statement
+    :param seconds: The seconds the execution took
+    :param rows: The rows returned or affected, -1 if it's unknown
+    :param plan: The plan of a slow statement
+    """
+    name = statement_name(sql)
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = StatementStats(name)
+        stats.add(seconds, rows)
+    metrics.db_query_seconds.observe(seconds, statement=name)
+    if rows > 0:
+        metrics.db_query_rows.inc(rows, statement=name)
+
+    if is_slow(seconds):
+        message = (f"Slow query {name} took {seconds * 1000:.0f}ms, {rows} rows, "
+                   f"the parameters: {_format_params(params)}")
+        if plan:
+            message += f"\n{plan}"
+        _slow_logger.warning(message)
+
+
+def record_connect(seconds: float) -> None:
+    """Record the time to open or borrow a connection."""
+    if not db.query_stats_config.enabled:
+        return
+    with _lock:
+        stats = _stats.get(CONNECT)
+        if stats is None:
+            stats = _stats[CONNECT] = StatementStats(CONNECT)
+        stats.add(seconds)
+    metrics.db_connect_seconds.observe(seconds)
+
+
+def explainable(sql: Any) -> Optional[str]:
+    """
+    Check whether a statement can be explained, the SQL of multiple commands can't,
+    as EXPLAIN only applies to the first one and the others would be executed.
+    :return: Returns None if it can be explained, otherwise the reason
+    """
+    if not isinstance(sql, str):
+        return "Not explained, the SQL is built at runtime."
+    if ";" in sql.rstrip("; \t\r\n"):
+        return "Not explained, the SQL has multiple commands."
+    return None
+
+
+def explain(conn, sql: str, params: Any = None) -> str:
+    """
+    Get the plan of a statement on the connection, without executing it.
+    It's run in a savepoint, so a statement can't be explained, e.g. a DDL, doesn't abort the transaction.
+    :param conn: The psycopg2 connection
+    :param sql: The SQL text
+    :param params: The parameters of the statement
+    :return: Returns the plan, or the reason if the statement can't be explained
+    """
+    reason = explainable(sql)
+    if reason is not None:
+        return reason
+
+    in_transaction = not conn.autocommit
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+        if in_transaction:
+            cursor.execute(f"SAVEPOINT {_EXPLAIN_SAVEPOINT}")
+        try:
+            cursor.execute("EXPLAIN " + sql.rstrip("; \t\r\n"), params)
+            plan = "\n".join(i[0] for i in cursor.fetchall())
+        except psycopg2.Error as e:
+            if in_transaction:
+                cursor.execute(f"ROLLBACK TO SAVEPOINT {_EXPLAIN_SAVEPOINT}")
+            return f"Failed to explain: {e}".strip()
+        if in_transaction:
+            cursor.execute(f"RELEASE SAVEPOINT {_EXPLAIN_SAVEPOINT}")
+        return plan
+
+
+class StatsCursor(psycopg2.extensions.cursor):
+    """The cursor recording the latency and the rows of every statement, it's the cursor factory of `db.get_conn`."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute(query, vars)
+            failed = False
+            return result
+        finally:
+            seconds = time.perf_counter() - start
+            plan = None
+            # a named cursor only declares the query here, and the statement of an aborted transaction can't be run
+            if not failed and self.name is None and db.query_stats_config.explain_slow and is_slow(seconds):
+                plan = explain(self.connection, query, vars)
+            record(query, vars, seconds, -1 if failed else self.rowcount, plan)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            # the parameter sets may be a generator which has been consumed
+            record(query, "(executemany)", time.perf_counter() - start, self.rowcount)
+
+
+def snapshot() -> List[Dict[str, Any]]:
+    """Get the statistics of the statements, in descending order of the total time."""
+    with _lock:
+        stats = [i.to_dict() for i in _stats.values()]
+    return sorted(stats, key=lambda i: -i["seconds"])
+
+
+def report(limit: int = 30) -> str:
+    """
+    Format the statistics as a table, e.g. to log it at the end of a run
+    :param limit: The count of the statements, the ones taking the most total time
+    """
+    lines = [f"{'calls':>8} {'total s':>10} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+             f"{'max ms':>9} {'rows':>10}  statement"]
+    for i in snapshot()[:limit]:
+        lines.append(
+            f"{i['calls']:>8} {i['seconds']:>10.3f} {i['mean_seconds'] * 1000:>9.1f} {i['p50_seconds'] * 1000:>9.1f} "
+            f"{i['p95_seconds'] * 1000:>9.1f} {i['p99_seconds'] * 1000:>9.1f} {i['max_seconds'] * 1000:>9.1f} "
+            f"{i['rows']:>10}  {i['name']}")
+    return "\n".join(lines)
+
+
+def reset() -> None:
+    """Clear the statistics, e.g. between the runs of a long-lived process."""
+    with _lock:
+        _stats.clear()
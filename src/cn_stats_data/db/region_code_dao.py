@@ -1,44 +1,17 @@
 from itertools import groupby
 from typing import List, Optional
 import json
-from cn_stats_data import db
+from cn_stats_data import db, metrics
 from cn_stats_util.models import Category
+from cn_stats_data.db.change_log_dao import _CHANGE_OPERATION_TEMPLATE, _LOCK_CHANGE_LOG_SQL
+from cn_stats_data.db.hierarchy_cache import hierarchy_cache
+from cn_stats_data.db.hierarchy_index import HierarchyIndex
 from cn_stats_data.db.models import RegionCode
+from cn_stats_data.db.row_hash import region_code_hash
 
 __all__ = ["RegionCodeDao"]
 
-
-class RegionCodeDao:
-    """
-    The class for interacting with database.
-    """
-
-    @classmethod
-    def add_or_update(cls, lst: List[RegionCode]) -> int:
-        """
-        Insert or update the data to database.
-        :param lst: The list of region codes
-        :return: The record count are saved
-        """
-
-        if not lst:
-            return 0
-        data = [
-            (
-                i.code,
-                i.db_code,
-                i.name,
-                i.explanation,
-                i.children if i.children is None else [c.code for c in i.children],
-                json.dumps(i.extra_attributes),
-            )
-            for i in lst
-            if not hasattr(i, "is_deleted") or not i.is_deleted
-        ]
-        if len(data) == 0:
-            return 0
-
-        sql = """        
+_ADD_OR_UPDATE_SQL = """
 INSERT INTO cn_stats_region_codes AS t (
     region_code,
     db_code,
@@ -46,73 +19,75 @@ INSERT INTO cn_stats_region_codes AS t (
     explanation,
     children_region_codes,
     extra_attributes,
+    row_hash,
     is_deleted,
     created_time,
     last_updated_time)
-VALUES(%s, %s, %s, %s, %s, %s::JSONB, False, now(), now()) 
+VALUES(%s, %s, %s, %s, %s, %s::JSONB, %s, False, now(), now()) 
 ON CONFLICT(db_code, region_code) 
 DO UPDATE SET 
     name = EXCLUDED.name, 
     explanation = EXCLUDED.explanation,
     children_region_codes = EXCLUDED.children_region_codes, 
     extra_attributes = EXCLUDED.extra_attributes,
+    row_hash = EXCLUDED.row_hash,
     is_deleted = False,
     last_updated_time = EXCLUDED.last_updated_time 
-WHERE t.name <> EXCLUDED.name 
-    OR ((t.explanation IS NULL AND EXCLUDED.explanation IS NOT NULL) 
-        OR (t.explanation IS NOT NULL AND EXCLUDED.explanation IS NULL) 
-        OR (t.explanation <> EXCLUDED.explanation))
-    OR ((t.children_region_codes IS NULL AND EXCLUDED.children_region_codes IS NOT NULL) 
-        OR (t.children_region_codes IS NOT NULL AND EXCLUDED.children_region_codes IS NULL) 
-        OR (t.children_region_codes <> EXCLUDED.children_region_codes))
-    OR ((t.extra_attributes IS NULL AND EXCLUDED.extra_attributes IS NOT NULL) 
-        OR (t.extra_attributes IS NOT NULL AND EXCLUDED.extra_attributes IS NULL) 
-        OR (t.extra_attributes <> EXCLUDED.extra_attributes))
+WHERE t.row_hash IS DISTINCT FROM EXCLUDED.row_hash
     OR t.is_deleted = True;
-        """
-        with db.get_conn() as conn:
-            with conn.cursor() as cursor:
-                cursor.executemany(sql, data)
-                return cursor.rowcount
+"""
 
-    @classmethod
-    def delete(cls, lst: List[RegionCode]) -> int:
-        """
-        Delete the data from database
-        :param lst: the list of region codes
-        :return: The record count are deleted
-        """
+# keep parent_region_code in line with the children_region_codes of the saved regions
+_SYNC_PARENT_SQL = """
+UPDATE cn_stats_region_codes c SET
+    parent_region_code = p.region_code
+FROM cn_stats_region_codes p
+WHERE p.db_code = %(db_code)s
+    AND p.region_code = ANY(%(region_codes)s)
+    AND c.db_code = p.db_code
+    AND c.region_code = ANY(p.children_region_codes)
+    AND c.parent_region_code IS DISTINCT FROM p.region_code;
 
-        if lst is None or len(lst) == 0:
-            return 0
-        data = [(i.db_code, i.code) for i in lst if not hasattr(i, "is_deleted") or i.is_deleted]
-        if len(data) == 0:
-            return 0
+UPDATE cn_stats_region_codes c SET
+    parent_region_code = NULL
+FROM cn_stats_region_codes p
+WHERE p.db_code = %(db_code)s
+    AND p.region_code = ANY(%(region_codes)s)
+    AND c.db_code = p.db_code
+    AND c.parent_region_code = p.region_code
+    AND NOT c.region_code = ANY(COALESCE(p.children_region_codes, '{}'));
+
+UPDATE cn_stats_region_codes c SET
+    parent_region_code = p.region_code
+FROM cn_stats_region_codes p
+WHERE c.db_code = %(db_code)s
+    AND c.region_code = ANY(%(region_codes)s)
+    AND c.parent_region_code IS NULL
+    AND p.db_code = c.db_code
+    AND p.children_region_codes @> ARRAY[c.region_code];
+"""
 
-        sql = """
+_DELETE_SQL = """
 UPDATE cn_stats_region_codes SET
     is_deleted = True,
     last_updated_time = now()    
 WHERE db_code = %s
     AND region_code = %s 
     AND is_deleted = False;
-        """
+"""
 
-        with db.get_conn() as conn:
-            with conn.cursor() as cursor:
-                cursor.executemany(sql, data)
-                return cursor.rowcount
-
-    @classmethod
-    def get(cls, reg_code: str, db_code: Category) -> RegionCode | None:
-        """
-        Get metric code from DB
-        :param reg_code: code of the region
-        :param db_code: db code of the region
-        :return: Returns the region code object if found, otherwise returns None
-        """
+# append the saved or deleted codes to the change log, the changed ones are updated at now() of the transaction
+_LOG_CHANGES_SQL = _LOCK_CHANGE_LOG_SQL + f"""
+INSERT INTO cn_stats_change_log (entity, operation, db_code, code, row_hash)
+SELECT 'region_code', {_CHANGE_OPERATION_TEMPLATE.format(t="c")}, c.db_code, c.region_code, c.row_hash
+FROM cn_stats_region_codes c
+WHERE c.db_code = %(db_code)s
+    AND c.region_code = ANY(%(region_codes)s)
+    AND c.last_updated_time = now()
+ORDER BY c.region_code;
+"""
 
-        sql = """
+_GET_SQL = """
 SELECT 
     r.region_code, 
     r.db_code,
@@ -123,87 +98,13 @@ SELECT
     r.is_deleted,
     r.created_time, 
     r.last_updated_time,
-    p.region_code AS parent_region_code
+    r.parent_region_code,
+    r.row_hash
 FROM cn_stats_region_codes r
-    LEFT JOIN cn_stats_region_codes p ON r.db_code = p.db_code AND r.region_code = ANY(p.children_region_codes)
 WHERE r.is_deleted = FALSE AND r.db_code = %s AND r.region_code = %s;
-        """
+"""
 
-        with db.get_conn() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(sql, (db_code.db_code, reg_code))
-                data = [
-                    RegionCode(
-                        code=i[0],
-                        db_code=i[1],
-                        name=i[2],
-                        explanation=i[3],
-                        is_parent=i[4] is not None,
-                        parent=(
-                            None
-                            if not i[9]
-                            else RegionCode(
-                                db_code=db_code,
-                                code=i[9],
-                                name=None,
-                                explanation=None,
-                                is_parent=False,
-                            )
-                        ),
-                        children=(
-                            None
-                            if not i[4]
-                            else [
-                                RegionCode(
-                                    db_code=i[1],
-                                    code=x,
-                                    name=None,
-                                    explanation=None,
-                                    is_parent=False,
-                                )
-                                for x in i[4]
-                            ]
-                        ),
-                        is_deleted=i[6],
-                        created_time=i[7],
-                        last_updated_time=i[8],
-                        **i[5],
-                    )
-                    for i in cursor.fetchall()
-                ]
-                if len(data) == 0:
-                    return None
-                else:
-                    return data[0]
-
-    @classmethod
-    def list(
-        cls, db_code: Category | None = None, reg_code: str | None = None
-    ) -> list[RegionCode]:
-        """
-        Get regions via db code and region code and its descendants
-        :param db_code: Specific the db code or None for all db codes
-        :param reg_code:  Specific the region code or None for metrics
-        :return: Returns the regions and its descendants
-        """
-
-        def manipulate_children(
-            dict: dict[(str, str), list[RegionCode]], parent: Optional[RegionCode] = None
-        ) -> None:
-            
-            if parent is None:
-                db_codes = [db_code] if db_code else list(Category)
-                for c in db_codes:
-                    children = dict.get((c.db_code, ""), [])
-                    for i in children:
-                        manipulate_children(dict, i)
-            else:
-                children = dict.get((parent.db_code, parent.code), [])
-                parent.children = children if parent.code else None
-                for i in children:
-                    manipulate_children(dict, i)
-
-        sql = """
+_LIST_SQL = """
 WITH RECURSIVE cte_regions (
     region_code, 
     db_code,
@@ -214,7 +115,8 @@ WITH RECURSIVE cte_regions (
     is_deleted,
     created_time, 
     last_updated_time,
-    parent_region_code)
+    parent_region_code,
+    row_hash)
 AS(
     SELECT 
         r.region_code, 
@@ -226,9 +128,9 @@ AS(
         r.is_deleted,
         r.created_time, 
         r.last_updated_time,
-        p.region_code AS parent_region_code
+        r.parent_region_code,
+        r.row_hash
     FROM cn_stats_region_codes r
-        LEFT JOIN cn_stats_region_codes p ON r.db_code = p.db_code AND r.region_code = ANY(p.children_region_codes)
     WHERE (%s OR r.db_code = %s) AND (%s OR r.region_code = %s)
     UNION
     SELECT 
@@ -241,65 +143,221 @@ AS(
         c.is_deleted, 
         c.created_time, 
         c.last_updated_time,
-        r.region_code AS parent_region_code 
+        c.parent_region_code,
+        c.row_hash
     FROM cn_stats_region_codes c
-        INNER JOIN cte_regions r ON c.db_code = r.db_code AND c.region_code = ANY(r.children_region_codes)
+        INNER JOIN cte_regions r ON c.db_code = r.db_code AND c.parent_region_code = r.region_code
 ) 
-SELECT * FROM cte_regions;        
+SELECT * FROM cte_regions;
+"""
+
+# last_updated_time is the start of the writing transaction, a transaction started earlier but committed later
+# can't move it, so the last sequence number of the change log, assigned in commit order, is compared as well
+_WATERMARK_SQL = """
+SELECT 
+    count(*), 
+    max(last_updated_time),
+    (SELECT max(seq) FROM cn_stats_change_log WHERE entity = 'region_code' AND db_code = %(db_code)s)
+FROM cn_stats_region_codes 
+WHERE db_code = %(db_code)s;
+"""
+
+
+def _build_index(data: List[RegionCode]) -> HierarchyIndex[RegionCode]:
+    return HierarchyIndex(
+        data,
+        key=lambda i: (i.db_code, i.code),
+        parent_key=lambda i: (i.db_code, i.parent.code) if i.parent else None,
+    )
+
+
+def _set_children(index: HierarchyIndex[RegionCode]) -> None:
+    for i in index:
+        if i.code:
+            i.children = index.children((i.db_code, i.code))
+
+
+def _region_code_from_row(i: tuple, is_parent: bool = False) -> RegionCode:
+    return RegionCode(
+        code=i[0],
+        db_code=i[1],
+        name=i[2],
+        explanation=i[3],
+        is_parent=is_parent,
+        parent=(
+            None
+            if not i[9]
+            else RegionCode(
+                db_code=i[1],
+                code=i[9],
+                name=None,
+                explanation=None,
+                is_parent=False,
+            )
+        ),
+        children=(
+            None
+            if not i[4]
+            else [
+                RegionCode(
+                    db_code=i[1],
+                    code=x,
+                    name=None,
+                    explanation=None,
+                    is_parent=False,
+                )
+                for x in i[4]
+            ]
+        ),
+        is_deleted=i[6],
+        created_time=i[7],
+        last_updated_time=i[8],
+        row_hash=i[10],
+        **i[5],
+    )
+
+
+def _region_code_params(i: RegionCode) -> tuple:
+    return (
+        i.code,
+        i.db_code,
+        i.name,
+        i.explanation,
+        i.children if i.children is None else [c.code for c in i.children],
+        json.dumps(i.extra_attributes),
+        region_code_hash(i),
+    )
+
+
+@metrics.instrument_dao
+class RegionCodeDao:
+    """
+    The class for interacting with database.
+    """
+
+    @classmethod
+    def add_or_update(cls, lst: List[RegionCode]) -> int:
         """
+        Insert or update the data to database.
+        :param lst: The list of region codes
+        :return: The record count are saved
+        """
+
+        if not lst:
+            return 0
+        data = [_region_code_params(i) for i in lst if not hasattr(i, "is_deleted") or not i.is_deleted]
+        if len(data) == 0:
+            return 0
 
         with db.get_conn() as conn:
             with conn.cursor() as cursor:
-                dbcode = None if db_code is None else db_code.db_code
-                cursor.execute(
-                    sql, (dbcode is None, dbcode, reg_code is None, reg_code)
-                )
+                cursor.executemany(_ADD_OR_UPDATE_SQL, data)
+                count = cursor.rowcount
+                for key, group in groupby(sorted(data, key=lambda x: x[1]), key=lambda x: x[1]):
+                    # the parents are synchronized by db code, and then the changes of it are logged
+                    cursor.execute(_SYNC_PARENT_SQL + _LOG_CHANGES_SQL, {"db_code": key, "region_codes": [i[0] for i in group]})
+                return count
+
+    @classmethod
+    def delete(cls, lst: List[RegionCode]) -> int:
+        """
+        Delete the data from database
+        :param lst: the list of region codes
+        :return: The record count are deleted
+        """
+
+        if lst is None or len(lst) == 0:
+            return 0
+        data = [(i.db_code, i.code) for i in lst if not hasattr(i, "is_deleted") or i.is_deleted]
+        if len(data) == 0:
+            return 0
+
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.executemany(_DELETE_SQL, data)
+                count = cursor.rowcount
+                for key, group in groupby(sorted(data, key=lambda x: x[0]), key=lambda x: x[0]):
+                    cursor.execute(_LOG_CHANGES_SQL, {"db_code": key, "region_codes": [i[1] for i in group]})
+                return count
+
+    @classmethod
+    def get(cls, reg_code: str, db_code: Category) -> RegionCode | None:
+        """
+        Get metric code from DB
+        :param reg_code: code of the region
+        :param db_code: db code of the region
+        :return: Returns the region code object if found, otherwise returns None
+        """
+
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(_GET_SQL, (db_code.db_code, reg_code))
                 data = [
-                    RegionCode(
-                        code=i[0],
-                        db_code=i[1],
-                        name=i[2],
-                        explanation=i[3],
-                        is_parent=False,
-                        parent=(
-                            None
-                            if not i[9]
-                            else RegionCode(
-                                db_code=i[1],
-                                code=i[9],
-                                name=None,
-                                explanation=None,
-                                is_parent=False,
-                            )
-                        ),
-                        children=(
-                            None
-                            if not i[4]
-                            else [
-                                RegionCode(
-                                    db_code=i[1],
-                                    code=x,
-                                    name=None,
-                                    explanation=None,
-                                    is_parent=False,
-                                )
-                                for x in i[4]
-                            ]
-                        ),
-                        is_deleted=i[6],
-                        created_time=i[7],
-                        last_updated_time=i[8],
-                        **i[5],
-                    )
+                    _region_code_from_row(i, is_parent=i[4] is not None)
                     for i in cursor.fetchall()
                 ]
+                if len(data) == 0:
+                    return None
+                else:
+                    return data[0]
 
-                parent_dict = {}
-                for i in data:
-                    if i.parent:
-                        parent_dict.setdefault((i.db_code, i.parent.code or ""), []).append(i)
-                    else:
-                        parent_dict.setdefault((i.db_code, ""), []).append(i)
-                manipulate_children(parent_dict)
+    @classmethod
+    def list(
+        cls, db_code: Category | None = None, reg_code: str | None = None
+    ) -> list[RegionCode]:
+        """
+        Get regions via db code and region code and its descendants
+        :param db_code: Specific the db code or None for all db codes
+        :param reg_code:  Specific the region code or None for metrics
+        :return: Returns the regions and its descendants
+        """
 
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                dbcode = None if db_code is None else db_code.db_code
+                cursor.execute(_LIST_SQL, (dbcode is None, dbcode, reg_code is None, reg_code))
+                data = [_region_code_from_row(i) for i in cursor.fetchall()]
+                _set_children(_build_index(data))
                 return data
+
+    @classmethod
+    def get_watermark(cls, db_code: Category) -> tuple:
+        """
+        Get the watermark of the region codes of the db code, it changes when any code is saved or deleted
+        :param db_code: db code of the regions
+        :return: Returns the count of the codes, the max last updated time and the last change log sequence number
+        """
+
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(_WATERMARK_SQL, {"db_code": db_code.db_code})
+                return tuple(cursor.fetchone())
+
+    @classmethod
+    def get_hierarchy(cls, db_code: Category) -> HierarchyIndex[RegionCode]:
+        """
+        Get the hierarchy of the regions of the db code from the hierarchy cache.
+        It's only reloaded from database when the codes in database are changed.
+        The nodes are shared with other callers and must not be modified.
+        :param db_code: Specific the db code
+        :return: Returns the hierarchy index of the regions, keyed by (db_code, region_code)
+        """
+        return hierarchy_cache.get(
+            ("region_codes", db_code.db_code),
+            watermark=lambda: cls.get_watermark(db_code),
+            loader=lambda: _build_index(cls.list(db_code)),
+        )
+
+    @classmethod
+    def list_cached(cls, db_code: Category, reg_code: str | None = None) -> List[RegionCode]:
+        """
+        Same as `list`, but the regions are served from the hierarchy cache, see `get_hierarchy`.
+        :param db_code: Specific the db code
+        :param reg_code: Specific the region code or None for regions
+        :return: Returns the regions and its descendants
+        """
+        index = cls.get_hierarchy(db_code)
+        if reg_code is None:
+            return list(index)
+        key = (db_code.db_code, reg_code)
+        return index.descendants(key) if key in index else []
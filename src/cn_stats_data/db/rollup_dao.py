@@ -0,0 +1,248 @@
+from typing import List
+
+from cn_stats_util.models import Category
+
+from cn_stats_data import db, metrics
+from cn_stats_data.db.models import Aggregation, RollupLevel, RollupRule
+
+__all__ = ["RollupDao"]
+
+_TABLES = {
+    RollupLevel.QUARTERLY: "cn_stats_metric_rollup_quarterly",
+    RollupLevel.ANNUAL: "cn_stats_metric_rollup_annual",
+}
+
+_ADD_OR_UPDATE_RULE_SQL = """
+INSERT INTO cn_stats_metric_rollup_rules AS t (db_code, metric_code, aggregation, last_updated_time)
+VALUES (%s, %s, %s, now())
+ON CONFLICT (db_code, metric_code)
+DO UPDATE SET
+    aggregation = EXCLUDED.aggregation,
+    last_updated_time = EXCLUDED.last_updated_time
+WHERE t.aggregation IS DISTINCT FROM EXCLUDED.aggregation;
+"""
+
+# all the buckets of the new or changed rules need to be computed
+_MARK_RULE_DIRTY_SQL = """
+INSERT INTO cn_stats_metric_rollup_dirty (db_code, metric_code, region_code, year)
+SELECT DISTINCT d.db_code, d.metric_code, d.region_code, d.date_num / 100
+FROM cn_stats_metric_rollup_rules r
+    INNER JOIN cn_stats_metric_data d ON d.db_code = r.db_code AND d.metric_code = r.metric_code AND d.is_deleted = FALSE
+WHERE r.last_updated_time = now()
+ON CONFLICT DO NOTHING;
+"""
+
+_DELETE_RULE_SQL = """
+DELETE FROM cn_stats_metric_rollup_rules WHERE db_code = %s AND metric_code = %s;
+"""
+
+_PURGE_RULE_SQL = """
+DELETE FROM cn_stats_metric_rollup_quarterly WHERE db_code = %(db_code)s AND metric_code = %(metric_code)s;
+DELETE FROM cn_stats_metric_rollup_annual WHERE db_code = %(db_code)s AND metric_code = %(metric_code)s;
+DELETE FROM cn_stats_metric_rollup_dirty WHERE db_code = %(db_code)s AND metric_code = %(metric_code)s;
+"""
+
+_LIST_RULES_SQL = """
+SELECT db_code, metric_code, aggregation
+FROM cn_stats_metric_rollup_rules
+WHERE (%s OR db_code = %s)
+ORDER BY db_code, metric_code;
+"""
+
+# take the dirty buckets, the ones recorded by other transactions after this are left to the next refresh
+_TAKE_DIRTY_SQL = """
+CREATE TEMP TABLE tmp_rollup_dirty ON COMMIT DROP AS
+SELECT db_code, metric_code, region_code, year
+FROM cn_stats_metric_rollup_dirty
+WITH NO DATA;
+
+WITH taken AS (
+    DELETE FROM cn_stats_metric_rollup_dirty
+    WHERE (%s OR db_code = %s)
+    RETURNING db_code, metric_code, region_code, year
+)
+INSERT INTO tmp_rollup_dirty SELECT * FROM taken;
+"""
+
+# recompute the taken buckets from the live monthly data, a bucket without data is left empty
+_REFRESH_SQL_TEMPLATE = """
+DELETE FROM {table} t
+USING tmp_rollup_dirty k
+WHERE t.db_code = k.db_code
+    AND t.metric_code = k.metric_code
+    AND t.region_code = k.region_code
+    AND t.date_num BETWEEN {first} AND {last};
+
+INSERT INTO {table} (db_code, metric_code, region_code, date_num, metric_value, month_count, last_updated_time)
+SELECT
+    d.db_code,
+    d.metric_code,
+    d.region_code,
+    {period} AS period,
+    CASE r.aggregation
+        WHEN 'sum' THEN sum(d.metric_value)
+        WHEN 'avg' THEN avg(d.metric_value)
+        ELSE (array_agg(d.metric_value ORDER BY d.date_num DESC) FILTER (WHERE d.metric_value IS NOT NULL))[1]
+    END,
+    count(d.metric_value),
+    now()
+FROM tmp_rollup_dirty k
+    INNER JOIN cn_stats_metric_rollup_rules r ON r.db_code = k.db_code AND r.metric_code = k.metric_code
+    INNER JOIN cn_stats_metric_data d
+        ON d.db_code = k.db_code
+        AND d.metric_code = k.metric_code
+        AND d.region_code = k.region_code
+        AND d.date_num >= k.year * 100
+        AND d.date_num < (k.year + 1) * 100
+        AND d.is_deleted = FALSE
+GROUP BY d.db_code, d.metric_code, d.region_code, period, r.aggregation;
+"""
+
+_REFRESH_SQL = {
+    RollupLevel.QUARTERLY: _REFRESH_SQL_TEMPLATE.format(
+        table=_TABLES[RollupLevel.QUARTERLY],
+        first="k.year * 10 + 1",
+        last="k.year * 10 + 4",
+        period="d.date_num / 100 * 10 + (d.date_num % 100 - 1) / 3 + 1",
+    ),
+    RollupLevel.ANNUAL: _REFRESH_SQL_TEMPLATE.format(
+        table=_TABLES[RollupLevel.ANNUAL],
+        first="k.year",
+        last="k.year",
+        period="d.date_num / 100",
+    ),
+}
+
+_SERIES_SQL = {
+    level: f"""
+SELECT date_num, metric_value
+FROM {table}
+WHERE db_code = %s
+    AND metric_code = %s
+    AND region_code = %s
+    AND (%s OR date_num >= %s)
+    AND (%s OR date_num <= %s)
+ORDER BY date_num;
+"""
+    for level, table in _TABLES.items()
+}
+
+
+def _is_monthly(db_code: str) -> bool:
+    category = next((i for i in Category if i.db_code == db_code), None)
+    return category is not None and len(category.get_periods_from_years([2000])) == 12
+
+
+@metrics.instrument_dao
+class RollupDao:
+    """
+    The class for the roll-ups of the monthly metric data into quarters and years.
+    The months of the metrics having a rule are aggregated by the aggregation of the rule.
+    `MetricDataDao` records the changed (series, year) buckets when the data is saved or deleted,
+    and `refresh` recomputes only those buckets, so the roll-ups are read by the primary keys of the roll-up tables.
+    """
+
+    @classmethod
+    def add_or_update_rules(cls, lst: List[RollupRule]) -> int:
+        """
+        Insert or update the roll-up rules, the roll-ups of the new or changed rules are computed by the next `refresh`.
+        :param lst: The list of rules, the metrics must be of monthly categories
+        :return: The record count are saved
+        """
+
+        if not lst:
+            return 0
+        invalid = sorted({i.db_code for i in lst if not _is_monthly(i.db_code)})
+        if invalid:
+            raise ValueError(f"Only the metrics of monthly categories can be rolled up, but got {invalid}.")
+
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.executemany(_ADD_OR_UPDATE_RULE_SQL, [(i.db_code, i.metric_code, i.aggregation.value) for i in lst])
+                count = cursor.rowcount
+                cursor.execute(_MARK_RULE_DIRTY_SQL)
+                return count
+
+    @classmethod
+    def delete_rules(cls, lst: List[RollupRule]) -> int:
+        """
+        Delete the roll-up rules and the roll-ups of them
+        :param lst: The list of rules
+        :return: The record count are deleted
+        """
+
+        if not lst:
+            return 0
+
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.executemany(_DELETE_RULE_SQL, [(i.db_code, i.metric_code) for i in lst])
+                count = cursor.rowcount
+                cursor.executemany(_PURGE_RULE_SQL, [{"db_code": i.db_code, "metric_code": i.metric_code} for i in lst])
+                return count
+
+    @classmethod
+    def list_rules(cls, db_code: str | None = None) -> List[RollupRule]:
+        """
+        Get the roll-up rules
+        :param db_code: Specific the db code or None for all db codes
+        :return: Returns the rules ordered by db code and metric code
+        """
+
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(_LIST_RULES_SQL, (db_code is None, db_code))
+                return [RollupRule(i[0], i[1], Aggregation(i[2])) for i in cursor.fetchall()]
+
+    @classmethod
+    def refresh(cls, db_code: str | None = None) -> int:
+        """
+        Recompute the roll-ups of the buckets changed since the last refresh, in one transaction.
+        :param db_code: Specific the db code or None for all db codes
+        :return: Returns the count of the (series, year) buckets recomputed
+        """
+
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(_TAKE_DIRTY_SQL, (db_code is None, db_code))
+                count = cursor.rowcount
+                if count > 0:
+                    for sql in _REFRESH_SQL.values():
+                        cursor.execute(sql)
+                return count
+
+    @classmethod
+    def series(
+        cls,
+        level: RollupLevel,
+        db_code: str,
+        metric_code: str,
+        region_code: str | None = None,
+        start: int | None = None,
+        end: int | None = None,
+    ) -> List[tuple[int, float | None]]:
+        """
+        Get the rolled up series of the metric of the region in the period range
+        :param level: The roll-up level
+        :param db_code: Specific the db code
+        :param metric_code: Specific the metric code
+        :param region_code: Specific the region code or None for the data without region
+        :param start: The first date num of the range (inclusive) or None for no lower bound,
+            year * 10 + quarter for the quarterly level, or the year for the annual level
+        :param end: The last date num of the range (inclusive) or None for no upper bound
+        :return: Returns the (date_num, metric_value) points ordered by date_num
+        """
+
+        criteria = (
+            db_code,
+            metric_code,
+            "" if region_code is None else region_code,
+            start is None,
+            start,
+            end is None,
+            end,
+        )
+        with db.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(_SERIES_SQL[level], criteria)
+                return [(i[0], i[1]) for i in cursor.fetchall()]
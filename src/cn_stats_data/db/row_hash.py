@@ -0,0 +1,72 @@
+import hashlib
+import json
+from typing import Any, List, Optional
+
+from cn_stats_util.models import HistoricalData, Metric, Region
+
+__all__ = [
+    "metric_code_hash",
+    "region_code_hash",
+    "metric_data_hash",
+    "metric_code_row_hash",
+    "region_code_row_hash",
+    "metric_data_row_hash",
+]
+
+
+def _digest(values: List[Any]) -> str:
+    text = json.dumps(values, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+def metric_code_hash(i: Metric) -> str:
+    """
+    Get the hash of the columns of a metric code which are compared to detect changes.
+    It's computed on the client side and stored in the row_hash column,
+    so the downloaded code can be compared with the stored one with one value.
+    """
+    return metric_code_row_hash(
+        i.name, i.explanation, i.memo, i.unit, i.parent.code if i.parent else None, i.extra_attributes
+    )
+
+
+def region_code_hash(i: Region) -> str:
+    """Get the hash of the columns of a region code which are compared to detect changes."""
+    return region_code_row_hash(
+        i.name, i.explanation, None if i.children is None else [c.code for c in i.children], i.extra_attributes
+    )
+
+
+def metric_data_hash(i: HistoricalData) -> str:
+    """Get the hash of the columns of a metric data which are compared to detect changes."""
+    return metric_data_row_hash(i.data, i.extra_attributes)
+
+
+def metric_code_row_hash(
+    name: Optional[str],
+    explanation: Optional[str],
+    memo: Optional[str],
+    unit: Optional[str],
+    parent_metric_code: Optional[str],
+    extra_attributes: Optional[dict],
+) -> str:
+    """Get the hash of a metric code from its stored columns, it's the same as `metric_code_hash` of the code."""
+    return _digest([name, explanation, memo, unit, parent_metric_code, extra_attributes])
+
+
+def region_code_row_hash(
+    name: Optional[str],
+    explanation: Optional[str],
+    children_region_codes: Optional[List[str]],
+    extra_attributes: Optional[dict],
+) -> str:
+    """Get the hash of a region code from its stored columns, it's the same as `region_code_hash` of the code."""
+    return _digest([name, explanation, children_region_codes, extra_attributes])
+
+
+def metric_data_row_hash(metric_value: Optional[float], extra_attributes: Optional[dict]) -> str:
+    """
+    Get the hash of a metric data from its stored columns, it's the same as `metric_data_hash` of the data.
+    The value is hashed as a float, so a downloaded 12 and the 12.0 read back from the database give the same hash.
+    """
+    return _digest([None if metric_value is None else float(metric_value), extra_attributes])
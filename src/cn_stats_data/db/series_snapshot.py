@@ -0,0 +1,218 @@
+from array import array
+import json
+import logging
+import mmap
+import os
+import pathlib
+import struct
+import sys
+import tempfile
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+from cn_stats_data import db
+from cn_stats_data.db.dao import MetricDataDao
+
+__all__ = ["SeriesSnapshot"]
+
+_MAGIC = b"CNSERIES"
+_VERSION = 1
+# magic, version, reserved, series count, point count,
+# offsets of the values, the periods, the series offsets and the keys, length of the keys
+_HEADER = struct.Struct("<8sIIQQQQQQQ")
+_SUFFIX = ".snapshot"
+_CHUNK = 65536
+
+
+def _align(pos: int) -> int:
+    return (pos + 7) // 8 * 8
+
+
+class SeriesSnapshot:
+    """
+    Read-only snapshot of the metric data of a db code, kept in a binary file which is memory-mapped when it's opened.
+    The file has the values (float64, NaN for no data) and the periods (int32) of all the series,
+    sorted by metric_code, region_code and date_num, and the offset of every series keyed by (metric_code, region_code).
+    The series are returned as zero-copy NumPy views of the mapped pages, so the processes opening the same file
+    share one copy in the page cache instead of each one querying database.
+    A snapshot is rebuilt by `build` into a new file which replaces the old one,
+    the processes having the old one opened keep reading it until they open the snapshot again.
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        """
+        :param path: The path of the snapshot file
+        """
+        self.path = pathlib.Path(path)
+        with self.path.open("rb") as fp:
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, _, series_count, point_count, values_offset, periods_offset, offsets_offset, keys_offset,
+         keys_length) = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self._mmap.close()
+            raise ValueError(f"{self.path} is not a series snapshot of version {_VERSION}.")
+
+        self.values: np.ndarray = np.frombuffer(self._mmap, dtype="<f8", count=point_count, offset=values_offset)
+        self.periods: np.ndarray = np.frombuffer(self._mmap, dtype="<i4", count=point_count, offset=periods_offset)
+        self._offsets: np.ndarray = np.frombuffer(
+            self._mmap, dtype="<i8", count=series_count + 1, offset=offsets_offset)
+        keys = json.loads(self._mmap[keys_offset:keys_offset + keys_length].decode("utf-8"))
+        self._index = {(i[0], i[1]): n for n, i in enumerate(keys)}
+
+    @classmethod
+    def get_path(cls, db_code: str, directory: Optional[str | os.PathLike] = None) -> pathlib.Path:
+        """
+        Get the path of the snapshot file of the db code
+        :param db_code: The db code of the snapshot
+        :param directory: The directory of the snapshot files, the directory of the snapshot config if not giving
+        """
+        return pathlib.Path(directory or db.snapshot_config.directory) / f"{db_code}{_SUFFIX}"
+
+    @classmethod
+    def open(cls, db_code: str, directory: Optional[str | os.PathLike] = None) -> "SeriesSnapshot":
+        """
+        Open the snapshot of the db code
+        :param db_code: The db code of the snapshot
+        :param directory: The directory of the snapshot files, the directory of the snapshot config if not giving
+        """
+        return cls(cls.get_path(db_code, directory))
+
+    @classmethod
+    def build(cls, db_code: str, directory: Optional[str | os.PathLike] = None) -> pathlib.Path:
+        """
+        Materialize the metric data of the db code into its snapshot file.
+        The points are streamed from database and written to a temporary file,
+        which replaces the snapshot file atomically when it's completed.
+        :param db_code: The db code of the snapshot
+        :param directory: The directory of the snapshot files, the directory of the snapshot config if not giving
+        :return: Returns the path of the snapshot file
+        """
+        path = cls.get_path(db_code, directory)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            return _write(path, MetricDataDao.iter_points(db_code))
+        finally:
+            path.with_name(path.name + ".tmp").unlink(missing_ok=True)
+
+    def series(
+        self,
+        metric_code: str,
+        region_code: str | None = None,
+        start: int | None = None,
+        end: int | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Get the series of the metric of the region in the period range, same as `MetricDataDao.series`.
+        The arrays are views of the mapped file, they must not be used after the snapshot is closed.
+        :param metric_code: Specific the metric code
+        :param region_code: Specific the region code or None for the data without region
+        :param start: The first date num of the range (inclusive) or None for no lower bound
+        :param end: The last date num of the range (inclusive) or None for no upper bound
+        :return: Returns the periods and the values of the series ordered by the periods,
+            both are empty if the series doesn't exist
+        """
+        n = self._index.get((metric_code, region_code))
+        if n is None:
+            return self.periods[:0], self.values[:0]
+        begin, stop = int(self._offsets[n]), int(self._offsets[n + 1])
+        periods = self.periods[begin:stop]
+        lo = 0 if start is None else int(np.searchsorted(periods, start, side="left"))
+        hi = len(periods) if end is None else int(np.searchsorted(periods, end, side="right"))
+        return periods[lo:hi], self.values[begin + lo:begin + hi]
+
+    def keys(self) -> List[tuple[str, str | None]]:
+        """Get the (metric_code, region_code) of all the series."""
+        return list(self._index.keys())
+
+    def __contains__(self, key: tuple[str, str | None]) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def close(self) -> None:
+        """
+        Release the mapping of the file. If any view returned by `series` is still referenced,
+        the pages are unmapped when the last one is garbage collected.
+        """
+        self.values = self.periods = self._offsets = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+    def __enter__(self) -> "SeriesSnapshot":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+def _tofile(data: array, fp) -> None:
+    # the file is little-endian whatever the platform is
+    if sys.byteorder == "big":
+        data = array(data.typecode, data)
+        data.byteswap()
+    data.tofile(fp)
+
+
+def _write(path: pathlib.Path, points: Iterator[tuple[str, str | None, int, float | None]]) -> pathlib.Path:
+    """
+    Write the points ordered by series into the snapshot file.
+    The values are written right after the header while the periods are buffered in a temporary file,
+    so only the keys and the offsets of the series are kept in memory.
+    """
+    keys: List[tuple[str, str | None]] = []
+    offsets = array("q")
+    point_count = 0
+    values = array("d")
+    periods = array("i")
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("wb") as fp, tempfile.TemporaryFile(dir=path.parent) as periods_fp:
+        fp.write(b"\0" * _HEADER.size)
+        for metric_code, region_code, date_num, metric_value in points:
+            if not keys or keys[-1] != (metric_code, region_code):
+                keys.append((metric_code, region_code))
+                offsets.append(point_count)
+            values.append(float("nan") if metric_value is None else metric_value)
+            periods.append(date_num)
+            point_count += 1
+            if len(values) >= _CHUNK:
+                _tofile(values, fp)
+                _tofile(periods, periods_fp)
+                values, periods = array("d"), array("i")
+        _tofile(values, fp)
+        _tofile(periods, periods_fp)
+        offsets.append(point_count)
+
+        values_offset = _HEADER.size
+        periods_offset = values_offset + point_count * 8
+        periods_fp.seek(0)
+        while chunk := periods_fp.read(_CHUNK * 4):
+            fp.write(chunk)
+        offsets_offset = _align(periods_offset + point_count * 4)
+        fp.write(b"\0" * (offsets_offset - periods_offset - point_count * 4))
+        _tofile(offsets, fp)
+        keys_offset = offsets_offset + len(offsets) * 8
+        keys_data = json.dumps(keys, ensure_ascii=False).encode("utf-8")
+        fp.write(keys_data)
+
+        fp.seek(0)
+        fp.write(_HEADER.pack(
+            _MAGIC, _VERSION, 0, len(keys), point_count, values_offset, periods_offset, offsets_offset, keys_offset,
+            len(keys_data)))
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
+    logging.getLogger(__name__).info(f"Saved {point_count} points of {len(keys)} series into {path}.")
+    return path
+
+
+if __name__ == "__main__":
+    from cn_stats_util.models import Category
+    from cn_stats_data.log import init_log_config
+
+    init_log_config()
+    for code in sys.argv[1:] or [i.db_code for i in Category]:
+        SeriesSnapshot.build(code)
@@ -0,0 +1,284 @@
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+from typing import Any, Iterator, List, Optional
+
+from cn_stats_util.models import HistoricalData
+
+from cn_stats_data import db, metrics
+from cn_stats_data.db.dao import MetricDataDao
+from cn_stats_data.db.models import MetricHistoricalData
+
+__all__ = ["MetricDataSpool"]
+
+_SEALED_SUFFIX = ".jsonl"
+_OPEN_SUFFIX = ".jsonl.part"
+
+
+class MetricDataSpool:
+    """
+    Local append-only spool of the downloaded metric data, kept as segmented JSONL files.
+    The downloader appends the data of every metric code to the current segment and continues crawling,
+    while a loader thread drains the sealed segments into database with `MetricDataDao.sync` in large batches.
+    A segment is only removed after all of its entries are saved. As `sync` is idempotent,
+    the segments left by a crash are replayed safely the next time the spool is drained.
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike,
+        segment_max_records: int = 100000,
+        batch_max_records: int = 50000,
+        retry_interval: float = 5.0,
+        segment_max_seconds: float = 60.0,
+    ):
+        """
+        :param directory: The directory of the segment files, it's created if not exists
+        :param segment_max_records: The record count to seal the current segment
+        :param segment_max_seconds: The age to seal the current segment, so a slow crawl is still loaded regularly
+        :param batch_max_records: The max record count saved to database by one `sync` call
+        :param retry_interval: The seconds to wait before retrying when database is unavailable
+        """
+        self.directory = pathlib.Path(directory)
+        self.segment_max_records = segment_max_records
+        self.batch_max_records = batch_max_records
+        self.retry_interval = retry_interval
+        self.segment_max_seconds = segment_max_seconds
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._abort = threading.Event()
+        self._wakeup = threading.Event()
+        self._loader: Optional[threading.Thread] = None
+        self._file = None
+        self._file_path: Optional[pathlib.Path] = None
+        self._file_records = 0
+        self._file_opened = 0.0
+        # the segment being written by a crashed process is complete up to its last full line
+        for p in self.directory.glob(f"*{_OPEN_SUFFIX}"):
+            p.rename(p.with_name(p.name[: -len(_OPEN_SUFFIX)] + _SEALED_SUFFIX))
+        self._next_seq = max((self._seq_of(p) for p in self._sealed_segments()), default=0) + 1
+
+    @classmethod
+    def from_config(cls) -> "MetricDataSpool":
+        """Create the spool with the [spool] section of the db config."""
+        return cls(
+            directory=db.spool_config.directory,
+            segment_max_records=db.spool_config.segment_max_records,
+            batch_max_records=db.spool_config.batch_max_records,
+            retry_interval=db.spool_config.retry_interval,
+            segment_max_seconds=db.spool_config.segment_max_seconds,
+        )
+
+    @staticmethod
+    def _seq_of(path: pathlib.Path) -> int:
+        return int(path.name.split(".")[0])
+
+    def _sealed_segments(self) -> List[pathlib.Path]:
+        return sorted(self.directory.glob(f"*{_SEALED_SUFFIX}"), key=self._seq_of)
+
+    @property
+    def pending_segments(self) -> int:
+        """The count of the sealed segments not saved to database yet."""
+        return len(self._sealed_segments())
+
+    def append(self, db_code: str, metric_codes: List[str], date_nums: List[int], lst: List[HistoricalData]) -> None:
+        """
+        Append the downloaded data to the spool, the arguments are the same as `MetricDataDao.sync`.
+        :param db_code: The db code of the data
+        :param metric_codes: The metric codes the data is downloaded for
+        :param date_nums: The periods the data is downloaded for
+        :param lst: The downloaded data
+        """
+        line = json.dumps(
+            {
+                "db_code": db_code,
+                "metric_codes": list(metric_codes),
+                "date_nums": list(date_nums),
+                "data": [
+                    {
+                        "metric_code": i.metric_code,
+                        "db_code": i.db_code,
+                        "region_code": i.region_code,
+                        "period": i.period,
+                        "data": i.data,
+                        "has_data": i.has_data,
+                        "extra_attributes": i.extra_attributes,
+                    }
+                    for i in lst
+                ],
+            },
+            ensure_ascii=False,
+        )
+        with self._lock:
+            opened = self._file is None
+            if opened:
+                self._file_path = self.directory / f"{self._next_seq:010d}{_OPEN_SUFFIX}"
+                self._next_seq += 1
+                self._file = self._file_path.open(mode="a", encoding="utf-8")
+                self._file_records = 0
+                self._file_opened = time.monotonic()
+            self._file.write(line + "\n")
+            self._file.flush()
+            self._file_records += max(len(lst), 1)
+            sealed = self._file_records >= self.segment_max_records
+            if sealed:
+                self._seal()
+        if opened or sealed:  # the loader waits for the age of the new segment, or loads the sealed one
+            self._wakeup.set()
+
+    def _seal(self) -> None:
+        """Close the current segment and make it visible to the loader, must be called with the lock."""
+        if self._file is None:
+            return
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file_path.rename(self._file_path.with_name(self._file_path.name[: -len(_OPEN_SUFFIX)] + _SEALED_SUFFIX))
+        self._file = None
+        self._file_path = None
+        self._file_records = 0
+        metrics.queue_depth.set(self.pending_segments, queue="spool_segments")
+
+    def flush(self) -> None:
+        """Seal the current segment, so it's drained without waiting for more data."""
+        with self._lock:
+            self._seal()
+
+    def _seal_if_expired(self) -> float:
+        """
+        Seal the current segment if it's older than segment_max_seconds
+        :return: Returns the seconds until the current segment expires, or segment_max_seconds if there's none
+        """
+        with self._lock:
+            if self._file is None:
+                return self.segment_max_seconds
+            remaining = self._file_opened + self.segment_max_seconds - time.monotonic()
+            if remaining <= 0:
+                self._seal()
+                return self.segment_max_seconds
+            return remaining
+
+    @staticmethod
+    def _read_segment(path: pathlib.Path) -> Iterator[dict[str, Any]]:
+        with path.open(mode="r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:  # the last line written when the process crashed
+                    logging.getLogger(__name__).warning(f"Skipped a broken line of the spool segment {path.name}.")
+
+    def _batches(self, path: pathlib.Path) -> Iterator[dict[str, Any]]:
+        """
+        Merge the consecutive entries of the same db code and periods into one batch.
+        An entry of a metric code already in the batch starts a new batch,
+        so the data of the later download replaces the earlier one, same as being saved one by one.
+        """
+        batch = None
+        for entry in self._read_segment(path):
+            if (
+                batch is not None
+                and batch["db_code"] == entry["db_code"]
+                and batch["date_nums"] == entry["date_nums"]
+                and batch["metric_codes"].isdisjoint(entry["metric_codes"])
+                and len(batch["data"]) + len(entry["data"]) <= self.batch_max_records
+            ):
+                batch["metric_codes"].update(entry["metric_codes"])
+                batch["data"].extend(entry["data"])
+                continue
+            if batch is not None:
+                yield batch
+            batch = {**entry, "metric_codes": set(entry["metric_codes"])}
+        if batch is not None:
+            yield batch
+
+    def _save_segment(self, path: pathlib.Path) -> int:
+        logger = logging.getLogger(__name__)
+        count = 0
+        for batch in self._batches(path):
+            if self._abort.is_set():  # given up by close, the segment is kept and replayed as a whole next time
+                return count
+            counts = MetricDataDao.sync(
+                db_code=batch["db_code"],
+                metric_codes=sorted(batch["metric_codes"]),
+                date_nums=batch["date_nums"],
+                lst=[MetricHistoricalData(**{k: v for k, v in i.items() if k != "extra_attributes"},
+                                          **(i["extra_attributes"] or {}))
+                     for i in batch["data"]],
+            )
+            count += len(batch["data"])
+            metrics.record_sync(batch["db_code"], counts)
+            logger.info(
+                f'Loaded {len(batch["metric_codes"])} metric codes of {batch["db_code"]} from the spool, '
+                f'inserted {counts["inserted"]}, updated {counts["updated"]}, and deleted {counts["deleted"]}.')
+        path.unlink()
+        metrics.queue_depth.set(self.pending_segments, queue="spool_segments")
+        return count
+
+    def drain(self) -> int:
+        """
+        Save the sealed segments to database in the order they are written.
+        It stops at the first segment failed to be saved, the segment is kept and retried next time.
+        :return: Returns the count of the records saved
+        """
+        count = 0
+        for path in self._sealed_segments():
+            if self._abort.is_set():
+                break
+            count += self._save_segment(path)
+        return count
+
+    def _run(self) -> None:
+        logger = logging.getLogger(__name__)
+        while not self._abort.is_set():
+            try:
+                # the current segment is only sealed when it's full, expired or closed, so the batches stay large
+                wait = self._seal_if_expired()
+                if not self._sealed_segments():
+                    if self._stopping.is_set():
+                        return
+                    self._wakeup.wait(wait)
+                    self._wakeup.clear()
+                    continue
+                self.drain()
+            except Exception as e:
+                logger.warning(f"Failed to load the spool into database, retry in {self.retry_interval}s: {e}")
+                self._abort.wait(self.retry_interval)
+
+    def start(self) -> None:
+        """Start the loader thread draining the spool in the background."""
+        self._stopping.clear()
+        self._abort.clear()
+        if self._loader is not None and self._loader.is_alive():  # incl. the one given up by close, it carries on
+            return
+        self._loader = threading.Thread(target=self._run, name="metric-data-spool-loader", daemon=True)
+        self._loader.start()
+
+    def close(self, timeout: Optional[float] = None) -> bool:
+        """
+        Seal the current segment and stop the loader thread after the spool is drained.
+        :param timeout: The max seconds to wait for the spool being drained, or None to wait until it's done
+        :return: Returns True if all the data is saved to database, the rest is replayed by the next drain otherwise
+        """
+        self.flush()
+        if self._loader is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            self._loader.join(timeout)
+            if self._loader.is_alive():
+                # database is slow or unavailable, give up and keep the segments. The loader stops before the next
+                # batch, it's a daemon thread, so a call hanging in database doesn't block the process from exiting
+                self._abort.set()
+            else:
+                self._loader = None
+        return self.pending_segments == 0
+
+
+if __name__ == "__main__":
+    from cn_stats_data.log import init_log_config
+
+    init_log_config()
+    MetricDataSpool.from_config().drain()
@@ -0,0 +1,62 @@
+import contextlib
+from datetime import datetime
+import json
+import pathlib
+import sqlite3
+import threading
+from typing import Any, Iterator, List, Optional
+
+from cn_stats_data import db
+
+__all__ = ['get_conn', 'init_schema', 'now', 'to_time', 'to_json', 'from_json',
+           'metric_code_dao', 'region_code_dao', 'metric_data_dao', 'process_data_dao']
+
+_SCHEMA_PATH = pathlib.Path(__file__).parent / "schema.sql"
+_initialized: set[str] = set()
+_lock = threading.Lock()
+
+
+def init_schema(conn: sqlite3.Connection) -> None:
+    """Create the tables and indexes which don't exist yet."""
+    conn.executescript(_SCHEMA_PATH.read_text(encoding="utf-8"))
+
+
+@contextlib.contextmanager
+def get_conn(path: Optional[str] = None) -> Iterator[sqlite3.Connection]:
+    """
+    Open the SQLite database, the schema is created the first time the file is opened by the process.
+    Same as the Postgres connection, the changes are committed when leaving the context without error.
+    :param path: The path of the database file, the sqlite_path of the db config if not giving
+    """
+    path = path or db.db_config.sqlite_path
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        with _lock:
+            if path not in _initialized:
+                init_schema(conn)
+                _initialized.add(path)
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def now() -> str:
+    """The timestamp of a transaction, the same value is used by all the statements like now() of Postgres."""
+    return datetime.now().isoformat(sep=" ", timespec="microseconds")
+
+
+def to_time(value: Optional[str]) -> Optional[datetime]:
+    return None if value is None else datetime.fromisoformat(value)
+
+
+def to_json(value: Optional[List[Any]]) -> str:
+    """Serialize a list parameter, so it can be used as `IN (SELECT value FROM json_each(?))` like `= ANY(%s)`."""
+    return json.dumps([] if value is None else value, ensure_ascii=False)
+
+
+def from_json(value: Optional[str], default: Any = None) -> Any:
+    return default if value is None else json.loads(value)
@@ -0,0 +1,225 @@
+import json
+from typing import List
+
+from cn_stats_util.models import Category
+
+from cn_stats_data import metrics
+from cn_stats_data.db import sqlite
+from cn_stats_data.db.metric_code_dao import MetricCodeDao, _build_index, _metric_code_from_row, _set_children
+from cn_stats_data.db.models import MetricCode
+from cn_stats_data.db.row_hash import metric_code_hash
+
+__all__ = ["SqliteMetricCodeDao"]
+
+_COLUMNS = """
+    m.metric_code,
+    m.db_code,
+    m.name,
+    m.explanation,
+    m.memo,
+    m.unit,
+    m.parent_metric_code,
+    m.extra_attributes,
+    m.is_deleted,
+    m.created_time,
+    m.last_updated_time,
+    m.row_hash"""
+
+
+def _from_row(i: tuple, is_parent: bool = False) -> MetricCode:
+    return _metric_code_from_row(
+        (*i[:7], sqlite.from_json(i[7], {}), bool(i[8]), sqlite.to_time(i[9]), sqlite.to_time(i[10]), i[11]),
+        is_parent=is_parent,
+    )
+
+
+@metrics.instrument_dao
+class SqliteMetricCodeDao(MetricCodeDao):
+    """
+    The `MetricCodeDao` of the embedded SQLite database.
+    The hierarchy is walked with recursive queries over parent_metric_code instead of the closure table,
+    a code is reachable from its ancestor only when every node on the path is not deleted, same as the closure table.
+    """
+
+    @classmethod
+    def add_or_update(cls, lst: List[MetricCode]) -> int:
+        if not lst:
+            return 0
+        ts = sqlite.now()
+        data = [
+            (
+                i.code,
+                i.db_code,
+                i.name,
+                i.explanation,
+                i.memo,
+                i.unit,
+                i.parent.code if i.parent else None,
+                json.dumps(i.extra_attributes),
+                metric_code_hash(i),
+                ts,
+                ts,
+            )
+            for i in lst
+            if not hasattr(i, "is_deleted") or not i.is_deleted
+        ]
+        if len(data) == 0:
+            return 0
+
+        sql = """
+INSERT INTO cn_stats_metric_codes (
+    metric_code,
+    db_code,
+    name,
+    explanation,
+    memo,
+    unit,
+    parent_metric_code,
+    extra_attributes,
+    row_hash,
+    is_deleted,
+    created_time,
+    last_updated_time)
+VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?)
+ON CONFLICT(db_code, metric_code)
+DO UPDATE SET
+    name = excluded.name,
+    explanation = excluded.explanation,
+    memo = excluded.memo,
+    unit = excluded.unit,
+    parent_metric_code = excluded.parent_metric_code,
+    extra_attributes = excluded.extra_attributes,
+    row_hash = excluded.row_hash,
+    is_deleted = 0,
+    last_updated_time = excluded.last_updated_time
+WHERE cn_stats_metric_codes.row_hash IS NOT excluded.row_hash
+    OR cn_stats_metric_codes.is_deleted = 1;
+        """
+        with sqlite.get_conn() as conn:
+            return conn.executemany(sql, data).rowcount
+
+    @classmethod
+    def delete(cls, lst: List[MetricCode]) -> int:
+        if not lst:
+            return 0
+        ts = sqlite.now()
+        data = [(ts, i.db_code, i.code) for i in lst if not hasattr(i, "is_deleted") or i.is_deleted]
+        if len(data) == 0:
+            return 0
+
+        sql = """
+UPDATE cn_stats_metric_codes SET
+    is_deleted = 1,
+    last_updated_time = ?
+WHERE db_code = ?
+    AND metric_code = ?
+    AND is_deleted = 0;
+        """
+        with sqlite.get_conn() as conn:
+            return conn.executemany(sql, data).rowcount
+
+    @classmethod
+    def get(cls, metric_code: str, db_code: Category) -> MetricCode | None:
+        sql = f"""
+SELECT {_COLUMNS},
+    EXISTS (SELECT 1 FROM cn_stats_metric_codes c
+            WHERE c.is_deleted = 0 AND c.db_code = m.db_code AND c.parent_metric_code = m.metric_code) AS is_parent
+FROM cn_stats_metric_codes m
+WHERE m.is_deleted = 0 AND m.db_code = ? AND m.metric_code = ?;
+        """
+        with sqlite.get_conn() as conn:
+            row = conn.execute(sql, (db_code.db_code, metric_code)).fetchone()
+            return None if row is None else _from_row(row[:12], is_parent=bool(row[12]))
+
+    @classmethod
+    def list(cls, db_code: Category | None = None, metric_code: str | None = None) -> List[MetricCode]:
+        dbcode = None if db_code is None else db_code.db_code
+        if metric_code is None:
+            sql = f"""
+SELECT {_COLUMNS}
+FROM cn_stats_metric_codes m
+WHERE m.is_deleted = 0 AND (? OR m.db_code = ?);
+            """
+            criteria = (dbcode is None, dbcode)
+        else:
+            sql = f"""
+WITH RECURSIVE cte_metrics (db_code, metric_code) AS (
+    SELECT db_code, metric_code
+    FROM cn_stats_metric_codes
+    WHERE is_deleted = 0 AND (? OR db_code = ?) AND metric_code = ?
+    UNION
+    SELECT c.db_code, c.metric_code
+    FROM cn_stats_metric_codes c
+        INNER JOIN cte_metrics p ON c.db_code = p.db_code AND c.parent_metric_code = p.metric_code
+    WHERE c.is_deleted = 0
+)
+SELECT {_COLUMNS}
+FROM cte_metrics r
+    INNER JOIN cn_stats_metric_codes m ON m.db_code = r.db_code AND m.metric_code = r.metric_code;
+            """
+            criteria = (dbcode is None, dbcode, metric_code)
+
+        with sqlite.get_conn() as conn:
+            data = [_from_row(i) for i in conn.execute(sql, criteria).fetchall()]
+            _set_children(_build_index(data))
+            return data
+
+    @classmethod
+    def list_leaves(cls, db_code: Category, metric_codes: List[str] | None = None) -> List[MetricCode]:
+        sql = f"""
+WITH RECURSIVE cte_metrics (db_code, metric_code) AS (
+    SELECT db_code, metric_code
+    FROM cn_stats_metric_codes
+    WHERE is_deleted = 0 AND db_code = ? AND (
+        -- all the leaves are walked from the top codes, so the ones under a deleted ancestor aren't reached
+        (? AND NOT EXISTS (
+            SELECT 1 FROM cn_stats_metric_codes p
+            WHERE p.db_code = cn_stats_metric_codes.db_code AND p.metric_code = cn_stats_metric_codes.parent_metric_code))
+        OR metric_code IN (SELECT value FROM json_each(?)))
+    UNION
+    SELECT c.db_code, c.metric_code
+    FROM cn_stats_metric_codes c
+        INNER JOIN cte_metrics p ON c.db_code = p.db_code AND c.parent_metric_code = p.metric_code
+    WHERE c.is_deleted = 0
+)
+SELECT {_COLUMNS}
+FROM cte_metrics r
+    INNER JOIN cn_stats_metric_codes m ON m.db_code = r.db_code AND m.metric_code = r.metric_code
+WHERE NOT EXISTS (
+    SELECT 1 FROM cn_stats_metric_codes c
+    WHERE c.is_deleted = 0 AND c.db_code = m.db_code AND c.parent_metric_code = m.metric_code);
+        """
+        with sqlite.get_conn() as conn:
+            rows = conn.execute(sql, (db_code.db_code, metric_codes is None, sqlite.to_json(metric_codes))).fetchall()
+            return [_from_row(i) for i in rows]
+
+    @classmethod
+    def list_ancestors(cls, metric_code: str, db_code: Category) -> List[MetricCode]:
+        sql = f"""
+WITH RECURSIVE cte_metrics (db_code, metric_code, parent_metric_code, depth) AS (
+    SELECT db_code, metric_code, parent_metric_code, 0
+    FROM cn_stats_metric_codes
+    WHERE is_deleted = 0 AND db_code = ? AND metric_code = ?
+    UNION ALL
+    SELECT p.db_code, p.metric_code, p.parent_metric_code, c.depth + 1
+    FROM cn_stats_metric_codes p
+        INNER JOIN cte_metrics c ON p.db_code = c.db_code AND p.metric_code = c.parent_metric_code
+    WHERE p.is_deleted = 0
+)
+SELECT {_COLUMNS}
+FROM cte_metrics r
+    INNER JOIN cn_stats_metric_codes m ON m.db_code = r.db_code AND m.metric_code = r.metric_code
+WHERE r.depth > 0
+ORDER BY r.depth DESC;
+        """
+        with sqlite.get_conn() as conn:
+            rows = conn.execute(sql, (db_code.db_code, metric_code)).fetchall()
+            return [_from_row(i, is_parent=True) for i in rows]
+
+    @classmethod
+    def get_watermark(cls, db_code: Category) -> tuple:
+        sql = """
+SELECT count(*), max(last_updated_time) FROM cn_stats_metric_codes WHERE db_code = ?;
+        """
+        with sqlite.get_conn() as conn:
+            return tuple(conn.execute(sql, (db_code.db_code,)).fetchone())
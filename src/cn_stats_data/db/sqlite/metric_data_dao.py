@@ -0,0 +1,383 @@
+import json
+from typing import Iterator, List
+
+from cn_stats_util.models import HistoricalData
+
+from cn_stats_data import metrics
+from cn_stats_data.db import sqlite
+from cn_stats_data.db.metric_data_dao import (
+    MetricDataDao,
+    _metric_data_from_row,
+    _panel_criteria,
+    _series_criteria,
+    _series_key,
+    _sync_params,
+)
+from cn_stats_data.db.models import MetricHistoricalData
+from cn_stats_data.db.row_hash import metric_data_hash
+
+__all__ = ["SqliteMetricDataDao"]
+
+
+def _from_row(i: tuple) -> MetricHistoricalData:
+    return _metric_data_from_row(
+        (*i[:5], sqlite.from_json(i[5], {}), bool(i[6]), sqlite.to_time(i[7]), sqlite.to_time(i[8]), i[9])
+    )
+
+
+@metrics.instrument_dao
+class SqliteMetricDataDao(MetricDataDao):
+    """
+    The `MetricDataDao` of the embedded SQLite database.
+    """
+
+    @classmethod
+    def add_or_update(cls, lst: List[MetricHistoricalData]) -> int:
+        if not lst:
+            return 0
+        ts = sqlite.now()
+        data = [
+            (
+                i.metric_code,
+                i.db_code,
+                i.period,
+                "" if i.region_code is None else i.region_code,
+                i.data,
+                json.dumps(i.extra_attributes),
+                metric_data_hash(i),
+                ts,
+                ts,
+            )
+            for i in lst
+            if not hasattr(i, "is_deleted") or not i.is_deleted
+        ]
+        if len(data) == 0:
+            return 0
+
+        sql = """
+INSERT INTO cn_stats_metric_data (
+    metric_code,
+    db_code,
+    date_num,
+    region_code,
+    metric_value,
+    extra_attributes,
+    row_hash,
+    is_deleted,
+    created_time,
+    last_updated_time)
+VALUES(?, ?, ?, ?, ?, ?, ?, 0, ?, ?)
+ON CONFLICT(metric_code, db_code, date_num, region_code)
+DO UPDATE SET
+    metric_value = excluded.metric_value,
+    extra_attributes = excluded.extra_attributes,
+    row_hash = excluded.row_hash,
+    is_deleted = 0,
+    last_updated_time = excluded.last_updated_time
+WHERE cn_stats_metric_data.row_hash IS NOT excluded.row_hash
+    OR cn_stats_metric_data.is_deleted = 1;
+        """
+        with sqlite.get_conn() as conn:
+            return conn.executemany(sql, data).rowcount
+
+    @classmethod
+    def delete(cls, lst: List[MetricHistoricalData]) -> int:
+        if lst is None or len(lst) == 0:
+            return 0
+        ts = sqlite.now()
+        data = [
+            (
+                ts,
+                i.metric_code,
+                i.db_code,
+                i.period,
+                "" if i.region_code is None else i.region_code,
+            )
+            for i in lst
+            if not hasattr(i, "is_deleted") or i.is_deleted
+        ]
+        if len(data) == 0:
+            return 0
+
+        sql = """
+UPDATE cn_stats_metric_data SET
+    is_deleted = 1,
+    last_updated_time = ?
+WHERE metric_code = ?
+    AND db_code = ?
+    AND date_num = ?
+    AND region_code = ?
+    AND is_deleted = 0;
+        """
+        with sqlite.get_conn() as conn:
+            return conn.executemany(sql, data).rowcount
+
+    @classmethod
+    def list(
+        cls,
+        db_codes: List[str] | None = None,
+        metric_codes: List[str] | None = None,
+        region_codes: List[str | None] | None = None,
+        date_nums: List[int] | None = None,
+    ) -> List[MetricHistoricalData]:
+        sql = """
+SELECT
+    metric_code,
+    db_code,
+    date_num,
+    region_code,
+    metric_value,
+    extra_attributes,
+    is_deleted,
+    created_time,
+    last_updated_time,
+    row_hash
+FROM cn_stats_metric_data
+WHERE is_deleted = 0
+    AND (? OR metric_code IN (SELECT value FROM json_each(?)))
+    AND (? OR db_code IN (SELECT value FROM json_each(?)))
+    AND (? OR date_num IN (SELECT value FROM json_each(?)))
+    AND (? OR region_code IN (SELECT value FROM json_each(?)));
+        """
+        criteria = (
+            metric_codes is None,
+            sqlite.to_json(metric_codes),
+            db_codes is None,
+            sqlite.to_json(db_codes),
+            date_nums is None,
+            sqlite.to_json(date_nums),
+            region_codes is None,
+            sqlite.to_json(None if region_codes is None else ["" if i is None else i for i in region_codes]),
+        )
+        with sqlite.get_conn() as conn:
+            return [_from_row(i) for i in conn.execute(sql, criteria).fetchall()]
+
+    @classmethod
+    def sync(
+        cls,
+        db_code: str,
+        metric_codes: List[str],
+        date_nums: List[int],
+        lst: List[HistoricalData],
+    ) -> dict[str, int]:
+        """
+        Same as `MetricDataDao.sync`, the data is loaded into a temporary table,
+        and the rows are inserted, updated and soft-deleted by three statements in one transaction.
+        """
+        ts = sqlite.now()
+        data = _sync_params(lst)
+
+        create_sql = """
+CREATE TEMP TABLE IF NOT EXISTS tmp_metric_data (
+    metric_code TEXT NOT NULL,
+    db_code TEXT NOT NULL,
+    date_num INTEGER NOT NULL,
+    region_code TEXT NOT NULL,
+    metric_value REAL,
+    extra_attributes TEXT,
+    row_hash TEXT);
+        """
+
+        insert_sql = """
+INSERT INTO tmp_metric_data (
+    metric_code,
+    db_code,
+    date_num,
+    region_code,
+    metric_value,
+    extra_attributes,
+    row_hash)
+VALUES (?, ?, ?, ?, ?, ?, ?);
+        """
+
+        inserted_sql = """
+SELECT count(*)
+FROM tmp_metric_data d
+WHERE NOT EXISTS (
+    SELECT 1 FROM cn_stats_metric_data t
+    WHERE t.metric_code = d.metric_code
+        AND t.db_code = d.db_code
+        AND t.date_num = d.date_num
+        AND t.region_code = d.region_code);
+        """
+
+        upsert_sql = """
+INSERT INTO cn_stats_metric_data (
+    metric_code,
+    db_code,
+    date_num,
+    region_code,
+    metric_value,
+    extra_attributes,
+    row_hash,
+    is_deleted,
+    created_time,
+    last_updated_time)
+SELECT metric_code, db_code, date_num, region_code, metric_value, extra_attributes, row_hash, 0, :ts, :ts
+FROM tmp_metric_data
+WHERE true
+ON CONFLICT(metric_code, db_code, date_num, region_code)
+DO UPDATE SET
+    metric_value = excluded.metric_value,
+    extra_attributes = excluded.extra_attributes,
+    row_hash = excluded.row_hash,
+    is_deleted = 0,
+    last_updated_time = excluded.last_updated_time
+WHERE cn_stats_metric_data.row_hash IS NOT excluded.row_hash
+    OR cn_stats_metric_data.is_deleted = 1;
+        """
+
+        delete_sql = """
+UPDATE cn_stats_metric_data SET
+    is_deleted = 1,
+    last_updated_time = :ts
+WHERE db_code = :db_code
+    AND metric_code IN (SELECT value FROM json_each(:metric_codes))
+    AND date_num IN (SELECT value FROM json_each(:date_nums))
+    AND is_deleted = 0
+    AND NOT EXISTS (
+        SELECT 1 FROM tmp_metric_data d
+        WHERE d.metric_code = cn_stats_metric_data.metric_code
+            AND d.db_code = cn_stats_metric_data.db_code
+            AND d.date_num = cn_stats_metric_data.date_num
+            AND d.region_code = cn_stats_metric_data.region_code);
+        """
+        with sqlite.get_conn() as conn:
+            conn.execute(create_sql)
+            conn.execute("DELETE FROM tmp_metric_data;")
+            conn.executemany(insert_sql, data)
+            inserted = conn.execute(inserted_sql).fetchone()[0]
+            upserted = conn.execute(upsert_sql, {"ts": ts}).rowcount
+            deleted = conn.execute(
+                delete_sql,
+                {
+                    "ts": ts,
+                    "db_code": db_code,
+                    "metric_codes": sqlite.to_json(metric_codes),
+                    "date_nums": sqlite.to_json(date_nums),
+                },
+            ).rowcount
+            conn.execute("DROP TABLE tmp_metric_data;")
+            return {"inserted": inserted, "updated": upserted - inserted, "deleted": deleted}
+
+    @classmethod
+    def list_values(
+        cls,
+        db_code: str,
+        metric_codes: List[str],
+        region_codes: List[str | None] | None = None,
+        date_nums: List[int] | None = None,
+    ) -> dict[tuple[str, int, str | None], tuple[float | None, str | None]]:
+        sql = """
+SELECT
+    metric_code,
+    date_num,
+    region_code,
+    metric_value,
+    row_hash
+FROM cn_stats_metric_data
+WHERE is_deleted = 0
+    AND db_code = ?
+    AND metric_code IN (SELECT value FROM json_each(?))
+    AND (? OR region_code IN (SELECT value FROM json_each(?)))
+    AND (? OR date_num IN (SELECT value FROM json_each(?)));
+        """
+        criteria = (
+            db_code,
+            sqlite.to_json(metric_codes),
+            region_codes is None,
+            sqlite.to_json(None if region_codes is None else ["" if i is None else i for i in region_codes]),
+            date_nums is None,
+            sqlite.to_json(date_nums),
+        )
+        with sqlite.get_conn() as conn:
+            return {
+                (i[0], i[1], i[2] if i[2] != "" else None): (i[3], i[4])
+                for i in conn.execute(sql, criteria).fetchall()
+            }
+
+    @classmethod
+    def series(
+        cls,
+        db_code: str,
+        metric_code: str,
+        region_code: str | None = None,
+        start: int | None = None,
+        end: int | None = None,
+    ) -> List[tuple[int, float | None]]:
+        sql = """
+SELECT
+    date_num,
+    metric_value
+FROM cn_stats_metric_data
+WHERE is_deleted = 0
+    AND db_code = ?
+    AND metric_code = ?
+    AND region_code = ?
+    AND (? OR date_num >= ?)
+    AND (? OR date_num <= ?)
+ORDER BY date_num;
+        """
+        with sqlite.get_conn() as conn:
+            rows = conn.execute(sql, _series_criteria(db_code, metric_code, region_code, start, end)).fetchall()
+            return [(i[0], i[1]) for i in rows]
+
+    @classmethod
+    def iter_points(cls, db_code: str, itersize: int = 10000) -> Iterator[tuple[str, str | None, int, float | None]]:
+        sql = """
+SELECT
+    metric_code,
+    region_code,
+    date_num,
+    metric_value
+FROM cn_stats_metric_data
+WHERE is_deleted = 0 AND db_code = ?
+ORDER BY metric_code, region_code, date_num;
+        """
+        with sqlite.get_conn() as conn:
+            cursor = conn.execute(sql, (db_code,))
+            while rows := cursor.fetchmany(itersize):
+                for i in rows:
+                    yield i[0], i[1] if i[1] != "" else None, i[2], i[3]
+
+    @classmethod
+    def iter_panel_values(
+        cls,
+        db_code: str,
+        metric_codes: List[str],
+        region_codes: List[str | None],
+        start: int,
+        end: int,
+        itersize: int = 10000,
+    ) -> Iterator[List[tuple[int, int, int, float | None]]]:
+        sql = """
+SELECT
+    m.key,
+    r.key,
+    d.date_num,
+    d.metric_value
+FROM json_each(?) m
+    INNER JOIN json_each(?) r
+    INNER JOIN cn_stats_metric_data d ON d.metric_code = m.value AND d.region_code = r.value
+WHERE d.is_deleted = 0
+    AND d.db_code = ?
+    AND d.date_num >= ?
+    AND d.date_num <= ?;
+        """
+        if not metric_codes or not region_codes:
+            return
+        metrics, regions, *criteria = _panel_criteria(db_code, metric_codes, region_codes, start, end)
+        with sqlite.get_conn() as conn:
+            cursor = conn.execute(sql, (sqlite.to_json(metrics), sqlite.to_json(regions), *criteria))
+            while rows := cursor.fetchmany(itersize):
+                yield rows
+
+    @classmethod
+    def get_series_watermark(cls, db_code: str, metric_code: str, region_code: str | None = None) -> tuple:
+        sql = """
+SELECT count(*), max(last_updated_time)
+FROM cn_stats_metric_data
+WHERE db_code = ? AND metric_code = ? AND region_code = ?;
+        """
+        with sqlite.get_conn() as conn:
+            return tuple(conn.execute(sql, _series_key(db_code, metric_code, region_code)).fetchone())
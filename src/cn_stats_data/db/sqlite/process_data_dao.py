@@ -0,0 +1,51 @@
+from typing import Optional
+
+from cn_stats_data import metrics
+from cn_stats_data.db import sqlite
+from cn_stats_data.db.models import ProcessData
+from cn_stats_data.db.process_data_dao import ProcessDataDao
+
+__all__ = ["SqliteProcessDataDao"]
+
+
+@metrics.instrument_dao
+class SqliteProcessDataDao(ProcessDataDao):
+    """
+    The `ProcessDataDao` of the embedded SQLite database, the data is kept as JSON text.
+    """
+
+    @classmethod
+    def add_or_update(cls, data: ProcessData) -> int:
+        sql = """
+INSERT INTO process_data (
+    process_id,
+    data,
+    created_time,
+    last_updated_time)
+VALUES(:process_id, :data, :ts, :ts)
+ON CONFLICT(process_id)
+DO UPDATE SET
+    data = excluded.data,
+    last_updated_time = excluded.last_updated_time;
+        """
+        with sqlite.get_conn() as conn:
+            return conn.execute(sql, {"process_id": data.process_id, "data": data.data, "ts": sqlite.now()}).rowcount
+
+    @classmethod
+    def get(cls, process_id: str) -> Optional[ProcessData]:
+        sql = """
+SELECT process_id, data FROM process_data WHERE process_id = ?;
+        """
+        with sqlite.get_conn() as conn:
+            row = conn.execute(sql, (process_id,)).fetchone()
+            if row is None:
+                return None
+            return ProcessData(process_id=row[0], data=row[1])
+
+    @classmethod
+    def delete(cls, process_id: str) -> int:
+        sql = """
+DELETE FROM process_data WHERE process_id = ?;
+        """
+        with sqlite.get_conn() as conn:
+            return conn.execute(sql, (process_id,)).rowcount
@@ -0,0 +1,205 @@
+from itertools import groupby
+import json
+from typing import List
+
+from cn_stats_util.models import Category
+
+from cn_stats_data import metrics
+from cn_stats_data.db import sqlite
+from cn_stats_data.db.models import RegionCode
+from cn_stats_data.db.region_code_dao import RegionCodeDao, _build_index, _region_code_from_row, _set_children
+from cn_stats_data.db.row_hash import region_code_hash
+
+__all__ = ["SqliteRegionCodeDao"]
+
+_COLUMNS = """
+    r.region_code,
+    r.db_code,
+    r.name,
+    r.explanation,
+    r.children_region_codes,
+    r.extra_attributes,
+    r.is_deleted,
+    r.created_time,
+    r.last_updated_time,
+    r.parent_region_code,
+    r.row_hash"""
+
+
+def _from_row(i: tuple, is_parent: bool = False) -> RegionCode:
+    return _region_code_from_row(
+        (*i[:4], sqlite.from_json(i[4]), sqlite.from_json(i[5], {}), bool(i[6]),
+         sqlite.to_time(i[7]), sqlite.to_time(i[8]), i[9], i[10]),
+        is_parent=is_parent,
+    )
+
+
+@metrics.instrument_dao
+class SqliteRegionCodeDao(RegionCodeDao):
+    """
+    The `RegionCodeDao` of the embedded SQLite database, children_region_codes is kept as a JSON array.
+    """
+
+    @classmethod
+    def add_or_update(cls, lst: List[RegionCode]) -> int:
+        if not lst:
+            return 0
+        ts = sqlite.now()
+        data = [
+            (
+                i.code,
+                i.db_code,
+                i.name,
+                i.explanation,
+                None if i.children is None else sqlite.to_json([c.code for c in i.children]),
+                json.dumps(i.extra_attributes),
+                region_code_hash(i),
+                ts,
+                ts,
+            )
+            for i in lst
+            if not hasattr(i, "is_deleted") or not i.is_deleted
+        ]
+        if len(data) == 0:
+            return 0
+
+        sql = """
+INSERT INTO cn_stats_region_codes (
+    region_code,
+    db_code,
+    name,
+    explanation,
+    children_region_codes,
+    extra_attributes,
+    row_hash,
+    is_deleted,
+    created_time,
+    last_updated_time)
+VALUES(?, ?, ?, ?, ?, ?, ?, 0, ?, ?)
+ON CONFLICT(db_code, region_code)
+DO UPDATE SET
+    name = excluded.name,
+    explanation = excluded.explanation,
+    children_region_codes = excluded.children_region_codes,
+    extra_attributes = excluded.extra_attributes,
+    row_hash = excluded.row_hash,
+    is_deleted = 0,
+    last_updated_time = excluded.last_updated_time
+WHERE cn_stats_region_codes.row_hash IS NOT excluded.row_hash
+    OR cn_stats_region_codes.is_deleted = 1;
+        """
+
+        # keep parent_region_code in line with the children_region_codes of the saved regions,
+        # joined with the parent -> child pairs expanded once, instead of expanding them for every row
+        sync_sqls = [
+            """
+UPDATE cn_stats_region_codes SET
+    parent_region_code = p.region_code
+FROM cn_stats_region_codes p, json_each(p.children_region_codes) ch
+WHERE p.db_code = :db_code
+    AND p.region_code IN (SELECT value FROM json_each(:region_codes))
+    AND cn_stats_region_codes.db_code = p.db_code
+    AND cn_stats_region_codes.region_code = ch.value
+    AND cn_stats_region_codes.parent_region_code IS NOT p.region_code;
+            """,
+            """
+UPDATE cn_stats_region_codes SET
+    parent_region_code = NULL
+FROM (
+    SELECT c.region_code
+    FROM cn_stats_region_codes c
+        LEFT JOIN (
+            SELECT p.region_code AS parent, ch.value AS child
+            FROM cn_stats_region_codes p, json_each(p.children_region_codes) ch
+            WHERE p.db_code = :db_code AND p.region_code IN (SELECT value FROM json_each(:region_codes))
+        ) m ON m.parent = c.parent_region_code AND m.child = c.region_code
+    WHERE c.db_code = :db_code
+        AND c.parent_region_code IN (SELECT value FROM json_each(:region_codes))
+        AND m.child IS NULL
+) s
+WHERE cn_stats_region_codes.db_code = :db_code
+    AND cn_stats_region_codes.region_code = s.region_code;
+            """,
+            """
+UPDATE cn_stats_region_codes SET
+    parent_region_code = m.parent
+FROM (
+    SELECT p.region_code AS parent, ch.value AS child
+    FROM cn_stats_region_codes p, json_each(p.children_region_codes) ch
+    WHERE p.db_code = :db_code
+) m
+WHERE cn_stats_region_codes.db_code = :db_code
+    AND cn_stats_region_codes.region_code = m.child
+    AND cn_stats_region_codes.parent_region_code IS NULL
+    AND cn_stats_region_codes.region_code IN (SELECT value FROM json_each(:region_codes));
+            """,
+        ]
+        with sqlite.get_conn() as conn:
+            count = conn.executemany(sql, data).rowcount
+            for key, group in groupby(sorted(data, key=lambda x: x[1]), key=lambda x: x[1]):
+                params = {"db_code": key, "region_codes": sqlite.to_json([i[0] for i in group])}
+                for s in sync_sqls:
+                    conn.execute(s, params)
+            return count
+
+    @classmethod
+    def delete(cls, lst: List[RegionCode]) -> int:
+        if lst is None or len(lst) == 0:
+            return 0
+        ts = sqlite.now()
+        data = [(ts, i.db_code, i.code) for i in lst if not hasattr(i, "is_deleted") or i.is_deleted]
+        if len(data) == 0:
+            return 0
+
+        sql = """
+UPDATE cn_stats_region_codes SET
+    is_deleted = 1,
+    last_updated_time = ?
+WHERE db_code = ?
+    AND region_code = ?
+    AND is_deleted = 0;
+        """
+        with sqlite.get_conn() as conn:
+            return conn.executemany(sql, data).rowcount
+
+    @classmethod
+    def get(cls, reg_code: str, db_code: Category) -> RegionCode | None:
+        sql = f"""
+SELECT {_COLUMNS}
+FROM cn_stats_region_codes r
+WHERE r.is_deleted = 0 AND r.db_code = ? AND r.region_code = ?;
+        """
+        with sqlite.get_conn() as conn:
+            row = conn.execute(sql, (db_code.db_code, reg_code)).fetchone()
+            return None if row is None else _from_row(row, is_parent=row[4] is not None)
+
+    @classmethod
+    def list(cls, db_code: Category | None = None, reg_code: str | None = None) -> List[RegionCode]:
+        sql = f"""
+WITH RECURSIVE cte_regions (db_code, region_code) AS (
+    SELECT db_code, region_code
+    FROM cn_stats_region_codes
+    WHERE (? OR db_code = ?) AND (? OR region_code = ?)
+    UNION
+    SELECT c.db_code, c.region_code
+    FROM cn_stats_region_codes c
+        INNER JOIN cte_regions p ON c.db_code = p.db_code AND c.parent_region_code = p.region_code
+)
+SELECT {_COLUMNS}
+FROM cte_regions c
+    INNER JOIN cn_stats_region_codes r ON r.db_code = c.db_code AND r.region_code = c.region_code;
+        """
+        dbcode = None if db_code is None else db_code.db_code
+        with sqlite.get_conn() as conn:
+            rows = conn.execute(sql, (dbcode is None, dbcode, reg_code is None, reg_code)).fetchall()
+            data = [_from_row(i) for i in rows]
+            _set_children(_build_index(data))
+            return data
+
+    @classmethod
+    def get_watermark(cls, db_code: Category) -> tuple:
+        sql = """
+SELECT count(*), max(last_updated_time) FROM cn_stats_region_codes WHERE db_code = ?;
+        """
+        with sqlite.get_conn() as conn:
+            return tuple(conn.execute(sql, (db_code.db_code,)).fetchone())
@@ -0,0 +1,73 @@
+-- Schema of the embedded SQLite backend, the same tables and columns as the Postgres database.
+-- JSONB columns and arrays are stored as JSON text, booleans as 0/1, and timestamps as ISO text.
+-- It's applied when the database file is opened the first time by the process.
+
+PRAGMA journal_mode = WAL;
+
+CREATE TABLE IF NOT EXISTS cn_stats_metric_codes (
+    metric_code TEXT NOT NULL,
+    db_code TEXT NOT NULL,
+    name TEXT,
+    explanation TEXT,
+    memo TEXT,
+    unit TEXT,
+    parent_metric_code TEXT,
+    extra_attributes TEXT,
+    row_hash TEXT,
+    is_deleted INTEGER NOT NULL DEFAULT 0,
+    created_time TEXT NOT NULL,
+    last_updated_time TEXT NOT NULL,
+    PRIMARY KEY (db_code, metric_code)
+);
+
+CREATE INDEX IF NOT EXISTS ix_cn_stats_metric_codes_parent
+    ON cn_stats_metric_codes (db_code, parent_metric_code);
+
+CREATE TABLE IF NOT EXISTS cn_stats_region_codes (
+    region_code TEXT NOT NULL,
+    db_code TEXT NOT NULL,
+    name TEXT,
+    explanation TEXT,
+    children_region_codes TEXT,
+    parent_region_code TEXT,
+    extra_attributes TEXT,
+    row_hash TEXT,
+    is_deleted INTEGER NOT NULL DEFAULT 0,
+    created_time TEXT NOT NULL,
+    last_updated_time TEXT NOT NULL,
+    PRIMARY KEY (db_code, region_code)
+);
+
+CREATE INDEX IF NOT EXISTS ix_cn_stats_region_codes_parent
+    ON cn_stats_region_codes (db_code, parent_region_code);
+
+CREATE TABLE IF NOT EXISTS cn_stats_metric_data (
+    metric_code TEXT NOT NULL,
+    db_code TEXT NOT NULL,
+    date_num INTEGER NOT NULL,
+    region_code TEXT NOT NULL DEFAULT '',
+    metric_value REAL,
+    extra_attributes TEXT,
+    row_hash TEXT,
+    is_deleted INTEGER NOT NULL DEFAULT 0,
+    created_time TEXT NOT NULL,
+    last_updated_time TEXT NOT NULL,
+    PRIMARY KEY (metric_code, db_code, date_num, region_code)
+);
+
+-- replaced by the index including the row hash, dropped from the databases created before it
+DROP INDEX IF EXISTS ix_cn_stats_metric_data_value;
+
+CREATE INDEX IF NOT EXISTS ix_cn_stats_metric_data_value_hash
+    ON cn_stats_metric_data (db_code, metric_code, region_code, date_num, metric_value, row_hash)
+    WHERE is_deleted = 0;
+
+CREATE INDEX IF NOT EXISTS ix_cn_stats_metric_data_last_updated
+    ON cn_stats_metric_data (db_code, metric_code, region_code, last_updated_time);
+
+CREATE TABLE IF NOT EXISTS process_data (
+    process_id TEXT NOT NULL PRIMARY KEY,
+    data TEXT,
+    created_time TEXT NOT NULL,
+    last_updated_time TEXT NOT NULL
+);
@@ -1 +1 @@
-__all__ = ['metric_code_download', 'metric_data_download', 'region_code_download']
+__all__ = ['metric_code_download', 'metric_data_download', 'region_code_download', 'replay']
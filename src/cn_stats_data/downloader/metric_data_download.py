@@ -1,137 +1,180 @@
-from functools import cache
 import logging
 import time
 from typing import List, Optional
 
-from cn_stats_util.models import Category, Metric, Region, HistoricalData
-from cn_stats_data.db.metric_code_dao import MetricCodeDao
-from cn_stats_data.db.region_code_dao import RegionCodeDao
-from cn_stats_data.db.metric_data_dao import MetricDataDao
+from cn_stats_util.models import Category, HistoricalData, Metric, Region
+from cn_stats_data.db.dao import MetricCodeDao, RegionCodeDao, MetricDataDao, RollupDao
 from cn_stats_data.db.models import MetricCode, RegionCode, MetricHistoricalData
+from cn_stats_data.db.spool import MetricDataSpool
+from cn_stats_data.db import spool_config
+from cn_stats_data.db.row_hash import metric_data_hash
 from cn_stats_util.apis import ChinaStatsDataApis
+from cn_stats_data import metrics, profiling, progress, tracing
+from cn_stats_data.downloader import replay
+from cn_stats_data.log import PER_NODE
 
 __all__ = ['download_metric_data']
 
 
-@cache
-def _load_metric_codes(db: Category) -> list[MetricCode]:
-    return MetricCodeDao.list(db)
-
-def _find_metric_codes_to_download(db: Category, metric_codes: List[str] | None) -> List[MetricCode]:
-    codes_in_db = _load_metric_codes(db)
-
-    if metric_codes:
-        return [c for c in codes_in_db if c.code in metric_codes]  # ignore the codes doesn't belong to the db_code
-    else:
-        return [c for c in codes_in_db if c.parent is None]  # all the codes in the db code if not giving
-
-def _get_non_parent_codes(c: MetricCode, lst: List[MetricCode]) -> None:
-    if c.children is None or len(c.children) == 0:
-        lst.append(c)
-    else:
-        for child in c.children:
-            _get_non_parent_codes(child, lst)
-
 def _get_metric_codes_to_download(db: Category, metric_codes: Optional[List[str]]) -> List[MetricCode]:
     """get the metric codes need to be downloaded according to the giving codes."""
 
-    root_codes = _find_metric_codes_to_download(db, metric_codes)
+    if db.is_regional():  # have to download it one by one if want to get all the regions at once
+        return MetricCodeDao.list_leaves(db, metric_codes if metric_codes else None)
 
-    non_parent_codes = []
-    for c in root_codes:
-        _get_non_parent_codes(c, non_parent_codes)
+    index = MetricCodeDao.get_hierarchy(db)
+    if metric_codes:  # ignore the codes doesn't belong to the db_code
+        root_codes = [index.node((db.db_code, c)) for c in metric_codes if (db.db_code, c) in index]
+    else:  # all the codes in the db code if not giving
+        root_codes = [c for c in index.roots if c.parent is None]
 
     codes_to_download: dict[str, MetricCode] = {}
-    if db.is_regional():
-        for c in non_parent_codes:  # have to download it one by one if want to get all the regions at once
-            codes_to_download[c.code] = c
-    else:
-        for c in non_parent_codes:  # get parent of non-parent codes for downloading
-            if c.parent is not None:
-                codes_to_download[c.parent.code] = c.parent
-
     for c in root_codes:
-        if c.children is None:
-            codes_to_download[c.code] = c
+        for leaf in index.leaves_under((c.db_code, c.code)):
+            parent = index.parent((leaf.db_code, leaf.code))
+            # get parent of non-parent codes for downloading, or the code itself if it has no children
+            code = parent if parent is not None and leaf is not c else leaf
+            codes_to_download[code.code] = code
 
     return [c for c in codes_to_download.values()]
 
 
+def _is_unchanged(db: Category, metric_codes: List[str], date_nums: List[int], lst: List[HistoricalData]) -> bool:
+    """
+    Check whether the downloaded data is the same as the saved data of the metric codes and periods,
+    by the keys and row hashes read from the covering index, so an unchanged metric isn't written again.
+    The row hash covers the value and the extra attributes, the same as compared by the sync.
+    """
+    downloaded = {(i.metric_code, i.period, i.region_code): metric_data_hash(i) for i in lst}  # the last one wins
+    saved = MetricDataDao.list_values(db.db_code, metric_codes, date_nums=date_nums)
+    return downloaded == {k: v[1] for k, v in saved.items()}
+
+
 def _download_metric_data(
         db: Category,
         code: Metric,
         years: List[int],
-        logger: logging) -> None:
-    
-    apis = ChinaStatsDataApis()
-
-    data_loaded = apis.fetch_history(
-        category=db,
-        metrics=[code.code],
-        years=years,
-        is_row_region=db.is_regional()
-    )
-    logger.info(f'Received {len(data_loaded)} records of {db.db_code}-{code.code}.')
-
-    metric_codes_in_db = [code.code] if db.is_regional() else [c.code for c in code.children]
-
-    data_in_db = MetricDataDao.list(
-        db_codes=[db.db_code], 
-        metric_codes=metric_codes_in_db,
-        region_codes=None,
-        date_nums=db.get_periods_from_years(years))
-    logger.info(f'Loaded {len(data_in_db)} metric historcial data of {db.db_code}-{metric_codes_in_db} from database.')
-
-    dict_of_downloaded = {(d.metric_code, d.period, d.region_code): d for d in data_loaded}    
-    data_to_delete = []
-
-    for c in data_in_db:
-        d = dict_of_downloaded.get((c.metric_code, c.period, c.region_code))
-        if d is None:
-            c.is_deleted = True
-            data_to_delete.append(c)
-        elif HistoricalData.__eq__(d, c):
-            dict_of_downloaded.pop((c.metric_code, c.period, c.region_code))
-
-    data_to_update = list(dict_of_downloaded.values())
-
-    # save the metric data which is not marked as deleted
-    data_updated = MetricDataDao.add_or_update(data_to_update)
-    # delete the metric data which is marked as deleted
-    data_deleted = MetricDataDao.delete(data_to_delete)
-    logger.info(f'Updated {data_updated} metric historical data of {db.db_code}-{metric_codes_in_db}, and deleted {data_deleted}.')
+        logger: logging,
+        spool: Optional[MetricDataSpool] = None) -> int:
+    """download the data of a metric code, and returns the count of the records received."""
+
+    apis = metrics.instrument_apis(replay.wrap(ChinaStatsDataApis()))
+
+    with tracing.span("fetch") as s:
+        data_loaded = apis.fetch_history(
+            category=db,
+            metrics=[code.code],
+            years=years,
+            is_row_region=db.is_regional()
+        )
+        s.set(rows=len(data_loaded))
+    logger.info('Received %s records of %s-%s.', len(data_loaded), db.db_code, code.code, extra=PER_NODE)
+
+    metric_codes_in_db = [code.code] if db.is_regional() or not code.children else [c.code for c in code.children]
+
+    if spool is not None:  # saved to database by the loader of the spool
+        with tracing.span("spool-append", rows=len(data_loaded)):
+            spool.append(
+                db_code=db.db_code,
+                metric_codes=metric_codes_in_db,
+                date_nums=db.get_periods_from_years(years),
+                lst=data_loaded)
+        return len(data_loaded)
+
+    with tracing.span("db-read") as s:
+        unchanged = _is_unchanged(db, metric_codes_in_db, db.get_periods_from_years(years), data_loaded)
+        s.set(unchanged=unchanged)
+    if unchanged:
+        counts = {"inserted": 0, "updated": 0, "deleted": 0}
+    else:
+        with tracing.span("db-write") as s:
+            counts = MetricDataDao.sync(
+                db_code=db.db_code,
+                metric_codes=metric_codes_in_db,
+                date_nums=db.get_periods_from_years(years),
+                lst=data_loaded)
+            s.set(**counts)
+    metrics.record_sync(db.db_code, counts)
+    logger.info(
+        'Inserted %s, updated %s metric historical data of %s-%s, and deleted %s.',
+        counts["inserted"], counts["updated"], db.db_code, metric_codes_in_db, counts["deleted"], extra=PER_NODE)
+    return len(data_loaded)
 
 
 def download_metric_data(
         db_code: Optional[Category] = None,
         metric_code: Optional[str] = None,        
-        years: Optional[List[int]] = None,) -> None:
-    
-    logger = logging.getLogger(__name__)
-    if not years: 
-        years = [x for x in range(time.localtime().tm_year - 4, time.localtime().tm_year + 1)]
-    logger.info(f'Starts to download metric data from data.stats.gov.cn, db_code: {db_code.db_code}, metric_code: {metric_code}, years: {years}.')
-    
-    db_codes: List[Category] = [db_code] if db_code else list(Category)
-    
-    # TODO: load checkpoint
-
-    for db in db_codes:
-
-        # TODO: check checkpoint
-
-        codes_to_download = _get_metric_codes_to_download(db, [metric_code] if not metric_code else None)
-
-        count = 0
-        total = len(codes_to_download)
-        logger.info(f'{len(codes_to_download)} metric codes in {db.db_code} need to be downloaded.')
-
-        for code in codes_to_download:
-            #TODO: check checkpoint
-            _download_metric_data(db, code, years, logger)
-            count += 1
-            logger.info(f'Progress of {db.db_code}: {count}/{total}.')
-            #TODO: update checkpoint
-
-    # TODO: update checkpoint
-    logger.info('All data has been downloaded.')
+        years: Optional[List[int]] = None,
+        use_spool: Optional[bool] = None,
+        profile: Optional[str] = None,
+        profile_memory: Optional[bool] = None) -> None:
+    """
+    Download metric data and save them to the database.
+    :param db_code: Specify which db_code's metric data should be downloaded. None means to download all.
+    :param metric_code: Specify which metric code and its descendants need to be downloaded.
+    :param years: The years need to be downloaded, the recent 5 years if not giving.
+    :param use_spool: Whether to save the data through the local spool, so crawling doesn't wait for database.
+        It's the `enabled` of the [spool] config if not giving.
+    :param profile: cprofile or sampling to profile the run, see `cn_stats_data.profiling.profile_run`.
+    :param profile_memory: Whether to trace the allocations of the profiled run, see `profile_run`.
+    """
+    with profiling.profile_run("download_metric_data", profile, memory=profile_memory), tracing.span("download_metric_data"):
+        logger = logging.getLogger(__name__)
+        if not years: 
+            years = [x for x in range(time.localtime().tm_year - 4, time.localtime().tm_year + 1)]
+        logger.info(f'Starts to download metric data from data.stats.gov.cn, db_code: {db_code.db_code if db_code else None}, metric_code: {metric_code}, years: {years}.')
+
+        db_codes: List[Category] = [db_code] if db_code else list(Category)
+
+        spool = None
+        if use_spool if use_spool is not None else spool_config.enabled:
+            spool = MetricDataSpool.from_config()
+            spool.start()  # also replays the segments left by the last run
+
+        try:
+            # TODO: load checkpoint
+
+            for db in db_codes:
+
+                # TODO: check checkpoint
+
+                with tracing.span("category", db_code=db.db_code) as category_span:
+                    with tracing.span("db-read") as s:
+                        codes_to_download = _get_metric_codes_to_download(db, [metric_code] if metric_code else None)
+                        s.set(rows=len(codes_to_download))
+
+                    count = 0
+                    total = len(codes_to_download)
+                    category_span.set(codes=total)
+                    logger.info(f'{len(codes_to_download)} metric codes in {db.db_code} need to be downloaded.')
+
+                    with progress.track(f"download_metric_data:{db.db_code}", total) as tracker:
+                        for code in codes_to_download:
+                            #TODO: check checkpoint
+                            metrics.queue_depth.set(total - count, queue='metric_data_download')
+                            with tracing.span("metric_data", db_code=db.db_code, code=code.code):
+                                rows = _download_metric_data(db, code, years, logger, spool)
+                            tracker.advance(rows=rows, requests=1)
+                            count += 1
+                            logger.info('Progress of %s: %s/%s.', db.db_code, count, total, extra=PER_NODE)
+                            #TODO: update checkpoint
+                metrics.queue_depth.set(0, queue='metric_data_download')
+
+            # TODO: update checkpoint
+        finally:  # the loader is stopped even if the crawl failed, the data appended is kept for the next run
+            if spool is not None:
+                logger.info(f'Waiting for {spool.pending_segments} spool segments being loaded into database.')
+                with tracing.span("spool-wait", segments=spool.pending_segments):
+                    if not spool.close(timeout=spool_config.close_timeout):
+                        logger.warning(
+                            f'{spool.pending_segments} spool segments are not loaded into database in '
+                            f'{spool_config.close_timeout}s, they will be replayed by the next download.')
+
+        if RollupDao is not None:  # only the buckets changed by this run are recomputed
+            for db in db_codes:
+                with tracing.span("rollup", db_code=db.db_code) as s:
+                    count = RollupDao.refresh(db.db_code)
+                    s.set(buckets=count)
+                if count > 0:
+                    logger.info(f'Refreshed the roll-ups of {count} changed buckets of {db.db_code}.')
+        logger.info('All data has been downloaded.')
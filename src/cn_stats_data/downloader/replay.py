@@ -0,0 +1,336 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import pathlib
+import pickle
+import threading
+import time
+from collections import defaultdict
+from enum import Enum
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+__all__ = ["Archive", "RecordingApis", "ReplayApis", "wrap", "recording", "replaying"]
+
+_INDEX = "calls.jsonl"
+_CALLS_DIR = "calls"
+
+_lock = threading.Lock()
+# the archives opened by the process, the downloaders create an api object per node, so they share the archive
+_archives: Dict[pathlib.Path, "Archive"] = {}
+# the mode set by `recording` or `replaying`, it wins over the environment variables
+_active: Optional[Tuple[str, "Archive", Optional[float], float]] = None
+
+
+def _normalize(value: Any) -> Any:
+    """The JSON form of an argument in the key of a call, a code object is keyed by its db code and code."""
+    if isinstance(value, Enum):
+        return f"{type(value).__name__}.{value.name}"
+    if hasattr(value, "code") and hasattr(value, "db_code"):  # a Metric or a Region
+        return {"db_code": value.db_code, "code": value.code}
+    if isinstance(value, (list, tuple, set)):
+        return [_normalize(i) for i in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def _key(method: str, args: tuple, kwargs: dict) -> str:
+    return json.dumps(
+        {"method": method, "args": _normalize(args), "kwargs": {k: _normalize(v) for k, v in kwargs.items()}},
+        ensure_ascii=False, sort_keys=True)
+
+
+def _refs(args: tuple, kwargs: dict) -> List[Any]:
+    """
+    The objects passed to a call, e.g. the parent metric, they aren't pickled with the result,
+    but referenced, so the replayed result points to the objects passed to the replayed call as the live one does.
+    """
+    values = list(args) + [kwargs[k] for k in sorted(kwargs)]
+    return [i for i in values if hasattr(i, "__dict__") and not isinstance(i, Enum)]
+
+
+class _Pickler(pickle.Pickler):
+    def __init__(self, file, refs: List[Any]):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._refs = {id(v): n for n, v in enumerate(refs)}
+
+    def persistent_id(self, obj: Any) -> Optional[int]:
+        return self._refs.get(id(obj))
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, refs: List[Any]):
+        super().__init__(file)
+        self._refs = refs
+
+    def persistent_load(self, pid: int) -> Any:
+        return self._refs[pid]
+
+
+def _dumps(value: Any, refs: List[Any]) -> bytes:
+    buf = io.BytesIO()
+    _Pickler(buf, refs).dump(value)
+    return buf.getvalue()
+
+
+class Archive:
+    """
+    The recorded calls of the api, a directory of calls.jsonl indexing the calls in the order they were made,
+    and a pickle file per call with the result or the exception raised.
+    The pickles are only safe to load from the archives recorded by yourself.
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        """
+        :param path: The directory of the archive, the calls are appended if it has been recorded before
+        """
+        self.path = pathlib.Path(path)
+        self._lock = threading.Lock()
+        self._entries: Optional[Dict[str, List[dict]]] = None
+        self._served: Dict[str, int] = defaultdict(int)
+        self._count: Optional[int] = None
+        self.misses = 0
+
+    def _load(self) -> Dict[str, List[dict]]:
+        """Load the index, it's called with the lock."""
+        if self._entries is None:
+            self._entries = defaultdict(list)
+            index = self.path / _INDEX
+            if index.exists():
+                with open(index, mode="r", encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            entry = json.loads(line)
+                            self._entries[entry["key"]].append(entry)
+            self._count = sum(len(i) for i in self._entries.values())
+        return self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._load()
+            return self._count
+
+    def record(self, method: str, args: tuple, kwargs: dict, result: Any, error: Optional[BaseException],
+               seconds: float) -> None:
+        """
+        Save a call of the live api
+        :param method: The name of the method
+        :param args: The positional arguments
+        :param kwargs: The keyword arguments
+        :param result: The result, ignored if it raised
+        :param error: The exception raised, or None
+        :param seconds: The seconds the call took
+        """
+        refs = _refs(args, kwargs)
+        if error is not None:
+            try:
+                data = _dumps(error, refs)
+            except Exception:  # e.g. holding a response object which can't be pickled
+                data = _dumps(RuntimeError(f"{type(error).__name__}: {error}"), refs)
+        else:
+            data = _dumps(result, refs)
+
+        key = _key(method, args, kwargs)
+        with self._lock:
+            entries = self._load()
+            self._count += 1
+            name = f"{_CALLS_DIR}/{self._count:08d}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}.pickle"
+            entry = {
+                "key": key,
+                "method": method,
+                "file": name,
+                "seconds": seconds,
+                "rows": len(result) if error is None and hasattr(result, "__len__") else None,
+                "error": None if error is None else f"{type(error).__name__}: {error}",
+            }
+            (self.path / _CALLS_DIR).mkdir(parents=True, exist_ok=True)
+            (self.path / name).write_bytes(data)
+            with open(self.path / _INDEX, mode="a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            entries[key].append(entry)
+
+    def replay(self, method: str, args: tuple, kwargs: dict) -> Tuple[dict, Any]:
+        """
+        Get the next recorded call of the same arguments, the calls of the same arguments are replayed in the order
+        they were recorded, and the last one is repeated when they run out.
+        :return: Returns the entry of the index, and the result or the exception to raise
+        """
+        key = _key(method, args, kwargs)
+        with self._lock:
+            entries = self._load().get(key)
+            if not entries:
+                self.misses += 1
+                raise LookupError(f"No call of {method} is recorded in {self.path} for {key}.")
+            entry = entries[min(self._served[key], len(entries) - 1)]
+            self._served[key] += 1
+        data = (self.path / entry["file"]).read_bytes()
+        return entry, _Unpickler(io.BytesIO(data), _refs(args, kwargs)).load()  # fresh objects for every call
+
+
+class RecordingApis:
+    """The proxy saving every call of the public methods of the live api object into an archive."""
+
+    def __init__(self, apis: Any, archive: Archive):
+        self._apis = apis
+        self._archive = archive
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._apis, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        def recorded(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception as e:
+                self._archive.record(name, args, kwargs, None, e, time.perf_counter() - start)
+                raise
+            self._archive.record(name, args, kwargs, result, None, time.perf_counter() - start)
+            return result
+
+        return recorded
+
+
+class ReplayApis:
+    """The api object serving the calls recorded in an archive, without any network access."""
+
+    def __init__(self, archive: Archive, latency: Optional[float] = None, scale: float = 1.0):
+        """
+        :param archive: The archive recorded by `RecordingApis`
+        :param latency: The seconds every call takes, or None for the seconds the call took when it was recorded
+        :param scale: The factor of the recorded seconds, e.g. 0 to replay as fast as possible
+        """
+        self._archive = archive
+        self._latency = latency
+        self._scale = scale
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def replayed(*args, **kwargs):
+            entry, result = self._archive.replay(name, args, kwargs)
+            delay = self._latency if self._latency is not None else entry["seconds"] * self._scale
+            if delay > 0:
+                time.sleep(delay)
+            if entry["error"] is not None:
+                raise result
+            return result
+
+        return replayed
+
+
+def _archive(path: str | os.PathLike) -> Archive:
+    key = pathlib.Path(path).resolve()
+    with _lock:
+        archive = _archives.get(key)
+        if archive is None:
+            archive = _archives[key] = Archive(path)
+        return archive
+
+
+def wrap(apis: Any) -> Any:
+    """
+    Wrap the live api object of a downloader by the record or replay mode, it's returned as is if neither is on.
+    The mode is set by `recording` or `replaying`, or by the CN_STATS_API_RECORD or CN_STATS_API_REPLAY environment
+    variable of the archive directory, with CN_STATS_API_LATENCY of the seconds every replayed call takes.
+    """
+    active = _active
+    if active is None:
+        if os.environ.get("CN_STATS_API_REPLAY"):
+            latency = os.environ.get("CN_STATS_API_LATENCY")
+            active = ("replay", _archive(os.environ["CN_STATS_API_REPLAY"]),
+                      float(latency) if latency else None, 1.0)
+        elif os.environ.get("CN_STATS_API_RECORD"):
+            active = ("record", _archive(os.environ["CN_STATS_API_RECORD"]), None, 1.0)
+        else:
+            return apis
+
+    mode, archive, latency, scale = active
+    if mode == "record":
+        return RecordingApis(apis, archive)
+    return ReplayApis(archive, latency, scale)
+
+
+@contextlib.contextmanager
+def _use(mode: str, archive: Archive, latency: Optional[float], scale: float) -> Iterator[Archive]:
+    global _active
+
+    saved, _active = _active, (mode, archive, latency, scale)
+    try:
+        yield archive
+    finally:
+        _active = saved
+
+
+def recording(path: str | os.PathLike) -> contextlib.AbstractContextManager[Archive]:
+    """
+    Record the api calls of the downloaders run in the block
+    :param path: The directory of the archive, the calls are appended if it has been recorded before
+    :return: Yields the archive
+    """
+    return _use("record", Archive(path), None, 1.0)
+
+
+def replaying(path: str | os.PathLike, latency: Optional[float] = None,
+              scale: float = 1.0) -> contextlib.AbstractContextManager[Archive]:
+    """
+    Serve the api calls of the downloaders run in the block from an archive, a call not recorded raises LookupError
+    :param path: The directory of the archive
+    :param latency: The seconds every call takes, or None for the seconds the call took when it was recorded
+    :param scale: The factor of the recorded seconds, e.g. 0 to replay as fast as possible
+    :return: Yields the archive
+    """
+    return _use("replay", Archive(path), latency, scale)
+
+
+def _run(args: argparse.Namespace) -> Dict[str, float]:
+    from cn_stats_util.models import Category
+    from cn_stats_data.downloader.metric_code_download import download_metric_codes
+    from cn_stats_data.downloader.metric_data_download import download_metric_data
+    from cn_stats_data.downloader.region_code_download import download_region_codes
+
+    db_code = next(i for i in Category if i.db_code == args.db_code) if args.db_code else None
+    years = [int(i) for i in args.years.split(",")] if args.years else None
+    downloads = {
+        "metric_codes": lambda: download_metric_codes(db_code, args.metric_code, profile=args.profile),
+        "region_codes": lambda: download_region_codes(db_code, profile=args.profile),
+        "metric_data": lambda: download_metric_data(db_code, args.metric_code, years, profile=args.profile),
+    }
+    seconds = {}
+    for name in args.downloads.split(","):
+        start = time.perf_counter()
+        downloads[name]()
+        seconds[name] = time.perf_counter() - start
+    return seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Record the api calls of the downloaders, or run them on a recording.")
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("archive", help="The directory of the archive")
+    parser.add_argument("--downloads", default="metric_codes,region_codes,metric_data",
+                        help="The downloaders to run, in order")
+    parser.add_argument("--db-code", help="The db code to download, e.g. hgnd, all of them if not giving")
+    parser.add_argument("--metric-code")
+    parser.add_argument("--years", help="The years of the metric data, e.g. 2020,2021")
+    parser.add_argument("--latency", type=float, help="The seconds every replayed call takes, as recorded if not giving")
+    parser.add_argument("--scale", type=float, default=1.0, help="The factor of the recorded seconds")
+    parser.add_argument("--profile", choices=["cprofile", "sampling"])
+    args = parser.parse_args()
+
+    # the mode is set on the module imported by the downloaders, not on this __main__ one
+    from cn_stats_data.downloader import replay
+    if args.mode == "record":
+        context = replay.recording(args.archive)
+    else:
+        context = replay.replaying(args.archive, args.latency, args.scale)
+    with context as archive:
+        timings = _run(args)
+    for name, s in timings.items():
+        print(f"{name}: {s:.3f}s")
+    print(f"{len(archive)} calls in {archive.path}, {archive.misses} not recorded.")
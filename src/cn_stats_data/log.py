@@ -1,5 +1,13 @@
+import atexit
+import itertools
+import json
+import logging
 from logging.config import dictConfig
+from logging.handlers import QueueHandler, QueueListener
 import os
+import queue
+import threading
+from typing import Optional
 from yaml import load
 
 try:
@@ -7,9 +15,118 @@ try:
 except ImportError:
     from yaml import Loader, Dumper
 
+__all__ = ['init_log_config', 'stop_log_listener', 'JsonFormatter', 'SamplingFilter', 'PER_NODE']
 
-def init_log_config() -> None:
-    config_path = os.path.join(os.path.dirname(__file__), 'log.yml')
+# the `extra` of the messages logged for every node of a download, they are sampled by SamplingFilter
+PER_NODE = {'per_node': True}
+
+# the attributes of every LogRecord, the other ones are the `extra` of the call
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {
+    'message', 'asctime', 'taskName', '_template'}
+
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format a record as a JSON object per line, with the `extra` of the call as the fields of the object.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        data.update({k: v for k, v in vars(record).items() if k not in _RECORD_ATTRIBUTES})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Pass one of every `rate` per-node messages (logged with `extra=PER_NODE`) of the same template,
+    the warnings and the errors are always passed.
+    """
+
+    def __init__(self, rate: int = 100):
+        super().__init__()
+        self.rate = rate
+        self._counters: dict[tuple[str, object], itertools.count] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, 'per_node', False) or record.levelno >= logging.WARNING or self.rate <= 1:
+            return True
+        key = (record.name, getattr(record, '_template', record.msg))
+        counter = self._counters.get(key)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(key, itertools.count())
+        return next(counter) % self.rate == 0
+
+
+class _QueueHandler(QueueHandler):
+    """
+    Only merge the arguments into the message on the logging thread,
+    the formatting of the handlers is left to the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(vars(record))
+        record._template = record.msg  # sampled by the template on the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _start_listener() -> None:
+    """Move the handlers of the root logger behind a queue, which is written by a background thread."""
+    global _listener
+
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    q = queue.SimpleQueue()
+    for h in handlers:
+        root.removeHandler(h)
+    root.addHandler(_QueueHandler(q))
+    _listener = QueueListener(q, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_log_listener() -> None:
+    """Write the queued records and stop the background writer, it's called at exit."""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def init_log_config(config_path: Optional[str] = None) -> None:
+    """
+    Configure logging by a YAML file of the logging dictConfig schema.
+    If the file has `queue: true`, the handlers of the root logger are written by a background thread.
+    :param config_path: The config file, or None for the CN_STATS_LOG_CONFIG environment variable,
+        or log.yml next to this module. A relative path is relative to this module, e.g. log_queue.yml.
+    """
+    config_path = config_path or os.environ.get('CN_STATS_LOG_CONFIG') or 'log.yml'
+    config_path = os.path.join(os.path.dirname(__file__), config_path)
     with open(config_path, mode='r') as obj:
         logging_config = load(obj, Loader=Loader)
-    dictConfig(logging_config)
\ No newline at end of file
+    use_queue = logging_config.pop('queue', False)
+    stop_log_listener()  # the queued records are written by the handlers of the last config
+    dictConfig(logging_config)
+    if use_queue:
+        _start_listener()
+
+
+atexit.register(stop_log_listener)
@@ -0,0 +1,404 @@
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import pathlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from cn_stats_data import tracing
+
+__all__ = [
+    "Counter", "Gauge", "Histogram", "Registry", "registry",
+    "api_requests", "api_request_seconds", "dao_call_seconds", "metric_data_rows", "checkpoint_writes", "queue_depth",
+    "progress_nodes", "progress_eta_seconds", "progress_stalled",
+    "db_query_seconds", "db_query_rows", "db_connect_seconds", "current_dao_call",
+    "instrument_apis", "instrument_dao", "record_sync", "start_http_server", "TextfileWriter",
+]
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        """
+        :param name: The metric name, in the Prometheus naming convention
+        :param documentation: The help text of the metric
+        :param labelnames: The names of the labels, the values are given by keyword arguments when recording
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"The labels of {self.name} should be {self.labelnames}, but got {tuple(labels)}.")
+        return tuple(str(labels[i]) for i in self.labelnames)
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if amount < 0:
+            raise ValueError("A counter can only be increased.")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterator[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterator[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        """
+        :param buckets: The upper bounds of the buckets in ascending order, +Inf is appended
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the seconds the block takes, including the ones raising an exception."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get_count(self, **labels) -> int:
+        with self._lock:
+            value = self._values.get(self._key(labels))
+            return sum(value[0]) if value else 0
+
+    def _samples(self) -> Iterator[str]:
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{float(bound)!r}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+
+class Registry:
+    """
+    The metrics exposed together in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if any(i.name == metric.name for i in self._metrics):
+                raise ValueError(f"The metric {metric.name} has been registered.")
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        return "".join(i.render() for i in metrics)
+
+    def clear(self) -> None:
+        """Reset the values of all the metrics, mostly for tests."""
+        with self._lock:
+            for i in self._metrics:
+                i.clear()
+
+
+registry = Registry()
+
+api_requests = registry.register(Counter(
+    "cn_stats_api_requests_total",
+    "The requests of the ChinaStatsDataApis methods by the outcome, ok or error.",
+    ("method", "outcome")))
+api_request_seconds = registry.register(Histogram(
+    "cn_stats_api_request_duration_seconds",
+    "The latency of the ChinaStatsDataApis methods.",
+    ("method",)))
+dao_call_seconds = registry.register(Histogram(
+    "cn_stats_dao_call_duration_seconds",
+    "The latency of the DAO methods.",
+    ("dao", "method")))
+metric_data_rows = registry.register(Counter(
+    "cn_stats_metric_data_rows_total",
+    "The metric data rows saved to database by the change, inserted, updated or deleted.",
+    ("db_code", "change")))
+checkpoint_writes = registry.register(Counter(
+    "cn_stats_checkpoint_writes_total",
+    "The writes of the download checkpoints.",
+    ("process",)))
+queue_depth = registry.register(Gauge(
+    "cn_stats_queue_depth",
+    "The work waiting in the pipeline, the metric codes to download of the current db code, "
+    "or the spool segments to load into database.",
+    ("queue",)))
+progress_nodes = registry.register(Gauge(
+    "cn_stats_progress_nodes",
+    "The nodes of a download task, the ones done or the estimated total.",
+    ("task", "kind")))
+progress_eta_seconds = registry.register(Gauge(
+    "cn_stats_progress_eta_seconds",
+    "The estimated seconds to finish a download task, -1 if it's unknown.",
+    ("task",)))
+progress_stalled = registry.register(Gauge(
+    "cn_stats_progress_stalled",
+    "1 if a download task hasn't made progress in the stall threshold, otherwise 0.",
+    ("task",)))
+db_query_seconds = registry.register(Histogram(
+    "cn_stats_db_query_duration_seconds",
+    "The latency of the SQL statements by the statement name, see cn_stats_data.db.query_stats.",
+    ("statement",)))
+db_query_rows = registry.register(Counter(
+    "cn_stats_db_query_rows_total",
+    "The rows returned or affected by the SQL statements.",
+    ("statement",)))
+db_connect_seconds = registry.register(Histogram(
+    "cn_stats_db_connect_duration_seconds",
+    "The time to open or borrow a database connection."))
+
+# the DAO method running, e.g. MetricDataDao.sync, it names the SQL statements which aren't constants
+current_dao_call: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("cn_stats_dao_call", default=None)
+
+
+class _InstrumentedApis:
+    """The proxy timing the public methods of the wrapped api object."""
+
+    def __init__(self, apis: Any):
+        self._apis = apis
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._apis, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def timed(*args, **kwargs):
+            outcome = "error"
+            try:
+                with tracing.span(f"api.{name}"), api_request_seconds.time(method=name):
+                    result = attr(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                api_requests.inc(method=name, outcome=outcome)
+
+        return timed
+
+
+def instrument_apis(apis: Any) -> Any:
+    """
+    Wrap the `ChinaStatsDataApis` object, so the count and the latency of its method calls are recorded.
+    :param apis: The api object
+    :return: Returns the proxy of the object
+    """
+    return _InstrumentedApis(apis)
+
+
+def _timed_method(name: str, func):
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def timed(cls, *args, **kwargs):
+            token = current_dao_call.set(f"{cls.__name__}.{name}")
+            try:
+                with tracing.span(f"{cls.__name__}.{name}"), dao_call_seconds.time(dao=cls.__name__, method=name):
+                    return await func(cls, *args, **kwargs)
+            finally:
+                current_dao_call.reset(token)
+    elif inspect.isgeneratorfunction(func):  # the time until the stream is consumed, no span as it leaks when suspended
+        @functools.wraps(func)
+        def timed(cls, *args, **kwargs):
+            with dao_call_seconds.time(dao=cls.__name__, method=name):
+                yield from func(cls, *args, **kwargs)
+    else:
+        @functools.wraps(func)
+        def timed(cls, *args, **kwargs):
+            token = current_dao_call.set(f"{cls.__name__}.{name}")
+            try:
+                with tracing.span(f"{cls.__name__}.{name}"), dao_call_seconds.time(dao=cls.__name__, method=name):
+                    return func(cls, *args, **kwargs)
+            finally:
+                current_dao_call.reset(token)
+    return timed
+
+
+def instrument_dao(cls: type) -> type:
+    """
+    The class decorator recording the latency of the public class methods of a DAO, labeled by the DAO class
+    the method is called on, so the methods inherited by the SQLite DAOs are told apart.
+    """
+    for name, attr in list(vars(cls).items()):
+        if isinstance(attr, classmethod) and not name.startswith("_"):
+            setattr(cls, name, classmethod(_timed_method(name, attr.__func__)))
+    return cls
+
+
+def record_sync(db_code: str, counts: dict[str, int]) -> None:
+    """
+    Record the row counts of a `MetricDataDao.sync` call
+    :param db_code: The db code of the data
+    :param counts: The result of the sync, keyed by inserted, updated and deleted
+    """
+    for change, count in counts.items():
+        metric_data_rows.inc(count, db_code=db_code, change=change)
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self) -> None:
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:  # scraped every few seconds, don't flood the log
+        logging.getLogger(__name__).debug(format % args)
+
+
+def start_http_server(port: int, addr: str = "", metrics: Registry = registry) -> ThreadingHTTPServer:
+    """
+    Serve the metrics in the Prometheus text format from a background thread.
+    :param port: The port to listen on, 0 for a free one
+    :param addr: The address to listen on, all the interfaces by default
+    :param metrics: The registry to expose
+    :return: Returns the server, call `shutdown` to stop it
+    """
+    server = ThreadingHTTPServer((addr, port), _Handler)
+    server.registry = metrics
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http-server", daemon=True)
+    thread.start()
+    logging.getLogger(__name__).info(f"Serving the metrics on port {server.server_address[1]}.")
+    return server
+
+
+class TextfileWriter:
+    """
+    Write the metrics to a file periodically, for the textfile collector of the node exporter.
+    The file is replaced atomically, so the collector never reads a partial file.
+    """
+
+    def __init__(self, path: str | os.PathLike, interval: float = 15.0, metrics: Registry = registry):
+        """
+        :param path: The file to write, it should end with .prom for the node exporter
+        :param interval: The seconds between the writes
+        :param metrics: The registry to write
+        """
+        self.path = pathlib.Path(path)
+        self.interval = interval
+        self.metrics = metrics
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def write(self) -> None:
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(self.metrics.render(), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                logging.getLogger(__name__).warning(f"Failed to write the metrics to {self.path}: {e}")
+
+    def start(self) -> None:
+        """Start writing the file in the background."""
+        if self._thread is not None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-textfile-writer", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """Stop the background thread, and write the final values."""
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+        self.write()
@@ -0,0 +1,223 @@
+import contextlib
+import cProfile
+import io
+import json
+import logging
+import os
+import pathlib
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from cn_stats_data import tracing
+
+__all__ = ["MODES", "SamplingProfiler", "profile_run"]
+
+# the profilers, cprofile traces every call, and sampling takes the stacks of the threads periodically
+MODES = ("cprofile", "sampling")
+
+_TOP = 30
+
+
+class SamplingProfiler:
+    """
+    Take the stacks of all the threads periodically from a background thread.
+    The overhead doesn't depend on the count of the calls, so it suits a long crawl better than cProfile.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        """
+        :param interval: The seconds between the samples
+        """
+        self.interval = interval
+        self.samples = 0
+        self.stacks: Counter[Tuple[str, ...]] = Counter()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        names = {i.ident: i.name for i in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.stacks[tuple(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.interval):
+            self._sample()
+
+    def start(self) -> None:
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def folded(self) -> List[str]:
+        """Get the stacks in the folded format of flamegraph.pl, the root of a stack is the thread name."""
+        return [f"{';'.join(k)} {v}" for k, v in sorted(self.stacks.items())]
+
+    def top(self, limit: int = _TOP) -> List[Tuple[str, int, int]]:
+        """
+        Get the functions taking the most samples
+        :param limit: The count of the functions
+        :return: Returns the (function, self samples, total samples) in descending order of the self samples
+        """
+        own: Counter[str] = Counter()
+        total: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for i in set(stack[1:]):  # a recursive function is counted once per stack
+                total[i] += count
+        return [(i, count, total[i]) for i, count in own.most_common(limit)]
+
+
+def _phase_times(path: pathlib.Path) -> Dict[str, Tuple[int, float]]:
+    """Sum the spans of the trace by the name, the spans of a recursive phase are counted by the outermost one."""
+    spans = {}
+    with open(path, mode="r", encoding="utf-8") as f:
+        for line in f:
+            s = json.loads(line)
+            spans[s["span_id"]] = s
+
+    phases: Dict[str, List] = defaultdict(lambda: [0, 0.0])
+    for s in spans.values():
+        parent = spans.get(s["parent_id"])
+        while parent is not None and parent["name"] != s["name"]:
+            parent = spans.get(parent["parent_id"])
+        phases[s["name"]][0] += 1
+        if parent is None:
+            phases[s["name"]][1] += s["duration_us"] / 1e6
+    return {k: (v[0], v[1]) for k, v in phases.items()}
+
+
+def _write_report(
+    out: pathlib.Path,
+    name: str,
+    mode: str,
+    seconds: float,
+    profiler: cProfile.Profile | SamplingProfiler,
+    memory: Optional[Tuple[tracemalloc.Snapshot, tracemalloc.Snapshot, int]],
+    traced: bool,
+) -> None:
+    report = io.StringIO()
+    report.write(f"{name} profiled by {mode}, took {seconds:.3f}s.\n\n")
+
+    report.write("== Top functions ==\n")
+    if isinstance(profiler, cProfile.Profile):
+        profiler.dump_stats(out / "profile.pstats")
+        stats = pstats.Stats(profiler, stream=report)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(_TOP)
+    else:
+        (out / "samples.folded").write_text("\n".join(profiler.folded()) + "\n", encoding="utf-8")
+        report.write(f"{profiler.samples} samples every {profiler.interval * 1000:g}ms.\n")
+        report.write(f"{'self':>8} {'total':>8}  function\n")
+        for func, own, total in profiler.top():
+            report.write(f"{own:>8} {total:>8}  {func}\n")
+
+    report.write("\n== Phases ==\n")
+    if traced:
+        report.write(f"{'spans':>8} {'seconds':>10}  phase\n")
+        for phase, (count, total) in sorted(_phase_times(out / "trace.jsonl").items(), key=lambda i: -i[1][1]):
+            report.write(f"{count:>8} {total:>10.3f}  {phase}\n")
+    else:
+        report.write("Skipped, tracing was enabled before the run.\n")
+
+    report.write("\n== Allocations ==\n")
+    if memory is not None:
+        start, end, peak = memory
+        end.dump(str(out / "memory.snapshot"))
+        report.write(f"Peak traced memory {peak / 1024 / 1024:.1f}MiB, the top allocations grown by the run:\n")
+        ignored = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        for i in end.filter_traces(ignored).compare_to(start.filter_traces(ignored), "lineno")[:_TOP]:
+            report.write(f"{i}\n")
+    else:
+        report.write("Skipped, memory profiling is disabled.\n")
+
+    (out / "report.txt").write_text(report.getvalue(), encoding="utf-8")
+
+
+@contextlib.contextmanager
+def profile_run(
+    name: str,
+    mode: Optional[str] = None,
+    output_dir: Optional[str | os.PathLike] = None,
+    interval: float = 0.005,
+    memory: Optional[bool] = None,
+) -> Iterator[Optional[pathlib.Path]]:
+    """
+    Profile the block, and write the report and the artefacts into a timestamped directory.
+    The directory has report.txt with the top functions, the time per downloader phase and the top allocations,
+    profile.pstats (cprofile) or samples.folded (sampling), trace.jsonl of the phases and memory.snapshot.
+    :param name: The name of the run, the prefix of the directory
+    :param mode: One of MODES, or None for the CN_STATS_PROFILE environment variable, the block isn't profiled if
+        neither is set
+    :param output_dir: The parent of the directory, or None for the CN_STATS_PROFILE_DIR environment variable or
+        ./profiles
+    :param interval: The seconds between the samples of the sampling mode
+    :param memory: Whether to trace the allocations by tracemalloc, it slows down the run noticeably.
+        None for the CN_STATS_PROFILE_MEMORY environment variable (1 or 0), or only in the cprofile mode
+        if it isn't set, so the sampling mode stays cheap
+    :return: Yields the directory, or None if the block isn't profiled
+    """
+    mode = mode or os.environ.get("CN_STATS_PROFILE") or None
+    if mode is None:
+        yield None
+        return
+    if mode not in MODES:
+        raise ValueError(f"Unknown profiling mode {mode}, it should be one of {', '.join(MODES)}.")
+
+    parent = pathlib.Path(output_dir or os.environ.get("CN_STATS_PROFILE_DIR") or "profiles")
+    out = parent / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}"
+    out.mkdir(parents=True, exist_ok=True)
+
+    if memory is None:
+        env = os.environ.get("CN_STATS_PROFILE_MEMORY")
+        memory = env.lower() in ("1", "true", "yes") if env else mode == "cprofile"
+
+    traced = not tracing.is_enabled()  # the phases are timed by the spans of the downloaders
+    if traced:
+        tracing.enable(out / "trace.jsonl")
+    memory = memory and not tracemalloc.is_tracing()
+    if memory:
+        tracemalloc.start()
+        start_snapshot = tracemalloc.take_snapshot()
+    profiler = cProfile.Profile() if mode == "cprofile" else SamplingProfiler(interval)
+    if isinstance(profiler, cProfile.Profile):
+        profiler.enable()
+    else:
+        profiler.start()
+
+    started = time.perf_counter()
+    try:
+        yield out
+    finally:
+        seconds = time.perf_counter() - started
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+        else:
+            profiler.stop()
+        snapshots = None
+        if memory:
+            snapshots = (start_snapshot, tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        if traced:
+            tracing.disable()
+        _write_report(out, name, mode, seconds, profiler, snapshots, traced)
+        logging.getLogger(__name__).info(f"The profile of {name} is written to {out}.")
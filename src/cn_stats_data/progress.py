@@ -0,0 +1,240 @@
+import contextlib
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, Optional, Tuple
+
+from cn_stats_data import metrics
+
+__all__ = ["Progress", "configure", "track", "status"]
+
+_lock = threading.Lock()
+_active: Dict[str, "Progress"] = {}
+# the nodes of the tasks finished by this run or the earlier ones, they're the estimates when database is empty
+_finished: Dict[str, int] = {}
+_loaded = False
+_reporter: Optional[Tuple[threading.Thread, threading.Event]] = None
+
+_config = {
+    "status_path": None,
+    "interval": 30.0,
+    "window": 60.0,
+    "stall_seconds": 300.0,
+}
+
+
+class Progress:
+    """
+    The progress of a download task, e.g. the metric codes of a db code.
+    The throughput is measured over the recent `window` seconds, so the ETA follows the current speed of the crawl.
+    """
+
+    def __init__(self, name: str, total: Optional[int] = None, window: float = 60.0, stall_seconds: float = 300.0):
+        """
+        :param name: The name of the task
+        :param total: The estimated count of the nodes, or None if it's unknown
+        :param window: The seconds the rolling throughput is measured over
+        :param stall_seconds: The seconds without any progress the task is considered stalled after
+        """
+        self.name = name
+        self.total = total
+        self.window = window
+        self.stall_seconds = stall_seconds
+        self.done = 0
+        self.rows = 0
+        self.requests = 0
+        self.started = time.time()
+        self._started_monotonic = time.monotonic()
+        self._last_advanced = self._started_monotonic
+        self._recent: Deque[Tuple[float, int, int, int]] = deque()
+        self._lock = threading.Lock()
+
+    def advance(self, nodes: int = 1, rows: int = 0, requests: int = 0) -> None:
+        """
+        Record the work done
+        :param nodes: The nodes processed
+        :param rows: The rows received or saved
+        :param requests: The api requests sent
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.done += nodes
+            self.rows += rows
+            self.requests += requests
+            self._last_advanced = now
+            self._recent.append((now, nodes, rows, requests))
+            self._trim(now)
+
+    def _trim(self, now: float) -> None:
+        while self._recent and self._recent[0][0] < now - self.window:
+            self._recent.popleft()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get the progress as a JSON-serializable dict, with the rolling throughput, the ETA and the stall flag."""
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            seconds = max(min(self.window, now - self._started_monotonic), 1e-9)
+            nodes, rows, requests = (sum(i[k] for i in self._recent) for k in (1, 2, 3))
+            done, total, idle = self.done, self.total, now - self._last_advanced
+
+        nodes_per_second = nodes / seconds
+        eta = None
+        if total is not None and nodes_per_second > 0:
+            eta = max(total - done, 0) / nodes_per_second
+        return {
+            "name": self.name,
+            "done": done,
+            "total": total,
+            "rows": self.rows,
+            "requests": self.requests,
+            "started": self.started,
+            "elapsed_seconds": now - self._started_monotonic,
+            "nodes_per_second": nodes_per_second,
+            "rows_per_second": rows / seconds,
+            "requests_per_second": requests / seconds,
+            "eta_seconds": eta,
+            "idle_seconds": idle,
+            "stalled": idle >= self.stall_seconds,
+        }
+
+
+def configure(
+    status_path: Optional[str | os.PathLike] = None,
+    interval: Optional[float] = None,
+    window: Optional[float] = None,
+    stall_seconds: Optional[float] = None,
+) -> None:
+    """
+    Configure the progress reporting, the arguments not giving are kept
+    :param status_path: The JSON file the status of the tasks is written to, None for the CN_STATS_PROGRESS_FILE
+        environment variable, the status is only logged if neither is set
+    :param interval: The seconds between the reports
+    :param window: The seconds the rolling throughput is measured over
+    :param stall_seconds: The seconds without any progress a task is reported as stalled after
+    """
+    global _loaded
+
+    with _lock:
+        for k, v in (("status_path", status_path), ("interval", interval), ("window", window),
+                     ("stall_seconds", stall_seconds)):
+            if v is not None:
+                _config[k] = v
+        _loaded = False  # the history is loaded from the new status file
+
+
+def _status_path() -> Optional[pathlib.Path]:
+    path = _config["status_path"] or os.environ.get("CN_STATS_PROGRESS_FILE")
+    return pathlib.Path(path) if path else None
+
+
+def _load_history() -> None:
+    """Load the nodes of the tasks finished by the earlier runs from the status file, it's called with the lock."""
+    global _loaded
+
+    if _loaded:
+        return
+    _loaded = True
+    path = _status_path()
+    if path is None or not path.exists():
+        return
+    try:
+        _finished.update(json.loads(path.read_text(encoding="utf-8")).get("finished", {}))
+    except (OSError, ValueError) as e:
+        logging.getLogger(__name__).warning(f"Failed to read the progress history from {path}: {e}")
+
+
+def status() -> Dict[str, Any]:
+    """Get the status of the running tasks, and the nodes of the finished ones."""
+    with _lock:
+        tasks = list(_active.values())
+        finished = dict(_finished)
+    return {"time": time.time(), "tasks": [i.snapshot() for i in tasks], "finished": finished}
+
+
+def _format_seconds(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def _report(stalled: set) -> None:
+    logger = logging.getLogger(__name__)
+    data = status()
+    for i in data["tasks"]:
+        name = i["name"]
+        metrics.progress_nodes.set(i["done"], task=name, kind="done")
+        metrics.progress_nodes.set(i["total"] or 0, task=name, kind="total")
+        metrics.progress_eta_seconds.set(-1 if i["eta_seconds"] is None else i["eta_seconds"], task=name)
+        metrics.progress_stalled.set(int(i["stalled"]), task=name)
+        if i["stalled"]:
+            if name not in stalled:  # warned once per stall
+                stalled.add(name)
+                logger.warning(f"{name} has made no progress for {i['idle_seconds']:.0f}s.")
+            continue
+        stalled.discard(name)
+        eta = "unknown" if i["eta_seconds"] is None else _format_seconds(i["eta_seconds"])
+        logger.info(
+            f"Progress of {name}: {i['done']}/{i['total'] if i['total'] is not None else '?'}, "
+            f"{i['nodes_per_second']:.2f} nodes/s, {i['rows_per_second']:.1f} rows/s, "
+            f"{i['requests_per_second']:.2f} requests/s, ETA {eta}.")
+
+    path = _status_path()
+    if path is not None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(path.name + ".tmp")
+            tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Failed to write the progress to {path}: {e}")
+
+
+def _run(stopping: threading.Event) -> None:
+    stalled = set()
+    while not stopping.wait(_config["interval"]):
+        _report(stalled)
+
+
+@contextlib.contextmanager
+def track(name: str, total: Optional[int] = None) -> Iterator[Progress]:
+    """
+    Track the progress of a task, it's reported periodically from a background thread while any task is running.
+    :param name: The name of the task, e.g. download_metric_codes:hgnd
+    :param total: The estimated count of the nodes, or None or 0 to use the count of the last run finished
+    :return: Yields the progress, call `advance` for every node processed
+    """
+    global _reporter
+
+    with _lock:
+        _load_history()
+        p = Progress(name, total or _finished.get(name), _config["window"], _config["stall_seconds"])
+        _active[name] = p
+        if _reporter is None:
+            stopping = threading.Event()  # per reporter, so stopping the last one doesn't stop a new one
+            thread = threading.Thread(target=_run, args=(stopping,), name="progress-reporter", daemon=True)
+            _reporter = (thread, stopping)
+            thread.start()
+
+    succeeded = False
+    try:
+        yield p
+        succeeded = True
+    finally:
+        reporter = None
+        with _lock:
+            _active.pop(name, None)
+            if succeeded:
+                _finished[name] = p.done
+            if not _active:
+                reporter, _reporter = _reporter, None
+        if reporter is not None:
+            reporter[1].set()
+            reporter[0].join()
+        metrics.progress_nodes.set(p.done, task=name, kind="done")
+        metrics.progress_eta_seconds.set(0 if succeeded else -1, task=name)
+        metrics.progress_stalled.set(0, task=name)
+        _report(set())  # the final state, with the finished task
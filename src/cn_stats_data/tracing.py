@@ -0,0 +1,223 @@
+import argparse
+import contextvars
+import itertools
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional
+
+__all__ = ["Span", "JsonlExporter", "span", "enable", "disable", "is_enabled", "to_chrome_trace", "to_folded"]
+
+# the span the code is running in, it's per thread and per asyncio task
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("cn_stats_span", default=None)
+
+_ids = itertools.count(1)
+_exporter: Optional["JsonlExporter"] = None
+
+
+class Span:
+    """
+    A timed unit of work, nested in the span it's started in.
+    Use it by `with tracing.span(name, **attrs) as s:`, and add the row counts by `s.set(rows=...)`.
+    """
+
+    __slots__ = ("name", "span_id", "parent_id", "trace_id", "attrs", "start_ns", "_perf_ns", "_token")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        parent = _current.get()
+        self.name = name
+        self.span_id = next(_ids)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.trace_id = parent.trace_id if parent is not None else self.span_id
+        self.attrs = attrs
+        self.start_ns = 0
+        self._perf_ns = 0
+        self._token = None
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        self._token = _current.set(self)
+        self.start_ns = time.time_ns()
+        self._perf_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        duration_ns = time.perf_counter_ns() - self._perf_ns
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        exporter = _exporter
+        if exporter is not None:
+            try:
+                exporter.export(self, duration_ns)
+            except Exception:  # tracing never fails the traced code
+                logging.getLogger(__name__).warning(f"Failed to export the span {self.name}.", exc_info=True)
+
+
+class _NoopSpan:
+    """The span returned when tracing is disabled, it records nothing."""
+
+    __slots__ = ()
+
+    def set(self, **attrs) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **attrs) -> Span | _NoopSpan:
+    """
+    Start a span when it's used as a context manager, it's a shared no-op object if tracing is disabled.
+    :param name: The name of the span, e.g. fetch or db-write
+    :param attrs: The attributes of the span, e.g. the db code and the code of the node
+    """
+    if _exporter is None:
+        return _NOOP
+    return Span(name, attrs)
+
+
+class JsonlExporter:
+    """
+    Write the finished spans to a file, one JSON object per line.
+    The children are written before their parents, as they finish first.
+    The spans finishing after it's closed, e.g. in the other threads when tracing is disabled, are dropped.
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        """
+        :param path: The file to write, it's overwritten if it exists
+        """
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._file = open(self.path, mode="w", encoding="utf-8")
+
+    def export(self, s: Span, duration_ns: int) -> None:
+        line = json.dumps({
+            "name": s.name,
+            "trace_id": s.trace_id,
+            "span_id": s.span_id,
+            "parent_id": s.parent_id,
+            "start_us": s.start_ns // 1000,
+            "duration_us": duration_ns // 1000,
+            "pid": os.getpid(),
+            "thread": threading.current_thread().name,
+            "attrs": s.attrs,
+        }, ensure_ascii=False, default=str)
+        with self._lock:
+            if not self._closed:
+                self._file.write(line + "\n")
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            self._file.close()
+
+
+def enable(path: str | os.PathLike) -> JsonlExporter:
+    """
+    Start writing the spans to a JSONL file
+    :param path: The file to write
+    :return: Returns the exporter
+    """
+    global _exporter
+
+    disable()
+    _exporter = JsonlExporter(path)
+    logging.getLogger(__name__).info(f"Writing the tracing spans to {_exporter.path}.")
+    return _exporter
+
+
+def disable() -> None:
+    """Stop tracing and close the file, the spans not finished yet are dropped."""
+    global _exporter
+
+    exporter, _exporter = _exporter, None
+    if exporter is not None:
+        exporter.close()
+
+
+def is_enabled() -> bool:
+    return _exporter is not None
+
+
+def _read_spans(path: str | os.PathLike) -> Iterator[dict]:
+    with open(path, mode="r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def to_chrome_trace(path: str | os.PathLike) -> dict:
+    """
+    Convert the spans to the Chrome trace event format, it can be opened by chrome://tracing, Perfetto or speedscope.
+    :param path: The JSONL file of the spans
+    :return: Returns the trace, dump it as JSON
+    """
+    events = []
+    threads = {}
+    for s in _read_spans(path):
+        tid = threads.setdefault((s["pid"], s["thread"]), len(threads) + 1)
+        events.append({
+            "name": s["name"],
+            "cat": "cn_stats",
+            "ph": "X",
+            "ts": s["start_us"],
+            "dur": s["duration_us"],
+            "pid": s["pid"],
+            "tid": tid,
+            "args": s["attrs"],
+        })
+    for (pid, thread), tid in threads.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def to_folded(path: str | os.PathLike) -> List[str]:
+    """
+    Convert the spans to the folded stacks of flamegraph.pl, the value of a stack is the self time in microseconds.
+    :param path: The JSONL file of the spans
+    :return: Returns the lines, one per distinct stack
+    """
+    spans = {s["span_id"]: s for s in _read_spans(path)}
+    self_us = {i: s["duration_us"] for i, s in spans.items()}
+    for s in spans.values():
+        if s["parent_id"] in self_us:
+            self_us[s["parent_id"]] -= s["duration_us"]
+
+    stacks: Dict[str, int] = defaultdict(int)
+    for i, s in spans.items():
+        names = []
+        while s is not None:
+            names.append(s["name"])
+            s = spans.get(s["parent_id"])
+        stacks[";".join(reversed(names))] += max(self_us[i], 0)
+    return [f"{k} {v}" for k, v in sorted(stacks.items())]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert the tracing spans for the trace viewers.")
+    parser.add_argument("spans", help="The JSONL file written by tracing.enable")
+    parser.add_argument("output", help="The file to write")
+    parser.add_argument("--format", choices=["chrome", "folded"], default="chrome")
+    args = parser.parse_args()
+
+    with open(args.output, mode="w", encoding="utf-8") as out:
+        if args.format == "chrome":
+            json.dump(to_chrome_trace(args.spans), out)
+        else:
+            out.write("\n".join(to_folded(args.spans)) + "\n")
@@ -0,0 +1,67 @@
+import json
+import unittest
+
+from cn_stats_data import benchmark
+
+
+def _results(**seconds):
+    return {"environment": {"backend": "sqlite"},
+            "results": {k: {"median_seconds": v, "min_seconds": v} for k, v in seconds.items()}}
+
+
+class BenchmarkTests(unittest.TestCase):
+
+    def test_trees(self) -> None:
+        nodes = benchmark.metric_tree('deep', 4, 2)
+        self.assertEqual(1 + 2 + 4 + 8, len(nodes))
+        self.assertEqual('ZDEEP020202', nodes[-1].code)
+        self.assertEqual('ZDEEP0202', nodes[-1].parent.code)
+        self.assertEqual(200, len(benchmark.metric_tree('chain', 200, 1)))
+
+        regions = benchmark.region_tree(2, 3, 4)
+        self.assertEqual(2 + 2 * 3 + 2 * 3 * 4, len(regions))
+        self.assertEqual(['110100', '110200', '110300'], [i.code for i in regions[0].children])
+
+        # the same seed gives the same rows, and the keys are unique
+        data = benchmark.metric_data(2500, seed=1)
+        self.assertEqual([i.data for i in data], [i.data for i in benchmark.metric_data(2500, seed=1)])
+        self.assertEqual(2500, len({(i.metric_code, i.region_code, i.period) for i in data}))
+
+    def test_compare(self) -> None:
+        baseline = _results(**{'metric_data.insert[1000]': 1.0, 'metric_data.list[1000]': 0.001,
+                               'metric_code.list[deep]': 0.5})
+        current = _results(**{'metric_data.insert[1000]': 1.3, 'metric_data.list[1000]': 0.01,
+                              'metric_code.list[deep]': 0.55, 'region_code.list[all]': 9.0})
+
+        # the timing below the noise and the case not in the baseline are skipped
+        regressions = benchmark.compare(baseline, current, tolerance=0.2)
+        self.assertEqual(['metric_data.insert[1000]'], [i['key'] for i in regressions])
+        self.assertAlmostEqual(1.3, regressions[0]['ratio'])
+        self.assertEqual([], benchmark.compare(baseline, current, tolerance=0.5))
+
+    def test_run_sqlite(self) -> None:
+        results = benchmark.run('sqlite', [1500], repeat=2, trees={'deep': (6, 2), 'chain': (50, 1)}, regions=(2, 3, 4))
+        results = json.loads(json.dumps(results))  # saved as JSON
+
+        self.assertEqual('sqlite', results['environment']['backend'])
+        r = results['results']
+        for case in ('insert', 'update', 'list', 'list_metric', 'delete'):
+            self.assertEqual(2, len(r[f'metric_data.{case}[1500]']['seconds']))
+        self.assertEqual(1500, r['metric_data.list[1500]']['rows'])
+        self.assertEqual(1200, r['metric_data.list_metric[1500]']['rows'])
+        self.assertEqual(2 ** 6 - 1, r['metric_code.list[deep]']['rows'])
+        self.assertEqual(50, r['metric_code.list[chain]']['rows'])
+        self.assertEqual(2 ** 6 - 1 + 50, r['metric_code.list[all]']['rows'])
+        self.assertEqual(2 + 6 + 24, r['region_code.list[all]']['rows'])
+        self.assertEqual(1 + 3 + 12, r['region_code.list[province]']['rows'])
+
+        # compared with itself, nothing is slower
+        self.assertEqual([], benchmark.compare(results, results))
+
+    def test_postgres_needs_throwaway(self) -> None:
+        with self.assertRaises(ValueError):
+            benchmark.run('postgres', [10])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+from datetime import datetime
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from cn_stats_util.models import Category, HistoricalData
+from cn_stats_data.db.hierarchy_cache import hierarchy_cache
+from cn_stats_data.db.metric_data_dao import _SYNC_SQL
+from cn_stats_data.db.models import MetricHistoricalData, RegionCode
+from cn_stats_data.db.region_code_dao import _LOG_CHANGES_SQL, _SYNC_PARENT_SQL
+
+# psycopg 3 is installed by the optional extra "async"
+try:
+    from cn_stats_data.db.aio.metric_code_dao import AsyncMetricCodeDao
+    from cn_stats_data.db.aio.metric_data_dao import AsyncMetricDataDao
+    from cn_stats_data.db.aio.process_data_dao import AsyncProcessDataDao
+    from cn_stats_data.db.aio.region_code_dao import AsyncRegionCodeDao
+    HAS_PSYCOPG = True
+except ImportError:
+    HAS_PSYCOPG = False
+
+
+def _mock_conn(mock_get_conn) -> AsyncMock:
+    mock_cursor = AsyncMock()
+    mock_conn = MagicMock()
+    mock_conn.cursor.return_value.__aenter__.return_value = mock_cursor
+    mock_get_conn.return_value.__aenter__.return_value = mock_conn
+    return mock_cursor
+
+
+@unittest.skipUnless(HAS_PSYCOPG, "psycopg isn't installed")
+class AsyncDaoTests(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        hierarchy_cache.invalidate()
+
+    @patch('cn_stats_data.db.aio.region_code_dao.aio.get_conn')
+    async def test_region_code_list(self, mock_get_conn):
+        mock_cursor = _mock_conn(mock_get_conn)
+        mock_cursor.fetchall.return_value = [
+            ('110000', Category.CITY_ANNUAL.db_code, 'Beijing', 'Capital', ['110100'], {}, False, datetime(2024, 1, 1), datetime(2024, 1, 1), None, None),
+            ('110100', Category.CITY_ANNUAL.db_code, 'Dongcheng', 'District', None, {}, False, datetime(2024, 1, 1), datetime(2024, 1, 1), '110000', None),
+        ]
+
+        result = await AsyncRegionCodeDao.list(db_code=Category.CITY_ANNUAL)
+
+        self.assertEqual(len(result), 2)
+        root = next(i for i in result if i.code == '110000')
+        self.assertEqual([i.code for i in root.children], ['110100'])
+        self.assertEqual(mock_cursor.execute.call_args[0][1], (False, Category.CITY_ANNUAL.db_code, True, None))
+
+    @patch('cn_stats_data.db.aio.region_code_dao.aio.get_conn')
+    async def test_region_code_add_or_update_syncs_parents(self, mock_get_conn):
+        mock_cursor = _mock_conn(mock_get_conn)
+        mock_cursor.rowcount = 1
+        region = RegionCode(db_code=Category.CITY_ANNUAL.db_code, code='110000', name='Beijing', explanation=None, is_parent=False)
+
+        result = await AsyncRegionCodeDao.add_or_update([region])
+
+        self.assertEqual(result, 1)
+        mock_cursor.execute.assert_awaited_once_with(
+            _SYNC_PARENT_SQL + _LOG_CHANGES_SQL, {"db_code": Category.CITY_ANNUAL.db_code, "region_codes": ['110000']})
+
+    @patch('cn_stats_data.db.aio.metric_code_dao.aio.get_conn')
+    async def test_metric_code_hierarchy_is_cached(self, mock_get_conn):
+        mock_cursor = _mock_conn(mock_get_conn)
+        mock_cursor.fetchone.return_value = (2, datetime(2024, 1, 1))
+        mock_cursor.fetchall.return_value = [
+            ('A01', Category.MACRO_ANNUAL.db_code, 'Root', None, None, None, None, {}, False, datetime(2024, 1, 1), datetime(2024, 1, 1), None),
+            ('A0101', Category.MACRO_ANNUAL.db_code, 'Child', None, None, None, 'A01', {}, False, datetime(2024, 1, 1), datetime(2024, 1, 1), None),
+        ]
+
+        first = await AsyncMetricCodeDao.list_cached(Category.MACRO_ANNUAL, 'A01')
+        second = await AsyncMetricCodeDao.list_cached(Category.MACRO_ANNUAL, 'A01')
+
+        self.assertEqual([i.code for i in first], ['A01', 'A0101'])
+        self.assertEqual([i.code for i in second], ['A01', 'A0101'])
+        self.assertEqual(mock_cursor.fetchall.await_count, 1)
+
+    @patch('cn_stats_data.db.aio.metric_data_dao.aio.get_conn')
+    async def test_metric_data_sync_copies_rows(self, mock_get_conn):
+        mock_cursor = _mock_conn(mock_get_conn)
+        mock_copy = AsyncMock()
+        mock_cursor.copy = MagicMock()
+        mock_cursor.copy.return_value.__aenter__.return_value = mock_copy
+        mock_cursor.fetchone.return_value = (1, 0, 2)
+        data = [
+            HistoricalData(metric_code='A01', db_code='hgnd', period=2023, region_code=None, data=1.0, has_data=True),
+            HistoricalData(metric_code='A01', db_code='hgnd', period=2023, region_code=None, data=2.0, has_data=True),
+        ]
+
+        result = await AsyncMetricDataDao.sync('hgnd', ['A01'], [2023], data)
+
+        self.assertEqual(result, {"inserted": 1, "updated": 0, "deleted": 2})
+        mock_copy.write_row.assert_awaited_once()
+        self.assertEqual(mock_copy.write_row.call_args[0][0][:5], ('A01', 'hgnd', 2023, '', 2.0))
+        mock_cursor.execute.assert_any_await(
+            _SYNC_SQL, {"db_code": 'hgnd', "metric_codes": ['A01'], "date_nums": [2023]})
+
+    @patch('cn_stats_data.db.aio.metric_data_dao.aio.get_conn')
+    async def test_metric_data_list(self, mock_get_conn):
+        mock_cursor = _mock_conn(mock_get_conn)
+        mock_cursor.fetchall.return_value = [
+            ('A01', 'hgnd', 2023, '', 1.5, {}, False, datetime(2024, 1, 1), datetime(2024, 1, 1), 'hash'),
+        ]
+
+        result = await AsyncMetricDataDao.list(db_codes=['hgnd'])
+
+        self.assertEqual(len(result), 1)
+        self.assertIsInstance(result[0], MetricHistoricalData)
+        self.assertIsNone(result[0].region_code)
+        self.assertEqual(result[0].data, 1.5)
+
+    @patch('cn_stats_data.db.aio.process_data_dao.aio.get_conn')
+    async def test_process_data_get(self, mock_get_conn):
+        mock_cursor = _mock_conn(mock_get_conn)
+        mock_cursor.fetchone.return_value = ('p1', {"a": 1})
+
+        result = await AsyncProcessDataDao.get('p1')
+
+        self.assertEqual(result.process_id, 'p1')
+        self.assertEqual(result.data, '{"a": 1}')
+
+
+if __name__ == '__main__':
+    unittest.main()
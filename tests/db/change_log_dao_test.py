@@ -0,0 +1,59 @@
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+from cn_stats_data.db.change_log_dao import ChangeLogDao
+from cn_stats_data.db.models import ChangeEntity, ChangeOperation
+
+
+class ChangeLogDaoTests(unittest.TestCase):
+
+    def _mock_cursor(self, mock_get_conn) -> MagicMock:
+        mock_cursor = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_get_conn.return_value.__enter__.return_value = mock_conn
+        return mock_cursor
+
+    @patch('cn_stats_data.db.change_log_dao.db.get_conn')
+    def test_list_changed_since(self, mock_get_conn):
+        mock_cursor = self._mock_cursor(mock_get_conn)
+        mock_cursor.__iter__.return_value = iter([
+            (11, 'metric_code', 'insert', 'hgnd', 'A01', None, None, None, 'h1', datetime(2024, 1, 1)),
+            (12, 'metric_data', 'delete', 'fsnd', 'A01', '110000', 2023, 0.1, 'h2', datetime(2024, 1, 1)),
+            (13, 'metric_data', 'update', 'hgnd', 'A01', '', 2023, None, 'h3', datetime(2024, 1, 1)),
+        ])
+
+        result = list(ChangeLogDao.list_changed_since(10, [ChangeEntity.METRIC_CODE, ChangeEntity.METRIC_DATA], itersize=2))
+
+        self.assertEqual([11, 12, 13], [i.seq for i in result])
+        self.assertEqual(ChangeEntity.METRIC_CODE, result[0].entity)
+        self.assertEqual(ChangeOperation.DELETE, result[1].operation)
+        self.assertEqual('110000', result[1].region_code)
+        self.assertIsNone(result[2].region_code)
+        self.assertEqual(2, mock_cursor.itersize)
+        self.assertEqual((10, False, ['metric_code', 'metric_data']), mock_cursor.execute.call_args.args[1])
+        # streamed by a server side cursor
+        self.assertEqual('cn_stats_change_log', mock_get_conn.return_value.__enter__.return_value.cursor.call_args.kwargs['name'])
+
+    @patch('cn_stats_data.db.change_log_dao.db.get_conn')
+    def test_list_changed_since_all_entities(self, mock_get_conn):
+        mock_cursor = self._mock_cursor(mock_get_conn)
+        mock_cursor.__iter__.return_value = iter([])
+
+        self.assertEqual([], list(ChangeLogDao.list_changed_since()))
+        self.assertEqual((0, True, []), mock_cursor.execute.call_args.args[1])
+
+    @patch('cn_stats_data.db.change_log_dao.db.get_conn')
+    def test_get_last_seq_and_purge(self, mock_get_conn):
+        mock_cursor = self._mock_cursor(mock_get_conn)
+        mock_cursor.fetchone.return_value = (42,)
+        mock_cursor.rowcount = 42
+
+        self.assertEqual(42, ChangeLogDao.get_last_seq())
+        self.assertEqual(42, ChangeLogDao.purge(42))
+        self.assertEqual((42,), mock_cursor.execute.call_args.args[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from cn_stats_data.db.compaction import _COMPACT_SQL, compact, compact_table
+
+
+class CompactionTests(unittest.TestCase):
+
+    def _mock_cursor(self, mock_get_conn) -> MagicMock:
+        mock_cursor = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_get_conn.return_value.__enter__.return_value = mock_conn
+        return mock_cursor
+
+    @patch('cn_stats_data.db.compaction.db.get_conn')
+    def test_compact_table_in_batches(self, mock_get_conn):
+        mock_cursor = self._mock_cursor(mock_get_conn)
+        mock_cursor.fetchone.side_effect = [(100,), (100,), (30,)]
+
+        result = compact_table('cn_stats_metric_data', retention_days=30, batch_size=100, archive=False)
+
+        self.assertEqual(230, result)
+        # one transaction per batch, until a batch isn't full
+        self.assertEqual(3, mock_get_conn.call_count)
+        self.assertEqual(
+            {'retention_days': 30, 'batch_size': 100, 'archive': False},
+            mock_cursor.execute.call_args.args[1],
+        )
+
+    @patch('cn_stats_data.db.compaction.db.get_conn')
+    def test_compact(self, mock_get_conn):
+        mock_cursor = self._mock_cursor(mock_get_conn)
+        mock_cursor.fetchone.return_value = (0,)
+
+        result = compact(batch_size=100)
+
+        self.assertEqual({'cn_stats_metric_data': 0, 'cn_stats_metric_codes': 0, 'cn_stats_region_codes': 0}, result)
+        self.assertEqual(list(_COMPACT_SQL.values()), [i.args[0] for i in mock_cursor.execute.call_args_list])
+        # the closure links are purged with the metric codes
+        self.assertIn('cn_stats_metric_code_closure', _COMPACT_SQL['cn_stats_metric_codes'])
+
+    def test_compact_unknown_table(self):
+        with self.assertRaises(ValueError):
+            compact_table('process_data')
+
+    @patch('cn_stats_data.db.compaction.db.get_conn')
+    def test_compact_table_invalid_batch_size(self, mock_get_conn):
+        with self.assertRaises(ValueError):
+            compact_table('cn_stats_metric_data', batch_size=0)
+        mock_get_conn.assert_not_called()
+
+    def test_archive_columns_named(self):
+        # the archive table has the archived time appended, the columns are matched by name not position
+        self.assertNotIn('moved.*', _COMPACT_SQL['cn_stats_metric_data'])
+        self.assertIn(
+            'INSERT INTO cn_stats_metric_data_archive (metric_code, db_code, date_num, region_code, metric_value, '
+            'extra_attributes, row_hash, is_deleted, created_time, last_updated_time, archived_time)',
+            _COMPACT_SQL['cn_stats_metric_data'],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+from cn_stats_data.db.hierarchy_cache import HierarchyCache
+
+
+class HierarchyCacheTests(unittest.TestCase):
+
+    def test_reload_only_when_watermark_changed(self) -> None:
+        cache = HierarchyCache(max_entries=4, max_nodes=100)
+        loader = MagicMock(return_value=[1, 2, 3])
+
+        self.assertEqual([1, 2, 3], cache.get('a', lambda: 1, loader))
+        self.assertEqual([1, 2, 3], cache.get('a', lambda: 1, loader))
+        self.assertEqual(1, loader.call_count)
+
+        loader.return_value = [1, 2]
+        self.assertEqual([1, 2], cache.get('a', lambda: 2, loader))
+        self.assertEqual(2, loader.call_count)
+        self.assertEqual(2, cache.nodes)
+
+    def test_hit_not_blocked_by_loading(self) -> None:
+        cache = HierarchyCache(max_entries=4, max_nodes=100)
+        cache.get('a', lambda: 1, lambda: [1])
+        loading, release = threading.Event(), threading.Event()
+        self.addCleanup(release.set)
+
+        def slow_loader():
+            loading.set()
+            release.wait()
+            return [1, 2]
+
+        thread = threading.Thread(target=cache.get, args=('b', lambda: 1, slow_loader))
+        thread.start()
+        self.assertTrue(loading.wait(1))
+
+        # 'b' is being loaded, while 'a' is served from the cache, and watermarks of the others are read
+        watermark = MagicMock(return_value=1)
+        self.assertEqual([1], cache.get('a', watermark, MagicMock()))
+        watermark.assert_called_once()
+        release.set()
+        thread.join(1)
+        self.assertEqual([1, 2], cache.get('b', lambda: 1, MagicMock()))
+
+    def test_concurrent_misses_load_once(self) -> None:
+        cache = HierarchyCache(max_entries=4, max_nodes=100)
+        loading, release = threading.Event(), threading.Event()
+        self.addCleanup(release.set)
+        calls = []
+
+        def slow_loader():
+            calls.append(1)
+            loading.set()
+            release.wait()
+            return [1, 2]
+
+        threads = [threading.Thread(target=cache.get, args=('a', lambda: 1, slow_loader)) for _ in range(3)]
+        for i in threads:
+            i.start()
+        self.assertTrue(loading.wait(1))
+
+        # the other keys are loaded meanwhile
+        self.assertEqual([3], cache.get('b', lambda: 1, lambda: [3]))
+        release.set()
+        for i in threads:
+            i.join(1)
+        self.assertEqual(1, len(calls))
+        self.assertEqual(0, len(cache._loading))
+
+    def test_evict_least_recently_used(self) -> None:
+        cache = HierarchyCache(max_entries=2, max_nodes=5)
+        cache.get('a', lambda: 1, lambda: [1, 2])
+        cache.get('b', lambda: 1, lambda: [1, 2])
+        cache.get('a', lambda: 1, lambda: [1, 2])
+
+        # exceeds the max nodes, 'b' is the least recently used one
+        cache.get('c', lambda: 1, lambda: [1, 2, 3])
+
+        loader = MagicMock(return_value=[1, 2])
+        cache.get('a', lambda: 1, loader)
+        loader.assert_not_called()
+        cache.get('b', lambda: 1, loader)
+        loader.assert_called_once()
+        self.assertLessEqual(cache.nodes, 5)
+        self.assertLessEqual(len(cache), 2)
+
+    def test_too_large_is_not_cached(self) -> None:
+        cache = HierarchyCache(max_entries=2, max_nodes=2)
+        self.assertEqual([1, 2, 3], cache.get('a', lambda: 1, lambda: [1, 2, 3]))
+        self.assertEqual(0, len(cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
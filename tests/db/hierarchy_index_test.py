@@ -0,0 +1,71 @@
+import unittest
+
+from cn_stats_data.db.hierarchy_index import HierarchyIndex
+
+
+class HierarchyIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        # A
+        # ├── A1
+        # │   ├── A11
+        # │   └── A12
+        # └── A2
+        # B
+        self.index = HierarchyIndex(
+            [('A11', 'A1'), ('A', None), ('A1', 'A'), ('A2', 'A'), ('B', None), ('A12', 'A1')],
+            key=lambda i: i[0],
+            parent_key=lambda i: i[1],
+        )
+
+    def test_structure(self) -> None:
+        self.assertEqual(6, len(self.index))
+        self.assertEqual(['A', 'B'], [i[0] for i in self.index.roots])
+        self.assertEqual(['A1', 'A2'], [i[0] for i in self.index.children('A')])
+        self.assertEqual(['A11', 'A12'], [i[0] for i in self.index.children('A1')])
+        self.assertEqual('A1', self.index.parent('A12')[0])
+        self.assertIsNone(self.index.parent('A'))
+        self.assertEqual(2, self.index.depth('A11'))
+        self.assertEqual(0, self.index.depth('B'))
+        self.assertEqual(['A', 'A1'], [i[0] for i in self.index.ancestors('A11')])
+
+    def test_leaves(self) -> None:
+        self.assertEqual(['A11', 'A12', 'A2', 'B'], [i[0] for i in self.index.leaves])
+        self.assertEqual(['A11', 'A12', 'A2'], [i[0] for i in self.index.leaves_under('A')])
+        self.assertEqual(['A2'], [i[0] for i in self.index.leaves_under('A2')])
+        self.assertTrue(self.index.is_leaf('B'))
+        self.assertFalse(self.index.is_leaf('A1'))
+
+    def test_descendants(self) -> None:
+        self.assertEqual(['A', 'A1', 'A11', 'A12', 'A2'], [i[0] for i in self.index.descendants('A')])
+        self.assertEqual(['A11', 'A12'], [i[0] for i in self.index.descendants('A1', include_self=False)])
+        self.assertTrue(self.index.is_descendant('A12', 'A'))
+        self.assertFalse(self.index.is_descendant('A', 'A'))
+        self.assertTrue(self.index.is_descendant('A', 'A', include_self=True))
+        self.assertFalse(self.index.is_descendant('A2', 'A1'))
+        self.assertFalse(self.index.is_descendant('B', 'A'))
+
+    def test_parent_not_in_index(self) -> None:
+        index = HierarchyIndex([('A1', 'A'), ('A11', 'A1')], key=lambda i: i[0], parent_key=lambda i: i[1])
+        self.assertEqual(['A1'], [i[0] for i in index.roots])
+        self.assertEqual(['A11'], [i[0] for i in index.leaves_under('A1')])
+
+    def test_deep_tree(self) -> None:
+        depth = 100000
+        index = HierarchyIndex(
+            [(i, i - 1 if i > 0 else None) for i in range(depth)],
+            key=lambda i: i[0],
+            parent_key=lambda i: i[1],
+        )
+        self.assertEqual(depth - 1, index.depth(depth - 1))
+        self.assertEqual([(depth - 1, depth - 2)], index.leaves_under(0))
+        self.assertTrue(index.is_descendant(depth - 1, 0))
+
+    def test_cycle(self) -> None:
+        index = HierarchyIndex([('A', 'B'), ('B', 'A')], key=lambda i: i[0], parent_key=lambda i: i[1])
+        self.assertEqual(2, len(index.descendants('A')))
+        self.assertEqual(['A'], [i[0] for i in index.roots])
+
+
+if __name__ == '__main__':
+    unittest.main()
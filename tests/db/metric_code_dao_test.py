@@ -5,6 +5,7 @@ from unittest.mock import MagicMock, patch
 
 from cn_stats_util.models import Category
 from cn_stats_data.db.metric_code_dao import MetricCodeDao
+from cn_stats_data.db.models import MetricCode
 
 
 class MetricCodeDaoTests(unittest.TestCase):
@@ -20,10 +21,10 @@ class MetricCodeDaoTests(unittest.TestCase):
 
         # Mock the cursor to return some data
         mock_cursor.fetchall.return_value = [
-            ('A01', Category.CITY_ANNUAL.db_code, 'Metric 1', 'Explanation 1', 'Memo 1', 'Unit 1', None, {}, False, datetime(2024,1,1), datetime(2024,1,2)),
-            ('A02', Category.CITY_ANNUAL.db_code, 'Metric 2', 'Explanation 2', 'Memo 2', 'Unit 2', 'A01', {}, False, datetime(2024,2,1), datetime(2024,2,1)),
-            ('A03', Category.CITY_ANNUAL.db_code, 'Metric 3', 'Explanation 3', 'Memo 3', 'Unit 3', 'A01', {}, False, datetime(2024,1,1), datetime(2024,1,1)),
-            ('A04', Category.CITY_ANNUAL.db_code, 'Metric 4', 'Explanation 4', 'Memo 4', None, 'A02', {}, False, datetime(2024,1,1), datetime(2024,1,1)),
+            ('A01', Category.CITY_ANNUAL.db_code, 'Metric 1', 'Explanation 1', 'Memo 1', 'Unit 1', None, {}, False, datetime(2024,1,1), datetime(2024,1,2), None),
+            ('A02', Category.CITY_ANNUAL.db_code, 'Metric 2', 'Explanation 2', 'Memo 2', 'Unit 2', 'A01', {}, False, datetime(2024,2,1), datetime(2024,2,1), None),
+            ('A03', Category.CITY_ANNUAL.db_code, 'Metric 3', 'Explanation 3', 'Memo 3', 'Unit 3', 'A01', {}, False, datetime(2024,1,1), datetime(2024,1,1), None),
+            ('A04', Category.CITY_ANNUAL.db_code, 'Metric 4', 'Explanation 4', 'Memo 4', None, 'A02', {}, False, datetime(2024,1,1), datetime(2024,1,1), None),
         ]
 
         # Call the list function
@@ -56,6 +57,77 @@ class MetricCodeDaoTests(unittest.TestCase):
         self.assertFalse(a04.children)
 
 
+    @patch('cn_stats_data.db.metric_code_dao.db.get_conn')
+    def test_add_or_update_relinks_closure(self, mock_get_conn):
+        mock_cursor = MagicMock()
+        mock_cursor.rowcount = 2
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_get_conn.return_value.__enter__.return_value = mock_conn
+
+        # A01 is linked to its parent already, A02 is a new code
+        mock_cursor.fetchall.return_value = [('A01', 'A01', 0), ('A01', 'A', 1)]
+        parent = MetricCode(Category.CITY_ANNUAL.db_code, 'A', 'Metric', None, True)
+
+        result = MetricCodeDao.add_or_update([
+            MetricCode(Category.CITY_ANNUAL.db_code, 'A01', 'Metric 1', None, False, parent=parent),
+            MetricCode(Category.CITY_ANNUAL.db_code, 'A02', 'Metric 2', None, False, parent=parent),
+        ])
+
+        self.assertEqual(2, result)
+        relinked = [c.args[1]['metric_code'] for c in mock_cursor.execute.call_args_list if isinstance(c.args[1], dict)]
+        self.assertEqual(['A02', 'A02'], relinked)
+
+    @patch('cn_stats_data.db.metric_code_dao.db.get_conn')
+    def test_list_leaves(self, mock_get_conn):
+        mock_cursor = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_get_conn.return_value.__enter__.return_value = mock_conn
+
+        mock_cursor.fetchall.return_value = [
+            ('A03', Category.CITY_ANNUAL.db_code, 'Metric 3', 'Explanation 3', 'Memo 3', 'Unit 3', 'A01', {}, False, datetime(2024,1,1), datetime(2024,1,1), None),
+            ('A04', Category.CITY_ANNUAL.db_code, 'Metric 4', 'Explanation 4', 'Memo 4', None, 'A02', {}, False, datetime(2024,1,1), datetime(2024,1,1), None),
+        ]
+
+        result = MetricCodeDao.list_leaves(Category.CITY_ANNUAL, ['A01'])
+
+        mock_cursor.execute.assert_called_once()
+        self.assertEqual((Category.CITY_ANNUAL.db_code, False, ['A01']), mock_cursor.execute.call_args.args[1])
+        self.assertEqual(['A03', 'A04'], [i.code for i in result])
+        self.assertEqual(['A01', 'A02'], [i.parent.code for i in result])
+
+    @patch('cn_stats_data.db.metric_code_dao.db.get_conn')
+    def test_list_all_leaves(self, mock_get_conn):
+        mock_cursor = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_get_conn.return_value.__enter__.return_value = mock_conn
+        mock_cursor.fetchall.return_value = []
+
+        MetricCodeDao.list_leaves(Category.CITY_ANNUAL)
+
+        self.assertEqual((Category.CITY_ANNUAL.db_code, True, []), mock_cursor.execute.call_args.args[1])
+        # the leaves under a deleted ancestor are excluded by its links in the closure table
+        sql = ' '.join(mock_cursor.execute.call_args.args[0].split())
+        self.assertIn('x.metric_code = d.ancestor_code AND x.is_deleted = TRUE', sql)
+        self.assertIn('d.descendant_code = m.metric_code AND d.depth > 0', sql)
+
+    @patch('cn_stats_data.db.metric_code_dao.db.get_conn')
+    def test_get_watermark(self, mock_get_conn):
+        mock_cursor = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_get_conn.return_value.__enter__.return_value = mock_conn
+
+        mock_cursor.fetchone.return_value = (3, datetime(2024,1,1), 7)
+
+        result = MetricCodeDao.get_watermark(Category.CITY_ANNUAL)
+
+        self.assertEqual((3, datetime(2024,1,1), 7), result)
+        self.assertEqual({'db_code': Category.CITY_ANNUAL.db_code}, mock_cursor.execute.call_args.args[1])
+        self.assertIn('cn_stats_change_log', mock_cursor.execute.call_args.args[0])
+
     def test_get_func(self) -> None:
         metric_code = MetricCodeDao.get('A01', Category.MACRO_ANNUAL)        
         self.assertIsNotNone(metric_code)
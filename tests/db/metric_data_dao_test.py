@@ -1,12 +1,136 @@
 import unittest
+from unittest.mock import MagicMock, patch
 
-from cn_stats_data.db.metric_data_dao import MetricDataDao
+from cn_stats_data.db.hierarchy_cache import series_cache
+from cn_stats_data.db.metric_data_dao import (
+    MetricDataDao, _LOG_CHANGES_SQL, _SYNC_CREATE_SQL, _SYNC_LOG_CHANGES_SQL, _SYNC_SQL)
 
 from cn_stats_data.db.models import MetricCode, RegionCode, MetricHistoricalData
 from cn_stats_util.models import Category
 
 class MetricDataDaoTests(unittest.TestCase):
 
+    @patch('cn_stats_data.db.metric_data_dao.execute_values')
+    @patch('cn_stats_data.db.metric_data_dao.db.get_conn')
+    def test_sync(self, mock_get_conn, mock_execute_values):
+        mock_cursor = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_get_conn.return_value.__enter__.return_value = mock_conn
+        mock_cursor.fetchone.return_value = (1, 2, 3)
+
+        data = [
+            MetricHistoricalData('A01', Category.MACRO_ANNUAL.db_code, None, 2023, 0.1, True),
+            MetricHistoricalData('A01', Category.MACRO_ANNUAL.db_code, None, 2024, 0.2, True),
+            MetricHistoricalData('A01', Category.MACRO_ANNUAL.db_code, None, 2024, 0.3, True),
+        ]
+        result = MetricDataDao.sync(Category.MACRO_ANNUAL.db_code, ['A01'], [2023, 2024], data)
+
+        self.assertEqual({'inserted': 1, 'updated': 2, 'deleted': 3}, result)
+        # the duplicated key is loaded once, and the last one wins
+        rows = mock_execute_values.call_args.args[2]
+        self.assertEqual([2023, 2024], [i[2] for i in rows])
+        self.assertEqual(0.3, rows[1][4])
+        self.assertEqual(
+            {'db_code': Category.MACRO_ANNUAL.db_code, 'metric_codes': ['A01'], 'date_nums': [2023, 2024]},
+            mock_cursor.execute.call_args.args[1],
+        )
+        # the change log is locked after the data is written, right before it's appended
+        self.assertEqual([_SYNC_CREATE_SQL, _SYNC_SQL, _SYNC_LOG_CHANGES_SQL],
+                         [c.args[0] for c in mock_cursor.execute.call_args_list])
+        self.assertNotIn('pg_advisory_xact_lock', _SYNC_SQL)
+        self.assertIn('(t.xmax = 0) AS inserted', _SYNC_SQL)
+
+    @patch('cn_stats_data.db.metric_data_dao.db.get_conn')
+    def test_add_or_update_marks_rollups(self, mock_get_conn):
+        mock_cursor = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_get_conn.return_value.__enter__.return_value = mock_conn
+        mock_cursor.rowcount = 2
+
+        data = [
+            MetricHistoricalData('A01', Category.MACRO_MONTHLY.db_code, None, 202401, 0.1, True),
+            MetricHistoricalData('A01', Category.MACRO_MONTHLY.db_code, '110000', 202402, 0.2, True),
+        ]
+        self.assertEqual(2, MetricDataDao.add_or_update(data))
+
+        # the keys of the saved rows, the roll-up buckets of the changed ones are recorded
+        self.assertEqual(
+            (['A01', 'A01'], [Category.MACRO_MONTHLY.db_code] * 2, [202401, 202402], ['', '110000']),
+            mock_cursor.execute.call_args.args[1],
+        )
+        # and the changed rows are appended to the change log at last
+        self.assertEqual(_LOG_CHANGES_SQL, mock_cursor.execute.call_args.args[0])
+
+    @patch('cn_stats_data.db.metric_data_dao.db.get_conn')
+    def test_series(self, mock_get_conn):
+        mock_cursor = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_get_conn.return_value.__enter__.return_value = mock_conn
+        mock_cursor.fetchall.return_value = [(2022, 0.1), (2023, None)]
+
+        result = MetricDataDao.series(Category.MACRO_ANNUAL.db_code, 'A01', start=2022)
+
+        self.assertEqual([(2022, 0.1), (2023, None)], result)
+        # the range bound not given is switched off by its flag
+        self.assertEqual(
+            (Category.MACRO_ANNUAL.db_code, 'A01', '', False, 2022, True, None),
+            mock_cursor.execute.call_args.args[1],
+        )
+
+    @patch('cn_stats_data.db.metric_data_dao.db.get_conn')
+    def test_get_series_watermark(self, mock_get_conn):
+        mock_cursor = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_get_conn.return_value.__enter__.return_value = mock_conn
+        mock_cursor.fetchone.return_value = (2, 1, 5)
+
+        result = MetricDataDao.get_series_watermark(Category.MACRO_ANNUAL.db_code, 'A01')
+
+        self.assertEqual((2, 1, 5), result)
+        # the data without region is logged with the empty region code
+        self.assertEqual(
+            {'db_code': Category.MACRO_ANNUAL.db_code, 'metric_code': 'A01', 'region_code': ''},
+            mock_cursor.execute.call_args.args[1],
+        )
+
+    def test_series_cached(self):
+        series_cache.invalidate()
+        with patch.object(MetricDataDao, 'get_series_watermark', return_value=(2, 1)) as mock_watermark, \
+                patch.object(MetricDataDao, 'series', return_value=[(2022, 0.1), (2023, 0.2)]) as mock_series:
+            MetricDataDao.series_cached(Category.CITY_ANNUAL.db_code, 'A01', '110000', 2022, 2023)
+            result = MetricDataDao.series_cached(Category.CITY_ANNUAL.db_code, 'A01', '110000', 2022, 2023)
+            self.assertEqual([(2022, 0.1), (2023, 0.2)], result)
+            mock_series.assert_called_once_with(Category.CITY_ANNUAL.db_code, 'A01', '110000', 2022, 2023)
+
+            # another range is another entry
+            MetricDataDao.series_cached(Category.CITY_ANNUAL.db_code, 'A01', '110000', 2023, 2023)
+            self.assertEqual(2, mock_series.call_count)
+
+            # reloaded once the series is changed
+            mock_watermark.return_value = (2, 2)
+            MetricDataDao.series_cached(Category.CITY_ANNUAL.db_code, 'A01', '110000', 2022, 2023)
+            self.assertEqual(3, mock_series.call_count)
+
+    @patch('cn_stats_data.db.metric_data_dao.db.get_conn')
+    def test_list_values(self, mock_get_conn):
+        mock_cursor = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_get_conn.return_value.__enter__.return_value = mock_conn
+        mock_cursor.fetchall.return_value = [('A01', 2023, '', 0.1, 'h1'), ('A01', 2024, '110000', None, 'h2')]
+
+        result = MetricDataDao.list_values(Category.CITY_ANNUAL.db_code, ['A01'], region_codes=[None, '110000'])
+
+        self.assertEqual({('A01', 2023, None): (0.1, 'h1'), ('A01', 2024, '110000'): (None, 'h2')}, result)
+        self.assertEqual(
+            (Category.CITY_ANNUAL.db_code, ['A01'], False, ['', '110000'], True, []),
+            mock_cursor.execute.call_args.args[1],
+        )
+
     def test_list_func(self) -> None:
         lst = MetricDataDao.list()
         self.assertIsNotNone(lst)
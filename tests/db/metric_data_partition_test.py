@@ -0,0 +1,39 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from cn_stats_util.models import Category
+from cn_stats_data.db import metric_data_partition
+
+
+class MetricDataPartitionTests(unittest.TestCase):
+
+    def test_get_year_bounds(self) -> None:
+        db_code = MagicMock()
+        db_code.get_periods_from_years.side_effect = lambda years: [years[0] * 100 + m for m in range(1, 13)]
+
+        lower, upper = metric_data_partition.get_year_bounds(db_code, 2024)
+
+        self.assertEqual(202401, lower)
+        self.assertEqual(202501, upper)
+
+    @patch('cn_stats_data.db.metric_data_partition.db.get_conn')
+    def test_ensure_partitions_skips_existing(self, mock_get_conn):
+        mock_cursor = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_get_conn.return_value.__enter__.return_value = mock_conn
+
+        # the db code partition exists, the year partitions don't
+        mock_cursor.fetchone.side_effect = [(True,), (False,), (False,)]
+
+        created = metric_data_partition.ensure_partitions([Category.MACRO_ANNUAL], [2025, 2024, 2025])
+
+        db_code = Category.MACRO_ANNUAL.db_code
+        self.assertEqual(
+            [f'cn_stats_metric_data_{db_code}_2024', f'cn_stats_metric_data_{db_code}_2025'],
+            created,
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from cn_stats_data.db import migration
+from cn_stats_data.db.metric_code_dao import _metric_code_params
+from cn_stats_data.db.metric_data_dao import _metric_data_params
+from cn_stats_data.db.models import MetricCode, MetricHistoricalData, RegionCode
+from cn_stats_data.db.region_code_dao import _region_code_params
+
+
+class MigrationTests(unittest.TestCase):
+
+    def test_list_migrations(self) -> None:
+        versions = [p.stem for p in migration.list_migrations()]
+        self.assertGreater(len(versions), 0)
+        self.assertEqual(sorted(versions), versions)
+        self.assertEqual('0001_region_parent_code', versions[0])
+
+    @patch('cn_stats_data.db.migration.db.get_conn')
+    def test_apply_migrations_skips_applied(self, mock_get_conn):
+        mock_cursor = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_get_conn.return_value.__enter__.return_value = mock_conn
+
+        versions = [p.stem for p in migration.list_migrations()]
+        mock_cursor.fetchall.return_value = [(versions[0],)]
+        mock_cursor.fetchmany.return_value = []
+
+        applied = migration.apply_migrations()
+
+        self.assertEqual(versions[1:], applied)
+        recorded = [
+            c.args[1][0] for c in mock_cursor.execute.call_args_list
+            if len(c.args) > 1 and 'schema_migrations' in c.args[0]
+        ]
+        self.assertEqual(versions[1:], recorded)
+
+    def test_row_hash_backfill(self) -> None:
+        path = next(p for p in migration.list_migrations() if p.stem == '0011_row_hash_backfill')
+        module = migration._load_python_migration(path)
+
+        # the rows saved before the row_hash column, as they are read back from the database
+        tables = {
+            'cn_stats_metric_codes': [('hgnd', 'A0101', 'GDP', None, None, '亿元', 'A01', {'sort': 1}, None)],
+            'cn_stats_region_codes': [('fsnd', '110000', '北京', None, ['110100'], {}, None),
+                                      ('fsnd', '110100', '市辖区', None, [], {}, None)],
+            'cn_stats_metric_data': [('hgnd', 'A0101', 2023, '', 12.0, {}, None),
+                                     ('hgnd', 'A0101', 2024, '', 13.5, {}, 'f' * 32)],
+        }
+        # the same rows downloaded again
+        parent = MetricCode(db_code='hgnd', code='A01', name='A01', explanation=None, is_parent=True)
+        downloaded = [
+            _metric_code_params(MetricCode(db_code='hgnd', code='A0101', name='GDP', explanation=None,
+                                           is_parent=False, unit='亿元', parent=parent, sort=1)),
+            _region_code_params(RegionCode(db_code='fsnd', code='110000', name='北京', explanation=None, is_parent=True,
+                                           children=[RegionCode(db_code='fsnd', code='110100', name=None,
+                                                                explanation=None, is_parent=False)])),
+            _region_code_params(RegionCode(db_code='fsnd', code='110100', name='市辖区', explanation=None,
+                                           is_parent=False, children=[])),
+            _metric_data_params(MetricHistoricalData('A0101', 'hgnd', None, 2023, 12, True)),
+            _metric_data_params(MetricHistoricalData('A0101', 'hgnd', None, 2024, 13.5, True)),
+        ]
+
+        conn = MagicMock()
+        reader = MagicMock()
+        conn.cursor.return_value.__enter__.return_value = reader
+        # a batch of the table selected, then the end of it
+        reader.fetchmany.side_effect = lambda size: tables.pop(
+            next((t for t in tables if t in reader.execute.call_args.args[0]), None), [])
+
+        with patch.object(module, 'execute_values') as mock_execute_values:
+            module.migrate(conn)
+
+        backfilled = [row for c in mock_execute_values.call_args_list for row in c.args[2]]
+        # every row is hashed as the DAOs hash the downloaded one, so an unchanged re-sync updates nothing
+        self.assertEqual([i[-1] for i in downloaded], [i[-1] for i in backfilled])
+        self.assertEqual(('hgnd', 'A0101', 2024, ''), backfilled[-1][:4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+from cn_stats_util.models import Category
+from cn_stats_data.db.panel import Panel, load_panel
+
+
+class PanelTests(unittest.TestCase):
+
+    def test_fill(self) -> None:
+        panel = Panel('fsnd', ['A01', 'A02'], ['110000', '120000', '130000'], [2022, 2023])
+
+        count = panel.fill([(0, 0, 2022, 1.0), (1, 2, 2023, None), (0, 1, 2023, 3.0), (0, 0, 2021, 9.0)])
+
+        # the period out of the axis is ignored
+        self.assertEqual(3, count)
+        self.assertEqual((2, 3, 2), panel.shape)
+        self.assertEqual(1.0, panel.values[0, 0, 0])
+        self.assertEqual(3.0, panel.values[0, 1, 1])
+        self.assertTrue(np.isnan(panel.values[1, 2, 1]))
+        self.assertEqual(2, int((~panel.mask).sum()))
+        self.assertTrue(panel.mask[1, 2, 1])
+        self.assertAlmostEqual(4.0, float(panel.masked().sum()))
+
+    @patch('cn_stats_data.db.panel.MetricDataDao')
+    @patch('cn_stats_data.db.panel.RegionCodeDao')
+    @patch('cn_stats_data.db.panel.MetricCodeDao')
+    def test_load_panel(self, mock_metric_code_dao, mock_region_code_dao, mock_metric_data_dao) -> None:
+        mock_metric_code_dao.list_leaves.return_value = [MagicMock(code='A01'), MagicMock(code='A02')]
+        mock_region_code_dao.list_cached.return_value = [MagicMock(code='110000'), MagicMock(code='120000')]
+        mock_metric_data_dao.iter_panel_values.return_value = iter([[(0, 1, 2023, 2.0)], [(1, 0, 2022, 5.0)]])
+
+        panel = load_panel(Category.PROVINCIAL_ANNUAL, [2023, 2022])
+
+        self.assertEqual(['A01', 'A02'], panel.metric_codes)
+        self.assertEqual(['110000', '120000'], panel.region_codes)
+        self.assertEqual([2022, 2023], panel.periods.tolist())
+        mock_metric_data_dao.iter_panel_values.assert_called_once_with(
+            Category.PROVINCIAL_ANNUAL.db_code, ['A01', 'A02'], ['110000', '120000'], 2022, 2023, 10000)
+        self.assertEqual(2.0, panel.values[0, 1, 1])
+        self.assertEqual(5.0, panel.values[1, 0, 0])
+        self.assertEqual(2, int((~panel.mask).sum()))
+
+    @patch('cn_stats_data.db.panel.MetricDataDao')
+    @patch('cn_stats_data.db.panel.RegionCodeDao')
+    def test_load_panel_without_regions(self, mock_region_code_dao, mock_metric_data_dao) -> None:
+        mock_metric_data_dao.iter_panel_values.return_value = iter([])
+
+        panel = load_panel(Category.MACRO_ANNUAL, [2023], metric_codes=['A01'])
+
+        self.assertEqual([None], panel.region_codes)
+        mock_region_code_dao.list_cached.assert_not_called()
+        self.assertTrue(panel.mask.all())
+
+
+if __name__ == '__main__':
+    unittest.main()
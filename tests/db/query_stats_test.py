@@ -0,0 +1,90 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import psycopg2
+
+from cn_stats_data import db, metrics
+from cn_stats_data.db import query_stats
+from cn_stats_data.db.compaction import _COMPACT_SQL
+from cn_stats_data.db.db_config import QueryStatsConfig
+from cn_stats_data.db.metric_code_dao import _GET_SQL, _LOG_CHANGES_SQL
+
+
+class QueryStatsTests(unittest.TestCase):
+
+    def setUp(self):
+        query_stats.reset()
+        metrics.registry.clear()
+
+    def test_statement_name(self) -> None:
+        self.assertEqual('metric_code_dao._GET_SQL', query_stats.statement_name(_GET_SQL))
+        self.assertEqual(
+            'compaction._COMPACT_SQL[cn_stats_metric_data]',
+            query_stats.statement_name(_COMPACT_SQL['cn_stats_metric_data']))
+
+        @metrics.instrument_dao
+        class SampleDao:
+
+            @classmethod
+            def add(cls, sql):
+                return query_stats.statement_name(sql)
+
+        # the statements built at runtime are named by the DAO method
+        self.assertEqual('SampleDao.add', SampleDao.add(b'INSERT INTO t VALUES (1), (2)'))
+        self.assertEqual('other', query_stats.statement_name('SELECT 1'))
+
+    def test_record(self) -> None:
+        for i in range(1, 101):
+            query_stats.record(_GET_SQL, ('hgnd',), i / 1000, rows=2)
+        query_stats.record(_GET_SQL, ('hgnd',), 0.5, rows=-1)
+        query_stats.record_connect(0.25)
+
+        stats = query_stats.snapshot()
+        self.assertEqual(['metric_code_dao._GET_SQL', query_stats.CONNECT], [i['name'] for i in stats])
+        self.assertEqual(101, stats[0]['calls'])
+        self.assertEqual(200, stats[0]['rows'])
+        self.assertAlmostEqual(0.051, stats[0]['p50_seconds'])
+        self.assertAlmostEqual(0.5, stats[0]['max_seconds'])
+        self.assertEqual(101, metrics.db_query_seconds.get_count(statement='metric_code_dao._GET_SQL'))
+        self.assertEqual(1, metrics.db_connect_seconds.get_count())
+        self.assertIn('metric_code_dao._GET_SQL', query_stats.report().splitlines()[1])
+
+    def test_slow_query_log(self) -> None:
+        config = QueryStatsConfig(slow_query_ms=100, max_param_chars=20)
+        with patch.object(db, 'query_stats_config', config):
+            with self.assertNoLogs('cn_stats_data.db.slow_query'):
+                query_stats.record(_GET_SQL, ('hgnd',), 0.05)
+            with self.assertLogs('cn_stats_data.db.slow_query', level='WARNING') as logs:
+                query_stats.record(_GET_SQL, ['x' * 100], 0.2, rows=3, plan='Seq Scan on cn_stats_metric_codes')
+
+        self.assertIn('Slow query metric_code_dao._GET_SQL took 200ms, 3 rows', logs.output[0])
+        self.assertIn("['xxxxxxxxxxxxxxxxxx... (104 chars)", logs.output[0])
+        self.assertTrue(logs.output[0].endswith('\nSeq Scan on cn_stats_metric_codes'))
+
+    def test_explain(self) -> None:
+        conn = MagicMock()
+        conn.autocommit = False
+        cursor = conn.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [('Index Scan',), ('  Index Cond: (db_code = hgnd)',)]
+
+        plan = query_stats.explain(conn, _GET_SQL, ('hgnd',))
+
+        self.assertEqual('Index Scan\n  Index Cond: (db_code = hgnd)', plan)
+        self.assertEqual(
+            ['SAVEPOINT cn_stats_explain', 'EXPLAIN ' + _GET_SQL.rstrip('; \n'), 'RELEASE SAVEPOINT cn_stats_explain'],
+            [i.args[0] for i in cursor.execute.call_args_list])
+
+        # a failed EXPLAIN doesn't abort the transaction of the DAO
+        cursor.execute.reset_mock()
+        cursor.execute.side_effect = [None, psycopg2.Error('syntax error'), None]
+        self.assertEqual('Failed to explain: syntax error', query_stats.explain(conn, _GET_SQL))
+        self.assertEqual('ROLLBACK TO SAVEPOINT cn_stats_explain', cursor.execute.call_args.args[0])
+
+        # EXPLAIN only applies to the first command, the others would be executed
+        cursor.execute.reset_mock()
+        self.assertEqual('Not explained, the SQL has multiple commands.', query_stats.explain(conn, _LOG_CHANGES_SQL))
+        cursor.execute.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
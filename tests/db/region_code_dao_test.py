@@ -20,10 +20,10 @@ class RegionCodeDaoTests(unittest.TestCase):
 
         # Mock the cursor to return some data
         mock_cursor.fetchall.return_value = [
-            ('110000', Category.CITY_ANNUAL.db_code, 'Beijing', 'Capital', ['110100', '110200'], {}, False, datetime(2024,1,1), datetime(2024,1,2), None),
-            ('110100', Category.CITY_ANNUAL.db_code, 'Dongcheng', 'District', ['110101'], {}, False, datetime(2024,2,1), datetime(2024,2,1), '110000'),
-            ('110200', Category.CITY_ANNUAL.db_code, 'Xicheng', 'District', None, {}, False, datetime(2024,1,1), datetime(2024,1,1), '110000'),
-            ('110101', Category.CITY_ANNUAL.db_code, 'Street1', 'Street', None, {}, False, datetime(2024,1,1), datetime(2024,1,1), '110100'),
+            ('110000', Category.CITY_ANNUAL.db_code, 'Beijing', 'Capital', ['110100', '110200'], {}, False, datetime(2024,1,1), datetime(2024,1,2), None, None),
+            ('110100', Category.CITY_ANNUAL.db_code, 'Dongcheng', 'District', ['110101'], {}, False, datetime(2024,2,1), datetime(2024,2,1), '110000', None),
+            ('110200', Category.CITY_ANNUAL.db_code, 'Xicheng', 'District', None, {}, False, datetime(2024,1,1), datetime(2024,1,1), '110000', None),
+            ('110101', Category.CITY_ANNUAL.db_code, 'Street1', 'Street', None, {}, False, datetime(2024,1,1), datetime(2024,1,1), '110100', None),
         ]
 
         # Call the list function
@@ -60,6 +60,35 @@ class RegionCodeDaoTests(unittest.TestCase):
         self.assertEqual(street.parent.code, '110100')
         self.assertIsNone(street.children)
 
+    @patch('cn_stats_data.db.region_code_dao.db.get_conn')
+    def test_add_or_update_syncs_parent_region_code(self, mock_get_conn):
+        mock_cursor = MagicMock()
+        mock_cursor.rowcount = 3
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_get_conn.return_value.__enter__.return_value = mock_conn
+
+        result = RegionCodeDao.add_or_update([
+            RegionCode(Category.CITY_ANNUAL.db_code, '110000', 'Beijing', 'Capital', False),
+            RegionCode(Category.CITY_ANNUAL.db_code, '120000', 'Tianjin', 'City', False),
+            RegionCode(Category.PROVINCIAL_ANNUAL.db_code, '00', 'China', 'Country', False),
+        ])
+
+        self.assertEqual(3, result)
+        mock_cursor.executemany.assert_called_once()
+        # the parent pointers are synchronized once per db code
+        self.assertEqual(2, mock_cursor.execute.call_count)
+        params = sorted(
+            (c.args[1]['db_code'], c.args[1]['region_codes']) for c in mock_cursor.execute.call_args_list
+        )
+        self.assertEqual(
+            sorted([
+                (Category.CITY_ANNUAL.db_code, ['110000', '120000']),
+                (Category.PROVINCIAL_ANNUAL.db_code, ['00']),
+            ]),
+            params,
+        )
+
     def test_get_func(self) -> None:
         region_code = RegionCodeDao.get('00', Category.PROVINCIAL_ANNUAL)
         self.assertIsNotNone(region_code)
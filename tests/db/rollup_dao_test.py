@@ -0,0 +1,72 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from cn_stats_util.models import Category
+from cn_stats_data.db.models import Aggregation, RollupLevel, RollupRule
+from cn_stats_data.db.rollup_dao import RollupDao, _REFRESH_SQL
+
+
+class RollupDaoTests(unittest.TestCase):
+
+    def _mock_cursor(self, mock_get_conn) -> MagicMock:
+        mock_cursor = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_get_conn.return_value.__enter__.return_value = mock_conn
+        return mock_cursor
+
+    @patch('cn_stats_data.db.rollup_dao.db.get_conn')
+    def test_add_or_update_rules(self, mock_get_conn):
+        mock_cursor = self._mock_cursor(mock_get_conn)
+        mock_cursor.rowcount = 1
+
+        result = RollupDao.add_or_update_rules([RollupRule(Category.MACRO_MONTHLY.db_code, 'A01', Aggregation.SUM)])
+
+        self.assertEqual(1, result)
+        self.assertEqual([(Category.MACRO_MONTHLY.db_code, 'A01', 'sum')], mock_cursor.executemany.call_args.args[1])
+        # the buckets of the new rule are recorded to be computed
+        mock_cursor.execute.assert_called_once()
+
+    @patch('cn_stats_data.db.rollup_dao.db.get_conn')
+    def test_add_or_update_rules_of_annual_category(self, mock_get_conn):
+        with self.assertRaises(ValueError):
+            RollupDao.add_or_update_rules([RollupRule(Category.MACRO_ANNUAL.db_code, 'A01', Aggregation.AVG)])
+        mock_get_conn.assert_not_called()
+
+    @patch('cn_stats_data.db.rollup_dao.db.get_conn')
+    def test_refresh(self, mock_get_conn):
+        mock_cursor = self._mock_cursor(mock_get_conn)
+        mock_cursor.rowcount = 3
+
+        self.assertEqual(3, RollupDao.refresh(Category.MACRO_MONTHLY.db_code))
+
+        self.assertEqual((False, Category.MACRO_MONTHLY.db_code), mock_cursor.execute.call_args_list[0].args[1])
+        self.assertEqual(
+            [_REFRESH_SQL[RollupLevel.QUARTERLY], _REFRESH_SQL[RollupLevel.ANNUAL]],
+            [i.args[0] for i in mock_cursor.execute.call_args_list[1:]])
+
+    @patch('cn_stats_data.db.rollup_dao.db.get_conn')
+    def test_refresh_nothing_changed(self, mock_get_conn):
+        mock_cursor = self._mock_cursor(mock_get_conn)
+        mock_cursor.rowcount = 0
+
+        self.assertEqual(0, RollupDao.refresh())
+        self.assertEqual((True, None), mock_cursor.execute.call_args.args[1])
+        mock_cursor.execute.assert_called_once()
+
+    @patch('cn_stats_data.db.rollup_dao.db.get_conn')
+    def test_series(self, mock_get_conn):
+        mock_cursor = self._mock_cursor(mock_get_conn)
+        mock_cursor.fetchall.return_value = [(20241, 3.0), (20242, None)]
+
+        result = RollupDao.series(RollupLevel.QUARTERLY, Category.MACRO_MONTHLY.db_code, 'A01', end=20242)
+
+        self.assertEqual([(20241, 3.0), (20242, None)], result)
+        self.assertIn('cn_stats_metric_rollup_quarterly', mock_cursor.execute.call_args.args[0])
+        self.assertEqual(
+            (Category.MACRO_MONTHLY.db_code, 'A01', '', True, None, False, 20242),
+            mock_cursor.execute.call_args.args[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
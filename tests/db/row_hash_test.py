@@ -0,0 +1,37 @@
+import unittest
+
+from cn_stats_data.db.models import MetricCode, RegionCode, MetricHistoricalData
+from cn_stats_data.db.row_hash import metric_code_hash, region_code_hash, metric_data_hash
+
+
+class RowHashTests(unittest.TestCase):
+
+    def test_metric_code_hash(self) -> None:
+        code = MetricCode(db_code='hgnd', code='A01', name='name', explanation='exp', is_parent=False, unit='%')
+        same = MetricCode(db_code='hgnd', code='A01', name='name', explanation='exp', is_parent=False, unit='%',
+                          is_deleted=True, row_hash='ignored')
+        changed = MetricCode(db_code='hgnd', code='A01', name='name', explanation='exp', is_parent=False, unit='元')
+
+        self.assertEqual(32, len(metric_code_hash(code)))
+        self.assertEqual(metric_code_hash(code), metric_code_hash(same))
+        self.assertNotEqual(metric_code_hash(code), metric_code_hash(changed))
+
+    def test_region_code_hash(self) -> None:
+        child = RegionCode(db_code='fsnd', code='110100', name=None, explanation=None, is_parent=False)
+        region = RegionCode(db_code='fsnd', code='110000', name='北京', explanation=None, is_parent=True,
+                            children=[child])
+        leaf = RegionCode(db_code='fsnd', code='110000', name='北京', explanation=None, is_parent=False)
+
+        self.assertNotEqual(region_code_hash(region), region_code_hash(leaf))
+
+    def test_metric_data_hash(self) -> None:
+        data = MetricHistoricalData(db_code='hgnd', metric_code='A01', region_code=None, period='2023', data=0.1, has_data=True)
+        same = MetricHistoricalData(db_code='hgnd', metric_code='A01', region_code=None, period='2024', data=0.1, has_data=True)
+        changed = MetricHistoricalData(db_code='hgnd', metric_code='A01', region_code=None, period='2023', data=0.2, has_data=True)
+
+        self.assertEqual(metric_data_hash(data), metric_data_hash(same))
+        self.assertNotEqual(metric_data_hash(data), metric_data_hash(changed))
+
+
+if __name__ == '__main__':
+    unittest.main()
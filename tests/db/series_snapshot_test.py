@@ -0,0 +1,68 @@
+import math
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from cn_stats_data.db.series_snapshot import SeriesSnapshot
+
+
+class SeriesSnapshotTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _build(self, points):
+        with patch('cn_stats_data.db.series_snapshot.MetricDataDao.iter_points', return_value=iter(points)):
+            return SeriesSnapshot.build('fsnd', self.dir.name)
+
+    def test_series(self) -> None:
+        self._build([
+            ('A01', None, 2021, 1.0),
+            ('A01', None, 2022, None),
+            ('A01', None, 2023, 3.0),
+            ('A01', '110000', 2022, 5.0),
+            ('A02', '110000', 2023, 7.0),
+        ])
+
+        with SeriesSnapshot.open('fsnd', self.dir.name) as snapshot:
+            self.assertEqual(3, len(snapshot))
+            self.assertIn(('A01', '110000'), snapshot)
+
+            periods, values = snapshot.series('A01')
+            self.assertEqual([2021, 2022, 2023], periods.tolist())
+            self.assertEqual(1.0, values[0])
+            self.assertTrue(math.isnan(values[1]))
+            # zero-copy views of the mapped file
+            self.assertFalse(values.flags.writeable)
+            self.assertFalse(values.flags.owndata)
+
+            periods, values = snapshot.series('A01', start=2022, end=2022)
+            self.assertEqual([2022], periods.tolist())
+            self.assertEqual([7.0], snapshot.series('A02', '110000', start=2020)[1].tolist())
+            self.assertEqual([], snapshot.series('A03')[0].tolist())
+
+    def test_rebuild_while_opened(self) -> None:
+        self._build([('A01', None, 2021, 1.0)])
+        snapshot = SeriesSnapshot.open('fsnd', self.dir.name)
+        values = snapshot.series('A01')[1]
+
+        self._build([('A01', None, 2021, 2.0)])
+
+        # the opened snapshot keeps reading the old file
+        self.assertEqual([1.0], values.tolist())
+        snapshot.close()
+        with SeriesSnapshot.open('fsnd', self.dir.name) as snapshot:
+            self.assertEqual([2.0], snapshot.series('A01')[1].tolist())
+
+    def test_empty(self) -> None:
+        self._build([])
+        with SeriesSnapshot.open('fsnd', self.dir.name) as snapshot:
+            self.assertEqual(0, len(snapshot))
+            self.assertEqual([], snapshot.series('A01')[0].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from cn_stats_data.db.spool import MetricDataSpool
+
+
+def _data(metric_code, period, value):
+    return SimpleNamespace(
+        metric_code=metric_code, db_code='hgnd', region_code=None, period=period, data=value, has_data=True,
+        extra_attributes={})
+
+
+class MetricDataSpoolTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.spool = MetricDataSpool(self.dir.name, segment_max_records=100, batch_max_records=100)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    @patch('cn_stats_data.db.spool.MetricDataDao')
+    def test_drain_merges_entries_into_one_batch(self, mock_dao):
+        mock_dao.sync.return_value = {'inserted': 1, 'updated': 0, 'deleted': 0}
+        self.spool.append('hgnd', ['A01'], [2023], [_data('A01', 2023, 0.1)])
+        self.spool.append('hgnd', ['A02'], [2023], [_data('A02', 2023, 0.2)])
+        self.spool.flush()
+
+        self.assertEqual(2, self.spool.drain())
+
+        mock_dao.sync.assert_called_once()
+        kwargs = mock_dao.sync.call_args.kwargs
+        self.assertEqual(['A01', 'A02'], kwargs['metric_codes'])
+        self.assertEqual([2023], kwargs['date_nums'])
+        self.assertEqual(2, len(kwargs['lst']))
+        self.assertEqual(0, self.spool.pending_segments)
+
+    @patch('cn_stats_data.db.spool.MetricDataDao')
+    def test_same_metric_code_starts_new_batch(self, mock_dao):
+        mock_dao.sync.return_value = {'inserted': 1, 'updated': 0, 'deleted': 0}
+        self.spool.append('hgnd', ['A01'], [2023], [_data('A01', 2023, 0.1)])
+        self.spool.append('hgnd', ['A01'], [2023], [_data('A01', 2023, 0.2)])
+        self.spool.flush()
+
+        self.spool.drain()
+
+        self.assertEqual(2, mock_dao.sync.call_count)
+
+    @patch('cn_stats_data.db.spool.MetricDataDao')
+    def test_failed_segment_is_kept(self, mock_dao):
+        mock_dao.sync.side_effect = ConnectionError('db is down')
+        self.spool.append('hgnd', ['A01'], [2023], [_data('A01', 2023, 0.1)])
+        self.spool.flush()
+
+        with self.assertRaises(ConnectionError):
+            self.spool.drain()
+        self.assertEqual(1, self.spool.pending_segments)
+
+        mock_dao.sync.side_effect = None
+        mock_dao.sync.return_value = {'inserted': 1, 'updated': 0, 'deleted': 0}
+        self.assertEqual(1, self.spool.drain())
+        self.assertEqual(0, self.spool.pending_segments)
+
+    @patch('cn_stats_data.db.spool.MetricDataDao')
+    def test_replay_segment_left_by_crash(self, mock_dao):
+        mock_dao.sync.return_value = {'inserted': 1, 'updated': 0, 'deleted': 0}
+        self.spool.append('hgnd', ['A01'], [2023], [_data('A01', 2023, 0.1)])
+        # the segment isn't sealed, and the last line is broken
+        self.spool._file.write('{"db_code": "hg')
+        self.spool._file.flush()
+
+        spool = MetricDataSpool(self.dir.name)
+
+        self.assertEqual(1, spool.pending_segments)
+        self.assertEqual(1, spool.drain())
+
+    @patch('cn_stats_data.db.spool.MetricDataDao')
+    def test_loader_thread(self, mock_dao):
+        mock_dao.sync.return_value = {'inserted': 1, 'updated': 0, 'deleted': 0}
+        self.spool.start()
+        self.spool.append('hgnd', ['A01'], [2023], [_data('A01', 2023, 0.1)])
+
+        self.assertTrue(self.spool.close())
+        mock_dao.sync.assert_called_once()
+
+    @patch('cn_stats_data.db.spool.MetricDataDao')
+    def test_loader_keeps_segment_open_until_full(self, mock_dao):
+        mock_dao.sync.return_value = {'inserted': 1, 'updated': 0, 'deleted': 0}
+        spool = MetricDataSpool(self.dir.name, segment_max_records=10, batch_max_records=100, segment_max_seconds=60)
+        spool.start()
+        for i in range(25):
+            spool.append('hgnd', [f'A{i:02d}'], [2023], [_data(f'A{i:02d}', 2023, 0.1)])
+            time.sleep(0.01)  # the loader is idle between the appends
+
+        self.assertTrue(spool.close())
+        # 2 full segments, and the rest sealed by close
+        self.assertEqual(3, mock_dao.sync.call_count)
+        self.assertEqual(25, sum(len(i.kwargs['lst']) for i in mock_dao.sync.call_args_list))
+
+    @patch('cn_stats_data.db.spool.MetricDataDao')
+    def test_loader_seals_expired_segment(self, mock_dao):
+        mock_dao.sync.return_value = {'inserted': 1, 'updated': 0, 'deleted': 0}
+        spool = MetricDataSpool(self.dir.name, segment_max_seconds=0.1)
+        spool.start()
+        spool.append('hgnd', ['A01'], [2023], [_data('A01', 2023, 0.1)])
+        spool.append('hgnd', ['A02'], [2023], [_data('A02', 2023, 0.2)])
+
+        for _ in range(100):
+            if mock_dao.sync.called:
+                break
+            time.sleep(0.05)
+        mock_dao.sync.assert_called_once()
+        self.assertEqual(['A01', 'A02'], mock_dao.sync.call_args.kwargs['metric_codes'])
+        self.assertTrue(spool.close())
+
+    @patch('cn_stats_data.db.spool.MetricDataDao')
+    def test_close_gives_up_in_timeout(self, mock_dao):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        # database hangs
+        mock_dao.sync.side_effect = lambda **kwargs: release.wait() and {'inserted': 1, 'updated': 0, 'deleted': 0}
+        self.spool.start()
+        self.spool.append('hgnd', ['A01'], [2023], [_data('A01', 2023, 0.1)])
+        self.spool.append('hgnd', ['A01'], [2024], [_data('A01', 2024, 0.2)])
+
+        start = time.monotonic()
+        self.assertFalse(self.spool.close(timeout=0.2))
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(1, self.spool.pending_segments)
+
+        # the loader stops before the next batch once the hanging call returns, and the segment is kept
+        release.set()
+        self.spool._loader.join(1)
+        self.assertFalse(self.spool._loader.is_alive())
+        self.assertEqual(1, mock_dao.sync.call_count)
+        self.assertEqual(1, self.spool.pending_segments)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from cn_stats_util.models import Category
+from cn_stats_data import db
+from cn_stats_data.db.models import MetricCode, RegionCode, MetricHistoricalData, ProcessData
+from cn_stats_data.db.row_hash import metric_data_hash
+from cn_stats_data.db.sqlite.metric_code_dao import SqliteMetricCodeDao
+from cn_stats_data.db.sqlite.metric_data_dao import SqliteMetricDataDao
+from cn_stats_data.db.sqlite.process_data_dao import SqliteProcessDataDao
+from cn_stats_data.db.sqlite.region_code_dao import SqliteRegionCodeDao
+
+
+def _metric(code, parent=None):
+    return MetricCode(
+        db_code=Category.MACRO_ANNUAL.db_code, code=code, name=f'Metric {code}', explanation=None, is_parent=False,
+        parent=None if parent is None else MetricCode(
+            db_code=Category.MACRO_ANNUAL.db_code, code=parent, name=None, explanation=None, is_parent=False))
+
+
+def _data(metric_code, period, value, region_code=None):
+    return MetricHistoricalData(
+        metric_code=metric_code, db_code=Category.MACRO_ANNUAL.db_code, region_code=region_code,
+        period=period, data=value, has_data=value is not None)
+
+
+class SqliteDaoTests(unittest.TestCase):
+    """Runs the SQLite DAOs against a temporary database file."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.patcher = patch.object(db.db_config, 'sqlite_path', os.path.join(self.dir.name, 'test.db'))
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.dir.cleanup()
+
+    def test_metric_codes(self) -> None:
+        # A01 ── A0101 ── A010101
+        #    └── A0102
+        codes = [_metric('A01'), _metric('A0101', 'A01'), _metric('A0102', 'A01'), _metric('A010101', 'A0101')]
+        self.assertEqual(4, SqliteMetricCodeDao.add_or_update(codes))
+        # not changed, nothing is saved
+        self.assertEqual(0, SqliteMetricCodeDao.add_or_update(codes))
+
+        result = SqliteMetricCodeDao.list(Category.MACRO_ANNUAL, 'A0101')
+        self.assertEqual(['A0101', 'A010101'], sorted(i.code for i in result))
+        self.assertEqual(['A010101', 'A0102'],
+                         sorted(i.code for i in SqliteMetricCodeDao.list_leaves(Category.MACRO_ANNUAL)))
+        self.assertEqual(['A01', 'A0101'],
+                         [i.code for i in SqliteMetricCodeDao.list_ancestors('A010101', Category.MACRO_ANNUAL)])
+        self.assertTrue(SqliteMetricCodeDao.get('A0101', Category.MACRO_ANNUAL).is_parent)
+
+        # the descendants of a deleted code are not reachable from its ancestors
+        deleted = _metric('A0101', 'A01')
+        deleted.is_deleted = True
+        self.assertEqual(1, SqliteMetricCodeDao.delete([deleted]))
+        self.assertIsNone(SqliteMetricCodeDao.get('A0101', Category.MACRO_ANNUAL))
+        self.assertEqual(['A01', 'A0102'],
+                         sorted(i.code for i in SqliteMetricCodeDao.list(Category.MACRO_ANNUAL, 'A01')))
+        self.assertEqual([], SqliteMetricCodeDao.list_ancestors('A010101', Category.MACRO_ANNUAL))
+        self.assertEqual(['A0102'], [i.code for i in SqliteMetricCodeDao.list_leaves(Category.MACRO_ANNUAL)])
+
+    def test_region_codes(self) -> None:
+        child = RegionCode(db_code=Category.PROVINCIAL_ANNUAL.db_code, code='110100', name='市辖区', explanation=None,
+                           is_parent=False)
+        parent = RegionCode(db_code=Category.PROVINCIAL_ANNUAL.db_code, code='110000', name='北京', explanation=None,
+                            is_parent=True, children=[child])
+        self.assertEqual(2, SqliteRegionCodeDao.add_or_update([child, parent]))
+
+        result = SqliteRegionCodeDao.list(Category.PROVINCIAL_ANNUAL, '110000')
+        self.assertEqual(['110000', '110100'], sorted(i.code for i in result))
+        self.assertEqual('110000', SqliteRegionCodeDao.get('110100', Category.PROVINCIAL_ANNUAL).parent.code)
+
+        parent.children = None
+        SqliteRegionCodeDao.add_or_update([parent])
+        self.assertIsNone(SqliteRegionCodeDao.get('110100', Category.PROVINCIAL_ANNUAL).parent)
+
+        # moved to another parent, the old parent is saved after the new one
+        other = RegionCode(db_code=Category.PROVINCIAL_ANNUAL.db_code, code='120000', name='天津', explanation=None,
+                           is_parent=True, children=[child])
+        parent.children = [child]
+        SqliteRegionCodeDao.add_or_update([parent])
+        parent.children = []
+        SqliteRegionCodeDao.add_or_update([other, parent])
+        self.assertEqual('120000', SqliteRegionCodeDao.get('110100', Category.PROVINCIAL_ANNUAL).parent.code)
+
+    def test_metric_data_sync(self) -> None:
+        db_code = Category.MACRO_ANNUAL.db_code
+        counts = SqliteMetricDataDao.sync(db_code, ['A01'], [2023, 2024], [_data('A01', 2023, 1.0), _data('A01', 2024, 2.0)])
+        self.assertEqual({'inserted': 2, 'updated': 0, 'deleted': 0}, counts)
+
+        counts = SqliteMetricDataDao.sync(db_code, ['A01'], [2023, 2024], [_data('A01', 2023, 1.5)])
+        self.assertEqual({'inserted': 0, 'updated': 1, 'deleted': 1}, counts)
+
+        self.assertEqual(
+            {('A01', 2023, None): (1.5, metric_data_hash(_data('A01', 2023, 1.5)))},
+            SqliteMetricDataDao.list_values(db_code, ['A01']),
+        )
+        self.assertEqual([2023], [i.period for i in SqliteMetricDataDao.list(db_codes=[db_code])])
+
+        # the soft-deleted row is restored
+        self.assertEqual(1, SqliteMetricDataDao.add_or_update([_data('A01', 2024, 2.0)]))
+        self.assertEqual(2, len(SqliteMetricDataDao.list(metric_codes=['A01'], region_codes=[None])))
+
+    def test_metric_data_series(self) -> None:
+        db_code = Category.MACRO_ANNUAL.db_code
+        SqliteMetricDataDao.add_or_update(
+            [_data('A01', 2024, 3.0), _data('A01', 2022, 1.0), _data('A01', 2023, None), _data('A01', 2023, 9.0, '110000')])
+
+        self.assertEqual([(2022, 1.0), (2023, None), (2024, 3.0)], SqliteMetricDataDao.series(db_code, 'A01'))
+        self.assertEqual([(2023, None), (2024, 3.0)], SqliteMetricDataDao.series(db_code, 'A01', start=2023))
+        self.assertEqual([(2023, 9.0)], SqliteMetricDataDao.series(db_code, 'A01', '110000', 2020, 2023))
+
+        self.assertEqual([(2022, 1.0)], SqliteMetricDataDao.series_cached(db_code, 'A01', end=2022))
+        SqliteMetricDataDao.add_or_update([_data('A01', 2021, 0.5)])
+        self.assertEqual([(2021, 0.5), (2022, 1.0)], SqliteMetricDataDao.series_cached(db_code, 'A01', end=2022))
+
+        self.assertEqual(
+            [('A01', None, 2021, 0.5), ('A01', None, 2022, 1.0), ('A01', None, 2023, None), ('A01', None, 2024, 3.0),
+             ('A01', '110000', 2023, 9.0)],
+            list(SqliteMetricDataDao.iter_points(db_code, itersize=2)))
+
+        chunks = list(SqliteMetricDataDao.iter_panel_values(db_code, ['A02', 'A01'], ['110000', None], 2022, 2023, 2))
+        self.assertEqual([2, 1], [len(i) for i in chunks])
+        self.assertEqual(
+            [(1, 0, 2023, 9.0), (1, 1, 2022, 1.0), (1, 1, 2023, None)],
+            sorted(i for chunk in chunks for i in chunk))
+
+    def test_process_data(self) -> None:
+        SqliteProcessDataDao.add_or_update(ProcessData('p1', '{"a": 1}'))
+        SqliteProcessDataDao.add_or_update(ProcessData('p1', '{"a": 2}'))
+        self.assertEqual('{"a": 2}', SqliteProcessDataDao.get('p1').data)
+        self.assertEqual(1, SqliteProcessDataDao.delete('p1'))
+        self.assertIsNone(SqliteProcessDataDao.get('p1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
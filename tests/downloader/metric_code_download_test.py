@@ -17,7 +17,7 @@ class TestDownloadMetricCodes(unittest.TestCase):
             Metric.of(Category.CITY_ANNUAL.db_code, "A02")]
 
         # Mock the database response
-        mock_metric_code_dao.list.return_value = []
+        mock_metric_code_dao.list_cached.return_value = []
 
         # Mock the checkpoint
         mock_checkpoint = MagicMock()
@@ -40,7 +40,7 @@ class TestDownloadMetricCodes(unittest.TestCase):
         mock_apis_instance.fetch_metrics.return_value = [Metric(code='A01'), Metric(code='A02')]
 
         # Mock the database response
-        mock_metric_code_dao.list.return_value = []
+        mock_metric_code_dao.list_cached.return_value = []
 
         # Mock the checkpoint
         mock_checkpoint = MagicMock()
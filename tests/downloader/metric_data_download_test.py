@@ -0,0 +1,138 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+from cn_stats_data.db.hierarchy_index import HierarchyIndex
+from cn_stats_data.db.row_hash import metric_data_row_hash
+from cn_stats_util.models import Category, HistoricalData
+from cn_stats_data.downloader.metric_data_download import (
+    _download_metric_data, _get_metric_codes_to_download, download_metric_data)
+
+
+def _code(code, parent=None):
+    c = MagicMock()
+    c.db_code = 'hgyd'
+    c.code = code
+    c.parent = parent
+    return c
+
+
+class TestGetMetricCodesToDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.db = MagicMock()
+        self.db.db_code = 'hgyd'
+        self.db.is_regional.return_value = False
+        a = _code('A')
+        a1 = _code('A1', a)
+        b = _code('B')
+        self.codes = [a, a1, _code('A11', a1), _code('A12', a1), _code('A2', a), b]
+        self.index = HierarchyIndex(
+            self.codes,
+            key=lambda i: (i.db_code, i.code),
+            parent_key=lambda i: (i.db_code, i.parent.code) if i.parent else None,
+        )
+
+    @patch('cn_stats_data.downloader.metric_data_download.MetricCodeDao')
+    def test_parents_of_leaves(self, mock_metric_code_dao):
+        mock_metric_code_dao.get_hierarchy.return_value = self.index
+
+        result = _get_metric_codes_to_download(self.db, None)
+
+        self.assertEqual(['A1', 'A', 'B'], [c.code for c in result])
+
+    @patch('cn_stats_data.downloader.metric_data_download.MetricCodeDao')
+    def test_giving_codes(self, mock_metric_code_dao):
+        mock_metric_code_dao.get_hierarchy.return_value = self.index
+
+        result = _get_metric_codes_to_download(self.db, ['A1', 'A2', 'C'])
+
+        self.assertEqual(['A1', 'A2'], [c.code for c in result])
+
+    @patch('cn_stats_data.downloader.metric_data_download.MetricCodeDao')
+    def test_regional_downloads_leaves(self, mock_metric_code_dao):
+        self.db.is_regional.return_value = True
+        mock_metric_code_dao.list_leaves.return_value = self.codes[2:4]
+
+        result = _get_metric_codes_to_download(self.db, ['A1'])
+
+        mock_metric_code_dao.list_leaves.assert_called_once_with(self.db, ['A1'])
+        mock_metric_code_dao.get_hierarchy.assert_not_called()
+        self.assertEqual(['A11', 'A12'], [c.code for c in result])
+
+
+
+class TestDownloadMetricDataSpool(unittest.TestCase):
+
+    @patch('cn_stats_data.downloader.metric_data_download.RollupDao', None)
+    @patch('cn_stats_data.downloader.metric_data_download.spool_config')
+    @patch('cn_stats_data.downloader.metric_data_download.MetricDataSpool')
+    @patch('cn_stats_data.downloader.metric_data_download._get_metric_codes_to_download')
+    def test_spool_closed_when_crawl_fails(self, mock_codes, mock_spool_cls, mock_spool_config):
+        mock_codes.side_effect = ConnectionError('db is down')
+        mock_spool_config.close_timeout = 30
+        spool = mock_spool_cls.from_config.return_value
+        spool.close.return_value = False
+        spool.pending_segments = 2
+
+        with self.assertLogs('cn_stats_data.downloader.metric_data_download', level='WARNING') as logs:
+            with self.assertRaises(ConnectionError):
+                download_metric_data(Category.MACRO_MONTHLY, years=[2023], use_spool=True)
+
+        spool.start.assert_called_once()
+        spool.close.assert_called_once_with(timeout=30)
+        self.assertIn('2 spool segments', logs.output[0])
+
+
+def _saved(i, **changes):
+    """the (metric_value, row_hash) saved of the downloaded data, with the columns changed"""
+    value = changes.get('data', i.data)
+    return value, metric_data_row_hash(value, changes.get('extra_attributes', i.extra_attributes))
+
+
+class TestDownloadMetricDataDiff(unittest.TestCase):
+
+    def _download(self, mock_apis_cls, mock_dao, data, saved):
+        mock_apis_cls.return_value.fetch_history.return_value = data
+        mock_dao.list_values.return_value = saved
+        mock_dao.sync.return_value = {'inserted': 0, 'updated': 1, 'deleted': 0}
+        code = _code('A0101')
+        code.children = None
+        return _download_metric_data(Category.MACRO_ANNUAL, code, [2023, 2024], MagicMock())
+
+    @patch('cn_stats_data.downloader.metric_data_download.MetricDataDao')
+    @patch('cn_stats_data.downloader.metric_data_download.ChinaStatsDataApis')
+    def test_unchanged_not_written(self, mock_apis_cls, mock_dao):
+        data = [HistoricalData(metric_code='A0101', db_code='hgnd', period=2023, region_code=None, data=1.0, has_data=True),
+                HistoricalData(metric_code='A0101', db_code='hgnd', period=2024, region_code=None, data=None, has_data=False)]
+
+        self.assertEqual(2, self._download(mock_apis_cls, mock_dao, data, {('A0101', 2023, None): _saved(data[0]),
+                                                                           ('A0101', 2024, None): _saved(data[1])}))
+        mock_dao.list_values.assert_called_once_with('hgnd', ['A0101'], date_nums=[2023, 2024])
+        mock_dao.sync.assert_not_called()
+
+        # a changed value, and a saved row not downloaded any more
+        for saved in ({('A0101', 2023, None): _saved(data[0], data=2.0), ('A0101', 2024, None): _saved(data[1])},
+                      {('A0101', 2023, None): _saved(data[0]), ('A0101', 2024, None): _saved(data[1]),
+                       ('A0101', 2024, '110000'): _saved(data[1], data=3.0)}):
+            mock_dao.reset_mock()
+            self._download(mock_apis_cls, mock_dao, data, saved)
+            mock_dao.sync.assert_called_once()
+
+    @patch('cn_stats_data.downloader.metric_data_download.MetricDataDao')
+    @patch('cn_stats_data.downloader.metric_data_download.ChinaStatsDataApis')
+    def test_extra_attributes_compared(self, mock_apis_cls, mock_dao):
+        data = [HistoricalData(metric_code='A0101', db_code='hgnd', period=2023, region_code=None, data=1.0, has_data=True,
+                               memo='revised')]
+
+        # the same value and extra attributes
+        self._download(mock_apis_cls, mock_dao, data, {('A0101', 2023, None): _saved(data[0])})
+        mock_dao.sync.assert_not_called()
+
+        # only the extra attributes are changed
+        mock_dao.reset_mock()
+        self._download(mock_apis_cls, mock_dao, data, {('A0101', 2023, None): _saved(data[0], extra_attributes={})})
+        mock_dao.sync.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
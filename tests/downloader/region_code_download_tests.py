@@ -18,7 +18,7 @@ class TestDownloadRegionCodes(unittest.TestCase):
         ]
 
         # Mock the database response
-        mock_region_code_dao.list.return_value = []
+        mock_region_code_dao.list_cached.return_value = []
 
         # Mock the checkpoint
         mock_checkpoint = MagicMock()
@@ -44,7 +44,7 @@ class TestDownloadRegionCodes(unittest.TestCase):
         ]
 
         # Mock the database response
-        mock_region_code_dao.list.return_value = []
+        mock_region_code_dao.list_cached.return_value = []
 
         # Mock the checkpoint
         mock_checkpoint = MagicMock()
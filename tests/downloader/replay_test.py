@@ -0,0 +1,87 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from cn_stats_util.models import Category, Metric
+from cn_stats_data.downloader import replay
+
+
+class _Apis:
+    """The live api, the children of a metric are numbered after it, and BAD fails while the site is down."""
+
+    def __init__(self, down: bool = True):
+        self.calls = 0
+        self.down = down
+
+    def fetch_metrics(self, db_code, parent, recursive_fetch=False):
+        self.calls += 1
+        if parent.code == 'BAD' and self.down:
+            raise IOError('timeout')
+        return [Metric(db_code=db_code.db_code, code=f'{parent.code}0{i}', name=f'Metric {i}', explanation=None,
+                       is_parent=False, parent=parent) for i in range(1, 3)]
+
+
+class ReplayTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_not_enabled(self) -> None:
+        apis = _Apis()
+        with patch.dict(os.environ, {'CN_STATS_API_RECORD': '', 'CN_STATS_API_REPLAY': ''}):
+            self.assertIs(apis, replay.wrap(apis))
+
+    def test_record_and_replay(self) -> None:
+        live = _Apis()
+        parent = Metric(db_code='hgnd', code='A01', name='A01', explanation=None, is_parent=True)
+        with replay.recording(self.dir.name) as archive:
+            recorded = replay.wrap(live).fetch_metrics(Category.MACRO_ANNUAL, parent=parent)
+            with self.assertRaises(IOError):
+                replay.wrap(live).fetch_metrics(Category.MACRO_ANNUAL, parent=Metric.of('hgnd', 'BAD'))
+        self.assertEqual(2, len(archive))
+        self.assertEqual(2, live.calls)
+
+        # the parent of the replayed children is the one passed to the replayed call
+        other = Metric(db_code='hgnd', code='A01', name='A01', explanation=None, is_parent=True)
+        with patch('time.sleep') as sleep, replay.replaying(self.dir.name, latency=0.05) as archive:
+            apis = replay.wrap(_Apis())
+            result = apis.fetch_metrics(Category.MACRO_ANNUAL, parent=other)
+            with self.assertRaises(IOError):
+                apis.fetch_metrics(Category.MACRO_ANNUAL, parent=Metric.of('hgnd', 'BAD'))
+            with self.assertRaises(LookupError):
+                apis.fetch_metrics(Category.MACRO_MONTHLY, parent=other)
+        self.assertEqual([i.code for i in recorded], [i.code for i in result])
+        self.assertEqual(['Metric 1', 'Metric 2'], [i.name for i in result])
+        self.assertIs(other, result[0].parent)
+        self.assertIsNot(recorded[0], result[0])
+        sleep.assert_called_with(0.05)
+        self.assertEqual(1, archive.misses)
+
+        # the calls are appended to the archive, and the calls of the same arguments are replayed in order
+        with replay.recording(self.dir.name) as archive:
+            replay.wrap(_Apis(down=False)).fetch_metrics(Category.MACRO_ANNUAL, parent=Metric.of('hgnd', 'BAD'))
+        self.assertEqual(3, len(archive))
+        with replay.replaying(self.dir.name, scale=0) as archive:
+            apis = replay.wrap(None)
+            with self.assertRaises(IOError):
+                apis.fetch_metrics(Category.MACRO_ANNUAL, parent=Metric.of('hgnd', 'BAD'))
+            self.assertEqual(['BAD01', 'BAD02'],
+                             [i.code for i in apis.fetch_metrics(Category.MACRO_ANNUAL, parent=Metric.of('hgnd', 'BAD'))])
+            # the last one is repeated when they run out
+            self.assertEqual(2, len(apis.fetch_metrics(Category.MACRO_ANNUAL, parent=Metric.of('hgnd', 'BAD'))))
+
+    def test_environment(self) -> None:
+        with patch.dict(os.environ, {'CN_STATS_API_RECORD': self.dir.name, 'CN_STATS_API_REPLAY': ''}):
+            self.assertIsInstance(replay.wrap(_Apis()), replay.RecordingApis)
+        with patch.dict(os.environ, {'CN_STATS_API_REPLAY': self.dir.name, 'CN_STATS_API_LATENCY': '0.1'}):
+            apis = replay.wrap(_Apis())
+            self.assertIsInstance(apis, replay.ReplayApis)
+            self.assertEqual(0.1, apis._latency)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import io
+import json
+import logging
+import unittest
+
+from cn_stats_data import log
+
+
+class LogTests(unittest.TestCase):
+
+    def _record(self, msg, *args, level=logging.INFO, **extra) -> logging.LogRecord:
+        record = logging.LogRecord('cn_stats_data.test', level, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_json_formatter(self) -> None:
+        text = log.JsonFormatter().format(self._record('Loaded %s codes.', 3, db_code='hgnd'))
+
+        data = json.loads(text)
+        self.assertEqual('Loaded 3 codes.', data['message'])
+        self.assertEqual('INFO', data['level'])
+        self.assertEqual('hgnd', data['db_code'])
+
+    def test_sampling_filter(self) -> None:
+        f = log.SamplingFilter(rate=3)
+
+        passed = [f.filter(self._record('Loaded %s codes.', i, **log.PER_NODE)) for i in range(7)]
+        self.assertEqual([True, False, False, True, False, False, True], passed)
+        # sampled by the template, and the other messages are always passed
+        self.assertTrue(f.filter(self._record('Updated %s codes.', 1, **log.PER_NODE)))
+        self.assertTrue(f.filter(self._record('Loaded %s codes.', 1, level=logging.WARNING, **log.PER_NODE)))
+        self.assertTrue(all(f.filter(self._record('Starting.')) for _ in range(3)))
+
+    def test_queue_mode(self) -> None:
+        stream = io.StringIO()
+        root = logging.getLogger()
+        saved = list(root.handlers), root.level
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(log.JsonFormatter())
+        handler.addFilter(log.SamplingFilter(rate=2))
+        root.handlers = [handler]
+        root.setLevel(logging.INFO)
+        try:
+            log._start_listener()
+            self.assertIsInstance(root.handlers[0], log._QueueHandler)
+
+            logger = logging.getLogger('cn_stats_data.test')
+            for i in range(4):  # the messages are sampled by the template, not by the merged message
+                logger.info('Loaded %s codes.', i, extra=log.PER_NODE)
+            logger.warning('Deleted %s codes.', 2, extra={'db_code': 'hgnd'})
+            log.stop_log_listener()
+
+            lines = [json.loads(i) for i in stream.getvalue().splitlines()]
+            self.assertEqual(['Loaded 0 codes.', 'Loaded 2 codes.', 'Deleted 2 codes.'], [i['message'] for i in lines])
+            self.assertEqual('hgnd', lines[-1]['db_code'])
+            self.assertNotIn('_template', lines[-1])
+        finally:
+            log.stop_log_listener()
+            root.handlers, root.level = saved
+
+
+if __name__ == '__main__':
+    unittest.main()
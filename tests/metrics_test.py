@@ -0,0 +1,104 @@
+import asyncio
+import tempfile
+import unittest
+import urllib.request
+from pathlib import Path
+from unittest.mock import MagicMock
+
+from cn_stats_data import metrics
+
+
+class MetricsTests(unittest.TestCase):
+
+    def setUp(self):
+        metrics.registry.clear()
+
+    def test_render(self) -> None:
+        registry = metrics.Registry()
+        counter = registry.register(metrics.Counter('test_total', 'The test counter.', ('kind',)))
+        histogram = registry.register(metrics.Histogram('test_seconds', 'The test histogram.', buckets=(0.1, 1.0)))
+        counter.inc(kind='a "quoted"')
+        counter.inc(2, kind='a "quoted"')
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+
+        text = registry.render()
+
+        self.assertIn('# TYPE test_total counter\n', text)
+        self.assertIn('test_total{kind="a \\"quoted\\""} 3\n', text)
+        self.assertIn('test_seconds_bucket{le="0.1"} 1\n', text)
+        self.assertIn('test_seconds_bucket{le="1.0"} 2\n', text)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 2\n', text)
+        self.assertIn('test_seconds_sum 0.55\n', text)
+        self.assertIn('test_seconds_count 2\n', text)
+        with self.assertRaises(ValueError):
+            counter.inc(other='b')
+
+    def test_instrument_apis(self) -> None:
+        apis = MagicMock()
+        apis.fetch_history.return_value = [1, 2]
+        apis.fetch_regions.side_effect = IOError('timeout')
+        instrumented = metrics.instrument_apis(apis)
+
+        self.assertEqual([1, 2], instrumented.fetch_history(category='hgnd'))
+        with self.assertRaises(IOError):
+            instrumented.fetch_regions('fsnd')
+
+        apis.fetch_history.assert_called_once_with(category='hgnd')
+        self.assertEqual(1, metrics.api_requests.get(method='fetch_history', outcome='ok'))
+        self.assertEqual(1, metrics.api_requests.get(method='fetch_regions', outcome='error'))
+        self.assertEqual(1, metrics.api_request_seconds.get_count(method='fetch_history'))
+
+    def test_instrument_dao(self) -> None:
+
+        @metrics.instrument_dao
+        class SampleDao:
+
+            @classmethod
+            def get(cls, key):
+                return key
+
+            @classmethod
+            def iterate(cls):
+                yield from [1, 2]
+
+            @classmethod
+            async def aget(cls, key):
+                return key
+
+        class SubDao(SampleDao):
+            pass
+
+        self.assertEqual('a', SampleDao.get('a'))
+        self.assertEqual('b', SubDao.get('b'))
+        self.assertEqual([1, 2], list(SampleDao.iterate()))
+        self.assertEqual('c', asyncio.run(SampleDao.aget('c')))
+
+        self.assertEqual(1, metrics.dao_call_seconds.get_count(dao='SampleDao', method='get'))
+        self.assertEqual(1, metrics.dao_call_seconds.get_count(dao='SubDao', method='get'))
+        self.assertEqual(1, metrics.dao_call_seconds.get_count(dao='SampleDao', method='iterate'))
+        self.assertEqual(1, metrics.dao_call_seconds.get_count(dao='SampleDao', method='aget'))
+
+    def test_exposition(self) -> None:
+        metrics.record_sync('hgnd', {'inserted': 2, 'updated': 1, 'deleted': 0})
+
+        server = metrics.start_http_server(0, addr='127.0.0.1')
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{server.server_address[1]}/metrics') as response:
+                self.assertEqual(metrics.CONTENT_TYPE, response.headers['Content-Type'])
+                body = response.read().decode('utf-8')
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertIn('cn_stats_metric_data_rows_total{db_code="hgnd",change="inserted"} 2\n', body)
+
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / 'cn_stats.prom'
+            writer = metrics.TextfileWriter(path, interval=60)
+            writer.start()
+            writer.close()
+            self.assertEqual(metrics.registry.render(), path.read_text(encoding='utf-8'))
+
+
+if __name__ == '__main__':
+    unittest.main()
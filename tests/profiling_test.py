@@ -0,0 +1,100 @@
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from cn_stats_data import profiling, tracing
+
+
+def _busy(seconds: float) -> int:
+    total = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        total += sum(range(100))
+    return total
+
+
+class ProfilingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        tracing.disable()
+        self.dir.cleanup()
+
+    def test_disabled(self) -> None:
+        with patch.dict(os.environ, {'CN_STATS_PROFILE': ''}):
+            with profiling.profile_run('run', output_dir=self.dir.name) as out:
+                self.assertIsNone(out)
+        self.assertEqual([], os.listdir(self.dir.name))
+
+        with self.assertRaises(ValueError):
+            with profiling.profile_run('run', 'perf', output_dir=self.dir.name):
+                pass
+
+    def test_cprofile(self) -> None:
+        with profiling.profile_run('download_metric_codes', 'cprofile', output_dir=self.dir.name) as out:
+            with tracing.span('download_metric_codes'), tracing.span('fetch'):
+                data = [bytearray(1024) for _ in range(100)]
+                _busy(0.01)
+
+        self.assertTrue(out.name.startswith('download_metric_codes-'))
+        self.assertEqual(
+            {'report.txt', 'profile.pstats', 'trace.jsonl', 'memory.snapshot'}, {i.name for i in out.iterdir()})
+        report = (out / 'report.txt').read_text(encoding='utf-8')
+        self.assertIn('_busy', report)
+        self.assertRegex(report, r'\n +1 +\d+\.\d{3}  fetch\n')
+        self.assertIn('profiling_test.py', report.split('== Allocations ==')[1])
+        self.assertFalse(tracing.is_enabled())
+        self.assertEqual(100, len(data))
+
+    def test_sampling(self) -> None:
+        with patch.dict(os.environ, {'CN_STATS_PROFILE_MEMORY': ''}):
+            with profiling.profile_run('run', 'sampling', output_dir=self.dir.name, interval=0.001) as out:
+                _busy(0.1)
+
+        report = (out / 'report.txt').read_text(encoding='utf-8')
+        self.assertIn('_busy (profiling_test.py:', report)
+        self.assertIn('Skipped, memory profiling is disabled.', report)
+        folded = (out / 'samples.folded').read_text(encoding='utf-8')
+        self.assertTrue(any(i.startswith('MainThread;') and '_busy' in i for i in folded.splitlines()))
+
+    def test_memory_switch(self) -> None:
+        # a directory per run, they are timestamped by the second
+        with patch.dict(os.environ, {'CN_STATS_PROFILE_MEMORY': '1'}):
+            with profiling.profile_run('sampling', 'sampling', output_dir=self.dir.name, interval=0.001) as out:
+                pass
+        self.assertTrue((out / 'memory.snapshot').exists())
+
+        with patch.dict(os.environ, {'CN_STATS_PROFILE_MEMORY': '0'}):
+            with profiling.profile_run('cprofile', 'cprofile', output_dir=self.dir.name) as out:
+                pass
+        self.assertFalse((out / 'memory.snapshot').exists())
+
+        # the argument wins over the environment variable
+        with patch.dict(os.environ, {'CN_STATS_PROFILE_MEMORY': '0'}):
+            with profiling.profile_run('argument', 'sampling', output_dir=self.dir.name, memory=True) as out:
+                pass
+        self.assertTrue((out / 'memory.snapshot').exists())
+
+    def test_phase_times(self) -> None:
+        path = Path(self.dir.name) / 'trace.jsonl'
+        tracing.enable(path)
+        with tracing.span('run'):
+            with tracing.span('node'), tracing.span('node'):
+                pass
+            with tracing.span('node'):
+                pass
+        tracing.disable()
+
+        phases = profiling._phase_times(path)
+        self.assertEqual({'run', 'node'}, set(phases))
+        self.assertEqual(3, phases['node'][0])  # the nested node is only counted by the spans
+        self.assertLessEqual(phases['node'][1], phases['run'][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
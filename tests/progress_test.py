@@ -0,0 +1,93 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from cn_stats_data import metrics, progress
+
+
+class ProgressTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.dir.name) / 'status.json'
+        progress.configure(status_path=self.path, interval=3600, window=60, stall_seconds=300)
+        progress._finished.clear()
+        metrics.registry.clear()
+
+    def tearDown(self):
+        progress._config['status_path'] = None
+        progress._finished.clear()
+        self.dir.cleanup()
+
+    @patch('cn_stats_data.progress.time.monotonic')
+    def test_snapshot(self, monotonic) -> None:
+        monotonic.return_value = 1000.0
+        p = progress.Progress('download_metric_codes:hgnd', total=100, window=60, stall_seconds=300)
+        for i in range(10):  # 10 nodes in the first 100s, and 10 in the last 10s
+            monotonic.return_value = 1000.0 + i * 10
+            p.advance(rows=5, requests=1)
+        for i in range(10):
+            monotonic.return_value = 1100.0 + i
+            p.advance(rows=5, requests=1)
+
+        monotonic.return_value = 1110.0
+        s = p.snapshot()
+        self.assertEqual(20, s['done'])
+        self.assertEqual(100, s['rows'])
+        self.assertAlmostEqual(15 / 60, s['nodes_per_second'])  # only the nodes of the last 60s
+        self.assertAlmostEqual(75 / 60, s['rows_per_second'])
+        self.assertAlmostEqual(80 / (15 / 60), s['eta_seconds'])
+        self.assertFalse(s['stalled'])
+
+        monotonic.return_value = 1500.0
+        s = p.snapshot()
+        self.assertTrue(s['stalled'])
+        self.assertIsNone(s['eta_seconds'])  # no progress in the window
+
+    def test_track(self) -> None:
+        with progress.track('download_region_codes:fsnd') as p:
+            self.assertIsNone(p.total)  # unknown for the first run
+            p.advance(rows=3, requests=1)
+            p.advance(rows=2, requests=1)
+            self.assertEqual(['download_region_codes:fsnd'], [i['name'] for i in progress.status()['tasks']])
+
+        data = json.loads(self.path.read_text(encoding='utf-8'))
+        self.assertEqual([], data['tasks'])
+        self.assertEqual({'download_region_codes:fsnd': 2}, data['finished'])
+        self.assertEqual(2, metrics.progress_nodes.get(task='download_region_codes:fsnd', kind='done'))
+
+        # the next run estimates by the last one, which is loaded from the status file
+        progress._finished.clear()
+        progress.configure(status_path=self.path)
+        with progress.track('download_region_codes:fsnd') as p:
+            self.assertEqual(2, p.total)
+        with progress.track('download_region_codes:fsnd', 10) as p:
+            self.assertEqual(10, p.total)
+        with self.assertRaises(ValueError):
+            with progress.track('download_region_codes:fsnd', 10) as p:
+                raise ValueError()
+        self.assertEqual({'download_region_codes:fsnd': 0}, progress.status()['finished'])
+
+    def test_report(self) -> None:
+        with progress.track('download_metric_data:hgnd', 4) as p:
+            p.advance(rows=10, requests=1)
+            with self.assertLogs('cn_stats_data.progress', level='INFO') as logs:
+                progress._report(set())
+            self.assertIn('Progress of download_metric_data:hgnd: 1/4', logs.output[0])
+            self.assertEqual(4, metrics.progress_nodes.get(task='download_metric_data:hgnd', kind='total'))
+            self.assertEqual(1, len(json.loads(self.path.read_text(encoding='utf-8'))['tasks']))
+
+            p.stall_seconds = 0
+            stalled = set()
+            with self.assertLogs('cn_stats_data.progress', level='WARNING') as logs:
+                progress._report(stalled)
+                progress._report(stalled)
+            self.assertEqual(1, len(logs.output))  # warned once
+            self.assertEqual(1, metrics.progress_stalled.get(task='download_metric_data:hgnd'))
+        self.assertEqual(0, metrics.progress_stalled.get(task='download_metric_data:hgnd'))
+
+
+if __name__ == '__main__':
+    unittest.main()
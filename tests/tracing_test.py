@@ -0,0 +1,125 @@
+import asyncio
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from cn_stats_data import metrics, tracing
+
+
+class TracingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.dir.name) / 'trace.jsonl'
+
+    def tearDown(self):
+        tracing.disable()
+        self.dir.cleanup()
+
+    def _spans(self) -> dict[str, dict]:
+        return {i['name']: i for i in map(json.loads, self.path.read_text(encoding='utf-8').splitlines())}
+
+    def test_disabled(self) -> None:
+        with tracing.span('fetch', code='A01') as s:
+            s.set(rows=1)
+
+        self.assertFalse(tracing.is_enabled())
+        self.assertIs(s, tracing.span('db-write'))
+        self.assertFalse(self.path.exists())
+
+    def test_nested_spans(self) -> None:
+        tracing.enable(self.path)
+
+        def run():
+            with tracing.span('run'), tracing.span('category', db_code='hgnd'):
+                with tracing.span('fetch') as s:
+                    s.set(rows=3)
+                with self.assertRaises(ValueError):
+                    with tracing.span('db-write'):
+                        raise ValueError('failed')
+
+        run()
+        with tracing.span('other'):
+            pass
+        tracing.disable()
+
+        spans = self._spans()
+        self.assertIsNone(spans['run']['parent_id'])
+        self.assertEqual(spans['run']['span_id'], spans['category']['parent_id'])
+        self.assertEqual(spans['category']['span_id'], spans['fetch']['parent_id'])
+        self.assertEqual(spans['run']['trace_id'], spans['db-write']['trace_id'])
+        self.assertNotEqual(spans['run']['trace_id'], spans['other']['trace_id'])
+        self.assertEqual({'db_code': 'hgnd'}, spans['category']['attrs'])
+        self.assertEqual({'rows': 3}, spans['fetch']['attrs'])
+        self.assertEqual({'error': 'ValueError'}, spans['db-write']['attrs'])
+        self.assertGreaterEqual(spans['run']['duration_us'], spans['fetch']['duration_us'])
+
+    def test_span_finished_after_disabled(self) -> None:
+        exporter = tracing.enable(self.path)
+        with tracing.span('run'):
+            with tracing.span('fetch'):
+                pass
+            tracing.disable()
+            # the span being finished after the file is closed is dropped
+            exporter.export(tracing.Span('other', {}), 0)
+
+        self.assertEqual(['fetch'], list(self._spans()))
+
+        # and an error of writing the span doesn't fail the traced code
+        exporter = tracing.enable(self.path)
+        exporter._file.close()
+        with self.assertLogs('cn_stats_data.tracing', level='WARNING') as logs:
+            with tracing.span('fetch'):
+                pass
+        self.assertIn('fetch', logs.output[0])
+
+    def test_dao_and_async_spans(self) -> None:
+
+        @metrics.instrument_dao
+        class SampleDao:
+
+            @classmethod
+            def get(cls, key):
+                return key
+
+            @classmethod
+            async def aget(cls, key):
+                return key
+
+        async def run():
+            with tracing.span('task'):
+                await asyncio.gather(SampleDao.aget('a'), SampleDao.aget('b'))
+
+        tracing.enable(self.path)
+        with tracing.span('db-read'):
+            SampleDao.get('a')
+        asyncio.run(run())
+        tracing.disable()
+
+        lines = [json.loads(i) for i in self.path.read_text(encoding='utf-8').splitlines()]
+        spans = self._spans()
+        self.assertEqual(spans['db-read']['span_id'], spans['SampleDao.get']['parent_id'])
+        self.assertEqual(
+            [spans['task']['span_id']] * 2, [i['parent_id'] for i in lines if i['name'] == 'SampleDao.aget'])
+
+    def test_convert(self) -> None:
+        self.path.write_text('\n'.join(json.dumps(i) for i in [
+            {'name': 'fetch', 'trace_id': 1, 'span_id': 2, 'parent_id': 1, 'start_us': 10, 'duration_us': 30,
+             'pid': 7, 'thread': 'MainThread', 'attrs': {'rows': 3}},
+            {'name': 'run', 'trace_id': 1, 'span_id': 1, 'parent_id': None, 'start_us': 0, 'duration_us': 100,
+             'pid': 7, 'thread': 'MainThread', 'attrs': {}},
+        ]), encoding='utf-8')
+
+        trace = tracing.to_chrome_trace(self.path)
+        self.assertEqual(
+            {'name': 'fetch', 'cat': 'cn_stats', 'ph': 'X', 'ts': 10, 'dur': 30, 'pid': 7, 'tid': 1,
+             'args': {'rows': 3}},
+            trace['traceEvents'][0])
+        self.assertEqual('thread_name', trace['traceEvents'][-1]['name'])
+
+        self.assertEqual(['run 70', 'run;fetch 30'], tracing.to_folded(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()